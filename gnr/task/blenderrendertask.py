@@ -4,12 +4,13 @@ import os
 import random
 from collections import OrderedDict
 
-from PIL import Image, ImageChops
+from PIL import Image
 from gnr.renderingdirmanager import get_test_task_path, find_task_script
 from gnr.renderingenvironment import BlenderEnvironment
 from gnr.renderingtaskstate import RendererDefaults, RendererInfo
 from gnr.task.framerenderingtask import FrameRenderingTask, FrameRenderingTaskBuilder
 from gnr.task.gnrtask import GNROptions
+from gnr.task.previewcanvas import PreviewCanvas, fill_rectangle
 from gnr.task.renderingtask import AcceptClientVerdict
 from gnr.task.renderingtaskcollector import RenderingTaskCollector, exr_to_pil
 from gnr.task.scenefileeditor import regenerate_blender_crop_file
@@ -29,7 +30,7 @@ class BlenderDefaults(RendererDefaults):
 
 
 class PreviewUpdater(object):
-    def __init__(self, preview_file_path, preview_res_x, preview_res_y, expected_offsets):
+    def __init__(self, preview_file_path, preview_res_x, preview_res_y, expected_offsets, canvas=None):
         # pairs of (subtask_number, its_image_filepath)
         # careful: chunks' numbers start from 1
         self.chunks = {}
@@ -37,6 +38,8 @@ class PreviewUpdater(object):
         self.preview_res_y = preview_res_y
         self.preview_file_path = preview_file_path
         self.expected_offsets = expected_offsets
+        # chunks are pasted into in-memory preview that is saved to preview_file_path from time to time
+        self.canvas = canvas or PreviewCanvas(preview_file_path, (preview_res_x, preview_res_y))
         
         # where the match ends - since the chunks have unexpectable sizes, we 
         # don't know where to paste new chunk unless all of the above are in 
@@ -72,16 +75,10 @@ class PreviewUpdater(object):
                 height = self.expected_offsets[subtask_number + 1] - self.expected_offsets[subtask_number]
             
             img = img.resize((self.preview_res_x, height), resample=Image.BILINEAR)
-            if not os.path.exists(self.preview_file_path) or len(self.chunks) == 1:
-                img_offset = Image.new("RGB", (self.preview_res_x, self.preview_res_y))
-                img_offset.paste(img, (0, offset))
-                img_offset.save(self.preview_file_path, "BMP")
-                img_offset.close()
-            else:
-                img_current = Image.open(self.preview_file_path)
-                img_current.paste(img, (0, offset))
-                img_current.save(self.preview_file_path, "BMP")
-                img_current.close()
+            if len(self.chunks) == 1:
+                self.canvas.clear()
+            self.canvas.paste(img, (0, offset))
+            self.canvas.flush()
             img.close()
 
         except Exception as err:
@@ -97,10 +94,8 @@ class PreviewUpdater(object):
         self.chunks = {}
         self.perfect_match_area_y = 0
         self.perfectly_placed_subtasks = 0
-        if os.path.exists(self.preview_file_path):
-            img = Image.new("RGB", (self.preview_res_x, self.preview_res_y))
-            img.save(self.preview_file_path, "BMP")
-            img.close()
+        self.canvas.clear()
+        self.canvas.flush(force=True)
 
 
 def build_blender_renderer_info(dialog, customizer):
@@ -224,6 +219,15 @@ class BlenderRenderTask(FrameRenderingTask):
         self.preview_updater = None
         self.preview_updaters = None
 
+    def __setstate__(self, dict_):
+        super(BlenderRenderTask, self).__setstate__(dict_)
+        # task attributes are pickled separately, so updaters got their own copies of the task's preview
+        # canvases
+        updaters = self.preview_updaters if self.use_frames else [self.preview_updater]
+        for updater in updaters or []:
+            if updater is not None:
+                updater.canvas = self._get_preview_canvas(updater.preview_file_path)
+
     def initialize(self, dir_manager):
         super(BlenderRenderTask, self).initialize(dir_manager)
 
@@ -245,13 +249,15 @@ class BlenderRenderTask(FrameRenderingTask):
                 self.preview_updaters.append(PreviewUpdater(preview_path, 
                                                             int(round(self.res_x * self.scale_factor)),
                                                             preview_y, 
-                                                            expected_offsets))
+                                                            expected_offsets,
+                                                            self._get_preview_canvas(preview_path)))
         else:
             self.preview_file_path = "{}".format(os.path.join(self.tmp_dir, "current_preview"))
             self.preview_updater = PreviewUpdater(self.preview_file_path, 
                                                   int(round(self.res_x * self.scale_factor)), 
                                                   preview_y, 
-                                                  expected_offsets)
+                                                  expected_offsets,
+                                                  self._get_preview_canvas())
 
     def query_extra_data(self, perf_index, num_cores=0, node_id=None, node_name=None):
 
@@ -452,16 +458,7 @@ class BlenderRenderTask(FrameRenderingTask):
 
     def _update_frame_preview(self, new_chunk_file_path, frame_num, part=1, final=False):
         if final:
-            if new_chunk_file_path.upper().endswith(".EXR"):
-                img = exr_to_pil(new_chunk_file_path)
-            else:   
-                img = Image.open(new_chunk_file_path)
-            scaled = img.resize((int(round(self.res_x * self.scale_factor)), int(round(self.res_y * self.scale_factor))), 
-                                resample=Image.BILINEAR)
-            scaled.save(self.preview_file_path[self.frames.index(frame_num)], "BMP")
-            scaled.save(self.preview_task_file_path[self.frames.index(frame_num)], "BMP")
-            scaled.close()
-            img.close()
+            FrameRenderingTask._update_frame_preview(self, new_chunk_file_path, frame_num, part, final)
         else:
             self.preview_updaters[self.frames.index(frame_num)].update_preview(new_chunk_file_path, part)
             self._update_frame_task_preview()
@@ -470,7 +467,7 @@ class BlenderRenderTask(FrameRenderingTask):
         output_file_name = u"{}".format(self.output_file, self.output_format)
         self.collected_file_names = OrderedDict(sorted(self.collected_file_names.items()))
         if not self._use_outer_task_collector():
-            collector = CustomCollector(paste=True, width=self.res_x, height=self.res_y)
+            collector = RenderingTaskCollector(paste=True, width=self.res_x, height=self.res_y)
             for file in self.collected_file_names.values():
                 collector.add_img_file(file)
             collector.finalize().save(output_file_name, self.output_format)
@@ -482,17 +479,14 @@ class BlenderRenderTask(FrameRenderingTask):
         lower = preview_updater.get_offset(part)
         upper = preview_updater.get_offset(part + 1)
         res_x = preview_updater.preview_res_x
-        for i in range(0, res_x):
-                for j in range(lower, upper):
-                    img_task.putpixel((i, j), color)
+        fill_rectangle(img_task, (0, lower, res_x, upper), color)
 
     def _mark_task_area(self, subtask, img_task, color, frame_index=0):
         if not self.use_frames:
             self.mark_part_on_preview(subtask['start_task'], img_task, color, self.preview_updater)
         elif self.total_tasks <= len(self.frames):
-            for i in range(0, int(math.floor(self.res_x * self.scale_factor))):
-                for j in range(0, int(math.floor(self.res_y * self.scale_factor))):
-                    img_task.putpixel((i, j), color)
+            fill_rectangle(img_task, (0, 0, int(math.floor(self.res_x * self.scale_factor)),
+                                      int(math.floor(self.res_y * self.scale_factor))), color)
         else:
             parts = self.total_tasks / len(self.frames)
             pu = self.preview_updaters[frame_index]
@@ -505,7 +499,7 @@ class BlenderRenderTask(FrameRenderingTask):
         collected = self.frames_given[frame_num]
         collected = OrderedDict(sorted(collected.items()))
         if not self._use_outer_task_collector():
-            collector = CustomCollector(paste=True, width=self.res_x, height=self.res_y)
+            collector = RenderingTaskCollector(paste=True, width=self.res_x, height=self.res_y)
             for file in collected.values():
                 collector.add_img_file(file)
             collector.finalize().save(output_file_name, self.output_format)
@@ -516,22 +510,6 @@ class BlenderRenderTask(FrameRenderingTask):
         self._update_frame_task_preview()
 
 
-class CustomCollector(RenderingTaskCollector):
-    def __init__(self, paste=False, width=1, height=1):
-        RenderingTaskCollector.__init__(self, paste, width, height)
-        self.current_offset = 0
-    
-    def _paste_image(self, final_img, new_part, num):
-        img_offset = Image.new("RGB", (self.width, self.height))
-        offset = self.current_offset
-        _, new_img_res_y = new_part.size
-        self.current_offset += new_img_res_y
-        img_offset.paste(new_part, (0, offset))
-        result = ImageChops.add(final_img, img_offset)
-        img_offset.close()
-        return result
-
-
 def generate_expected_offsets(parts, res_x, res_y):
     # returns expected offsets for preview; the highest value is preview's height
     scale_factor = __scale_factor(res_x, res_y)
@@ -3,11 +3,13 @@ import logging
 import math
 import shutil
 from collections import OrderedDict
-from PIL import Image, ImageChops
+from PIL import Image
 
 from gnr.task.gnrtask import GNRTask
+from gnr.task.previewcanvas import fill_rectangle
 from gnr.task.renderingtask import RenderingTask, RenderingTaskBuilder
 from gnr.task.renderingtaskcollector import exr_to_pil, RenderingTaskCollector
+from golem.task.taskbase import result_types
 from golem.task.taskstate import SubtaskStatus
 
 logger = logging.getLogger("gnr.task")
@@ -71,7 +73,14 @@ class FrameRenderingTask(RenderingTask):
             self.preview_task_file_path = [None] * len(frames)
 
     @RenderingTask.handle_key_error
-    def computation_finished(self, subtask_id, task_results, result_type=0):
+    def verify_results(self, subtask_id, task_results, result_type=0):
+        """ Verify received images, render reference boxes for advanced verification if needed """
+        if result_type != result_types['files'] or not self.should_accept(subtask_id):
+            return None
+        return self._verify_imgs(subtask_id, [tr for tr in task_results if not tr.endswith(".log")])
+
+    @RenderingTask.handle_key_error
+    def computation_finished(self, subtask_id, task_results, result_type=0, verification=None):
         if not self.should_accept(subtask_id):
             return
 
@@ -95,7 +104,9 @@ class FrameRenderingTask(RenderingTask):
                         self._update_frame_task_preview()
                     return
 
-            if not self._verify_imgs(subtask_id, tr_files):
+            if verification is None:
+                verification = self._verify_imgs(subtask_id, tr_files)
+            if not verification:
                 self._mark_subtask_failed(subtask_id)
                 if not self.use_frames:
                     self._update_task_preview()
@@ -103,7 +114,10 @@ class FrameRenderingTask(RenderingTask):
                     self._update_frame_task_preview()
                 return
 
-            self.counting_nodes[self.subtasks_given[subtask_id]['node_id']].accept()
+            node_id = self.subtasks_given[subtask_id]['node_id']
+            self.counting_nodes[node_id].accept()
+            if self.advanceVerification:
+                self.verified_clients.add(node_id)
 
             for tr_file in tr_files:
 
@@ -143,38 +157,28 @@ class FrameRenderingTask(RenderingTask):
         if self.preview_task_file_path[num] is None:
             self.preview_task_file_path[num] = "{}{}".format(os.path.join(self.tmp_dir, "current_task_preview"), num)
 
-        if not final:
-            img = self._paste_new_chunk(img, self.preview_file_path[num], part, self.total_tasks / len(self.frames))
-
-        if img:
-            img_x, img_y = img.size
-            img = Image.resize((int(round(self.scale_factor * img_x)), int(round(self.scale_factor * img_y))),
-                               resample=Image.BILINEAR)
-            img.save(self.preview_file_path[num], "BMP")
-            img.save(self.preview_task_file_path[num], "BMP")
-            
+        img_x, img_y = img.size
+        img_scaled = img.resize((int(round(self.scale_factor * img_x)),
+                                 int(round(self.scale_factor * img_y))),
+                                resample=Image.BILINEAR)
         img.close()
 
-    def _paste_new_chunk(self, img_chunk, preview_file_path, chunk_num, all_chunks_num):
-        try:
-            img_offset = Image.new("RGB", (int(round(self.res_x * self.scale_factor)), int(round(self.res_y * self.scale_factor))))
-            offset = int(math.floor((chunk_num - 1) * float(self.res_y) * self.scale_factor / float(all_chunks_num)))
-            img_offset.paste(img_chunk, (0, offset))
-        except Exception as err:
-            logger.error("Can't generate preview {}".format(err))
-            img_offset = None
-
-        if not os.path.exists(preview_file_path):
-            return img_offset
-
-        try:
-            img = Image.open(preview_file_path)
-            if img_offset:
-                img = ImageChops.add(img, img_offset)
-            return img
-        except Exception as err:
-            logger.error("Can't add new chunk to preview{}".format(err))
-            return img_offset
+        canvas = self._get_preview_canvas(self.preview_file_path[num])
+        if final:
+            canvas.paste(img_scaled)
+        else:
+            canvas.add(img_scaled, (0, self._get_chunk_offset(part, self.total_tasks / len(self.frames))))
+        img_scaled.close()
+
+        task_canvas = self._get_preview_canvas(self.preview_task_file_path[num])
+        if task_canvas is not canvas:
+            task_canvas.paste(canvas.copy())
+            task_canvas.flush(force=final)
+        canvas.flush(force=final)
+
+    def _get_chunk_offset(self, chunk_num, all_chunks_num):
+        return int(math.floor((chunk_num - 1) * float(self.res_y) * self.scale_factor /
+                              float(all_chunks_num)))
 
     def _update_frame_task_preview(self):
         sent_color = (0, 255, 0)
@@ -189,29 +193,17 @@ class FrameRenderingTask(RenderingTask):
                 for frame in sub['frames']:
                     self.__mark_sub_frame(sub, frame, failed_color)
 
-    def _open_frame_preview(self, preview_file_path):
-
-        if not os.path.exists(preview_file_path):
-            img = Image.new("RGB", (int(round(self.res_x * self.scale_factor)), 
-                                    int(round(self.res_y * self.scale_factor))))
-            img.save(preview_file_path, "BMP")
-
-        return Image.open(preview_file_path)
-
     def _mark_task_area(self, subtask, img_task, color, frame_index=0):
         if not self.use_frames:
             RenderingTask._mark_task_area(self, subtask, img_task, color)
         elif self.__full_frames():
-            for i in range(0, int(round(self.res_x * self.scale_factor))):
-                for j in range(0, int(round(self.res_y))):
-                    img_task.putpixel((i, j), color)
+            fill_rectangle(img_task, (0, 0, int(round(self.res_x * self.scale_factor)),
+                                      int(round(self.res_y))), color)
         else:
             parts = self.total_tasks / len(self.frames)
             upper = int(math.ceil(self.res_y / parts * self.scale_factor) * ((subtask['start_task'] - 1) % parts))
             lower = int(math.floor(self.res_y / parts * self.scale_factor) * ((subtask['start_task'] - 1) % parts + 1))
-            for i in range(0, self.res_x):
-                for j in range(upper, lower):
-                    img_task.putpixel((i, j), color)
+            fill_rectangle(img_task, (0, upper, self.res_x, lower), color)
 
     @RenderingTask.handle_key_error
     def _get_part_img_size(self, subtask_id, adv_test_file):
@@ -297,10 +289,10 @@ class FrameRenderingTask(RenderingTask):
     def __mark_sub_frame(self, sub, frame, color):
         idx = self.frames.index(frame)
         preview_task_file_path = "{}{}".format(os.path.join(self.tmp_dir, "current_task_preview"), idx)
-        preview_file_path = "{}{}".format(os.path.join(self.tmp_dir, "current_preview"), idx)
-        img_task = self._open_frame_preview(preview_task_file_path)
-        self._mark_task_area(sub, img_task, color, idx)
-        img_task.save(preview_task_file_path, "BMP")
+        canvas = self._get_preview_canvas(preview_task_file_path)
+        with canvas.edit() as img_task:
+            self._mark_task_area(sub, img_task, color, idx)
+        canvas.flush()
         self.preview_task_file_path[idx] = preview_task_file_path
 
     def _get_output_name(self, frame_num):
@@ -121,6 +121,18 @@ class GNRTask(Task):
     def computation_failed(self, subtask_id):
         self._mark_subtask_failed(subtask_id)
 
+    @handle_key_error
+    def computation_cancelled(self, subtask_id):
+        sub = self.subtasks_given[subtask_id]
+        if sub['status'] == SubtaskStatus.starting:
+            sub['status'] = SubtaskStatus.cancelled
+            self.counting_nodes[sub['node_id']].cancel(finishing=sub.get('result_incoming', False))
+
+    def prepare_results(self, subtask_id, task_result, result_type=0):
+        if result_type == result_types['data']:
+            return self.load_task_results(task_result, result_type, subtask_id), result_types['files']
+        return task_result, result_type
+
     @handle_key_error
     def verify_subtask(self, subtask_id):
         return self.subtasks_given[subtask_id]['status'] == SubtaskStatus.finished
@@ -216,6 +228,7 @@ class GNRTask(Task):
         self.results[subtask_id] = self.filter_task_results(tr_files, subtask_id)
 
     def result_incoming(self, subtask_id):
+        self.subtasks_given[subtask_id]['result_incoming'] = True
         self.counting_nodes[self.subtasks_given[subtask_id]['node_id']].finish()
 
     def query_extra_data_for_test_task(self):
@@ -212,7 +212,9 @@ class LuxTask(RenderingTask):
                       "output_format": self.output_format,
                       "scene_file_src": scene_src,
                       "scene_dir": scene_dir,
-                      "num_threads": num_threads
+                      "num_threads": num_threads,
+                      "halttime": self.halttime,
+                      "haltspp": self.haltspp
                       }
 
         hash = "{}".format(random.getrandbits(128))
@@ -224,7 +226,7 @@ class LuxTask(RenderingTask):
         ctd = self._new_compute_task_def(hash, extra_data, working_directory, perf_index)
         return self.ExtraData(ctd=ctd)
 
-    def computation_finished(self, subtask_id, task_result, result_type=0):
+    def computation_finished(self, subtask_id, task_result, result_type=0, verification=None):
         test_result_flm = self.__get_test_flm()
 
         self.interpret_task_results(subtask_id, task_result, result_type)
@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from PIL import Image, ImageChops
+
+logger = logging.getLogger("gnr.task")
+
+PREVIEW_FLUSH_INTERVAL = 2.0  # seconds
+
+
+class PreviewCanvas(object):
+    """ Task preview kept in memory. Chunks and marked areas are drawn on the image in place and the image is
+    written to preview file at most once per flush_interval (or whenever flush is forced), instead of being
+    read from and saved to disk after every change. The image is loaded when it's first needed and it isn't
+    pickled: it's saved to the preview file instead and loaded from there by the unpickled canvas.
+    """
+
+    def __init__(self, file_path, size, flush_interval=PREVIEW_FLUSH_INTERVAL):
+        """
+        :param str file_path: preview file; if it already exists and has the right size, it's used as a
+        starting point
+        :param (int, int) size: preview size
+        :param float flush_interval: minimal time between two saves of the preview file
+        """
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.last_flush = None
+        self.dirty = True
+        self._size = size
+        self._img = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        if self.file_path and self._img is not None:
+            self.flush(force=True)
+        state = self.__dict__.copy()
+        del state['_lock']
+        if self.file_path:
+            state['_img'] = None
+        elif self._img is not None:
+            state['_img'] = self._img.copy()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        self._lock = threading.Lock()
+
+    @property
+    def img(self):
+        if self._img is None:
+            self._img = self.__load(self.file_path, self._size)
+        return self._img
+
+    @property
+    def size(self):
+        return self._size
+
+    @contextmanager
+    def edit(self):
+        """ Give access to preview image for in-place changes """
+        with self._lock:
+            yield self.img
+            self.dirty = True
+
+    def paste(self, img, offset=(0, 0)):
+        with self.edit() as preview:
+            preview.paste(img, offset)
+
+    def add(self, img, offset=(0, 0)):
+        """ Add img to the preview region that it covers """
+        width, height = img.size
+        box = (offset[0], offset[1], offset[0] + width, offset[1] + height)
+        with self.edit() as preview:
+            preview.paste(ImageChops.add(preview.crop(box), img.convert(preview.mode)), offset)
+
+    def fill(self, box, color):
+        """ Paint (left, upper, right, lower) rectangle with given color """
+        with self.edit() as preview:
+            fill_rectangle(preview, box, color)
+
+    def clear(self):
+        self.fill((0, 0) + self.size, (0, 0, 0))
+
+    def copy(self):
+        with self._lock:
+            return self.img.copy()
+
+    def flush(self, force=False):
+        """ Save preview to file if it has changed since the last save and flush_interval has passed
+        :param bool force: save even if flush_interval hasn't passed yet
+        :return bool: True if the file was saved
+        """
+        with self._lock:
+            if not self.dirty:
+                return False
+            now = time.time()
+            if not force and self.last_flush is not None and now - self.last_flush < self.flush_interval:
+                return False
+            try:
+                self.img.save(self.file_path, "BMP")
+            except (IOError, OSError) as err:
+                logger.error("Can't save preview {}: {}".format(self.file_path, err))
+                return False
+            self.dirty = False
+            self.last_flush = now
+            return True
+
+    @staticmethod
+    def __load(file_path, size):
+        if file_path and os.path.exists(file_path):
+            try:
+                img = Image.open(file_path)
+                if img.size == size:
+                    return img.convert("RGB")
+            except (IOError, OSError) as err:
+                logger.warning("Can't load preview {}: {}".format(file_path, err))
+        return Image.new("RGB", size)
+
+
+def fill_rectangle(img, box, color):
+    """ Paint (left, upper, right, lower) rectangle of img with given color. Parts outside of the image and
+    empty rectangles are ignored. """
+    width, height = img.size
+    left, upper = max(0, box[0]), max(0, box[1])
+    right, lower = min(width, box[2]), min(height, box[3])
+    if left < right and upper < lower:
+        img.paste(color, (left, upper, right, lower))
@@ -5,7 +5,7 @@ import random
 import uuid
 from copy import deepcopy, copy
 
-from PIL import Image, ImageChops
+from PIL import Image
 
 from golem.core.common import get_golem_path, timeout_to_deadline
 from golem.core.fileshelper import find_file_with_ext
@@ -18,6 +18,7 @@ from golem.task.taskstate import SubtaskStatus
 from gnr.task.gnrtask import GNRTask, GNRTaskBuilder
 from gnr.task.imgrepr import verify_img, advance_verify_img
 from gnr.task.localcomputer import LocalComputer
+from gnr.task.previewcanvas import PreviewCanvas, fill_rectangle
 from gnr.task.renderingtaskcollector import exr_to_pil
 
 
@@ -99,6 +100,7 @@ class RenderingTask(GNRTask):
         self.root_path = root_path
         self.preview_file_path = None
         self.preview_task_file_path = None
+        self.preview_canvases = {}
 
         self.task_resources = deepcopy(task_resources)
 
@@ -128,6 +130,28 @@ class RenderingTask(GNRTask):
         super(RenderingTask, self).restart()
         self.collected_file_names = {}
 
+    def query_speculative_extra_data(self, subtask_id, perf_index, num_cores=0, node_id=None, node_name=None):
+        sub = self.subtasks_given.get(subtask_id)
+        if sub is None or sub['status'] != SubtaskStatus.starting:
+            return None
+
+        verdict = self._accept_client(node_id)
+        if verdict != AcceptClientVerdict.ACCEPTED:
+            return self.ExtraData(should_wait=verdict == AcceptClientVerdict.SHOULD_WAIT)
+
+        extra_data = dict(sub)
+        extra_data.pop('result_incoming', None)
+        extra_data['status'] = SubtaskStatus.starting
+        extra_data['perf'] = perf_index
+        extra_data['node_id'] = node_id
+
+        hash = "{}".format(random.getrandbits(128))
+        self.subtasks_given[hash] = extra_data
+        logger.info("Subtask {} given to {} as a copy of {}".format(hash, node_name, subtask_id))
+
+        ctd = self._new_compute_task_def(hash, extra_data, self._get_working_directory(), perf_index)
+        return self.ExtraData(ctd=ctd)
+
     @GNRTask.handle_key_error
     def restart_subtask(self, subtask_id):
         if subtask_id in self.subtasks_given:
@@ -136,6 +160,7 @@ class RenderingTask(GNRTask):
         GNRTask.restart_subtask(self, subtask_id)
 
     def update_task_state(self, task_state):
+        self._flush_previews(force=True)
         if not self.finished_computation() and self.preview_task_file_path:
             task_state.extra_data['resultPreview'] = self.preview_task_file_path
         elif self.preview_file_path:
@@ -164,9 +189,9 @@ class RenderingTask(GNRTask):
         else:
             img = Image.open(new_chunk_file_path)
 
-        img_current = self._open_preview()
-        img_current = ImageChops.add(img_current, img)
-        img_current.save(self.preview_file_path, "BMP")
+        canvas = self._get_preview_canvas()
+        canvas.add(img)
+        canvas.flush()
         img.close()
 
     @GNRTask.handle_key_error
@@ -174,9 +199,10 @@ class RenderingTask(GNRTask):
         empty_color = (0, 0, 0)
         if isinstance(self.preview_file_path, list):  # FIXME Add possibility to remove subtask from frame
             return
-        img = self._open_preview()
-        self._mark_task_area(self.subtasks_given[subtask_id], img, empty_color)
-        img.save(self.preview_file_path, "BMP")
+        canvas = self._get_preview_canvas()
+        with canvas.edit() as img:
+            self._mark_task_area(self.subtasks_given[subtask_id], img, empty_color)
+        canvas.flush()
 
     def _update_task_preview(self):
         sent_color = (0, 255, 0)
@@ -184,7 +210,7 @@ class RenderingTask(GNRTask):
 
         self.preview_task_file_path = "{}".format(os.path.join(self.tmp_dir, "current_task_preview"))
 
-        img_task = self._open_preview()
+        img_task = self._get_preview_canvas().copy()
 
         for sub in self.subtasks_given.values():
             if sub['status'] == SubtaskStatus.starting:
@@ -192,7 +218,10 @@ class RenderingTask(GNRTask):
             if sub['status'] in [SubtaskStatus.failure, SubtaskStatus.restarted]:
                 self._mark_task_area(sub, img_task, failed_color)
 
-        img_task.save(self.preview_task_file_path, "BMP")
+        task_canvas = self._get_preview_canvas(self.preview_task_file_path)
+        task_canvas.paste(img_task)
+        task_canvas.flush()
+        img_task.close()
         self._update_preview_task_file_path(self.preview_task_file_path)
 
     def _update_preview_task_file_path(self, preview_task_file_path):
@@ -201,9 +230,7 @@ class RenderingTask(GNRTask):
     def _mark_task_area(self, subtask, img_task, color):
         upper = max(0, int(math.floor(self.scale_factor * self.res_y / self.total_tasks * (subtask['start_task'] - 1))))
         lower = min(int(math.floor(self.scale_factor * self.res_y / self.total_tasks * (subtask['end_task']))), int(round(self.res_y * self.scale_factor)))
-        for i in range(0, int(round(self.res_x * self.scale_factor))):
-            for j in range(int(round(upper)), int(round(lower))):
-                img_task.putpixel((i, j), color)
+        fill_rectangle(img_task, (0, upper, int(round(self.res_x * self.scale_factor)), lower), color)
 
     def _put_collected_files_together(self, output_file_name, files, arg):
         if is_windows():
@@ -288,6 +315,29 @@ class RenderingTask(GNRTask):
 
         return Image.open(self.preview_file_path)
 
+    def _get_preview_canvas(self, file_path=None):
+        """ Return in-memory preview that is saved to file_path (task preview file by default). Previews are
+        flushed to disk at most once per PREVIEW_FLUSH_INTERVAL and when task state is queried.
+        :param str|None file_path: preview file
+        :return PreviewCanvas:
+        """
+        if file_path is None:
+            if self.preview_file_path is None:
+                self.preview_file_path = "{}".format(os.path.join(self.tmp_dir, "current_preview"))
+            file_path = self.preview_file_path
+        canvas = self.preview_canvases.get(file_path)
+        if canvas is None:
+            canvas = PreviewCanvas(file_path, self._get_preview_size())
+            self.preview_canvases[file_path] = canvas
+        return canvas
+
+    def _get_preview_size(self):
+        return int(round(self.res_x * self.scale_factor)), int(round(self.res_y * self.scale_factor))
+
+    def _flush_previews(self, force=False):
+        for canvas in self.preview_canvases.values():
+            canvas.flush(force)
+
     def _use_outer_task_collector(self):
         unsupported_formats = ['EXR', 'EPS']
         if self.output_format.upper() in unsupported_formats:
@@ -332,8 +382,6 @@ class RenderingTask(GNRTask):
                 if not advance_verify_img(tr_file, res_x, res_y, start_box, self.verification_options.box_size,
                                           cmp_file, cmp_start_box):
                     return False
-                else:
-                    self.verified_clients.add(self.subtasks_given[subtask_id]['node_id'])
             if not self._verify_img(tr_file, res_x, res_y):
                 return False
 
@@ -399,4 +447,4 @@ class RenderingTask(GNRTask):
         return path
 
     def __get_path_windows(self, path):
-        return path.replace("\\", "/")
\ No newline at end of file
+        return path.replace("\\", "/")
\ No newline at end of file
@@ -1,6 +1,5 @@
 import glob
 import logging
-import math
 import OpenEXR
 import Imath
 import os
@@ -27,8 +26,6 @@ def open_exr_as_rgbf_images(exr_file):
 
 
 def convert_rgbf_images_to_rgb8_image(rgbf, lightest=255.0, darkest=0.0):
-    scale = 255 / (lightest - darkest)
-
     def normalize_0_255(val):
         scale = 255.0
         darkest = 0.0
@@ -42,8 +39,6 @@ def convert_rgbf_images_to_rgb8_image(rgbf, lightest=255.0, darkest=0.0):
 
 
 def convert_rgbf_images_to_l_image(rgbf, lightest=255.0, darkest=0.0):
-    scale = 255 / (lightest - darkest)
-
     def normalize_0_255(val):
         scale = 255.0
         darkest = 0.0
@@ -161,6 +156,11 @@ def exr_to_pil(exr_file):
 
 
 class RenderingTaskCollector:
+    """ Puts rendered chunks together into a final image. EXR chunks are decoded only once, when they're
+    added: their extrema are accumulated and they're written straight into a single output frame, so memory
+    usage doesn't depend on the number of chunks. In paste mode chunks are placed one below another in the
+    order in which they're added, otherwise they're added to each other.
+    """
     def __init__(self, paste=False, width=1, height=1):
         self.darkest = None
         self.lightest = None
@@ -171,38 +171,37 @@ class RenderingTaskCollector:
         self.paste = paste
         self.width = width
         self.height = height
+        self.current_offset = 0
+        self.frame = None
+        self.alpha_frame = None
+        self.extend_frame = False
 
     def add_img_file(self, img_file):
         if img_file.upper().endswith("EXR"):
             rgbf = open_exr_as_rgbf_images(img_file)
             d, l = get_single_rgbf_extrema(rgbf)
+            self.darkest = d if self.darkest is None else min(d, self.darkest)
+            self.lightest = l if self.lightest is None else max(l, self.lightest)
 
-            if self.darkest:
-                self.darkest = min(d, self.darkest)
+            chunk = convert_rgbf_images_to_rgb8_image(rgbf, self.lightest, self.darkest)
+            if self.paste:
+                self._paste_chunk(chunk)
             else:
-                self.darkest = d
+                self.frame = self._add_image(self.frame, chunk)
+            chunk.close()
 
-            if self.lightest:
-                self.lightest = max(l, self.lightest)
-            else:
-                self.lightest = l
-        
         self.accepted_img_files.append(img_file)
 
     def add_alpha_file(self, img_file):
         if img_file.upper().endswith("EXR"):
             rgbf = open_exr_as_rgbf_images(img_file)
             d, l = get_single_rgbf_extrema(rgbf)
+            self.alpha_darkest = d if self.alpha_darkest is None else min(d, self.alpha_darkest)
+            self.alpha_lightest = l if self.alpha_lightest is None else max(l, self.alpha_lightest)
 
-            if self.alpha_darkest:
-                self.alpha_darkest = min(d, self.alpha_darkest)
-            else:
-                self.alpha_darkest = d
-
-            if self.alpha_lightest:
-                self.alpha_lightest = max(l, self.alpha_lightest)
-            else:
-                self.alpha_lightest = l
+            chunk = convert_rgbf_images_to_l_image(rgbf, self.lightest, self.darkest)
+            self.alpha_frame = self._add_image(self.alpha_frame, chunk)
+            chunk.close()
 
         self.accepted_alpha_files.append(img_file)
 
@@ -216,51 +215,19 @@ class RenderingTaskCollector:
             final_img = self.finalize_exr(show_progress)
         else:
             final_img = self.finalize_not_exr(show_progress)
-                    
-        if len(self.accepted_alpha_files) > 0:
-            final_alpha = convert_rgbf_images_to_l_image(open_exr_as_rgbf_images(self.accepted_alpha_files[0]),
-                                                         self.lightest, self.darkest)
 
-            for i in range(1, len(self.accepted_alpha_files)):
-                l_im = convert_rgbf_images_to_l_image(open_exr_as_rgbf_images(self.accepted_alpha_files[i]),
-                                                      self.lightest, self.darkest)
-                final_alpha = ImageChops.add(final_alpha, l_im)
-                l_im.close()
-
-            final_img.putalpha(final_alpha)
-            final_alpha.close()
+        if self.alpha_frame is not None:
+            final_img.putalpha(self.alpha_frame)
+            self.alpha_frame.close()
+            self.alpha_frame = None
 
         return final_img
 
     def finalize_exr(self, show_progress=False):
         if self.lightest == self.darkest:
             self.lightest = self.darkest + 0.1
+        return self.frame
 
-        final_img = convert_rgbf_images_to_rgb8_image(open_exr_as_rgbf_images(self.accepted_img_files[0]),
-                                                    self.lightest, self.darkest)
-
-        if self.paste:
-            if not self.width or not self.height:
-                self.width, self.height = final_img.size
-                self.height *= len(self.accepted_img_files)
-            img = Image.new('RGB', (self.width, self.height))
-            final_img = self._paste_image(img, final_img, 0)
-            img.close()
-
-        for i in range(1, len(self.accepted_img_files)):
-            rgb8_im = convert_rgbf_images_to_rgb8_image(open_exr_as_rgbf_images(self.accepted_img_files[i]),
-                                                        self.lightest, self.darkest)
-            if not self.paste:
-                final_img = ImageChops.add(final_img, rgb8_im)
-            else:
-                final_img = self._paste_image(final_img, rgb8_im, i)
-                
-            rgb8_im.close()
-            
-            if show_progress:
-                print_progress(i, len(self.accepted_img_files))
-        return final_img
-        
     def finalize_not_exr(self, show_progress=False):
         _, output_format = os.path.splitext(self.accepted_img_files[0])
         output_format = output_format[1:].upper()
@@ -296,8 +263,33 @@ class RenderingTaskCollector:
                 print_progress(i, len(self.accepted_img_files))        
         return final_img
 
-    def _paste_image(self, final_img, new_part, num):
-        img_offset = Image.new("RGB", (self.width, self.height))
-        offset = int(math.floor(num * float(self.height) / float(len(self.accepted_img_files))))
-        img_offset.paste(new_part, (0, offset))
-        return ImageChops.add(final_img, img_offset)
+    def _paste_chunk(self, chunk):
+        chunk_x, chunk_y = chunk.size
+        if self.frame is None:
+            if not self.width or not self.height:
+                # Final size is unknown, the frame is extended with every chunk
+                self.width, self.height = chunk_x, 0
+                self.extend_frame = True
+            self.frame = Image.new("RGB", (self.width, self.height))
+
+        offset = self.current_offset
+        self.current_offset += chunk_y
+        if self.extend_frame and self.current_offset > self.height:
+            self.height = self.current_offset
+            frame = Image.new("RGB", (self.width, self.height))
+            frame.paste(self.frame, (0, 0))
+            self.frame.close()
+            self.frame = frame
+
+        # Chunks may overlap, so they're added to what is already in the frame instead of replacing it
+        region = self.frame.crop((0, offset, chunk_x, offset + chunk_y))
+        added = ImageChops.add(region, chunk)
+        self.frame.paste(added, (0, offset))
+        region.close()
+        added.close()
+
+    @staticmethod
+    def _add_image(final_img, new_img):
+        if final_img is None:
+            return new_img.copy()
+        return ImageChops.add(final_img, new_img)
@@ -1,8 +1,10 @@
 from __future__ import print_function
 
 import os
+import re
 import sys
 import subprocess
+import threading
 
 import params  # This module is generated before this script is run
 
@@ -10,12 +12,56 @@ BLENDER_COMMAND = "blender"
 WORK_DIR = "/golem/work"
 OUTPUT_DIR = "/golem/output"
 
+# Golem reads the subtask progress (a number between 0 and 1) from this file
+PROGRESS_FILE = WORK_DIR + "/.progress"
+# Progress is reported from both stdout and stderr forwarding threads
+progress_lock = threading.Lock()
 
-def exec_cmd(cmd):
-    pc = subprocess.Popen(cmd)
+# Rendered tiles (Cycles) or parts (Blender Internal) of the current frame
+TILE_PATTERNS = [re.compile(r"(?:Tile|Part) (\d+)[/-](\d+)"),
+                 re.compile(r"Rendered (\d+)/(\d+) Tiles")]
+
+
+def report_progress(progress):
+    tmp_path = PROGRESS_FILE + ".tmp"
+    with progress_lock:
+        with open(tmp_path, "w") as f:
+            f.write("{:.4f}".format(min(max(progress, 0.0), 1.0)))
+        os.rename(tmp_path, PROGRESS_FILE)
+
+
+def forward_stream(src, dst, on_line):
+    for line in iter(src.readline, ""):
+        dst.write(line)
+        dst.flush()
+        try:
+            on_line(line)
+        except (IOError, OSError) as err:
+            # keep reading, otherwise the pipe fills up and blocks the process
+            print("Can't report progress: {}".format(err), file=sys.stderr)
+
+
+def exec_cmd(cmd, on_line=lambda line: None):
+    pc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    threads = [threading.Thread(target=forward_stream, args=(pc.stdout, sys.stdout, on_line)),
+               threading.Thread(target=forward_stream, args=(pc.stderr, sys.stderr, on_line))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
     return pc.wait()
 
 
+def frame_progress(line):
+    for pattern in TILE_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            done, total = int(match.group(1)), int(match.group(2))
+            if total > 0:
+                return float(done) / total
+    return None
+
+
 def format_blender_render_cmd(outfilebasename, scene_file, script_file,
                               start_task, frame, output_format):
     cmd = [
@@ -42,13 +88,21 @@ def run_blender_task(outfilebasename, scene_file, script_src, start_task,
     with open(blender_script_path, "w") as script_file:
         script_file.write(script_src)
 
-    for frame in frames:
+    report_progress(0.0)
+    for i, frame in enumerate(frames):
         cmd = format_blender_render_cmd(outfilebasename, scene_file,
                                         script_file.name, start_task, frame, output_format)
         print(cmd, file=sys.stderr)
-        exit_code = exec_cmd(cmd)
+
+        def on_line(line, frames_done=i):
+            progress = frame_progress(line)
+            if progress is not None:
+                report_progress((frames_done + progress) / len(frames))
+
+        exit_code = exec_cmd(cmd, on_line)
         if exit_code is not 0:
             sys.exit(exit_code)
+        report_progress(float(i + 1) / len(frames))
 
 
 run_blender_task(params.outfilebasename, params.scene_file, params.script_src, params.start_task, params.frames,
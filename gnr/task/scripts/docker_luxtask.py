@@ -1,10 +1,13 @@
 from __future__ import print_function
 
 import os
+import re
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 
 import params  # This module is generated before this script is run
 
@@ -13,6 +16,44 @@ OUTPUT_DIR = "/golem/output"
 WORK_DIR = "/golem/work"
 RESOURCES_DIR = "/golem/resources"
 
+# Golem reads the subtask progress (a number between 0 and 1) from this file
+PROGRESS_FILE = WORK_DIR + "/.progress"
+# Progress is reported from both stdout and stderr forwarding threads
+progress_lock = threading.Lock()
+
+# Samples per pixel in luxconsole's statistics lines
+SAMPLES_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*S/p")
+
+
+def report_progress(progress):
+    tmp_path = PROGRESS_FILE + ".tmp"
+    with progress_lock:
+        with open(tmp_path, "w") as f:
+            f.write("{:.4f}".format(min(max(progress, 0.0), 1.0)))
+        os.rename(tmp_path, PROGRESS_FILE)
+
+
+class RenderProgress(object):
+    """ Progress of rendering towards the scene's halt condition: halttime seconds or haltspp samples per
+    pixel """
+
+    def __init__(self, halttime, haltspp):
+        self.halttime = halttime
+        self.haltspp = haltspp
+        self.start_time = time.time()
+
+    def on_line(self, line):
+        if self.halttime > 0:
+            progress = (time.time() - self.start_time) / self.halttime
+        elif self.haltspp > 0:
+            match = SAMPLES_PATTERN.search(line)
+            if not match:
+                return
+            progress = float(match.group(1)) / self.haltspp
+        else:
+            return
+        report_progress(progress)
+
 
 def symlink_or_copy(source, target):
     try:
@@ -62,13 +103,30 @@ def format_lux_renderer_cmd(start_task, output_basename, output_format, scene_fi
     return cmd
 
 
-def exec_cmd(cmd):
-    pc = subprocess.Popen(cmd)
+def forward_stream(src, dst, on_line):
+    for line in iter(src.readline, ""):
+        dst.write(line)
+        dst.flush()
+        try:
+            on_line(line)
+        except (IOError, OSError) as err:
+            # keep reading, otherwise the pipe fills up and blocks the process
+            print("Can't report progress: {}".format(err), file=sys.stderr)
+
+
+def exec_cmd(cmd, on_line=lambda line: None):
+    pc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    threads = [threading.Thread(target=forward_stream, args=(pc.stdout, sys.stdout, on_line)),
+               threading.Thread(target=forward_stream, args=(pc.stderr, sys.stderr, on_line))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
     return pc.wait()
 
 
 def run_lux_renderer_task(start_task, outfilebasename, output_format, scene_file_src,
-                          scene_dir, num_cores):
+                          scene_dir, num_cores, halttime=0, haltspp=0):
 
     with tempfile.NamedTemporaryFile(mode="w", suffix=".lxs", dir=WORK_DIR,
                                      delete=False) as tmp_scene_file:
@@ -88,10 +146,12 @@ def run_lux_renderer_task(start_task, outfilebasename, output_format, scene_file
     cmd = format_lux_renderer_cmd(start_task, outfilebasename, output_format,
                                   tmp_scene_file.name, num_cores)
 
-    exit_code = exec_cmd(cmd)
+    report_progress(0.0)
+    exit_code = exec_cmd(cmd, RenderProgress(halttime, haltspp).on_line)
     if exit_code is not 0:
         sys.exit(exit_code)
     else:
+        report_progress(1.0)
         outfile = "{}/{}{}.{}".format(OUTPUT_DIR, outfilebasename, start_task, output_format)
         if not os.path.isfile(outfile):
             flm_file = find_flm(WORK_DIR)
@@ -105,6 +165,7 @@ def run_lux_renderer_task(start_task, outfilebasename, output_format, scene_file
 
 
 run_lux_renderer_task(params.start_task, params.outfilebasename, params.output_format,
-                      params.scene_file_src, params.scene_dir, params.num_threads)
+                      params.scene_file_src, params.scene_dir, params.num_threads,
+                      getattr(params, "halttime", 0), getattr(params, "haltspp", 0))
 
 
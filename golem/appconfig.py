@@ -23,6 +23,13 @@ MIN_MEMORY_SIZE = 1000 * 1024
 MAX_RESOURCE_SIZE = 2 * 1024 * 1024
 MAX_MEMORY_SIZE = max(int(virtual_memory().total * 0.75) / 1024, MIN_MEMORY_SIZE)
 NUM_CORES = 1
+# Resources given to a single compute slot. 0 cores means that there is only one slot that uses all cores,
+# 0 memory means that memory is split evenly between the slots
+SLOT_NUM_CORES = 0
+SLOT_MAX_MEMORY_SIZE = 0
+# Docker containers are kept for subtasks of the same task for this many seconds,
+# 0 turns off reusing containers
+CONTAINER_IDLE_TIMEOUT = 300
 DISTRIBUTED_RES_NUM = 2
 
 logger = logging.getLogger(__name__)
@@ -61,10 +68,19 @@ COMPUTING_TRUST = -1.0
 P2P_SESSION_TIMEOUT = 240
 TASK_SESSION_TIMEOUT = 900
 RESOURCE_SESSION_TIMEOUT = 600
+# Task sessions are kept open and reused for all task traffic with a node,
+# until they're idle for this many seconds
+TASK_SESSION_IDLE_TIMEOUT = 300
+# 0 connections per node turns off reusing task sessions
+MAX_TASK_SESSIONS_PER_PEER = 1
 PLUGIN_PORT = 1111
 ETH_ACCOUNT_NAME = ""
 USE_IP6 = 0
 ACCEPT_TASKS = 1
+USE_SESSION_ENCRYPTION = 1
+# Verification of received results (eg. rendering of reference images) is done by a pool of worker threads
+VERIFICATION_WORKERS = 2
+VERIFICATION_QUEUE_SIZE = 100
 
 # Default max price per hour -- 0.005 ETH ~ 0.05 USD
 MAX_PRICE = int(0.005 * denoms.ether)
@@ -135,6 +151,9 @@ class AppConfig:
                                  num_cores=NUM_CORES,
                                  max_resource_size=MAX_RESOURCE_SIZE,
                                  max_memory_size=MAX_MEMORY_SIZE,
+                                 slot_num_cores=SLOT_NUM_CORES,
+                                 slot_max_memory_size=SLOT_MAX_MEMORY_SIZE,
+                                 container_idle_timeout=CONTAINER_IDLE_TIMEOUT,
                                  send_pings=SEND_PINGS,
                                  pings_interval=PINGS_INTERVALS,
                                  getting_peers_interval=GETTING_PEERS_INTERVAL,
@@ -154,12 +173,17 @@ class AppConfig:
                                  p2p_session_timeout=P2P_SESSION_TIMEOUT,
                                  task_session_timeout=TASK_SESSION_TIMEOUT,
                                  resource_session_timeout=RESOURCE_SESSION_TIMEOUT,
+                                 task_session_idle_timeout=TASK_SESSION_IDLE_TIMEOUT,
+                                 max_task_sessions_per_peer=MAX_TASK_SESSIONS_PER_PEER,
                                  plugin_port=PLUGIN_PORT,
                                  eth_account=ETH_ACCOUNT_NAME,
                                  min_price=MIN_PRICE,
                                  max_price=MAX_PRICE,
                                  use_ipv6=USE_IP6,
                                  accept_tasks=ACCEPT_TASKS,
+                                 use_session_encryption=USE_SESSION_ENCRYPTION,
+                                 verification_workers=VERIFICATION_WORKERS,
+                                 verification_queue_size=VERIFICATION_QUEUE_SIZE,
                                  node_name="",
                                  public_address="",
                                  estimated_lux_performance="0",
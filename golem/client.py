@@ -242,6 +242,8 @@ class Client(object):
         if self.monitor:
             self.monitor.on_logout()
             self.monitor.shut_down()
+        if self.ranking:
+            self.ranking.quit()
         if self.db:
             self.db.close()
         self._unlock_datadir()
@@ -634,15 +636,9 @@ class Client(object):
     def send_gossip(self, gossip, send_to):
         return self.p2pservice.send_gossip(gossip, send_to)
 
-    def send_stop_gossip(self):
-        return self.p2pservice.send_stop_gossip()
-
     def collect_gossip(self):
         return self.p2pservice.pop_gossip()
 
-    def collect_stopped_peers(self):
-        return self.p2pservice.pop_stop_gossip_form_peers()
-
     def collect_neighbours_loc_ranks(self):
         return self.p2pservice.pop_neighbours_loc_ranks()
 
@@ -38,6 +38,8 @@ class ClientConfigDescriptor(object):
         self.p2p_session_timeout = 0
         self.task_session_timeout = 0
         self.resource_session_timeout = 0
+        self.task_session_idle_timeout = 300
+        self.max_task_sessions_per_peer = 1
 
         self.estimated_performance = 0.0
         self.estimated_lux_performance = 0.0
@@ -48,6 +50,9 @@ class ClientConfigDescriptor(object):
         self.num_cores = 0
         self.max_resource_size = 0
         self.max_memory_size = 0
+        self.slot_num_cores = 0
+        self.slot_max_memory_size = 0
+        self.container_idle_timeout = 300
 
         self.use_distributed_resource_management = 1
 
@@ -60,6 +65,9 @@ class ClientConfigDescriptor(object):
         self.public_address = ""
 
         self.accept_tasks = 1
+        self.use_session_encryption = 1
+        self.verification_workers = 2
+        self.verification_queue_size = 100
 
     def init_from_app_config(self, app_config):
         """Initializes config parameters based on the specified AppConfig
@@ -100,10 +108,13 @@ class ConfigApprover(object):
     def _init_actions(self):
         dont_change_opt = ['seed_host', 'max_resource_size', 'max_memory_size',
                            'use_distributed_resource_management', 'use_waiting_for_task_timeout', 'send_pings',
-                           'use_ipv6', 'eth_account', 'accept_tasks', 'node_name']
+                           'use_ipv6', 'eth_account', 'accept_tasks', 'node_name', 'use_session_encryption']
         to_int_opt = ['seed_port', 'num_cores', 'opt_peer_num', 'waiting_for_task_timeout', 'p2p_session_timeout',
-                      'task_session_timeout', 'pings_interval', 'max_results_sending_delay',
-                      'min_price', 'max_price']
+                      'task_session_timeout', 'task_session_idle_timeout', 'max_task_sessions_per_peer',
+                      'pings_interval', 'max_results_sending_delay',
+                      'min_price', 'max_price', 'slot_num_cores', 'slot_max_memory_size',
+                      'container_idle_timeout',
+                      'verification_workers', 'verification_queue_size']
         to_float_opt = ['estimated_performance', 'estimated_lux_performance', 'estimated_blender_performance',
                         'getting_peers_interval', 'getting_tasks_interval', 'computing_trust', 'requesting_trust']
         self._opts_to_change = dont_change_opt + to_int_opt + to_float_opt
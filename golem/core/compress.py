@@ -42,3 +42,68 @@ def decompress(data):
     :return str: string containing uncompressed data
     """
     return zlib.decompress(data)
+
+
+class CompressingWriter(object):
+    """ File-like object that compresses data written to it and writes the result to dst.
+    close() flushes the compressor, but doesn't close dst.
+    """
+
+    def __init__(self, dst, level=zlib.Z_DEFAULT_COMPRESSION):
+        """
+        :param dst: file-like object to write compressed data to
+        :param int level: zlib compression level
+        """
+        self._dst = dst
+        self._compressor = zlib.compressobj(level)
+        self.closed = False
+
+    def write(self, data):
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self._dst.write(compressed)
+
+    def close(self):
+        if not self.closed:
+            self._dst.write(self._compressor.flush())
+            self.closed = True
+
+
+class DecompressingReader(object):
+    """ File-like object that decompresses data read from src. At most buffer_size bytes of src
+    and of decompressed data are processed at once.
+    """
+
+    def __init__(self, src, buffer_size=1024 * 1024):
+        """
+        :param src: file-like object with data compressed with zlib
+        :param int buffer_size: size of chunks read from src
+        """
+        self._src = src
+        self._decompressor = zlib.decompressobj()
+        self.buffer_size = buffer_size
+        self._decompressed = str()
+        self._pos = 0
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._decompressed) - self._pos < size):
+            self.__decompress_chunk()
+
+        end = len(self._decompressed) if size < 0 else self._pos + size
+        data = self._decompressed[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def __decompress_chunk(self):
+        remaining = self._decompressed[self._pos:]
+        self._pos = 0
+
+        compressed = self._decompressor.unconsumed_tail
+        if not compressed:
+            compressed = self._src.read(self.buffer_size)
+        if compressed:
+            self._decompressed = remaining + self._decompressor.decompress(compressed, self.buffer_size)
+        else:
+            self._eof = True
+            self._decompressed = remaining + self._decompressor.flush()
@@ -5,11 +5,26 @@ from variables import LONG_STANDARD_SIZE
 MAX_BUFFER_SIZE = 2 * 1024 * 1024
 
 
+class DataBufferOverflow(Exception):
+    """ Raised when appending data would grow the buffer past its size limit """
+    pass
+
+
 class DataBuffer:
-    """ Data buffer that helps with network communication. """
-    def __init__(self):
-        """ Create new data buffer """
-        self.buffered_data = ""
+    """ Data buffer that helps with network communication.
+
+    Data is kept in a single bytearray with a read offset. Reads only advance
+    the offset and the consumed prefix is dropped once it takes up more than
+    half of the buffer, so every byte is copied a constant number of times
+    and reading a frame costs time proportional to the frame, not the buffer.
+    """
+    def __init__(self, max_size=MAX_BUFFER_SIZE):
+        """ Create new data buffer
+        :param int max_size: maximum number of unread bytes kept in the buffer
+        """
+        self.max_size = max_size
+        self._data = bytearray()
+        self._offset = 0
 
     def append_ulong(self, num):
         """
@@ -18,34 +33,40 @@ class DataBuffer:
         """
         assert num >= 0
         str_num_rep = struct.pack("!L", num)
-        self.buffered_data = "".join([self.buffered_data, str_num_rep])
+        self.append_string(str_num_rep)
         return str_num_rep
 
-    def append_string(self, data, check_size=True, overflow_prefix=None):
+    def append_string(self, data, check_size=True):
         """ Append given string to data buffer
-        :param check_size: keep buffer size below MAX_BUFFER_SIZE
-        :param overflow_prefix: string to prepend on overflow
+        :param check_size: keep buffer size below max_size. If the limit would be exceeded
+        DataBufferOverflow is raised and the buffer is left unchanged, so the caller can stop
+        reading from the source (or drop it) instead of losing data silently.
         :param str data: string to append
         """
-        new_size = self.data_size() + len(data)
-        if check_size and new_size > MAX_BUFFER_SIZE:
-            self.buffered_data = "".join([overflow_prefix or '', data])
-        else:
-            self.buffered_data = "".join([self.buffered_data, data])
+        if check_size and self.data_size() + len(data) > self.max_size:
+            raise DataBufferOverflow("Buffer size limit exceeded: {} + {} > {}"
+                                     .format(self.data_size(), len(data), self.max_size))
+        self._data.extend(data)
 
     def data_size(self):
         """ Return size of data in buffer
         :return int: size of data in buffer
         """
-        return len(self.buffered_data)
+        return len(self._data) - self._offset
+
+    def free_space(self):
+        """ Return how many bytes can be appended before the size limit is reached
+        :return int: number of bytes that still fit into the buffer
+        """
+        return max(self.max_size - self.data_size(), 0)
 
     def peek_ulong(self):
         """ Check long number that is located at the beginning of this data buffer
         :return long: number at the beginning of the buffer
         """
-        assert len(self.buffered_data) >= LONG_STANDARD_SIZE
+        assert self.data_size() >= LONG_STANDARD_SIZE
 
-        (ret_val,) = struct.unpack("!L", self.buffered_data[0:LONG_STANDARD_SIZE])
+        (ret_val,) = struct.unpack_from("!L", self._data, self._offset)
         return ret_val
 
     def read_ulong(self):
@@ -53,7 +74,7 @@ class DataBuffer:
         :return long: long number removed from the beginning of buffer
         """
         val_ = self.peek_ulong()
-        self.buffered_data = self.buffered_data[4:]
+        self._consume(LONG_STANDARD_SIZE)
 
         return val_
 
@@ -62,10 +83,9 @@ class DataBuffer:
         :param long num_chars: how many chars should be read from buffer
         :return str: first <num_chars> chars from buffer
         """
-        assert num_chars <= len(self.buffered_data)
+        assert num_chars <= self.data_size()
 
-        ret_str = self.buffered_data[:num_chars]
-        return ret_str
+        return str(self._data[self._offset:self._offset + num_chars])
 
     def read_string(self, num_chars):
         """ Remove first <num_chars> chars from buffer and return them.
@@ -73,7 +93,7 @@ class DataBuffer:
         :return str: string removed form buffer
         """
         val_ = self.peek_string(num_chars)
-        self.buffered_data = self.buffered_data[num_chars:]
+        self._consume(num_chars)
 
         return val_
 
@@ -81,8 +101,8 @@ class DataBuffer:
         """ Return all data from buffer and clear the buffer.
         :return str: all data that was in the buffer.
         """
-        ret_data = self.buffered_data
-        self.buffered_data = ""
+        ret_data = str(self._data[self._offset:])
+        self.clear_buffer()
 
         return ret_data
 
@@ -92,8 +112,7 @@ class DataBuffer:
         """
         ret_str = None
 
-        if (self.data_size() > LONG_STANDARD_SIZE and
-                self.data_size() >= (self.peek_ulong() + LONG_STANDARD_SIZE)):
+        if self._has_len_prefixed_string():
             num_chars = self.read_ulong()
             ret_str = self.read_string(num_chars)
 
@@ -101,18 +120,33 @@ class DataBuffer:
 
     def get_len_prefixed_string(self):
         """Generator function that return from buffer strings preceded with their length (long) """
-        while (self.data_size() > LONG_STANDARD_SIZE and
-               self.data_size() >= (self.peek_ulong() + LONG_STANDARD_SIZE)):
+        while self._has_len_prefixed_string():
             num_chars = self.read_ulong()
             yield self.read_string(num_chars)
 
-    def append_len_prefixed_string(self, data):
+    def append_len_prefixed_string(self, data, check_size=True):
         """ Append length of a given data and then given data to the buffer
         :param str data: data to append
+        :param check_size: keep buffer size below max_size (see append_string)
         """
-        prefix = self.append_ulong(len(data))
-        self.append_string(data, overflow_prefix=prefix)
+        if check_size and self.data_size() + LONG_STANDARD_SIZE + len(data) > self.max_size:
+            raise DataBufferOverflow("Message too long: {} bytes".format(len(data)))
+        self.append_ulong(len(data))
+        self.append_string(data, check_size=False)
 
     def clear_buffer(self):
         """ Remove all data from the buffer """
-        self.buffered_data = ""
+        self._data = bytearray()
+        self._offset = 0
+
+    def _has_len_prefixed_string(self):
+        size = self.data_size()
+        return size > LONG_STANDARD_SIZE and size >= self.peek_ulong() + LONG_STANDARD_SIZE
+
+    def _consume(self, num_chars):
+        self._offset += num_chars
+        if self._offset == len(self._data):
+            self.clear_buffer()
+        elif self._offset > len(self._data) // 2:
+            del self._data[:self._offset]
+            self._offset = 0
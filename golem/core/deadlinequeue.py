@@ -0,0 +1,53 @@
+import heapq
+
+
+class DeadlineQueue(object):
+    """ Keys ordered by their deadlines, so that expired keys can be found without looking at the other ones.
+    Changed and removed deadlines leave outdated entries in the heap, they are skipped when they expire and
+    dropped when there are more of them than of the valid ones.
+    """
+
+    def __init__(self):
+        self._heap = []  # (deadline, key), possibly outdated
+        self._deadlines = {}  # key -> current deadline
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def get(self, key):
+        """ Return current deadline for a key or None if the key isn't in the queue """
+        return self._deadlines.get(key)
+
+    def push(self, key, deadline):
+        """ Add a key or change its deadline. O(log n) """
+        if key in self._deadlines and self._deadlines[key] == deadline:
+            return
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        self._compact()
+
+    def remove(self, key):
+        """ Remove a key if it's in the queue. Amortized O(1) """
+        if self._deadlines.pop(key, None) is not None:
+            self._compact()
+
+    def pop_expired(self, now):
+        """ Remove and return keys with deadlines earlier than now, the earliest first. O(expired * log n)
+        :param now: current time, comparable with deadlines
+        :return list:
+        """
+        expired = []
+        while self._heap and self._heap[0][0] < now:
+            deadline, key = heapq.heappop(self._heap)
+            if key in self._deadlines and self._deadlines[key] == deadline:
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._deadlines) + 16:
+            self._heap = [(deadline, key) for key, deadline in self._deadlines.iteritems()]
+            heapq.heapify(self._heap)
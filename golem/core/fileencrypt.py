@@ -131,3 +131,104 @@ class AESFileEncryptor(FileEncryptor):
                     working = False
 
                 dst.write(chunk)
+
+
+class AESStreamWriter(object):
+    """ File-like object that encrypts data written to it and writes the result to dst. Output has the same
+    format as AESFileEncryptor.encrypt output. At most buffer_size bytes (plus the last write) are kept
+    in memory. close() writes the final block, but doesn't close dst.
+    """
+
+    def __init__(self, dst, secret, key_len=32, encryptor=AESFileEncryptor, buffer_size=1024 * 1024):
+        self.block_size = encryptor.block_size
+        self.buffer_size = max(buffer_size, self.block_size)
+        salt = encryptor.gen_salt(self.block_size)
+        key, iv = encryptor.get_key_and_iv(secret, salt, key_len, self.block_size)
+        self._cipher = AES.new(key, encryptor.aes_mode, iv)
+        self._dst = dst
+        self._buffer = []
+        self._buffered = 0
+        self.closed = False
+
+        dst.write(encryptor.salt_prefix + salt)
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self.__encrypt_buffer()
+
+    def close(self):
+        if not self.closed:
+            self.__encrypt_buffer(final=True)
+            self.closed = True
+
+    def __encrypt_buffer(self, final=False):
+        data = str().join(self._buffer)
+        rest = str()
+        if final:
+            pad_len = self.block_size - len(data) % self.block_size
+            data += pad_len * chr(pad_len)
+        else:
+            split = len(data) - len(data) % self.block_size
+            data, rest = data[:split], data[split:]
+
+        self._dst.write(self._cipher.encrypt(data))
+        self._buffer = [rest]
+        self._buffered = len(rest)
+
+
+class AESStreamReader(object):
+    """ File-like object that decrypts data read from src, which has been encrypted with
+    AESFileEncryptor.encrypt or AESStreamWriter. src is read in buffer_size chunks.
+    """
+
+    def __init__(self, src, secret, key_len=32, encryptor=AESFileEncryptor, buffer_size=1024 * 1024):
+        self.block_size = encryptor.block_size
+        self.buffer_size = max(buffer_size - buffer_size % self.block_size, self.block_size)
+        salt = src.read(self.block_size)[encryptor.salt_prefix_len:]
+        key, iv = encryptor.get_key_and_iv(secret, salt, key_len, self.block_size)
+        self._cipher = AES.new(key, encryptor.aes_mode, iv)
+        self._src = src
+        self._encrypted = str()
+        # decrypted data, the last block is held back until the end of src is reached, since it contains
+        # padding
+        self._decrypted = str()
+        self._last_block = str()
+        self._pos = 0
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._decrypted) - self._pos < size):
+            self.__decrypt_chunk()
+
+        end = len(self._decrypted) if size < 0 else self._pos + size
+        data = self._decrypted[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def __decrypt_chunk(self):
+        chunk = self._src.read(self.buffer_size)
+        remaining = self._decrypted[self._pos:]
+        self._pos = 0
+
+        if not chunk:
+            self._eof = True
+            if self._encrypted or not self._last_block:
+                raise ValueError("Invalid encrypted data length")
+            pad_len = ord(self._last_block[-1])
+            if not 0 < pad_len <= self.block_size:
+                raise ValueError("Invalid padding")
+            self._decrypted = remaining + self._last_block[:-pad_len]
+            self._last_block = str()
+            return
+
+        encrypted = self._encrypted + chunk
+        split = len(encrypted) - len(encrypted) % self.block_size
+        self._encrypted = encrypted[split:]
+        if split:
+            decrypted = self._last_block + self._cipher.decrypt(encrypted[:split])
+            self._decrypted = remaining + decrypted[:-self.block_size]
+            self._last_block = decrypted[-self.block_size:]
+        else:
+            self._decrypted = remaining
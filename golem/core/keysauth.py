@@ -1,7 +1,9 @@
 import os
 import abc
 import logging
+from collections import OrderedDict
 from random import random
+from threading import Lock
 
 from Crypto.PublicKey import RSA
 from simpleenv import get_local_datadir
@@ -15,6 +17,8 @@ from golem.core.variables import PRIVATE_KEY, PUBLIC_KEY
 
 logger = logging.getLogger(__name__)
 
+PUBLIC_KEY_CACHE_SIZE = 1024
+
 
 def sha3(seed):
     """ Return sha3-256 of seed in digest
@@ -28,6 +32,51 @@ def sha2(seed):
     return int("0x" + sha256(seed).hexdigest(), 16)
 
 
+class PublicKeyCache(object):
+    """ Bounded, thread-safe LRU cache of ECCx objects built from peers' public keys. Building ECCx requires
+    decoding and validating the key, so verifiers are prepared once and reused for subsequent signatures. """
+    def __init__(self, max_size=PUBLIC_KEY_CACHE_SIZE):
+        """
+        :param int max_size: maximum number of public keys kept in the cache
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._verifiers = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, raw_public_key):
+        """ Return ECCx object for given public key, create it if it's not in the cache yet
+        :param str raw_public_key: public key in digest (len == 64)
+        :return ECCx: object that can be used to verify signatures made with the matching private key
+        """
+        with self._lock:
+            ecc = self._verifiers.pop(raw_public_key, None)
+            if ecc is not None:
+                self.hits += 1
+                self._verifiers[raw_public_key] = ecc
+                return ecc
+            self.misses += 1
+
+        ecc = ECCx(raw_public_key)
+
+        with self._lock:
+            self._verifiers[raw_public_key] = ecc
+            while len(self._verifiers) > self.max_size:
+                self._verifiers.popitem(last=False)
+        return ecc
+
+    def clear(self):
+        """ Remove all keys from the cache and reset counters """
+        with self._lock:
+            self._verifiers.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._verifiers)
+
+
 class KeysAuth(object):
     """ Cryptographic authorization manager. Create and keeps private and public keys."""
 
@@ -109,6 +158,20 @@ class KeysAuth(object):
         """
         return sig == data
 
+    def verify_batch(self, items):
+        """ Verify many signatures at once
+        :param list items: list of (sig, data, public_key) tuples, see verify
+        :return list: list of verification results in the same order as items
+        """
+        return [self.verify(sig, data, public_key) for sig, data, public_key in items]
+
+    def get_shared_secret(self, public_key):
+        """ Return secret shared with the owner of given public key, that can be used to derive symmetric keys
+        :param public_key: public key of the other party
+        :return str|None: shared secret or None if key agreement is not supported
+        """
+        return None
+
     @abc.abstractmethod
     def load_from_file(self, file_name):
         """ Load private key from given file. If it's proper key, then generate public key and
@@ -336,6 +399,7 @@ class EllipticalKeysAuth(KeysAuth):
         :param uuid|None uuid: application identifier (to read keys)
         """
         KeysAuth.__init__(self, datadir, private_key_name, public_key_name)
+        self.public_key_cache = PublicKeyCache()
         try:
             self.ecc = ECCx(None, self._private_key)
         except AssertionError:
@@ -389,18 +453,49 @@ class EllipticalKeysAuth(KeysAuth):
         """
 
         try:
-            if public_key is None:
-                public_key = self.public_key
-            if len(public_key) == 128:
-                public_key = public_key.decode('hex')
-            ecc = ECCx(public_key)
-            return ecc.verify(sig, sha3(data))
+            return self._get_verifier(public_key).verify(sig, sha3(data))
         except AssertionError:
             logger.info("Wrong key format")
         except Exception as exc:
             logger.error("Cannot verify signature: {}".format(exc))
         return False
 
+    def verify_batch(self, items):
+        """ Verify many ECDSA signatures at once. Every distinct public key is looked up only once,
+        so it's cheaper than calling verify for each signature separately.
+        :param list items: list of (sig, data, public_key) tuples, see verify
+        :return list: list of verification results in the same order as items
+        """
+        verifiers = {}
+        results = []
+        for sig, data, public_key in items:
+            try:
+                if public_key not in verifiers:
+                    verifiers[public_key] = None
+                    verifiers[public_key] = self._get_verifier(public_key)
+                ecc = verifiers[public_key]
+                results.append(ecc is not None and ecc.verify(sig, sha3(data)))
+                continue
+            except AssertionError:
+                logger.info("Wrong key format")
+            except Exception as exc:
+                logger.error("Cannot verify signature: {}".format(exc))
+            results.append(False)
+        return results
+
+    def get_shared_secret(self, public_key):
+        """ Return ECDH secret shared with the owner of given public key
+        :param str public_key: public key of the other party in digest (len == 64) or hexdigest (len == 128)
+        :return str|None: 32 bytes of shared key material or None if the public key is invalid
+        """
+        try:
+            if len(public_key) == 128:
+                public_key = public_key.decode('hex')
+            return self.ecc.get_ecdh_key(public_key)
+        except Exception as exc:
+            logger.error("Cannot compute shared secret: {}".format(exc))
+        return None
+
     def generate_new(self, difficulty):
         """ Generate new pair of keys with given difficulty
         :param int difficulty: desired key difficulty level
@@ -453,6 +548,13 @@ class EllipticalKeysAuth(KeysAuth):
         self.save_to_files(priv_key_loc, pub_key_loc)
         self.ecc = ECCx(None, self._private_key)
 
+    def _get_verifier(self, public_key):
+        if public_key is None:
+            public_key = self.public_key
+        if len(public_key) == 128:
+            public_key = public_key.decode('hex')
+        return self.public_key_cache.get(public_key)
+
     @staticmethod
     def _load_private_key_from_file(file_name):
         if not os.path.isfile(file_name):
@@ -0,0 +1,88 @@
+import hmac
+import struct
+from hashlib import sha256
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+
+class SessionCipherError(Exception):
+    pass
+
+
+class SessionCipher(object):
+    """ Symmetric authenticated encryption for a single connection, based on a secret shared by both peers
+    (eg. ECDH of their keys) and random values exchanged during the handshake.
+
+    Each direction uses its own pair of keys. Data is encrypted with AES-256 in CTR mode and authenticated
+    with HMAC-SHA256 (encrypt-then-MAC). Every chunk carries a sequence number that is used as the CTR nonce
+    and must be strictly increasing, so replayed chunks are rejected.
+
+    Chunk format: MARKER | seq (8 bytes) | ciphertext | tag (32 bytes)
+    """
+
+    MARKER = '\x53'
+    SEQ_SIZE = 8
+    TAG_SIZE = 32
+    OVERHEAD = len(MARKER) + SEQ_SIZE + TAG_SIZE
+
+    def __init__(self, shared_secret, local_key_id, peer_key_id, local_rand_val, peer_rand_val):
+        """
+        :param str shared_secret: secret known only to this node and the peer
+        :param str local_key_id: public key of this node
+        :param str peer_key_id: public key of the peer
+        :param float local_rand_val: random value sent by this node in the handshake
+        :param float peer_rand_val: random value sent by the peer in the handshake
+        """
+        salt = ":".join(repr(v) for v in sorted([local_rand_val, peer_rand_val]))
+        self._send_enc_key, self._send_mac_key = self._derive_keys(shared_secret, salt, local_key_id)
+        self._recv_enc_key, self._recv_mac_key = self._derive_keys(shared_secret, salt, peer_key_id)
+        self._send_seq = 0
+        self._recv_seq = -1
+
+    @classmethod
+    def is_encrypted(cls, data):
+        """ Check whether data looks like a chunk encrypted with a session cipher
+        :param str data: received data
+        :return bool:
+        """
+        return len(data) >= cls.OVERHEAD and data[0] == cls.MARKER
+
+    def encrypt(self, data):
+        """ Encrypt and authenticate data sent to the peer
+        :param str data: data to encrypt
+        :return str: encrypted chunk
+        """
+        seq = struct.pack("!Q", self._send_seq)
+        self._send_seq += 1
+        ciphertext = self._cipher(self._send_enc_key, seq).encrypt(data)
+        header = self.MARKER + seq
+        return header + ciphertext + hmac.new(self._send_mac_key, header + ciphertext, sha256).digest()
+
+    def decrypt(self, data):
+        """ Verify and decrypt a chunk received from the peer
+        :param str data: encrypted chunk
+        :return str: decrypted data
+        :raise SessionCipherError: if the chunk is malformed, was tampered with or replayed
+        """
+        if not self.is_encrypted(data):
+            raise SessionCipherError("Wrong session cipher header")
+        body, tag = data[:-self.TAG_SIZE], data[-self.TAG_SIZE:]
+        if not hmac.compare_digest(hmac.new(self._recv_mac_key, body, sha256).digest(), tag):
+            raise SessionCipherError("Failed to authenticate data")
+        seq_bytes = body[1:1 + self.SEQ_SIZE]
+        (seq,) = struct.unpack("!Q", seq_bytes)
+        if seq <= self._recv_seq:
+            raise SessionCipherError("Replayed or reordered data ({} <= {})".format(seq, self._recv_seq))
+        self._recv_seq = seq
+        return self._cipher(self._recv_enc_key, seq_bytes).decrypt(body[1 + self.SEQ_SIZE:])
+
+    @staticmethod
+    def _cipher(key, seq_bytes):
+        return AES.new(key, AES.MODE_CTR, counter=Counter.new(64, prefix=seq_bytes))
+
+    @staticmethod
+    def _derive_keys(shared_secret, salt, sender_key_id):
+        def derive(label):
+            return hmac.new(shared_secret, "|".join([salt, str(sender_key_id), label]), sha256).digest()
+        return derive("enc"), derive("mac")
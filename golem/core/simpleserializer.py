@@ -1,12 +1,14 @@
 import cPickle  # release version
 import collections
 import json   # debug version
+from io import BytesIO
 
 import types
 
 
 import cbor2
 import dill
+from cbor2.encoder import CBOREncoder, encode_length
 import pytz
 import sys
 
@@ -207,6 +209,58 @@ class CBORSerializer(object):
     def dumps(cls, obj):
         return cbor2.dumps(obj, encoders=cls.encoders, datetime_as_timestamp=True, timezone=pytz.utc)
 
+    @classmethod
+    def dumps_canonical(cls, obj):
+        """ Serialize obj in a canonical form, independent of dictionary ordering (see CanonicalCBOREncoder)
+        :param obj: object to be serialized
+        :return str: canonical CBOR representation of obj
+        """
+        fp = BytesIO()
+        CanonicalCBOREncoder(encoders=cls.encoders, datetime_as_timestamp=True,
+                             timezone=pytz.utc).encode(obj, fp)
+        return fp.getvalue()
+
+
+class CanonicalCBOREncoder(CBOREncoder):
+    """ CBOR encoder that writes dictionaries and objects' public properties as lists of (key, value) pairs
+    sorted by key. The output is the same as encoding a sorted copy of the structure with CBORSerializer,
+    but it's produced in a single pass, without building the sorted copy first. """
+
+    def encode(self, obj, fp):
+        if isinstance(obj, dict):
+            self._encode_sorted_items(obj, fp, filter_properties=False)
+        # treat objects as dictionaries
+        elif hasattr(obj, '__dict__'):
+            self._encode_sorted_items(obj.__dict__, fp, filter_properties=True)
+        # strings are iterable (see the case below)
+        elif isinstance(obj, basestring):
+            CBOREncoder.encode(self, obj, fp)
+        elif isinstance(obj, (list, tuple)):
+            self._write_array_header(len(obj), fp)
+            for item in obj:
+                self.encode(item, fp)
+        else:
+            CBOREncoder.encode(self, obj, fp)
+
+    def _encode_sorted_items(self, dictionary, fp, filter_properties):
+        if filter_properties:
+            keys = [k for k, v in dictionary.iteritems() if not (k.startswith('_') or callable(v))]
+        else:
+            keys = dictionary.keys()
+        keys.sort()
+
+        self._write_array_header(len(keys), fp)
+        for k in keys:
+            self._write_array_header(2, fp)
+            CBOREncoder.encode(self, k, fp)
+            self.encode(dictionary[k], fp)
+
+    def _write_array_header(self, length, fp):
+        # every array is a distinct container, so with value sharing enabled it's only marked as shareable
+        if self.value_sharing:
+            fp.write(encode_length(0xd8, 0x1c))
+        fp.write(encode_length(0x80, length))
+
 
 if IS_DEBUG:
     SimpleSerializer = SimpleSerializerDebug
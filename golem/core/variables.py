@@ -39,3 +39,5 @@ BREAK_TIME = 2400
 END_ROUND_TIME = 1200
 ROUND_TIME = 600
 STAGE_TIME = 36000
+GOSSIP_INTERVAL = 60
+GOSSIP_EPOCH_LENGTH = 21600
@@ -57,6 +57,28 @@ class DockerConfigManager(object):
 
         self.container_host_config.update(host_config)
 
+    def get_slot_host_config(self, slot_index, num_cores, max_memory_size):
+        """ Return host config for a container run in one of the task computer's slots. Each slot is given
+        its own subset of the CPU cores available to containers and its share of memory.
+        :param int slot_index: index of the compute slot
+        :param int num_cores: number of cores assigned to a single slot
+        :param int max_memory_size: memory assigned to a single slot [kB]
+        :return dict: host config
+        """
+        host_config = dict(self.container_host_config)
+
+        with self._try():
+            cpu_set = host_config['cpuset'].split(',')
+            slot_cores = min(int(num_cores) or len(cpu_set), len(cpu_set))
+            first = (slot_index * slot_cores) % len(cpu_set)
+            host_config['cpuset'] = ','.join(cpu_set[(first + i) % len(cpu_set)] for i in range(slot_cores))
+
+        with self._try():
+            if int(max_memory_size):
+                host_config['mem_limit'] = int(max_memory_size) * 1000
+
+        return host_config
+
     @classmethod
     def install(cls, *args, **kwargs):
         docker_manager = cls(*args, **kwargs)
@@ -0,0 +1,375 @@
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import time
+
+import docker.errors
+import requests
+
+from golem.docker.client import local_client
+from golem.docker.job import DockerJob
+
+__all__ = ['ContainerPool', 'PooledDockerJob']
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which an unused container is removed
+CONTAINER_IDLE_TIMEOUT = 300
+
+# Warm containers only wait for work, task scripts are run in them with docker exec
+IDLE_COMMAND = ["tail", "-f", "/dev/null"]
+
+# Entrypoint of the Golem images (see gnr/task/images/Dockerfile.base),
+# runs the task script as a non-root user
+IMAGE_ENTRYPOINT = "/usr/local/bin/entrypoint.sh"
+
+
+class WarmContainer(object):
+    """ Running container that accepts subtasks. Its work and output directories are mounted from a host
+    directory owned by the pool and emptied before the container is reused. """
+
+    def __init__(self, key, container_id, host_dir, mem_limit):
+        self.key = key
+        self.container_id = container_id
+        self.host_dir = host_dir
+        self.work_dir = os.path.join(host_dir, "work")
+        self.output_dir = os.path.join(host_dir, "output")
+        self.mem_limit = mem_limit
+        self.last_used = time.time()
+        self.reusable = True
+
+    def clear(self):
+        """ Remove files left by the last subtask """
+        for directory in (self.work_dir, self.output_dir):
+            for name in os.listdir(directory):
+                file_path = os.path.join(directory, name)
+                if os.path.isdir(file_path) and not os.path.islink(file_path):
+                    shutil.rmtree(file_path)
+                else:
+                    os.remove(file_path)
+
+
+class ContainerPool(object):
+    """ Keeps containers running between subtasks, so that short subtasks don't pay for creating, starting
+    and removing a container each time.
+
+    Containers are pooled per image, resources directory and host config, so a container only computes
+    subtasks of a single task with the same CPU and memory limits. Each subtask gets empty work and output
+    directories and read-only resources. Containers that haven't been used for idle_timeout seconds are
+    removed. The sum of memory limits of pooled containers doesn't exceed max_memory; idle containers
+    are evicted to make room for new ones and jobs that still don't fit are run in a new container.
+    """
+
+    def __init__(self, root_dir, idle_timeout=CONTAINER_IDLE_TIMEOUT, max_memory=0,
+                 client_factory=local_client):
+        """
+        :param str root_dir: directory for the containers' work and output directories
+        :param float idle_timeout: how long a container may wait for a subtask [s]
+        :param int max_memory: limit of memory reserved by pooled containers [B], 0 means no limit
+        :param client_factory: function returning docker client
+        """
+        self.root_dir = root_dir
+        self.idle_timeout = idle_timeout
+        self.max_memory = max_memory
+        self.client_factory = client_factory
+        self.reserved_memory = 0
+        self._idle = {}  # key -> list of idle containers, the most recently used one is the last
+        self._containers = {}  # container_id -> WarmContainer, both idle and busy
+        self._lock = threading.Lock()
+
+    def acquire(self, image, resources_dir, host_config=None):
+        """ Return a container for a subtask, create it if there's no idle one
+        :param DockerImage image: image to run
+        :param str resources_dir: task resources directory, mounted read-only
+        :param dict host_config: container host config
+        :return WarmContainer|None: None if a container can't be pooled
+        """
+        key = self._get_key(image, resources_dir, host_config)
+        mem_limit = (host_config or {}).get('mem_limit') or 0
+
+        with self._lock:
+            evicted = self._take_expired(time.time())
+            idle = self._idle.get(key)
+            container = idle.pop() if idle else None
+            if container is None:
+                evicted += self._make_room(mem_limit)
+                can_create = not self.max_memory or (mem_limit and
+                                                     self.reserved_memory + mem_limit <= self.max_memory)
+                if can_create:
+                    self.reserved_memory += mem_limit
+
+        self._remove_all(evicted)
+        if container is not None:
+            logger.debug("Reusing container {}".format(container.container_id))
+            return container
+        if not can_create:
+            logger.debug("Not enough memory to pool a new container")
+            return None
+
+        try:
+            container = self._create(key, image, resources_dir, host_config, mem_limit)
+        except Exception as err:
+            logger.warning("Can't create a warm container: {}".format(err))
+            with self._lock:
+                self.reserved_memory -= mem_limit
+            return None
+
+        with self._lock:
+            self._containers[container.container_id] = container
+        return container
+
+    def release(self, container):
+        """ Return container to the pool after its subtask has finished. Containers that can't be reused
+        are removed. """
+        reusable = container.reusable and self.idle_timeout > 0
+        if reusable:
+            try:
+                container.clear()
+            except (IOError, OSError) as err:
+                logger.warning("Can't clear container {} directories: {}".format(container.container_id, err))
+                reusable = False
+
+        with self._lock:
+            if reusable and container.container_id in self._containers:
+                container.last_used = time.time()
+                self._idle.setdefault(container.key, []).append(container)
+                return
+            self._forget(container)
+        self._remove_all([container])
+
+    def evict_idle(self):
+        """ Take containers that have been idle for longer than idle_timeout out of the pool. Removing them
+        blocks on the docker daemon, so it's left to the caller.
+        :return list: evicted containers, pass them to remove
+        """
+        with self._lock:
+            return self._take_expired(time.time())
+
+    def remove(self, containers):
+        """ Stop and remove containers taken out of the pool, blocks until the docker daemon is done """
+        self._remove_all(containers)
+
+    def get_num_containers(self):
+        return len(self._containers)
+
+    def get_num_idle(self):
+        return sum(len(idle) for idle in self._idle.values())
+
+    def quit(self):
+        """ Remove all containers """
+        with self._lock:
+            containers = self._containers.values()
+            for container in containers:
+                container.reusable = False
+                self._forget(container)
+        self._remove_all(containers)
+
+    def _take_expired(self, now):
+        expired = [c for idle in self._idle.values() for c in idle if now - c.last_used >= self.idle_timeout]
+        for container in expired:
+            self._forget(container)
+        return expired
+
+    def _make_room(self, mem_limit):
+        """ Forget least recently used idle containers until mem_limit fits into max_memory """
+        if not self.max_memory or not mem_limit or mem_limit > self.max_memory:
+            return []
+        idle = sorted((c for containers in self._idle.values() for c in containers),
+                      key=lambda c: c.last_used)
+        evicted = []
+        while idle and self.reserved_memory + mem_limit > self.max_memory:
+            container = idle.pop(0)
+            self._forget(container)
+            evicted.append(container)
+        return evicted
+
+    def _forget(self, container):
+        idle = self._idle.get(container.key)
+        if idle and container in idle:
+            idle.remove(container)
+            if not idle:
+                del self._idle[container.key]
+        if self._containers.pop(container.container_id, None) is not None:
+            self.reserved_memory -= container.mem_limit
+
+    def _create(self, key, image, resources_dir, host_config, mem_limit):
+        if not os.path.exists(self.root_dir):
+            os.makedirs(self.root_dir)
+        host_dir = tempfile.mkdtemp(prefix="container-", dir=self.root_dir)
+        try:
+            for name in ("work", "output"):
+                os.mkdir(os.path.join(host_dir, name))
+                DockerJob._host_dir_chmod(os.path.join(host_dir, name), "rw")
+
+            client = self.client_factory()
+            container = DockerJob._create_container(client, image, host_config,
+                                                    os.path.join(host_dir, "work"), resources_dir,
+                                                    os.path.join(host_dir, "output"),
+                                                    entrypoint=IDLE_COMMAND)
+            container_id = container["Id"]
+            try:
+                client.start(container_id)
+            except Exception:
+                client.remove_container(container_id, force=True)
+                raise
+        except Exception:
+            shutil.rmtree(host_dir, ignore_errors=True)
+            raise
+
+        logger.debug("Warm container {} created, image: {}".format(container_id, image.name))
+        return WarmContainer(key, container_id, host_dir, mem_limit)
+
+    def _remove_all(self, containers):
+        if not containers:
+            return
+        client = self.client_factory()
+        for container in containers:
+            try:
+                client.remove_container(container.container_id, force=True)
+                logger.debug("Warm container {} removed".format(container.container_id))
+            except (docker.errors.APIError, requests.exceptions.RequestException) as err:
+                logger.warning("Can't remove container {}: {}".format(container.container_id, err))
+            shutil.rmtree(container.host_dir, ignore_errors=True)
+
+    @staticmethod
+    def _get_key(image, resources_dir, host_config):
+        return (image.name, image.id, os.path.normpath(resources_dir),
+                repr(sorted((host_config or {}).items())))
+
+
+class PooledDockerJob(DockerJob):
+    """ DockerJob that runs the task script in a warm container from the ContainerPool. If the pool can't
+    provide a container, the job creates its own one like DockerJob does. """
+
+    # Files with the script's stdout and stderr, relative to WORK_DIR
+    STDOUT_FILE = ".stdout"
+    STDERR_FILE = ".stderr"
+
+    def __init__(self, pool, *args, **kwargs):
+        """
+        :param ContainerPool pool: pool of warm containers
+        Other arguments are the same as DockerJob's.
+        """
+        super(PooledDockerJob, self).__init__(*args, **kwargs)
+        self.pool = pool
+        self.warm_container = None
+        self.exec_id = None
+        self.exec_thread = None
+        self._exec_finished = threading.Event()
+
+    def _prepare(self):
+        self.warm_container = self.pool.acquire(self.image, self.resources_dir, self.host_config)
+        if self.warm_container is None:
+            return super(PooledDockerJob, self)._prepare()
+
+        self._write_job_files(self.warm_container.work_dir)
+        self.container_id = self.warm_container.container_id
+        self.container = {"Id": self.container_id}
+        self.state = self.STATE_CREATED
+
+    def _cleanup(self):
+        if self.warm_container is None:
+            return super(PooledDockerJob, self)._cleanup()
+
+        self.pool.release(self.warm_container)
+        self.warm_container = None
+        self.container = None
+        self.container_id = None
+        self.state = self.STATE_REMOVED
+
+    def start(self):
+        if self.warm_container is None:
+            return super(PooledDockerJob, self).start()
+        if self.state != self.STATE_CREATED:
+            logger.debug("Container {} not started, status = {}".format(self.container_id, self.state))
+            return None
+
+        command = "{} {} >{} 2>{}".format(IMAGE_ENTRYPOINT, self._get_container_script_path(),
+                                          posixpath.join(self.WORK_DIR, self.STDOUT_FILE),
+                                          posixpath.join(self.WORK_DIR, self.STDERR_FILE))
+        client = self.pool.client_factory()
+        result = client.exec_create(self.container_id, ["/bin/sh", "-c", command])
+        self.exec_id = result["Id"]
+        # The output goes to files, so the attached stream only ends when the script exits
+        stream = client.exec_start(self.exec_id, stream=True)
+        self.exec_thread = threading.Thread(target=self._wait_for_exec, args=(stream,),
+                                            name="ContainerExecThread")
+        self.exec_thread.daemon = True
+        self.exec_thread.start()
+        self.state = self.STATE_RUNNING
+        logger.debug("Job started in container {}".format(self.container_id))
+        return result
+
+    def wait(self, timeout=None):
+        if self.warm_container is None:
+            return super(PooledDockerJob, self).wait(timeout)
+        if self.state not in [self.STATE_RUNNING, self.STATE_EXITED]:
+            logger.debug("Cannot wait for container {}, status = {}".format(self.container_id, self.state))
+            return -1
+
+        if not self._exec_finished.wait(timeout):
+            raise requests.exceptions.ReadTimeout("Job in container {} is still running"
+                                                  .format(self.container_id))
+        info = self.pool.client_factory().exec_inspect(self.exec_id)
+        if info["Running"]:
+            # Connection to the daemon was lost while the script runs
+            self.warm_container.reusable = False
+            raise requests.exceptions.ConnectionError("Lost job in container {}".format(self.container_id))
+        if self.state == self.STATE_RUNNING:
+            self.state = self.STATE_EXITED
+            self._collect_output()
+        return info["ExitCode"]
+
+    def kill(self):
+        if self.warm_container is None:
+            return super(PooledDockerJob, self).kill()
+        if self.state == self.STATE_RUNNING:
+            # The task script can't be stopped separately, the whole container is killed and won't be reused
+            self.warm_container.reusable = False
+            self.pool.client_factory().kill(self.container_id)
+
+    def stream_logs(self, stdout_file=None, stderr_file=None):
+        if self.warm_container is None:
+            return super(PooledDockerJob, self).stream_logs(stdout_file, stderr_file)
+        # The script writes its logs to files in the work directory as it runs, they're copied by dump_logs
+
+    def dump_logs(self, stdout_file=None, stderr_file=None):
+        if self.warm_container is None:
+            return super(PooledDockerJob, self).dump_logs(stdout_file, stderr_file)
+
+        for log_file, name in [(stdout_file, self.STDOUT_FILE), (stderr_file, self.STDERR_FILE)]:
+            if not log_file:
+                continue
+            src = os.path.join(self.warm_container.work_dir, name)
+            if os.path.exists(src):
+                shutil.copyfile(src, log_file)
+            else:
+                open(log_file, "w").close()
+
+    def get_status(self):
+        if self.warm_container is None:
+            return super(PooledDockerJob, self).get_status()
+        return self.state
+
+    def _wait_for_exec(self, stream):
+        try:
+            for _ in stream:
+                pass
+        except Exception as err:
+            logger.warning("Exec stream of container {} broken: {}".format(self.container_id, err))
+        finally:
+            self._exec_finished.set()
+
+    def _get_host_progress_path(self):
+        if self.warm_container is None:
+            return super(PooledDockerJob, self)._get_host_progress_path()
+        return os.path.join(self.warm_container.work_dir, self.PROGRESS_FILE)
+
+    def _collect_output(self):
+        """ Move output files from the container's output directory to the job's output directory """
+        src_dir = self.warm_container.output_dir
+        for name in os.listdir(src_dir):
+            shutil.move(os.path.join(src_dir, name), os.path.join(self.output_dir, name))
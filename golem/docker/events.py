@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+
+from client import local_client
+
+__all__ = ['DockerEventMonitor', 'ContainerWatch', 'event_monitor']
+
+logger = logging.getLogger(__name__)
+
+STATE_CREATED = "created"
+STATE_RUNNING = "running"
+STATE_EXITED = "exited"
+STATE_REMOVED = "removed"
+
+# Container states after Docker events
+EVENT_STATES = {
+    "create": STATE_CREATED,
+    "start": STATE_RUNNING,
+    "restart": STATE_RUNNING,
+    "unpause": STATE_RUNNING,
+    "die": STATE_EXITED,
+    "destroy": STATE_REMOVED,
+}
+
+# Delay between reconnection attempts [s]
+RECONNECT_DELAY = 1.0
+
+
+class ContainerWatch(object):
+    """ State of a container, updated by DockerEventMonitor """
+
+    def __init__(self, container_id):
+        self.container_id = container_id
+        self.status = None
+        self.exit_code = None
+        self._finished = threading.Event()
+
+    def update(self, status, exit_code=None):
+        self.status = status
+        if exit_code is not None:
+            self.exit_code = exit_code
+        if status in [STATE_EXITED, STATE_REMOVED]:
+            self._finished.set()
+
+    def is_finished(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """ Block until the container exits or timeout elapses
+        :param float|None timeout: time to wait [s]
+        :return bool: True if the container has exited
+        """
+        return self._finished.wait(timeout)
+
+
+class DockerEventMonitor(object):
+    """ Reads the Docker events stream in a single background thread and passes container state changes
+    to the watches of the containers they concern. Instead of asking the daemon about the state of each
+    container over and over, jobs wait until an event comes.
+    If the stream breaks, the monitor reconnects and replays events since the last one it has seen.
+    """
+
+    def __init__(self, client_factory=local_client, reconnect_delay=RECONNECT_DELAY):
+        """
+        :param client_factory: function returning docker client
+        :param float reconnect_delay: delay between reconnection attempts [s]
+        """
+        self.client_factory = client_factory
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        self.running = False
+        self._since = None
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, container_id):
+        """ Start receiving state changes of the container. Events since the previous second are replayed,
+        so the container should be watched right after it has been created.
+        :param str container_id: container to watch
+        :return ContainerWatch:
+        """
+        with self._lock:
+            watch = self._watches.get(container_id)
+            if watch is None:
+                watch = self._watches[container_id] = ContainerWatch(container_id)
+            if self._since is None:
+                self._since = int(time.time()) - 1
+            if not self.running:
+                self.running = True
+                self._thread = threading.Thread(target=self._run, name="DockerEventMonitor")
+                self._thread.daemon = True
+                self._thread.start()
+        return watch
+
+    def unwatch(self, container_id):
+        with self._lock:
+            self._watches.pop(container_id, None)
+
+    def get_num_watched(self):
+        return len(self._watches)
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            try:
+                events = self.client_factory().events(since=self._since, decode=True)
+                self.connected = True
+                for event in events:
+                    self._dispatch(event)
+                    if not self.running:
+                        break
+            except Exception as err:
+                logger.warning("Docker events stream broken: {}".format(err))
+            self.connected = False
+            if self.running:
+                time.sleep(self.reconnect_delay)
+
+    def _dispatch(self, event):
+        event_time = event.get("time")
+        if event_time and event_time > self._since:
+            self._since = event_time
+
+        with self._lock:
+            watch = self._watches.get(event.get("id"))
+        status = EVENT_STATES.get(event.get("Action") or event.get("status"))
+        if watch is None or status is None:
+            return
+
+        exit_code = None
+        if status == STATE_EXITED:
+            # Only newer daemons put the exit code in the event
+            attributes = (event.get("Actor") or {}).get("Attributes") or {}
+            try:
+                exit_code = int(attributes["exitCode"])
+            except (KeyError, TypeError, ValueError):
+                pass
+        watch.update(status, exit_code)
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def event_monitor():
+    """Returns the DockerEventMonitor shared by all jobs.
+    :returns DockerEventMonitor:
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = DockerEventMonitor()
+        return _monitor
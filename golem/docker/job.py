@@ -5,9 +5,11 @@ import threading
 from os import path
 
 import docker.errors
+import requests
 
 from golem.core.common import is_windows, nt_path_to_posix_path
 from client import local_client
+from events import event_monitor
 
 __all__ = ['DockerJob']
 
@@ -47,6 +49,10 @@ class DockerJob(object):
     # Name of the parameters file, relative to WORK_DIR
     PARAMS_FILE = "params.py"
 
+    # Name of the file in which the task script may report its progress
+    # (a number between 0 and 1), relative to WORK_DIR
+    PROGRESS_FILE = ".progress"
+
     def __init__(self, image, script_src, parameters,
                  resources_dir, work_dir, output_dir,
                  host_config=None, container_log_level=None):
@@ -75,6 +81,8 @@ class DockerJob(object):
         self.container_id = None
         self.container_log = None
         self.state = self.STATE_NEW
+        self.watch = None
+        self.log_threads = {}  # log file path -> thread writing the container's logs to it
 
         if container_log_level is None:
             container_log_level = container_logger.getEffectiveLevel()
@@ -86,21 +94,41 @@ class DockerJob(object):
         self.resources_dir_mod = self._host_dir_chmod(self.resources_dir, "rw")
         self.output_dir_mod = self._host_dir_chmod(self.output_dir, "rw")
 
+        self._write_job_files(self.work_dir)
+
+        # The location of the task script when mounted in the container
+        container_script_path = self._get_container_script_path()
+        self.container = self._create_container(local_client(), self.image, self.host_config,
+                                                self.work_dir, self.resources_dir, self.output_dir,
+                                                command=[container_script_path])
+        self.container_id = self.container["Id"]
+        self.state = self.STATE_CREATED
+        # State changes come from the events stream, the container is never inspected
+        self.watch = event_monitor().watch(self.container_id)
+        logger.debug("Container {} prepared, image: {}, dirs: {}; {}; {}"
+                     .format(self.container_id, self.image.name,
+                             self.work_dir, self.resources_dir, self.output_dir)
+                     )
+        assert self.container_id
+
+    def _write_job_files(self, work_dir):
         # Save parameters in work_dir/PARAMS_FILE
-        params_file_path = self._get_host_params_path()
+        params_file_path = path.join(work_dir, self.PARAMS_FILE)
         with open(params_file_path, "w") as params_file:
             for key, value in self.parameters.iteritems():
                 line = "{} = {}\n".format(key, repr(value))
                 params_file.write(bytearray(line, encoding='utf-8'))
 
         # Save the script in work_dir/TASK_SCRIPT
-        task_script_path = self._get_host_script_path()
+        task_script_path = path.join(work_dir, self.TASK_SCRIPT)
         with open(task_script_path, "w") as script_file:
             script_file.write(bytearray(self.script_src, "utf-8"))
 
-        # Setup volumes for the container
-        client = local_client()
-
+    @classmethod
+    def _create_container(cls, client, image, host_config, work_dir, resources_dir, output_dir, **kwargs):
+        """ Create a container with work_dir, resources_dir and output_dir mounted as WORK_DIR, RESOURCES_DIR
+        and OUTPUT_DIR. Additional kwargs are passed to client.create_container.
+        """
         # Docker config requires binds to be specified using posix paths,
         # even on Windows. Hence this function:
         def posix_path(path):
@@ -108,7 +136,7 @@ class DockerJob(object):
                 return nt_path_to_posix_path(path)
             return path
 
-        container_config = dict(self.host_config)
+        container_config = dict(host_config or {})
         cpuset = container_config.pop('cpuset', None)
 
         if is_windows():
@@ -116,41 +144,34 @@ class DockerJob(object):
         else:
             environment = dict(LOCAL_USER_ID=os.getuid())
 
+        # Setup volumes for the container
         host_cfg = client.create_host_config(
             binds={
-                posix_path(self.work_dir): {
-                    "bind": self.WORK_DIR,
+                posix_path(work_dir): {
+                    "bind": cls.WORK_DIR,
                     "mode": "rw"
                 },
-                posix_path(self.resources_dir): {
-                    "bind": self.RESOURCES_DIR,
+                posix_path(resources_dir): {
+                    "bind": cls.RESOURCES_DIR,
                     "mode": "ro"
                 },
-                posix_path(self.output_dir): {
-                    "bind": self.OUTPUT_DIR,
+                posix_path(output_dir): {
+                    "bind": cls.OUTPUT_DIR,
                     "mode": "rw"
                 }
             },
             **container_config
         )
 
-        # The location of the task script when mounted in the container
-        container_script_path = self._get_container_script_path()
-        self.container = client.create_container(
-            image=self.image.name,
-            volumes=[self.WORK_DIR, self.RESOURCES_DIR, self.OUTPUT_DIR],
+        return client.create_container(
+            image=image.name,
+            volumes=[cls.WORK_DIR, cls.RESOURCES_DIR, cls.OUTPUT_DIR],
             host_config=host_cfg,
-            command=[container_script_path],
-            working_dir=self.WORK_DIR,
+            working_dir=cls.WORK_DIR,
             cpuset=cpuset,
-            environment=environment
+            environment=environment,
+            **kwargs
         )
-        self.container_id = self.container["Id"]
-        logger.debug("Container {} prepared, image: {}, dirs: {}; {}; {}"
-                     .format(self.container_id, self.image.name,
-                             self.work_dir, self.resources_dir, self.output_dir)
-                     )
-        assert self.container_id
 
     def _cleanup(self):
         if self.container:
@@ -163,12 +184,17 @@ class DockerJob(object):
                 logger.debug("Container {} removed".format(self.container_id))
             except docker.errors.APIError:
                 pass  # Already removed? Sometimes happens in CircleCI.
+            event_monitor().unwatch(self.container_id)
+            self.watch = None
             self.container = None
             self.container_id = None
             self.state = self.STATE_REMOVED
         if self.logging_thread:
             self.logging_thread.join()
             self.logging_thread = None
+        for thread in self.log_threads.values():
+            thread.join()
+        self.log_threads = {}
 
     def __enter__(self):
         self._prepare()
@@ -183,6 +209,9 @@ class DockerJob(object):
     def _get_host_params_path(self):
         return path.join(self.work_dir, self.PARAMS_FILE)
 
+    def _get_host_progress_path(self):
+        return path.join(self.work_dir, self.PROGRESS_FILE)
+
     @staticmethod
     def _host_dir_chmod(dst_dir, mod):
         if isinstance(mod, basestring):
@@ -228,9 +257,8 @@ class DockerJob(object):
     def start(self):
         if self.get_status() == self.STATE_CREATED:
             client = local_client()
-            client.start(self.container_id)
-            result = client.inspect_container(self.container_id)
-            self.state = result["State"]["Status"]
+            result = client.start(self.container_id)
+            self.state = self.STATE_RUNNING
             logger.debug("Container {} started".format(self.container_id))
             if self.log_std_streams:
                 self._start_logging_thread(client)
@@ -246,7 +274,17 @@ class DockerJob(object):
         """
         if self.get_status() in [self.STATE_RUNNING, self.STATE_EXITED]:
             client = local_client()
-            return client.wait(self.container_id, timeout)
+            if not event_monitor().connected:
+                # Events may be missed until the monitor connects, fall back to a blocking wait
+                return client.wait(self.container_id, timeout)
+            if not self.watch.wait(timeout):
+                raise requests.exceptions.ReadTimeout("Container {} is still running after {}s"
+                                                      .format(self.container_id, timeout))
+            self.state = self.STATE_EXITED
+            if self.watch.exit_code is None:
+                # Older daemons don't send the exit code with the event
+                self.watch.exit_code = client.inspect_container(self.container_id)["State"]["ExitCode"]
+            return self.watch.exit_code
         logger.debug("Cannot wait for container {}, status = {}"
                      .format(self.container_id, self.get_status()))
         return -1
@@ -261,29 +299,62 @@ class DockerJob(object):
             client = local_client()
             client.kill(self.container_id)
 
+    def stream_logs(self, stdout_file=None, stderr_file=None):
+        """Write the container's stdout and stderr to files as the job
+        produces them. Call dump_logs with the same files to wait until
+        the logs are complete.
+        """
+        if not self.container:
+            return
+        client = local_client()
+        for log_file, stdout in [(stdout_file, True), (stderr_file, False)]:
+            if log_file and log_file not in self.log_threads:
+                stream = client.logs(self.container_id, stream=True,
+                                     stdout=stdout, stderr=not stdout)
+                thread = threading.Thread(
+                    target=self._dump_stream, args=(stream, log_file),
+                    name="ContainerLogThread")
+                thread.daemon = True
+                thread.start()
+                self.log_threads[log_file] = thread
+
     def dump_logs(self, stdout_file=None, stderr_file=None):
         if not self.container:
             return
         client = local_client()
 
-        def dump_stream(stream, path):
-            with open(path, "w") as f:
-                for line in stream:
-                    f.write(line)
+        for log_file, stdout in [(stdout_file, True), (stderr_file, False)]:
+            if not log_file:
+                continue
+            thread = self.log_threads.pop(log_file, None)
+            if thread:
+                # The stream ends when the container exits
+                thread.join()
+            else:
+                stream = client.logs(self.container_id, stream=True,
+                                     stdout=stdout, stderr=not stdout)
+                self._dump_stream(stream, log_file)
+
+    @staticmethod
+    def _dump_stream(stream, path):
+        with open(path, "w") as f:
+            for chunk in stream:
+                f.write(chunk)
                 f.flush()
 
-        if stdout_file:
-            stdout = client.logs(self.container_id,
-                                 stream=True, stdout=True, stderr=False)
-            dump_stream(stdout, stdout_file)
-        if stderr_file:
-            stderr = client.logs(self.container_id,
-                                 stream=True, stdout=False, stderr=True)
-            dump_stream(stderr, stderr_file)
+    def get_progress(self):
+        """Returns the progress reported by the task script, None if
+        the script hasn't reported any.
+        """
+        try:
+            with open(self._get_host_progress_path()) as f:
+                progress = float(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+        return min(max(progress, 0.0), 1.0)
 
     def get_status(self):
         if self.container:
-            client = local_client()
-            inspect = client.inspect_container(self.container_id)
-            return inspect["State"]["Status"]
+            if self.watch and self.watch.status in [self.STATE_EXITED, self.STATE_REMOVED]:
+                return self.watch.status
         return self.state
@@ -2,6 +2,7 @@ import logging
 import os
 
 import requests
+from golem.docker.container_pool import PooledDockerJob
 from golem.docker.job import DockerJob
 from golem.task.taskthread import TaskThread
 from golem.vm.memorychecker import MemoryChecker
@@ -24,7 +25,7 @@ class DockerTaskThread(TaskThread):
 
     def __init__(self, task_computer, subtask_id, docker_images,
                  orig_script_dir, src_code, extra_data, short_desc,
-                 res_path, tmp_path, timeout, check_mem=False):
+                 res_path, tmp_path, timeout, check_mem=False, host_config=None, container_pool=None):
 
         super(DockerTaskThread, self).__init__(
             task_computer, subtask_id, orig_script_dir, src_code, extra_data,
@@ -41,6 +42,8 @@ class DockerTaskThread(TaskThread):
         self.job = None
         self.mc = None
         self.check_mem = check_mem
+        self.host_config = host_config
+        self.container_pool = container_pool
 
     def run(self):
         if not self.image:
@@ -58,23 +61,33 @@ class DockerTaskThread(TaskThread):
             if not os.path.exists(output_dir):
                 os.mkdir(output_dir)
 
-            if self.docker_manager:
+            if self.host_config:
+                host_config = self.host_config
+            elif self.docker_manager:
                 host_config = self.docker_manager.container_host_config
             else:
                 host_config = None
 
-            with DockerJob(self.image, self.src_code, self.extra_data,
-                           self.res_path, work_dir, output_dir,
-                           host_config=host_config) as job:
+            if self.container_pool:
+                job = PooledDockerJob(self.container_pool, self.image, self.src_code, self.extra_data,
+                                      self.res_path, work_dir, output_dir,
+                                      host_config=host_config)
+            else:
+                job = DockerJob(self.image, self.src_code, self.extra_data,
+                                self.res_path, work_dir, output_dir,
+                                host_config=host_config)
+
+            with job:
                 self.job = job
                 if self.check_mem:
                     self.mc = MemoryChecker()
                     self.mc.start()
                 self.job.start()
-                exit_code = self.job.wait()
-                # Get stdout and stderr
+                # Get stdout and stderr while the job runs
                 stdout_file = os.path.join(output_dir, self.STDOUT_FILE)
                 stderr_file = os.path.join(output_dir, self.STDERR_FILE)
+                self.job.stream_logs(stdout_file, stderr_file)
+                exit_code = self.job.wait()
                 self.job.dump_logs(stdout_file, stderr_file)
 
                 if self.mc:
@@ -105,8 +118,9 @@ class DockerTaskThread(TaskThread):
             self._cleanup()
 
     def get_progress(self):
-        # TODO: make the container update some status file?
-        return 0.0
+        job = self.job
+        progress = job.get_progress() if job else None
+        return progress if progress is not None else 0.0
 
     def end_comp(self):
         try:
@@ -154,6 +154,18 @@ class Settings(object):
             '{} >= int >= 1'.format(_cpu_count),
             _int,
             lambda x: _cpu_count >= x >= 1
+        ),
+        'slot_num_cores': Setting(
+            'Number of CPU cores per subtask (0 - all)',
+            '{} >= int >= 0'.format(_cpu_count),
+            _int,
+            lambda x: _cpu_count >= x >= 0
+        ),
+        'slot_max_memory_size': Setting(
+            'Max memory size per subtask (0 - split evenly)',
+            'int >= 0 [kB]',
+            _int,
+            lambda x: x >= 0
         )
     }
 
@@ -85,6 +85,7 @@ class P2PService(PendingConnectionsServer, DiagnosticsProvider):
         self.last_peers_request = time.time()
         self.last_tasks_request = time.time()
         self.last_refresh_peers = time.time()
+        self.tasks_resync_version = 0  # task server's resync version when full task lists were last requested
 
         self.last_messages = []
 
@@ -595,11 +596,18 @@ class P2PService(PendingConnectionsServer, DiagnosticsProvider):
 
     # TASK FUNCTIONS
     ############################
-    def get_tasks_headers(self):
+    def get_tasks_headers(self, since=None):
         """ Return a list of a known tasks headers
+        :param int|None since: return only headers that changed after this version of the list
         :return list: list of task header
         """
-        return self.task_server.get_tasks_headers()
+        return self.task_server.get_tasks_headers(since)
+
+    def get_tasks_version(self):
+        """ Return current version of the known tasks headers list
+        :return int:
+        """
+        return self.task_server.get_tasks_version()
 
     def add_task_header(self, th_dict_repr):
         """ Add new task header to a list of known task headers
@@ -608,6 +616,13 @@ class P2PService(PendingConnectionsServer, DiagnosticsProvider):
         """
         return self.task_server.add_task_header(th_dict_repr)
 
+    def add_task_headers(self, th_dict_reprs):
+        """ Add many new task headers at once, verifying their signatures in one batch
+        :param list th_dict_reprs: new task headers dictionary representations
+        :return list: for each header True if it was in a right format, False otherwise
+        """
+        return self.task_server.add_task_headers(th_dict_reprs)
+
     def remove_task_header(self, task_id):
         """ Remove header of a task with given id from a list of a known tasks
         :param str task_id: id of a task that should be removed
@@ -729,24 +744,6 @@ class P2PService(PendingConnectionsServer, DiagnosticsProvider):
         """
         return self.gossip_keeper.pop_gossip()
 
-    def send_stop_gossip(self):
-        """ Send stop gossip message to all peers
-        """
-        for peer in self.peers.values():
-            peer.send_stop_gossip()
-
-    def stop_gossip(self, id_):
-        """ Register that peer with given id has stopped gossiping
-        :param str id_: id of a string that has stopped gossiping
-        """
-        self.gossip_keeper.stop_gossip(id_)
-
-    def pop_stop_gossip_form_peers(self):
-        """ Return set of all peers that has stopped gossiping
-        :return set: set of peers id's
-        """
-        return self.gossip_keeper.pop_stop_gossip_from_peers()
-
     def push_local_rank(self, node_id, loc_rank):
         """ Send local rank to peers
         :param str node_id: id of anode that this opinion is about
@@ -808,8 +805,11 @@ class P2PService(PendingConnectionsServer, DiagnosticsProvider):
     def __send_message_get_tasks(self):
         if time.time() - self.last_tasks_request > 2:
             self.last_tasks_request = time.time()
+            resync_version = self.task_server.get_tasks_resync_version()
+            full = resync_version != self.tasks_resync_version
+            self.tasks_resync_version = resync_version
             for p in self.peers.values():
-                p.send_get_tasks()
+                p.send_get_tasks(full)
 
     def __connection_established(self, session, conn_id=None):
         peer_conn = session.conn.transport.getPeer()
@@ -1,7 +1,7 @@
 import time
 import logging
 import random
-import operator
+import heapq
 from collections import deque
 
 logger = logging.getLogger(__name__)
@@ -15,7 +15,11 @@ IDLE_REFRESH = 3  # refresh idle buckets after this time
 
 
 class PeerKeeper(object):
-    """ Keeps information about peers in a network"""
+    """ Keeps information about peers in a network. Bucket i keeps peers whose keys share exactly i leading
+    bits with this peer's key, the last bucket keeps all peers that share at least that many bits (it contains
+    this peer's key and it's the only one that may be split). So a bucket of a peer is found directly from the
+    length of the XOR prefix.
+    """
     def __init__(self, key, k_size=K_SIZE):
         """
         Create new peer keeper instance
@@ -27,7 +31,7 @@ class PeerKeeper(object):
         self.k = K  # bucket size
         self.concurrency = CONCURRENCY  # parallel find node lookup
         self.k_size = k_size  # pubkey size
-        self.buckets = [KBucket(0, 2 ** k_size - 1, self.k)]
+        self.buckets = [KBucket(0, 2 ** k_size - 1, self.k)]  # ordered by XOR prefix length
         self.pong_timeout = PONG_TIMEOUT
         self.request_timeout = REQUEST_TIMEOUT
         self.idle_refresh = IDLE_REFRESH
@@ -62,18 +66,19 @@ class PeerKeeper(object):
 
         key_num = long(peer_info.key, 16)
 
-        bucket = self.bucket_for_peer(key_num)
-        peer_to_remove = bucket.add_peer(peer_info)
-        if peer_to_remove:
-            if bucket.start <= self.key_num <= bucket.end:
-                self.split_bucket(bucket)
-                return self.add_peer(peer_info)
-            else:
+        while True:
+            bucket = self.bucket_for_peer(key_num)
+            peer_to_remove = bucket.add_peer(peer_info, key_num)
+            if not peer_to_remove:
+                break
+            if bucket is not self.buckets[-1]:
                 self.expected_pongs[peer_to_remove.key] = (peer_info, time.time())
                 return peer_to_remove
+            self.split_bucket(bucket)
 
-        for bucket in self.buckets:
-            logger.debug(str(bucket))
+        if logger.isEnabledFor(logging.DEBUG):
+            for bucket in self.buckets:
+                logger.debug(str(bucket))
         return None
 
     def set_last_message_time(self, key):
@@ -83,10 +88,7 @@ class PeerKeeper(object):
         if not key:
             return
 
-        for i, bucket in enumerate(self.buckets):
-            if bucket.start <= long(key, 16) < bucket.end:
-                self.buckets[i].last_updated = time.time()
-                break
+        self.bucket_for_peer(long(key, 16)).last_updated = time.time()
 
     def get_random_known_peer(self):
         """ Return random peer from any bucket
@@ -105,24 +107,34 @@ class PeerKeeper(object):
         if key in self.expected_pongs:
             del self.expected_pongs[key]
 
+    def prefix_len(self, key_num):
+        """ Return number of leading bits that given key shares with this peer's key
+        :param long key_num: key long representation
+        :return int:
+        """
+        return self.k_size - (self.key_num ^ key_num).bit_length()
+
     def bucket_for_peer(self, key_num):
         """ Find a bucket which contains given num in it's range
         :param long key_num: key long representation for which a bucket should be found
         :return KBucket: bucket containing key in it's range
         """
-        for bucket in self.buckets:
-            if bucket.start <= key_num < bucket.end:
-                return bucket
+        return self.buckets[min(self.prefix_len(key_num), len(self.buckets) - 1)]
 
     def split_bucket(self, bucket):
-        """ Split given bucket into two buckets
+        """ Split the bucket containing this peer's key (the last one) into two buckets. The half without this
+        peer's key keeps its place, the other one becomes the last bucket.
         :param KBucket bucket: bucket to be split
         """
         logger.debug("Splitting bucket")
-        buck1, buck2 = bucket.split()
+        lower, upper = bucket.split()
+        if lower.start <= self.key_num <= lower.end:
+            far, near = upper, lower
+        else:
+            far, near = lower, upper
         idx = self.buckets.index(bucket)
-        self.buckets[idx] = buck1
-        self.buckets.insert(idx + 1, buck2)
+        self.buckets[idx] = far
+        self.buckets.insert(idx + 1, near)
 
     def cnt_distance(self, key):
         """ Return distance between this peer and peer with a given key. Distance is a xor between keys.
@@ -152,22 +164,30 @@ class PeerKeeper(object):
             alpha = self.concurrency
 
         neigh = []
-        for bucket in self.buckets_by_id_distance(key_num):
-            for peer in bucket.peers_by_id_distance(key_num):
-                if long(peer.key, 16) != key_num:
-                    neigh.append(peer)
-                    if len(neigh) == alpha * 2:
-                        break
-        return sorted(neigh, key=lambda p: node_id_distance(p, key_num))[:alpha]
+        for group in self.buckets_by_id_distance(key_num):
+            candidates = ((num ^ key_num, peer) for bucket in group for peer, num in bucket.peers_with_nums()
+                          if num != key_num)
+            neigh += [peer for _, peer in heapq.nsmallest(alpha - len(neigh), candidates, key=lambda c: c[0])]
+            if len(neigh) >= alpha:
+                break
+        return neigh
 
     def buckets_by_id_distance(self, key_num):
-        """
-        Return list of buckets sorted by distance from given key. Bucket middle range element
-        will be taken into account
+        """ Return groups of buckets ordered by distance from given key. Every peer from a group is closer to
+        the key than any peer from the following groups, so only peers within a group have to be compared.
         :param long key_num: given key in long format
-        :return list: sorted buckets list
+        :return list: list of lists of buckets
         """
-        return sorted(self.buckets, key=operator.methodcaller('id_distance', key_num))
+        last = len(self.buckets) - 1
+        prefix = self.prefix_len(key_num)
+        if prefix >= last:
+            return [[bucket] for bucket in reversed(self.buckets)]
+        # peers from the key's bucket share the most leading bits with the key, peers from deeper buckets
+        # differ from the key at the same bit as this peer does, peers from the other buckets are farther with
+        # every bucket
+        groups = [[self.buckets[prefix]], self.buckets[prefix + 1:]]
+        groups += [[bucket] for bucket in reversed(self.buckets[:prefix])]
+        return groups
 
     def __remove_old_expected_pongs(self):
         cur_time = time.time()
@@ -213,7 +233,7 @@ def node_id_distance(node_info, key_num):
 class KBucket(object):
     """ K-bucket for keeping information about peers from a given distance range """
     def __init__(self, start, end, k):
-        """ Create new bucket with range [start, end)
+        """ Create new bucket with range [start, end]
         :param long start: bucket range start
         :param long end: bucket range end
         :param int k: bucket size
@@ -222,28 +242,27 @@ class KBucket(object):
         self.end = end
         self.k = k
         self.peers = deque()
+        self.peer_nums = {}  # peer key -> key in long format
         self.last_updated = time.time()
 
-    def add_peer(self, peer):
+    def add_peer(self, peer, key_num=None):
         """ Try to append peer to a bucket. If it's already in a bucket remove it and append it at the end.
         If a bucket is full then return oldest peer in a bucket as a candidate for replacement
         :param Node peer: peer to add
+        :param long|None key_num: peer's key in long format, computed from the peer's key if None
         :return Node|None: oldest peer in a bucket, if a new peer hasn't been added or None otherwise
         """
         logger.debug("KBucket adding peer {}".format(peer))
         self.last_updated = time.time()
-        old_peer = None
-        for p in self.peers:
-            if p.key == peer.key:
-                old_peer = p
-                break
-        if old_peer:
-            self.peers.remove(old_peer)
-            self.peers.append(peer)
-        elif len(self.peers) < self.k:
-            self.peers.append(peer)
-        else:
+        if peer.key in self.peer_nums:
+            for p in self.peers:
+                if p.key == peer.key:
+                    self.peers.remove(p)
+                    break
+        elif len(self.peers) >= self.k:
             return self.peers[0]
+        self.peers.append(peer)
+        self.peer_nums[peer.key] = long(peer.key, 16) if key_num is None else key_num
         return None
 
     def remove_peer(self, key_num):
@@ -252,33 +271,28 @@ class KBucket(object):
         :return Node|None: information about peer if it was in this bucket, None otherwise
         """
         for peer in self.peers:
-            if long(peer.key, 16) == key_num:
+            if self.peer_nums[peer.key] == key_num:
                 self.peers.remove(peer)
+                del self.peer_nums[peer.key]
                 return peer
         return None
 
-    def id_distance(self, key_num):
-        """ Return distance from a middle of a bucket range to a given key
-        :param long key_num:  other node public key in long format
-        :return long: distance from a middle of this bucket to a given key
-        """
-        return ((self.start + self.end) / 2) ^ key_num
-
-    def peers_by_id_distance(self, key_num):
-        return sorted(self.peers, key=lambda p: node_id_distance(p, key_num))
+    def peers_with_nums(self):
+        """ Return list of (peer, peer's key in long format) pairs """
+        return [(peer, self.peer_nums[peer.key]) for peer in self.peers]
 
     def split(self):
-        """ Split bucket into two buckets
+        """ Split bucket into two halves
         :return (KBucket, KBucket): two buckets that were created from this bucket
         """
-        midpoint = (self.start + self.end) / 2
-        lower = KBucket(self.start, midpoint, self.k)
-        upper = KBucket(midpoint + 1, self.end, self.k)
-        for peer in self.peers:
-            if long(peer.key, 16) < midpoint:
-                lower.add_peer(peer)
+        midpoint = (self.start + self.end + 1) / 2
+        lower = KBucket(self.start, midpoint - 1, self.k)
+        upper = KBucket(midpoint, self.end, self.k)
+        for peer, key_num in self.peers_with_nums():
+            if key_num < midpoint:
+                lower.add_peer(peer, key_num)
             else:
-                upper.add_peer(peer)
+                upper.add_peer(peer, key_num)
         return lower, upper
 
     def __str__(self):
@@ -13,7 +13,7 @@ from golem.network.transport.tcpnetwork import SafeProtocol
 
 logger = logging.getLogger(__name__)
 
-P2P_PROTOCOL_ID = 8
+P2P_PROTOCOL_ID = 9
 
 
 class PeerSessionInfo(object):
@@ -61,6 +61,7 @@ class PeerSession(BasicSafeSession):
         self.listen_port = None
 
         self.conn_id = None
+        self.tasks_version = 0  # version of peer's task header list that this node has already received
 
         self.solve_challenge = False  # Verification by challenge not a random value
         self.challenge = None
@@ -165,9 +166,13 @@ class PeerSession(BasicSafeSession):
         """  Send get peers message """
         self.send(MessageGetPeers())
 
-    def send_get_tasks(self):
-        """  Send get tasks message """
-        self.send(MessageGetTasks())
+    def send_get_tasks(self, full=False):
+        """  Send get tasks message. Only headers that changed after the last received version are requested.
+        :param bool full: request all headers known to the peer
+        """
+        if full:
+            self.tasks_version = 0
+        self.send(MessageGetTasks(self.tasks_version))
 
     def send_remove_task(self, task_id):
         """  Send remove task  message
@@ -191,10 +196,6 @@ class PeerSession(BasicSafeSession):
         """
         self.send(MessageGossip(gossip))
 
-    def send_stop_gossip(self):
-        """ Send stop gossip message """
-        self.send(MessageStopGossip())
-
     def send_loc_rank(self, node_id, loc_rank):
         """ Send local opinion about given node
         :param node_id: send opinion about node with this id
@@ -338,13 +339,22 @@ class PeerSession(BasicSafeSession):
             self.p2p_service.try_to_add_peer(pi)
 
     def _react_to_get_tasks(self, msg):
-        tasks = self.p2p_service.get_tasks_headers()
-        self.__send_tasks(tasks)
+        if msg.version is None:
+            self.__send_tasks(self.p2p_service.get_tasks_headers())
+            return
+        since = msg.version
+        if since > self.p2p_service.get_tasks_version():
+            since = 0  # peer has a version that this node never had, send everything
+        tasks = self.p2p_service.get_tasks_headers(since)
+        version = self.p2p_service.get_tasks_version()
+        if version != msg.version:
+            self.__send_tasks(tasks, version)
 
     def _react_to_tasks(self, msg):
-        for t in msg.tasks_array:
-            if not self.p2p_service.add_task_header(t):
-                self.disconnect(PeerSession.DCRBadProtocol)
+        if not all(self.p2p_service.add_task_headers(msg.tasks_array)):
+            self.disconnect(PeerSession.DCRBadProtocol)
+        elif msg.version is not None:
+            self.tasks_version = msg.version
 
     def _react_to_remove_task(self, msg):
         self.p2p_service.remove_task_header(msg.task_id)
@@ -362,7 +372,8 @@ class PeerSession(BasicSafeSession):
         self.p2p_service.hear_gossip(msg.gossip)
 
     def _react_to_stop_gossip(self, msg):
-        self.p2p_service.stop_gossip(self.key_id)
+        # Sent by nodes that still gossip in stages, push-sum gossip restarts in epochs instead of stopping
+        pass
 
     def _react_to_loc_rank(self, msg):
         self.p2p_service.safe_neighbour_loc_rank(self.key_id, msg.node_id, msg.loc_rank)
@@ -433,8 +444,8 @@ class PeerSession(BasicSafeSession):
             })
         self.send(MessagePeers(peers_info))
 
-    def __send_tasks(self, tasks):
-        self.send(MessageTasks(tasks))
+    def __send_tasks(self, tasks, version=None):
+        self.send(MessageTasks(tasks, version))
 
     def __send_resource_peers(self):
         resource_peers = self.p2p_service.get_resource_peers()
@@ -1,11 +1,10 @@
 import abc
-import collections
 import logging
 import time
 
 from golem.core.databuffer import DataBuffer
 from golem.core.simplehash import SimpleHash
-from golem.core.simpleserializer import SimpleSerializer
+from golem.core.simpleserializer import CBORSerializer, SimpleSerializer
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +26,7 @@ class Message:
             timestamp = time.time()
         self.timestamp = timestamp
         self.encrypted = False  # inform if message was encrypted
+        self._short_hash = None
 
     def get_type(self):
         """ Return message type
@@ -35,32 +35,16 @@ class Message:
         return self.type
 
     def get_short_hash(self):
-        """ Return short message representation for signature
+        """ Return short message representation for signature. The hash is computed once and reused,
+        so a message must not be modified after it has been signed or verified.
         :return str: short hash of serialized and sorted message dictionary representation """
-        sorted_dict = self._sort_obj(self.dict_repr())
-        return SimpleHash.hash(SimpleSerializer.dumps(sorted_dict))
-
-    def _sort_obj(self, v):
-        if isinstance(v, dict):
-            return self._sort_dict(v)
-        # treat objects as dictionaries
-        elif hasattr(v, '__dict__'):
-            return self._sort_dict(v.__dict__,
-                                   filter_properties=True)
-        # strings are iterable (see the case below)
-        elif isinstance(v, basestring):
-            return v
-        elif isinstance(v, collections.Iterable):
-            return v.__class__([self._sort_obj(_v) for _v in v])
-        return v
-
-    def _sort_dict(self, dictionary, filter_properties=False):
-        result = dict()
-        for k, v in dictionary.iteritems():
-            if filter_properties and (k.startswith('_') or callable(v)):
-                continue
-            result[k] = self._sort_obj(v)
-        return sorted(result.items())
+        if self._short_hash is None:
+            self._short_hash = SimpleHash.hash(CBORSerializer.dumps_canonical(self._get_hashed_data()))
+        return self._short_hash
+
+    def _get_hashed_data(self):
+        """ Return the part of the message that is covered by the signature """
+        return self.dict_repr()
 
     def serialize(self):
         """ Return serialized message
@@ -425,39 +409,47 @@ class MessagePeers(Message):
     def dict_repr(self):
         return {MessagePeers.PEERS_STR: self.peers_array}
 
-    def get_short_hash(self):
-        return SimpleHash.hash(SimpleSerializer.dumps(self._sort_obj(self.peers_array)))
+    def _get_hashed_data(self):
+        return self.peers_array
 
 
 class MessageGetTasks(Message):
     Type = P2P_MESSAGE_BASE + 5
 
     GET_TASKS_STR = u"GET_TASKS"
+    VERSION_STR = u"VERSION"
 
-    def __init__(self, sig="", timestamp=None, dict_repr=None):
+    def __init__(self, version=None, sig="", timestamp=None, dict_repr=None):
         """ Create request task message
+        :param int|None version: ask only for headers that changed after this version of the task list,
+                                 for all headers if None
         :param str sig: signature
         :param float timestamp: current timestamp
         :param dict dict_repr: dictionary representation of a message
         """
         Message.__init__(self, MessageGetTasks.Type, sig, timestamp)
 
+        self.version = version
+
         if dict_repr:
             assert dict_repr.get(MessageGetTasks.GET_TASKS_STR)
+            self.version = dict_repr.get(MessageGetTasks.VERSION_STR)
 
     def dict_repr(self):
-        return {MessageGetTasks.GET_TASKS_STR: True}
+        return {MessageGetTasks.GET_TASKS_STR: True, MessageGetTasks.VERSION_STR: self.version}
 
 
 class MessageTasks(Message):
     Type = P2P_MESSAGE_BASE + 6
 
     TASKS_STR = u"TASKS"
+    VERSION_STR = u"VERSION"
 
-    def __init__(self, tasks_array=None, sig="", timestamp=None, dict_repr=None):
+    def __init__(self, tasks_array=None, version=None, sig="", timestamp=None, dict_repr=None):
         """
         Create message containing information about tasks
         :param list tasks_array: list of peers information
+        :param int|None version: version of the sender's task list, that includes these headers
         :param str sig: signature
         :param float timestamp: current timestamp
         :param dict dict_repr: dictionary representation of a message
@@ -468,15 +460,19 @@ class MessageTasks(Message):
             tasks_array = []
 
         self.tasks_array = tasks_array
+        self.version = version
 
         if dict_repr:
             self.tasks_array = dict_repr[MessageTasks.TASKS_STR]
+            self.version = dict_repr.get(MessageTasks.VERSION_STR)
 
     def dict_repr(self):
-        return {MessageTasks.TASKS_STR: self.tasks_array}
+        return {MessageTasks.TASKS_STR: self.tasks_array, MessageTasks.VERSION_STR: self.version}
 
-    def get_short_hash(self):
-        return SimpleHash.hash(SimpleSerializer.dumps(self._sort_obj(self.tasks_array)))
+    def _get_hashed_data(self):
+        if self.version is None:
+            return self.tasks_array
+        return [self.tasks_array, self.version]
 
 
 class MessageRemoveTask(Message):
@@ -550,8 +546,8 @@ class MessageResourcePeers(Message):
     def dict_repr(self):
         return {MessageResourcePeers.RESOURCE_PEERS_STR: self.resource_peers}
 
-    def get_short_hash(self):
-        return SimpleHash.hash(SimpleSerializer.dumps(self._sort_obj(self.resource_peers)))
+    def _get_hashed_data(self):
+        return self.resource_peers
 
 
 class MessageDegree(Message):
@@ -933,8 +929,8 @@ class MessageTaskToCompute(Message):
     def dict_repr(self):
         return {MessageTaskToCompute.COMPUTE_TASK_DEF_STR: self.ctd}
 
-    def get_short_hash(self):
-        return SimpleHash.hash(SimpleSerializer.dumps(self._sort_obj(self.ctd)))
+    def _get_hashed_data(self):
+        return self.ctd
 
 
 class MessageCannotAssignTask(Message):
@@ -1673,6 +1669,66 @@ class MessageCannotComputeTask(Message):
         return {MessageCannotComputeTask.REASON_STR: self.reason,
                 MessageCannotComputeTask.SUBTASK_ID_STR: self.subtask_id}
 
+
+class MessageSubtaskProgress(Message):
+    Type = TASK_MSG_BASE + 27
+
+    SUBTASK_ID_STR = u"SUBTASK_ID"
+    PROGRESS_STR = u"PROGRESS"
+
+    def __init__(self, subtask_id=None, progress=0.0, sig="", timestamp=None, dict_repr=None):
+        """
+        Message informs task owner about progress of subtask computation
+        :param str subtask_id: subtask that is being computed
+        :param float progress: part of the subtask that is already computed (between 0 and 1)
+        :param str sig: signature
+        :param float timestamp: current timestamp
+        :param dict dict_repr: dictionary representation of a message
+        """
+        Message.__init__(self, MessageSubtaskProgress.Type, sig, timestamp)
+
+        self.subtask_id = subtask_id
+        self.progress = progress
+
+        if dict_repr:
+            self.subtask_id = dict_repr[MessageSubtaskProgress.SUBTASK_ID_STR]
+            self.progress = dict_repr[MessageSubtaskProgress.PROGRESS_STR]
+
+    def dict_repr(self):
+        return {MessageSubtaskProgress.SUBTASK_ID_STR: self.subtask_id,
+                MessageSubtaskProgress.PROGRESS_STR: self.progress}
+
+
+class MessageSubtaskResultNotNeeded(Message):
+    Type = TASK_MSG_BASE + 28
+
+    SUBTASK_ID_STR = u"SUBTASK_ID"
+    REASON_STR = u"REASON"
+
+    def __init__(self, subtask_id=None, reason=None, sig="", timestamp=None, dict_repr=None):
+        """
+        Message informs that subtask result won't be verified nor paid for, because it's no longer needed
+        (eg. result of another copy of this subtask was accepted). It's neither provider's nor requester's
+        fault.
+        :param str subtask_id: id of a subtask
+        :param str reason: why the result isn't needed
+        :param str sig: signature
+        :param float timestamp: current timestamp
+        :param dict dict_repr: dictionary representation of a message
+        """
+        Message.__init__(self, MessageSubtaskResultNotNeeded.Type, sig, timestamp)
+
+        self.subtask_id = subtask_id
+        self.reason = reason
+
+        if dict_repr:
+            self.subtask_id = dict_repr[MessageSubtaskResultNotNeeded.SUBTASK_ID_STR]
+            self.reason = dict_repr[MessageSubtaskResultNotNeeded.REASON_STR]
+
+    def dict_repr(self):
+        return {MessageSubtaskResultNotNeeded.SUBTASK_ID_STR: self.subtask_id,
+                MessageSubtaskResultNotNeeded.REASON_STR: self.reason}
+
 RESOURCE_MSG_BASE = 3000
 
 
@@ -1903,8 +1959,10 @@ def init_messages():
     MessageWaitForNatTraverse()
     MessageNatPunchFailure()
     MessageWaitingForResults()
+    MessageSubtaskProgress()
     MessageSubtaskResultAccepted()
     MessageSubtaskResultRejected()
+    MessageSubtaskResultNotNeeded()
     MessageDeltaParts()
     MessageResourceFormat()
     MessageAcceptResourceFormat()
@@ -0,0 +1,110 @@
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool(object):
+    """ Open, verified sessions with other nodes. Pooled sessions aren't closed when an interaction ends, so
+    the following interactions with the same node reuse the connection instead of connecting and going
+    through the handshake again. Requests for a node that already has as many connections as allowed wait
+    until one of them is verified.
+    """
+
+    def __init__(self, max_sessions_per_peer=1, idle_timeout=300):
+        """
+        :param int max_sessions_per_peer: maximal number of connections with a single node, 0 turns off
+                                          pooling
+        :param float idle_timeout: pooled sessions that haven't sent or received anything for this many
+                                   seconds are closed
+        """
+        self.max_sessions_per_peer = max_sessions_per_peer
+        self.idle_timeout = idle_timeout
+        self.sessions = {}  # key id -> sessions with that node, the most recently added first
+        self.waiting = {}  # key id -> requests waiting for a session with that node
+
+    def change_config(self, max_sessions_per_peer, idle_timeout):
+        self.max_sessions_per_peer = max_sessions_per_peer
+        self.idle_timeout = idle_timeout
+
+    def __contains__(self, session):
+        return session in self.sessions.get(session.key_id, [])
+
+    def __len__(self):
+        return sum(len(sessions) for sessions in self.sessions.itervalues())
+
+    def add(self, key_id, session):
+        """ Keep a verified session with a node
+        :param str key_id: key of the node
+        :param session:
+        :return bool: False if the node already has as many pooled sessions as allowed
+        """
+        sessions = self.sessions.setdefault(key_id, [])
+        if session in sessions:
+            return True
+        if len(sessions) >= self.max_sessions_per_peer:
+            if not sessions:
+                del self.sessions[key_id]
+            return False
+        sessions.insert(0, session)
+        return True
+
+    def remove(self, session):
+        sessions = self.sessions.get(session.key_id)
+        if sessions and session in sessions:
+            sessions.remove(session)
+            if not sessions:
+                del self.sessions[session.key_id]
+
+    def get(self, key_id):
+        """ Return an open session with a node, the most recently used one if there's more of them
+        :param str key_id: key of the node
+        :return session|None:
+        """
+        sessions = [session for session in self.sessions.get(key_id, []) if session.conn.opened]
+        if not sessions:
+            return None
+        return max(sessions, key=lambda session: session.last_message_time)
+
+    def can_connect(self, key_id, connecting=0):
+        """ Check whether another connection with a node may be started
+        :param str key_id: key of the node
+        :param int connecting: number of connections with the node that are being established
+        :return bool:
+        """
+        return len(self.sessions.get(key_id, [])) + connecting < self.max_sessions_per_peer
+
+    def wait(self, key_id, request):
+        """ Remember a request that should be sent through the next session with a node """
+        self.waiting.setdefault(key_id, deque()).append(request)
+
+    def pop_waiting(self, key_id, num=None):
+        """ Return requests waiting for a session with a node, the oldest first
+        :param str key_id: key of the node
+        :param int|None num: maximal number of requests to return, all of them if None
+        :return list:
+        """
+        waiting = self.waiting.get(key_id)
+        if not waiting:
+            return []
+        if num is None or num >= len(waiting):
+            del self.waiting[key_id]
+            return list(waiting)
+        return [waiting.popleft() for _ in range(num)]
+
+    def get_waiting_peers(self):
+        return self.waiting.keys()
+
+    def remove_idle(self, now):
+        """ Remove and return sessions that haven't sent or received anything for longer than idle timeout.
+        Busy sessions (eg. waiting for result verification) are never idle.
+        :param float now: current time
+        :return list:
+        """
+        idle = []
+        for sessions in self.sessions.values():
+            for session in list(sessions):
+                if now - session.last_message_time > self.idle_timeout and not session.is_busy():
+                    self.remove(session)
+                    idle.append(session)
+        return idle
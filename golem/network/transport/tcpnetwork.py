@@ -16,7 +16,7 @@ from zope.interface import implements
 
 from ipaddress import IPv6Address, IPv4Address, ip_address, AddressValueError
 
-from golem.core.databuffer import DataBuffer
+from golem.core.databuffer import DataBuffer, DataBufferOverflow
 from golem.core.variables import LONG_STANDARD_SIZE, BUFF_SIZE, MIN_PORT, MAX_PORT
 from golem.network.transport.message import Message
 from network import Network, SessionProtocol
@@ -213,18 +213,41 @@ class TCPConnectInfo(object):
                                                                                           self.established_callback,
                                                                                           self.failure_callback)
 
+
+class TCPConnectAttempts(object):
+    def __init__(self, socket_addresses, established_callback=None, failure_callback=None, kwargs=None):
+        """
+        State of connection attempts to the addresses from a single connect request. Attempts to subsequent
+        addresses overlap, the first one that succeeds wins and the others are cancelled.
+        :param list socket_addresses: SocketAddresses that haven't been tried yet
+        :param fun|None established_callback:
+        :param fun|None failure_callback:
+        :param dict|None kwargs: additional parameters for the callbacks
+        :return None:
+        """
+        self.socket_addresses = socket_addresses
+        self.established_callback = established_callback
+        self.failure_callback = failure_callback
+        self.kwargs = kwargs or {}
+        self.pending = []  # deferreds of attempts in progress
+        self.next_attempt = None  # delayed call that starts the next attempt
+        self.finished = False
+
 ###############
 # TCP Network #
 ###############
 
 
 class TCPNetwork(Network):
-    def __init__(self, protocol_factory, use_ipv6=False, timeout=5):
+    def __init__(self, protocol_factory, use_ipv6=False, timeout=5, connect_delay=0.25):
         """
         TCP network information
         :param ProtocolFactory protocol_factory: Protocols should be at least ServerProtocol implementation
         :param bool use_ipv6: *Default: False* should network use IPv6 server endpoint?
         :param int timeout: *Default: 5*
+        :param float connect_delay: *Default: 0.25* time after which the next address from a connect request
+                                    is tried if a connection to the previous one hasn't been established or
+                                    failed yet
         :return None:
         """
         from twisted.internet import reactor
@@ -232,12 +255,16 @@ class TCPNetwork(Network):
         self.protocol_factory = protocol_factory
         self.use_ipv6 = use_ipv6
         self.timeout = timeout
+        self.connect_delay = connect_delay
         self.active_listeners = {}
         self.host_addresses = get_host_addresses()
 
     def connect(self, connect_info, **kwargs):
         """
-        Connect network protocol factory to address from connect_info via TCP.
+        Connect network protocol factory to address from connect_info via TCP. Addresses are tried in the
+        given order, each one connect_delay after the previous one (or as soon as it fails), so that
+        unreachable addresses don't delay the connection. The first established connection is kept and the
+        other attempts are cancelled.
         :param TCPConnectInfo connect_info:
         :param kwargs: any additional parameters
         :return None:
@@ -292,20 +319,29 @@ class TCPNetwork(Network):
             TCPNetwork.__call_failure_callback(failure_callback, **kwargs)
             return
 
-        address = addresses[0].address
-        port = addresses[0].port
+        attempts = TCPConnectAttempts(addresses, established_callback, failure_callback, kwargs)
+        self.__start_connect_attempt(attempts)
+
+    def __start_connect_attempt(self, attempts):
+        attempts.next_attempt = None
+        if attempts.finished or not attempts.socket_addresses:
+            return
+
+        socket_address = attempts.socket_addresses.pop(0)
+        logger.debug("Connection to host {}: {}".format(socket_address.address, socket_address.port))
 
-        self.__try_to_connect_to_address(address, port,
-                                         self.__connection_to_address_established,
-                                         self.__connection_to_address_failure,
-                                         addresses_to_arg=addresses,
-                                         established_callback_to_arg=established_callback,
-                                         failure_callback_to_arg=failure_callback,
-                                         **kwargs)
+        endpoint = self._get_client_endpoint(socket_address.address, socket_address.port)
+        defer = endpoint.connect(self.protocol_factory)
+        attempts.pending.append(defer)
+        defer.addCallbacks(self.__connect_attempt_established, self.__connect_attempt_failure,
+                           callbackArgs=(attempts, defer), errbackArgs=(attempts, defer))
 
-    def __try_to_connect_to_address(self, address, port, established_callback, failure_callback, **kwargs):
-        logger.debug("Connection to host {}: {}".format(address, port))
+        # the attempt may have already failed and started the next one
+        if attempts.socket_addresses and not attempts.finished and attempts.next_attempt is None:
+            attempts.next_attempt = self.reactor.callLater(self.connect_delay, self.__start_connect_attempt,
+                                                           attempts)
 
+    def _get_client_endpoint(self, address, port):
         use_ipv6 = False
         try:
             ip = ip_address(address.decode())
@@ -316,35 +352,45 @@ class TCPNetwork(Network):
             endpoint = TCP6ClientEndpoint(self.reactor, address, port, self.timeout)
         else:
             endpoint = TCP4ClientEndpoint(self.reactor, address, port, self.timeout)
+        return endpoint
 
-        defer = endpoint.connect(self.protocol_factory)
+    def __connect_attempt_established(self, conn, attempts, defer):
+        if defer in attempts.pending:
+            attempts.pending.remove(defer)
+        if attempts.finished:
+            conn.transport.loseConnection()
+            return
 
-        defer.addCallback(self.__connection_established, established_callback, **kwargs)
-        defer.addErrback(self.__connection_failure, failure_callback, **kwargs)
+        attempts.finished = True
+        TCPNetwork.__cancel_connect_attempts(attempts)
 
-    def __connection_established(self, conn, established_callback, **kwargs):
         pp = conn.transport.getPeer()
         logger.debug("Connection established {} {}".format(pp.host, pp.port))
-        TCPNetwork.__call_established_callback(established_callback, conn.session, **kwargs)
+        TCPNetwork.__call_established_callback(attempts.established_callback, conn.session, **attempts.kwargs)
+
+    def __connect_attempt_failure(self, err_desc, attempts, defer):
+        if defer in attempts.pending:
+            attempts.pending.remove(defer)
+        if attempts.finished:
+            return
 
-    def __connection_failure(self, err_desc, failure_callback, **kwargs):
         logger.info("Connection failure. {}".format(err_desc))
-        TCPNetwork.__call_failure_callback(failure_callback, **kwargs)
-
-    def __connection_to_address_established(self, conn, **kwargs):
-        established_callback = kwargs.pop("established_callback_to_arg", None)
-        kwargs.pop("failure_callback_to_arg", None)
-        kwargs.pop("addresses_to_arg", None)
-        TCPNetwork.__call_established_callback(established_callback, conn, **kwargs)
-
-    def __connection_to_address_failure(self, **kwargs):
-        established_callback = kwargs.pop("established_callback_to_arg", None)
-        failure_callback = kwargs.pop("failure_callback_to_arg", None)
-        addresses = kwargs.pop("addresses_to_arg", [])
-        if len(addresses) > 1:
-            self.__try_to_connect_to_addresses(addresses[1:], established_callback, failure_callback, **kwargs)
-        else:
-            TCPNetwork.__call_failure_callback(failure_callback, **kwargs)
+        if attempts.socket_addresses:
+            if attempts.next_attempt is not None and attempts.next_attempt.active():
+                attempts.next_attempt.cancel()
+            self.__start_connect_attempt(attempts)
+        elif not attempts.pending:
+            attempts.finished = True
+            TCPNetwork.__call_failure_callback(attempts.failure_callback, **attempts.kwargs)
+
+    @staticmethod
+    def __cancel_connect_attempts(attempts):
+        if attempts.next_attempt is not None and attempts.next_attempt.active():
+            attempts.next_attempt.cancel()
+        attempts.next_attempt = None
+        pending, attempts.pending = attempts.pending, []
+        for defer in pending:
+            defer.cancel()
 
     def __try_to_listen_on_port(self, port, max_port, established_callback, failure_callback, **kwargs):
         if self.use_ipv6:
@@ -483,9 +529,16 @@ class BasicProtocol(SessionProtocol):
     # Protected functions
     def _prepare_msg_to_send(self, msg):
         ser_msg = msg.serialize()
+        return self._frame(ser_msg)
 
+    @staticmethod
+    def _frame(data):
         db = DataBuffer()
-        db.append_len_prefixed_string(ser_msg)
+        try:
+            db.append_len_prefixed_string(data)
+        except DataBufferOverflow as err:
+            logger.error("Cannot send message: {}".format(err))
+            return None
         return db.read_all()
 
     def _can_receive(self):
@@ -493,7 +546,13 @@ class BasicProtocol(SessionProtocol):
 
     def _interpret(self, data):
         with self.lock:
-            self.db.append_string(data)
+            try:
+                self.db.append_string(data)
+            except DataBufferOverflow as err:
+                logger.error("Receive buffer overflow, dropping connection with {} (message size {}): {}"
+                             .format(self.transport.getPeer(), self._incoming_message_size(data), err))
+                self.close_now()
+                return None
             mess = self._data_to_messages()
 
         if mess is None:
@@ -506,6 +565,16 @@ class BasicProtocol(SessionProtocol):
     def _data_to_messages(self):
         return Message.deserialize(self.db)
 
+    def _incoming_message_size(self, data):
+        """ Return the length of the message that is being received, announced in its prefix
+        :param str data: data received after the buffered one
+        :return int|None: message length or None if the prefix hasn't been received yet
+        """
+        prefix = self.db.peek_string(min(self.db.data_size(), LONG_STANDARD_SIZE)) + data[:LONG_STANDARD_SIZE]
+        if len(prefix) < LONG_STANDARD_SIZE:
+            return None
+        return struct.unpack("!L", prefix[:LONG_STANDARD_SIZE])[0]
+
 
 class ServerProtocol(BasicProtocol):
     """ Basic protocol connected to server instance
@@ -550,10 +619,7 @@ class SafeProtocol(ServerProtocol):
             return None
         ser_msg = msg.serialize()
         enc_msg = self.session.encrypt(ser_msg)
-
-        db = DataBuffer()
-        db.append_len_prefixed_string(enc_msg)
-        return db.read_all()
+        return self._frame(enc_msg)
 
     def _data_to_messages(self):
         assert isinstance(self.db, DataBuffer)
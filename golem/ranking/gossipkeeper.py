@@ -3,7 +3,6 @@ class GossipKeeper(object):
     def __init__(self):
         """ Create new gossip keeper instance """
         self.gossip = []
-        self.stop_gossip_from_peers = set()
         self.neighbour_loc_rank_buff = []
 
     def add_gossip(self, gossip):
@@ -20,20 +19,6 @@ class GossipKeeper(object):
         self.gossip = []
         return gossip
 
-    def stop_gossip(self, id_):
-        """ Register that peer with given id has stopped gossiping
-        :param str id_: id of a string that has stopped gossiping
-        """
-        self.stop_gossip_from_peers.add(id_)
-
-    def pop_stop_gossip_from_peers(self):
-        """ Return set of all peers that has stopped gossiping
-        :return set: set of peers id's
-        """
-        stop = self.stop_gossip_from_peers
-        self.stop_gossip_from_peers = set()
-        return stop
-
     def add_neighbour_loc_rank(self, neigh_id, about_id, rank):
         """
         Add local rank from neighbour to the collection
@@ -3,14 +3,14 @@ import time
 import random
 import operator
 import datetime
-from threading import Lock
+from threading import Lock, RLock
 
 from twisted.internet.task import deferLater
 from itertools import izip
 from peewee import IntegrityError
 
 from golem.model import LocalRank, GlobalRank, NeighbourLocRank, db
-from golem.core.variables import BREAK_TIME, ROUND_TIME, END_ROUND_TIME, STAGE_TIME
+from golem.core.variables import GOSSIP_INTERVAL, GOSSIP_EPOCH_LENGTH
 
 
 logger = logging.getLogger(__name__)
@@ -149,22 +149,269 @@ class RankingDatabase(object):
                 (NeighbourLocRank.node_id == neighbour_id) & (NeighbourLocRank.about_node_id == about_id)).first()
 
 
+FLUSH_INTERVAL = 10.0
+MAX_PENDING = 1000
+SQLITE_MAX_VARIABLES = 999
+
+
+class BufferedRankingDatabase(RankingDatabase):
+    """ Ranking database that keeps local rank increments and neighbours' local ranks in memory and writes
+    them to the database in a single transaction on flush. Reads include changes that haven't been flushed
+    yet.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        """
+        :param float flush_interval: pending changes should be flushed after this many seconds
+        :param int max_pending: pending changes should be flushed earlier if there's that many of them
+        """
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.last_flush = time.time()
+        self.increments = {}  # node id -> {local rank field: increment}
+        self.neighbour_loc_ranks = {}  # (neighbour id, about id) -> neighbour's local rank
+        self.changed = set()  # ids of nodes whose local ranks changed since the last pop_changed
+        self.lock = RLock()
+
+    def increase_positive_computing(self, node_id, trust_mod):
+        self._increase(node_id, "positive_computed", trust_mod)
+
+    def increase_negative_computing(self, node_id, trust_mod):
+        self._increase(node_id, "negative_computed", trust_mod)
+
+    def increase_wrong_computed(self, node_id, trust_mod):
+        self._increase(node_id, "wrong_computed", trust_mod)
+
+    def increase_positive_requested(self, node_id, trust_mod):
+        self._increase(node_id, "positive_requested", trust_mod)
+
+    def increase_negative_requested(self, node_id, trust_mod):
+        self._increase(node_id, "negative_requested", trust_mod)
+
+    def increase_positive_payment(self, node_id, trust_mod):
+        self._increase(node_id, "positive_payment", trust_mod)
+
+    def increase_negative_payment(self, node_id, trust_mod):
+        self._increase(node_id, "negative_payment", trust_mod)
+
+    def increase_positive_resource(self, node_id, trust_mod):
+        self._increase(node_id, "positive_resource", trust_mod)
+
+    def increase_negative_resource(self, node_id, trust_mod):
+        self._increase(node_id, "negative_resource", trust_mod)
+
+    def _increase(self, node_id, field, trust_mod):
+        with self.lock:
+            increments = self.increments.setdefault(node_id, {})
+            increments[field] = increments.get(field, 0.0) + trust_mod
+            self.changed.add(node_id)
+
+    def get_local_rank(self, node_id):
+        with self.lock:
+            return self.__with_increments(RankingDatabase.get_local_rank(node_id), node_id)
+
+    def get_all_local_rank(self):
+        with self.lock:
+            return self.__merge_increments(RankingDatabase.get_all_local_rank(), self.increments.keys())
+
+    def get_local_ranks(self, node_ids):
+        """ Return local ranks of given nodes, nodes without local rank are skipped
+        :param iterable node_ids:
+        :return list:
+        """
+        node_ids = list(node_ids)
+        with self.lock:
+            ranks = []
+            for chunk in _chunks(node_ids, SQLITE_MAX_VARIABLES):
+                ranks.extend(LocalRank.select().where(LocalRank.node_id << chunk))
+            incremented = [node_id for node_id in node_ids if node_id in self.increments]
+            return self.__merge_increments(ranks, incremented)
+
+    def pop_changed(self):
+        """ Return ids of nodes whose local ranks changed since the last call """
+        with self.lock:
+            changed, self.changed = self.changed, set()
+            return changed
+
+    def insert_or_update_neighbour_loc_rank(self, neighbour_id, about_id, loc_rank):
+        if neighbour_id == about_id:
+            logger.warning("Removing {} selftrust".format(about_id))
+            return
+        with self.lock:
+            self.neighbour_loc_ranks[(neighbour_id, about_id)] = loc_rank
+
+    def get_neighbour_loc_rank(self, neighbour_id, about_id):
+        with self.lock:
+            loc_rank = self.neighbour_loc_ranks.get((neighbour_id, about_id))
+            if loc_rank is None:
+                return RankingDatabase.get_neighbour_loc_rank(neighbour_id, about_id)
+        return NeighbourLocRank(node_id=neighbour_id, about_node_id=about_id,
+                                requesting_trust_value=loc_rank[1], computing_trust_value=loc_rank[0])
+
+    def pending(self):
+        """ Return number of changes that haven't been flushed yet """
+        return len(self.increments) + len(self.neighbour_loc_ranks)
+
+    def needs_flush(self):
+        pending = self.pending()
+        return pending > 0 and (pending >= self.max_pending or
+                                time.time() - self.last_flush >= self.flush_interval)
+
+    def flush(self):
+        """ Write all pending changes in a single transaction. If it fails, the changes are kept for the next
+        flush.
+        """
+        with self.lock:
+            self.last_flush = time.time()
+            if not self.pending():
+                return
+            with db.transaction():
+                self.__flush_increments()
+                self.__flush_neighbour_loc_ranks()
+            self.increments = {}
+            self.neighbour_loc_ranks = {}
+
+    def __flush_increments(self):
+        modified_date = str(datetime.datetime.now())
+        existing = set()
+        for chunk in _chunks(self.increments.keys(), SQLITE_MAX_VARIABLES):
+            query = LocalRank.select(LocalRank.node_id).where(LocalRank.node_id << chunk)
+            existing.update(rank.node_id for rank in query)
+
+        new_ranks = []
+        for node_id, increments in self.increments.iteritems():
+            if node_id in existing:
+                update = {field: getattr(LocalRank, field) + value for field, value in increments.iteritems()}
+                LocalRank.update(modified_date=modified_date, **update).where(
+                    LocalRank.node_id == node_id).execute()
+            else:
+                new_ranks.append(LocalRank(node_id=node_id, **increments))
+
+        # every row has the same columns, so it doesn't matter which fields were increased
+        fields = [f for f in LocalRank._meta.sorted_field_names if f != "id"]
+        for chunk in _chunks(new_ranks, SQLITE_MAX_VARIABLES // len(fields)):
+            LocalRank.insert_many([{f: getattr(rank, f) for f in fields} for rank in chunk]).execute()
+
+    def __flush_neighbour_loc_ranks(self):
+        for (neighbour_id, about_id), loc_rank in self.neighbour_loc_ranks.iteritems():
+            updated = NeighbourLocRank.update(requesting_trust_value=loc_rank[1],
+                                              computing_trust_value=loc_rank[0]).where(
+                (NeighbourLocRank.about_node_id == about_id) &
+                (NeighbourLocRank.node_id == neighbour_id)).execute()
+            if not updated:
+                NeighbourLocRank.create(node_id=neighbour_id, about_node_id=about_id,
+                                        requesting_trust_value=loc_rank[1], computing_trust_value=loc_rank[0])
+
+    def __merge_increments(self, ranks, node_ids):
+        merged = {}
+        for rank in ranks:
+            merged[rank.node_id] = self.__with_increments(rank, rank.node_id)
+        for node_id in node_ids:
+            if node_id not in merged:
+                merged[node_id] = self.__with_increments(None, node_id)
+        return merged.values()
+
+    def __with_increments(self, rank, node_id):
+        """ Return a copy of a local rank with pending increments added. The copy must not be saved. """
+        increments = self.increments.get(node_id)
+        if not increments:
+            return rank
+        if rank is None:
+            rank = LocalRank(node_id=node_id)
+        else:
+            rank = LocalRank(**rank._data)
+        for field, value in increments.iteritems():
+            setattr(rank, field, getattr(rank, field) + value)
+        return rank
+
+
+def _chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+
+MAX_TRUST_CACHE_SIZE = 10000
+
+
+class TrustCache(object):
+    """ Trust values counted by Ranking. A trust value counted from the node's local rank depends only on that
+    rank. Other values (counted from neighbours' local ranks and global ranks) are derived from ranks of many
+    nodes, so they are all dropped whenever any of those ranks changes.
+    """
+
+    def __init__(self, max_size=MAX_TRUST_CACHE_SIZE):
+        self.max_size = max_size
+        self.local = {}  # (node id, computing) -> trust counted from the node's local rank
+        self.derived = {}  # (node id, computing) -> trust counted from neighbours' and global ranks
+        self.generation = 0  # increased on every invalidation
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.local) + len(self.derived)
+
+    def get(self, node_id, computing):
+        """ Return cached trust of a node or None if it has to be counted """
+        key = (node_id, computing)
+        trust = self.local.get(key)
+        if trust is None:
+            trust = self.derived.get(key)
+        return trust
+
+    def put(self, node_id, computing, trust, local, generation):
+        """ Cache a counted trust value
+        :param str node_id:
+        :param bool computing: computing or requesting trust
+        :param float trust:
+        :param bool local: True if the value was counted from the node's local rank
+        :param int generation: cache generation read before the value was counted. If the cache was
+                               invalidated since then, the value may be stale and isn't cached.
+        """
+        with self.lock:
+            if generation != self.generation:
+                return
+            values = self.local if local else self.derived
+            if len(values) >= self.max_size:
+                values.clear()
+            values[(node_id, computing)] = trust
+
+    def invalidate(self, node_id, derived=False):
+        """ Drop trust of a node whose local rank changed
+        :param str node_id:
+        :param bool derived: drop all derived values as well, eg. when the node is a neighbour
+        """
+        with self.lock:
+            self.generation += 1
+            for computing in (True, False):
+                self.local.pop((node_id, computing), None)
+                self.derived.pop((node_id, computing), None)
+            if derived:
+                self.derived = {}
+
+    def invalidate_derived(self):
+        """ Drop values counted from neighbours' and global ranks """
+        with self.lock:
+            self.generation += 1
+            self.derived = {}
+
+
 POS_PAR = 1.0
 NEG_PAR = 2.0
 MAX_TRUST = 1.0
 MIN_TRUST = -1.0
 UNKNOWN_TRUST = 0.0
 MIN_OP_NUM = 50
-MAX_STEPS = 10
 EPSILON = 0.01
+CONVERGENCE_ROUNDS = 5
 LOC_RANK_PUSH_DELTA = 0.1
 
 
 class Ranking(object):
     def __init__(self, client, pos_par=POS_PAR, neg_par=NEG_PAR, max_trust=MAX_TRUST, min_trust=MIN_TRUST,
-                 min_op_num=MIN_OP_NUM, unknown_trust=UNKNOWN_TRUST, max_steps=MAX_STEPS, epsilon=EPSILON,
-                 loc_rank_push_delta=LOC_RANK_PUSH_DELTA):
-        self.db = RankingDatabase()
+                 min_op_num=MIN_OP_NUM, unknown_trust=UNKNOWN_TRUST, epsilon=EPSILON,
+                 loc_rank_push_delta=LOC_RANK_PUSH_DELTA, gossip_interval=GOSSIP_INTERVAL,
+                 convergence_rounds=CONVERGENCE_ROUNDS, epoch_length=GOSSIP_EPOCH_LENGTH):
+        self.db = BufferedRankingDatabase()
+        self.trust_cache = TrustCache()
         self.client = client
         self.pos_par = pos_par
         self.neg_par = neg_par
@@ -172,20 +419,24 @@ class Ranking(object):
         self.min_trust = min_trust
         self.unknown_trust = unknown_trust
         self.min_op_num = min_op_num
-        self.round_oracle = DiscreteTimeRoundOracle()
 
         self.k = 1
         self.epsilon = epsilon
         self.neighbours = []
-        self.step = 0
-        self.max_steps = max_steps
-        self.working_vec = {}
-        self.prevRank = {}
-        self.globRank = {}
-        self.received_gossip = []
-        self.finished = False
-        self.finished_neighbours = set()
-        self.global_finished = False
+        self.gossip_interval = gossip_interval
+        self.convergence_rounds = convergence_rounds
+        self.epoch_length = epoch_length
+        self.epoch = None  # gossip epoch that the working vector belongs to
+        # whether local ranks of this node are added to the working vector in this epoch
+        self.contributing = False
+        self.working_vec = {}  # node id -> [[computing value, weight], [requesting value, weight]]
+        # node id -> [computing trust, requesting trust] added to working vec by this node
+        self.contributed = {}
+        self.prevRank = {}  # node id -> trust estimates from the previous round
+        self.globRank = {}  # node id -> saved global trust
+        # node id -> number of rounds in which its trust estimate will still be gossiped
+        self.unconverged = {}
+        self.unsaved = set()  # ids of nodes whose trust estimates changed since they were saved
         self.reactor = None
         self.initLocRankPush = True
         self.prev_loc_rank = {}
@@ -194,75 +445,73 @@ class Ranking(object):
 
     def run(self, reactor):
         self.reactor = reactor
-        deferLater(self.reactor, self.round_oracle.sec_to_new_stage(), self.__init_stage)
+        deferLater(self.reactor, self.gossip_interval, self.__gossip_round)
 
-    def __init_stage(self):
+    def __gossip_round(self):
         try:
-            logger.debug("New gossip stage")
-            self.__push_local_ranks()
-            self.finished = False
-            self.global_finished = False
-            self.step = 0
-            self.finished_neighbours = set()
-            self.__init_working_vec()
+            self.__make_round()
         finally:
-            deferLater(self.reactor, self.round_oracle.sec_to_round(), self.__new_round)
+            deferLater(self.reactor, self.gossip_interval, self.__gossip_round)
 
-    def __init_working_vec(self):
-        with self.lock:
-            self.working_vec = {}
-            self.prevRank = {}
-            for loc_rank in self.db.get_all_local_rank():
-                comp_trust = self.__count_trust(self.__get_comp_trust_pos(loc_rank), self.__get_comp_trust_neg(loc_rank))
-                req_trust = self.__count_trust(self.__get_req_trust_pos(loc_rank), self.__get_req_trust_neg(loc_rank))
-                self.working_vec[loc_rank.node_id] = [[comp_trust, 1.0], [req_trust, 1.0]]
-                self.prevRank[loc_rank.node_id] = [comp_trust, req_trust]
-
-    def __new_round(self):
+    def __make_round(self):
+        """ One round of push-sum gossip. Local rank changes are added to the working vector, trust estimates
+        that haven't converged are gossiped and the converged ones are saved as global ranks. A round without
+        local rank changes and received gossip doesn't send or save anything.
+        """
         logger.debug("New gossip round")
-        try:
-            self.__set_k()
-            self.step += 1
-            gossip = self.__prepare_gossip()
-            if len(self.neighbours) > 0:
-                send_to = random.sample(self.neighbours, self.k)
-                self.client.send_gossip(gossip, send_to)
-            self.received_gossip = [gossip]
-        finally:
-            deferLater(self.reactor, self.round_oracle.sec_to_end_round(), self.__end_round)
-
-    def __end_round(self):
-        logger.debug("End gossip round")
-        try:
-            self.received_gossip = self.client.collect_gossip() + self.received_gossip
-            self.__make_prev_rank()
-            self.working_vec = {}
-            self.__add_gossip()
-            self.__check_finished()
-        finally:
-            deferLater(self.reactor, self.round_oracle.sec_to_break(), self.__make_break)
-
-    def __make_break(self):
-        logger.debug("Gossip round finished")
-        try:
-            self.__check_global_finished()
-        except Exception:
-            deferLater(self.reactor, self.round_oracle.sec_to_round(), self.__new_round)
-            raise
-
-        if self.global_finished:
-            try:
-                self.client.collect_gossip()
-                self.client.collect_stopped_peers()
-                self.__save_working_vec()
-            finally:
-                deferLater(self.reactor, self.round_oracle.sec_to_new_stage(), self.__init_stage)
-        else:
-            deferLater(self.reactor, self.round_oracle.sec_to_round(), self.__new_round)
+        received = self.client.collect_gossip()
+        self.__update_epoch(received)
+        touched = set()
+        for node_id, trust in self.__push_local_ranks().iteritems():
+            if self.contributing and self.__contribute(node_id, trust):
+                touched.add(node_id)
+        touched |= self.__add_gossip(received)
+        self.__check_converged(touched)
+        self.__save_working_vec()
+        self.__set_k()
+        if self.unconverged:
+            self.__send_gossip()
+
+    def __current_epoch(self):
+        now = self.reactor.seconds() if self.reactor else time.time()
+        return int(now // self.epoch_length)
+
+    def __update_epoch(self, received_gossip):
+        """ Start a new gossip epoch when the current one ends or when gossip from the next one is received.
+        Mass of push-sum estimates held by nodes that left the network is lost, so every epoch starts again
+        from local ranks of nodes that are online. A node contributes only to epochs that started while it was
+        running, it doesn't know whether it contributed to the current one before a restart.
+        """
+        current = self.__current_epoch()
+        epoch = current
+        for gossip_group in received_gossip:
+            for gossip in gossip_group:
+                try:
+                    if epoch < int(gossip[1]) <= current + 1:
+                        epoch = int(gossip[1])
+                except (TypeError, ValueError, IndexError):
+                    pass
+        if self.epoch is None:
+            logger.debug("Joining gossip epoch {}".format(current))
+            self.epoch = current
+        if epoch > self.epoch:
+            self.__start_epoch(epoch)
+
+    def __start_epoch(self, epoch):
+        logger.debug("Starting gossip epoch {}".format(epoch))
+        self.epoch = epoch
+        self.contributing = True
+        self.initLocRankPush = True
+        self.working_vec = {}
+        self.contributed = {}
+        self.prevRank = {}
+        self.unconverged = {}
+        self.unsaved = set()
 
     # thread-safe
     def increase_trust(self, node_id, stat, mod):
         with self.lock:
+            self.trust_cache.invalidate(node_id, derived=node_id in self.neighbours)
             if stat == RankingStats.computed:
                 self.db.increase_positive_computing(node_id, mod)
             elif stat == RankingStats.requested:
@@ -276,6 +525,7 @@ class Ranking(object):
 
     def decrease_trust(self, node_id, stat, mod):
         with self.lock:
+            self.trust_cache.invalidate(node_id, derived=node_id in self.neighbours)
             if stat == RankingStats.computed:
                 self.db.increase_negative_computing(node_id, mod)
             elif stat == RankingStats.wrong_computed:
@@ -290,38 +540,59 @@ class Ranking(object):
                 logger.error("Wrong stat type {}".format(stat))
 
     def get_computing_trust(self, node_id):
+        return self.__get_trust(node_id, computing=True)
+
+    def get_requesting_trust(self, node_id):
+        return self.__get_trust(node_id, computing=False)
+
+    def __get_trust(self, node_id, computing):
+        trust = self.trust_cache.get(node_id, computing)
+        if trust is not None:
+            return trust
+        generation = self.trust_cache.generation
+        if computing:
+            trust, local = self.__count_computing_trust(node_id)
+        else:
+            trust, local = self.__count_requesting_trust(node_id)
+        self.trust_cache.put(node_id, computing, trust, local, generation)
+        return trust
+
+    def __count_computing_trust(self, node_id):
+        """ Return computing trust of a node and whether it was counted from the node's local rank """
         local_rank = self.__get_loc_computing_trust(node_id)
         if local_rank is not None:
             logger.debug("Using local rank {}".format(local_rank))
-            return local_rank
+            return local_rank, True
         rank, weight_sum = self.__count_neighbours_rank(node_id, computing=True)
         global_rank = self.db.get_global_rank(node_id)
         if global_rank is not None:
             if weight_sum + global_rank.gossip_weight_computing != 0:
                 logger.debug("Using gossipRank + neighboursRank")
-                return (rank + global_rank.computing_trust_value) / (weight_sum + global_rank.gossip_weight_computing)
+                return (rank + global_rank.computing_trust_value) / (
+                    weight_sum + global_rank.gossip_weight_computing), False
         elif weight_sum != 0:
             logger.debug("Using neighboursRank")
-            return rank / float(weight_sum)
-        return self.unknown_trust
+            return rank / float(weight_sum), False
+        return self.unknown_trust, False
 
-    def get_requesting_trust(self, node_id):
+    def __count_requesting_trust(self, node_id):
+        """ Return requesting trust of a node and whether it was counted from the node's local rank """
         local_rank = self.__get_loc_requesting_trust(node_id)
         if local_rank is not None:
             logger.debug("Using local rank {}".format(local_rank))
-            return local_rank
+            return local_rank, True
         rank, weight_sum = self.__count_neighbours_rank(node_id, computing=False)
         global_rank = self.db.get_global_rank(node_id)
         if global_rank is not None:
             if global_rank.gossip_weight_requesting != 0:
                 logger.debug("Using gossipRank + neighboursRank")
                 return (rank + global_rank.requesting_trust_value) / float(
-                    weight_sum + global_rank.gossip_weight_requesting)
+                    weight_sum + global_rank.gossip_weight_requesting), False
         elif weight_sum != 0:
             logger.debug("Using neighboursRank")
-            return rank / float(weight_sum)
+            return rank / float(weight_sum), False
 
-        return self.unknown_trust
+        return self.unknown_trust, False
 
     def sync_network(self):
         neighbours_loc_ranks = self.client.collect_neighbours_loc_ranks()
@@ -329,6 +600,20 @@ class Ranking(object):
             with self.lock:
                 self.db.insert_or_update_neighbour_loc_rank(neighbour_id,
                                                             about_id, loc_rank)
+        if neighbours_loc_ranks:
+            self.trust_cache.invalidate_derived()
+        if self.db.needs_flush():
+            self.flush()
+
+    def flush(self):
+        """ Write ranking changes kept in memory to the database """
+        try:
+            self.db.flush()
+        except Exception as err:
+            logger.error("Cannot save ranking changes: {}".format(err))
+
+    def quit(self):
+        self.flush()
 
     def __get_loc_computing_trust(self, node_id):
         local_rank = self.db.get_local_rank(node_id)
@@ -372,13 +657,26 @@ class Ranking(object):
         return self.__neighbour_weight_base() ** (self.__neighbour_weight_power(node_id) * loc_trust)
 
     def __push_local_ranks(self):
-        for loc_rank in self.db.get_all_local_rank():
+        """ Push local ranks that changed enough to neighbours
+        :return dict: node id -> [computing trust, requesting trust] of local ranks that changed since the
+                      last call
+        """
+        # only local ranks that changed since the last push may differ from the pushed ones
+        if self.initLocRankPush:
+            self.initLocRankPush = False
+            self.db.pop_changed()
+            loc_ranks = self.db.get_all_local_rank()
+        else:
+            loc_ranks = self.db.get_local_ranks(self.db.pop_changed())
+        changed = {}
+        for loc_rank in loc_ranks:
             if loc_rank.node_id in self.prev_loc_rank:
                 prev_trust = self.prev_loc_rank[loc_rank.node_id]
 
             comp_trust = self.__count_trust(self.__get_comp_trust_pos(loc_rank), self.__get_comp_trust_neg(loc_rank))
             req_trust = self.__count_trust(self.__get_req_trust_pos(loc_rank), self.__get_req_trust_neg(loc_rank))
             trust = [comp_trust, req_trust]
+            changed[loc_rank.node_id] = trust
             if loc_rank.node_id in self.prev_loc_rank:
                 prev_trust = self.prev_loc_rank[loc_rank.node_id]
             else:
@@ -386,46 +684,61 @@ class Ranking(object):
             if max(map(abs, map(operator.sub, prev_trust, trust))) > self.loc_rank_push_delta:
                 self.client.push_local_rank(loc_rank.node_id, trust)
                 self.prev_loc_rank[loc_rank.node_id] = trust
-
-    def __check_finished(self):
-        if self.global_finished:
+        return changed
+
+    def __contribute(self, node_id, trust):
+        """ Add the change of this node's trust in a node to the working vector. The first contribution also
+        adds weight, so the node counts in the average.
+        :return bool: False if the trust hasn't changed
+        """
+        prev = self.contributed.get(node_id)
+        if prev == trust:
+            return False
+        if prev is None:
+            delta, weight = trust, 1.0
+        else:
+            delta, weight = map(operator.sub, trust, prev), 0.0
+        computing, requesting = self.working_vec.get(node_id, [[0.0, 0.0], [0.0, 0.0]])
+        self.working_vec[node_id] = [[computing[0] + delta[0], computing[1] + weight],
+                                     [requesting[0] + delta[1], requesting[1] + weight]]
+        self.contributed[node_id] = trust
+        self.__mark_unconverged(node_id)
+        return True
+
+    def __check_converged(self, node_ids):
+        """ Mark trust estimates of given nodes that changed more than epsilon since the previous round as
+        unconverged. Sending gossip doesn't change estimates, so other nodes don't have to be checked.
+        """
+        for node_id in node_ids:
+            computing, requesting = self.working_vec[node_id]
+            trust = [self.__working_vec_to_trust(computing), self.__working_vec_to_trust(requesting)]
+            prev = self.prevRank.get(node_id)
+            if prev is None or max(map(abs, map(operator.sub, prev, trust))) > self.epsilon:
+                self.__mark_unconverged(node_id)
+            self.prevRank[node_id] = trust
+        self.unsaved.update(self.unconverged)
+
+    def __mark_unconverged(self, node_id):
+        """ Gossip trust estimate of a node in the next convergence_rounds rounds. Without gossiping a changed
+        estimate several times it wouldn't reach all nodes.
+        """
+        self.unconverged[node_id] = self.convergence_rounds
+
+    def __send_gossip(self):
+        """ Send shares of unconverged trust estimates to k random neighbours and keep one share. An estimate
+        that didn't change in convergence_rounds rounds is converged.
+        """
+        if not self.neighbours:
             return
-        if not self.finished:
-            if self.step >= self.max_steps:
-                self.finished = True
-                self.__send_finished()
-            else:
-                val = self.__compare_working_vec_and_prev_rank()
-                if val <= len(self.working_vec) * self.epsilon * 2:
-                    self.finished = True
-                    self.__send_finished()
-
-    def __check_global_finished(self):
-        self.__mark_finished(self.client.collect_stopped_peers())
-        if self.finished:
-            self.global_finished = True
-            for n in self.neighbours:
-                if n not in self.finished_neighbours:
-                    self.global_finished = False
-                    break
-
-    def __compare_working_vec_and_prev_rank(self):
-        sum = 0.0
-        for node_id, val in self.working_vec.iteritems():
-            try:
-                computing, requesting = val
-            except (TypeError, ValueError):
-                logger.warning("Wrong trust vector element {}".format(val))
-                break
-            comp_trust = self.__working_vec_to_trust(computing)
-            req_trust = self.__working_vec_to_trust(requesting)
-            if node_id in self.prevRank:
-                comp_trust_old = self.prevRank[node_id][0]
-                req_trust_old = self.prevRank[node_id][1]
+        gossip = self.__prepare_gossip()
+        self.client.send_gossip(gossip, random.sample(self.neighbours, self.k))
+        for node_id, _, share in gossip:
+            self.working_vec[node_id] = share
+        for node_id, rounds in self.unconverged.items():
+            if rounds > 1:
+                self.unconverged[node_id] = rounds - 1
             else:
-                comp_trust_old, req_trust_old = 0, 0
-            sum += abs(comp_trust - comp_trust_old) + abs(req_trust - req_trust_old)
-        return sum
+                del self.unconverged[node_id]
 
     def __count_trust(self, pos, neg):
         val = pos * self.pos_par - neg * self.neg_par
@@ -445,30 +758,29 @@ class Ranking(object):
 
     def __get_neighbours_degree(self):
         degrees = self.client.get_neighbours_degree()
-        self.neighbours = degrees.keys()
+        neighbours = degrees.keys()
+        if set(neighbours) != set(self.neighbours):
+            self.trust_cache.invalidate_derived()
+        self.neighbours = neighbours
         return degrees
 
-    def __make_prev_rank(self):
-        for node_id, val in self.working_vec.iteritems():
-            try:
-                computing, requesting = val
-            except (TypeError, ValueError):
-                logger.warning("Wrong trust vector element {}".format(val))
-                break
-            comp_trust = self.__working_vec_to_trust(computing)
-            req_trust = self.__working_vec_to_trust(requesting)
-            self.prevRank[node_id] = [comp_trust, req_trust]
-
     def __save_working_vec(self):
-        for node_id, val in self.working_vec.iteritems():
-            try:
-                computing, requesting = val
-            except (TypeError, ValueError):
-                logger.warning("Wrong trust vector element {}".format(val))
-                break
+        """ Save converged trust estimates that differ from the saved global ranks """
+        saved = False
+        for node_id in self.unsaved.difference(self.unconverged):
+            computing, requesting = self.working_vec[node_id]
             comp_trust = self.__working_vec_to_trust(computing)
             req_trust = self.__working_vec_to_trust(requesting)
-            self.db.insert_or_update_global_rank(node_id, comp_trust, req_trust, computing[1], requesting[1])
+            trust = [comp_trust, req_trust]
+            prev = self.globRank.get(node_id)
+            if prev is None or max(map(abs, map(operator.sub, prev, trust))) > self.epsilon:
+                self.db.insert_or_update_global_rank(node_id, comp_trust, req_trust, computing[1],
+                                                     requesting[1])
+                self.globRank[node_id] = trust
+                saved = True
+        self.unsaved.intersection_update(self.unconverged)
+        if saved:
+            self.trust_cache.invalidate_derived()
 
     def __working_vec_to_trust(self, val):
         if val is None:
@@ -485,40 +797,51 @@ class Ranking(object):
 
     def __prepare_gossip(self):
         gossip_vec = []
-        for node_id, val in self.working_vec.iteritems():
+        for node_id in self.unconverged:
+            val = self.working_vec[node_id]
             comp_trust = map(self.__scale_gossip, val[0])
             req_trust = map(self.__scale_gossip, val[1])
-            gossip_vec.append([node_id, [comp_trust, req_trust]])
+            gossip_vec.append([node_id, self.epoch, [comp_trust, req_trust]])
         return gossip_vec
 
     def __scale_gossip(self, val):
         return val / float(self.k + 1)
 
-    def __add_gossip(self):
-        for gossip_group in self.received_gossip:
+    def __add_gossip(self, received_gossip):
+        """ Add received shares of the current epoch to the working vector. Estimates that differ from
+        received ones by more than epsilon are unconverged.
+        :return set: ids of nodes whose estimates were changed
+        """
+        touched = set()
+        for gossip_group in received_gossip:
             for gossip in gossip_group:
                 try:
-                    node_id, [comp, req] = gossip
+                    node_id, epoch, [[comp_val, comp_weight], [req_val, req_weight]] = gossip
+                    if int(epoch) != self.epoch:
+                        continue
+                    comp = [float(comp_val), float(comp_weight)]
+                    req = [float(req_val), float(req_weight)]
                     if node_id in self.working_vec:
                         [prev_comp, prev_req] = self.working_vec[node_id]
+                        if self.__disagree(comp, prev_comp) or self.__disagree(req, prev_req):
+                            self.__mark_unconverged(node_id)
                         self.working_vec[node_id] = [self.__sum_gossip(comp, prev_comp),
                                                      self.__sum_gossip(req, prev_req)]
                     else:
                         self.working_vec[node_id] = [comp, req]
+                    touched.add(node_id)
                 except Exception as err:
                     logger.error("Wrong gossip {}, {}".format(gossip, err))
+        return touched
 
-        self.received_gossip = []
+    def __disagree(self, a, b):
+        if a[1] == 0.0 or b[1] == 0.0:
+            return False
+        return abs(self.__working_vec_to_trust(a) - self.__working_vec_to_trust(b)) > self.epsilon
 
     def __sum_gossip(self, a, b):
         return map(sum, izip(a, b))
 
-    def __send_finished(self):
-        self.client.send_stop_gossip()
-
-    def __mark_finished(self, finished):
-        self.finished_neighbours |= finished
-
     def __count_neighbours_rank(self, node_id, computing):
         sum_weight = 0.0
         sum_trust = 0.0
@@ -544,38 +867,3 @@ class Ranking(object):
 
     def __get_req_trust_neg(self, rank):
         return rank.negative_requested + rank.negative_payment
-
-
-class DiscreteTimeRoundOracle:
-    def __init__(self, break_time=BREAK_TIME, round_time=ROUND_TIME, end_round_time=END_ROUND_TIME,
-                 stage_time=STAGE_TIME):
-        self.break_time = break_time
-        self.round_time = round_time
-        self.end_round_time = end_round_time
-        self.stage_time = stage_time
-
-    def __sum_time(self):
-        return self.round_time + self.break_time + self.end_round_time
-
-    def __time_mod(self):
-        return time.time() % self.__sum_time()
-
-    def sec_to_end_round(self):
-        tm = self.__time_mod()
-        if self.round_time - tm >= 0:
-            return self.round_time - tm
-        else:
-            return self.__sum_time() + self.round_time - tm
-
-    def sec_to_round(self):
-        return self.__sum_time() - self.__time_mod()
-
-    def sec_to_break(self):
-        tm = self.__time_mod()
-        if self.round_time + self.end_round_time - tm >= 0:
-            return self.round_time + self.end_round_time - tm
-        else:
-            return self.__sum_time() + self.round_time + self.end_round_time - tm
-
-    def sec_to_new_stage(self):
-        return self.stage_time - time.time() % self.stage_time
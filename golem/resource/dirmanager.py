@@ -116,6 +116,14 @@ class DirManager(object):
         full_path = self.__get_res_path(task_id)
         return self.get_dir(full_path, create, "resource dir does not exist")
 
+    def has_task_resources(self, task_id):
+        """ Check whether any resources of a task with given id are already stored
+        :param task_id:
+        :return bool:
+        """
+        full_path = self.__get_res_path(task_id)
+        return os.path.isdir(full_path) and len(os.listdir(full_path)) > 0
+
     def get_task_output_dir(self, task_id, create=True):
         """ Get task output directory
         :param task_id:
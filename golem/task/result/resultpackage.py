@@ -1,10 +1,16 @@
 import abc
 import os
 import pickle
+import shutil
+import tarfile
+import time
 import uuid
 import zipfile
+from contextlib import contextmanager
+from cStringIO import StringIO
 
-from golem.core.fileencrypt import AESFileEncryptor
+from golem.core.compress import CompressingWriter, DecompressingReader
+from golem.core.fileencrypt import AESFileEncryptor, AESStreamWriter, AESStreamReader
 from golem.task.taskbase import result_types
 
 
@@ -123,6 +129,77 @@ class EncryptingPackager(Packager):
         self._creator.write_pickle_file(obj, file_name, pickled_data)
 
 
+class StreamingEncryptingPackager(Packager):
+    """ Packs files into a compressed tar archive that is encrypted while it's being written, so the package
+    is written to disk once. Extraction decrypts, decompresses and unpacks the package in a single pass.
+    Only buffer_size bytes of each stage are kept in memory.
+    """
+
+    encryptor_class = AESFileEncryptor
+    compression_level = 1
+    buffer_size = 1024 * 1024
+
+    def __init__(self, key_or_secret):
+        self.key_or_secret = key_or_secret
+
+    def extract(self, input_path, output_dir=None, **kwargs):
+
+        if not output_dir:
+            output_dir = os.path.dirname(input_path)
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        extracted = []
+
+        with open(input_path, 'rb') as src:
+            decrypted = AESStreamReader(src, self.key_or_secret,
+                                        encryptor=self.encryptor_class,
+                                        buffer_size=self.buffer_size)
+            decompressed = DecompressingReader(decrypted, buffer_size=self.buffer_size)
+            tar = tarfile.open(fileobj=decompressed, mode='r|')
+
+            for member in tar:
+                if not member.isfile():
+                    continue
+                file_name = member.name
+                if os.path.basename(file_name) != file_name or file_name in ('', os.curdir, os.pardir):
+                    raise ValueError("Invalid file name in package: {}".format(file_name))
+
+                with open(os.path.join(output_dir, file_name), 'wb') as dst:
+                    shutil.copyfileobj(tar.extractfile(member), dst, self.buffer_size)
+                extracted.append(file_name)
+
+            tar.close()
+
+        return extracted, output_dir
+
+    @contextmanager
+    def generator(self, output_path):
+        with open(output_path, 'wb') as dst:
+            encrypted = AESStreamWriter(dst, self.key_or_secret,
+                                        encryptor=self.encryptor_class,
+                                        buffer_size=self.buffer_size)
+            compressed = CompressingWriter(encrypted, self.compression_level)
+            tar = tarfile.open(fileobj=compressed, mode='w|')
+
+            yield tar
+
+            tar.close()
+            compressed.close()
+            encrypted.close()
+
+    def write_disk_file(self, obj, file_path, file_name):
+        with open(file_path, 'rb') as src:
+            obj.addfile(obj.gettarinfo(file_path, file_name), src)
+
+    def write_pickle_file(self, obj, file_name, pickled_data):
+        info = tarfile.TarInfo(file_name)
+        info.size = len(pickled_data)
+        info.mtime = time.time()
+        obj.addfile(info, StringIO(pickled_data))
+
+
 class TaskResultDescriptor(object):
 
     def __init__(self, node, task_result):
@@ -136,7 +213,7 @@ class TaskResultDescriptor(object):
         self.owner = task_result.owner
 
 
-class EncryptingTaskResultPackager(EncryptingPackager):
+class EncryptingTaskResultPackager(StreamingEncryptingPackager):
 
     descriptor_file_name = '.package_desc'
     result_file_name = '.result_pickle'
@@ -0,0 +1,126 @@
+import logging
+
+from golem.task.taskstate import SubtaskStatus
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculationPolicy(object):
+    """ Decides when subtasks that are projected to finish late (stragglers) are duplicated, ie. given
+    to another node as well. The first accepted result of any copy wins, the other copies are cancelled.
+    """
+
+    def __init__(self, enabled=True, min_progress=0.75, slowdown=1.5, min_finished=3, max_copies=1,
+                 max_duplicates=0.1):
+        """
+        :param bool enabled: whether duplicates should be issued at all
+        :param float min_progress: part of the task that has to be computed before duplicates are issued
+        :param float slowdown: subtask is a straggler if it's projected to take this many times longer than
+                               the median duration of already computed subtasks
+        :param int min_finished: number of computed subtasks needed to estimate the median duration
+        :param int max_copies: maximum number of duplicates of a single subtask
+        :param float max_duplicates: maximum number of duplicates issued for a task as a part of the number
+                                     of its subtasks (at least one duplicate is always allowed)
+        """
+        self.enabled = enabled
+        self.min_progress = min_progress
+        self.slowdown = slowdown
+        self.min_finished = min_finished
+        self.max_copies = max_copies
+        self.max_duplicates = max_duplicates
+
+    def get_max_duplicates(self, total_tasks):
+        return max(1, int(self.max_duplicates * total_tasks))
+
+
+class SpeculationStats(object):
+    def __init__(self):
+        self.issued = 0  # duplicates given to other nodes
+        self.won = 0  # duplicates whose result was accepted before the original's
+        self.lost = 0  # duplicates cancelled after the original's result was accepted
+        self.cancelled = 0  # copies cancelled after another copy's result was accepted
+
+
+class TaskSpeculation(object):
+    """ Speculative execution state of a single task: copies of subtasks, stragglers waiting for
+    a duplicate and durations of computed subtasks
+    """
+
+    def __init__(self, policy):
+        """
+        :param SpeculationPolicy policy:
+        """
+        self.policy = policy
+        self.stats = SpeculationStats()
+        self.durations = []  # wall-clock durations of computed subtasks
+        self.stragglers = []  # subtasks that should be duplicated, the slowest first
+        self.originals = {}  # duplicate subtask id -> original subtask id
+        self.copies = {}  # original subtask id -> list of its duplicates
+
+    def get_group(self, subtask_id):
+        """ Return ids of all copies of a subtask, the original first """
+        original = self.originals.get(subtask_id, subtask_id)
+        return [original] + self.copies.get(original, [])
+
+    def is_duplicate(self, subtask_id):
+        return subtask_id in self.originals
+
+    def add_duplicate(self, original, subtask_id):
+        self.originals[subtask_id] = original
+        self.copies.setdefault(original, []).append(subtask_id)
+        if original in self.stragglers:
+            self.stragglers.remove(original)
+        self.stats.issued += 1
+
+    def subtask_computed(self, duration):
+        self.durations.append(duration)
+
+    def get_typical_duration(self):
+        """ Return median duration of computed subtasks or None if too few subtasks have been computed """
+        if len(self.durations) < max(self.policy.min_finished, 1):
+            return None
+        durations = sorted(self.durations)
+        return durations[len(durations) / 2]
+
+    def find_stragglers(self, task, subtask_states, now):
+        """ Update the list of subtasks that should be duplicated
+        :param Task task: the task
+        :param dict subtask_states: subtask id -> SubtaskState of the task's subtasks
+        :param float now: current time
+        """
+        self.stragglers = []
+        if not self.policy.enabled or task.needs_computation():
+            return
+        if task.get_progress() < self.policy.min_progress:
+            return
+        typical = self.get_typical_duration()
+        if typical is None:
+            return
+        budget = self.policy.get_max_duplicates(task.get_total_tasks()) - self.stats.issued
+        if budget <= 0:
+            return
+
+        projected = []
+        for ss in subtask_states.values():
+            if ss.subtask_status != SubtaskStatus.starting or self.is_duplicate(ss.subtask_id):
+                continue
+            if len(self.copies.get(ss.subtask_id, [])) >= self.policy.max_copies:
+                continue
+            duration = self.get_projected_duration(ss, now)
+            if duration > self.policy.slowdown * typical:
+                projected.append((duration, ss.subtask_id))
+
+        projected.sort(reverse=True)
+        self.stragglers = [subtask_id for _, subtask_id in projected[:budget]]
+        if self.stragglers:
+            logger.debug("Stragglers of task {}: {}".format(task.header.task_id, self.stragglers))
+
+    @staticmethod
+    def get_projected_duration(subtask_state, now):
+        """ Estimate total duration of a subtask from the progress reported by the computing node. Without any
+        progress reports the time elapsed so far is the only lower bound. """
+        elapsed = now - subtask_state.time_started
+        if subtask_state.subtask_progress > 0.0 and subtask_state.last_progress_time:
+            reported = subtask_state.last_progress_time - subtask_state.time_started
+            return max(elapsed, reported / subtask_state.subtask_progress)
+        return elapsed
@@ -189,11 +189,12 @@ class Task(object):
         return False
 
     @abc.abstractmethod
-    def computation_finished(self, subtask_id, task_result, result_type=0):
+    def computation_finished(self, subtask_id, task_result, result_type=0, verification=None):
         """ Inform about finished subtask
         :param subtask_id: finished subtask id
         :param task_result: task result, can be binary data or list of files
         :param result_type: result_types representation
+        :param verification: outcome of verify_results, None if the result hasn't been verified yet
         """
         return  # Implement in derived class
 
@@ -337,6 +338,47 @@ class Task(object):
         """
         pass
 
+    def query_speculative_extra_data(self, subtask_id, perf_index, num_cores=1, node_id=None, node_name=None):
+        """ Called when a node asks for a subtask and all subtasks are already given, but subtask_id is late
+        and may be computed by this node as well. Tasks that can't give the same part of work twice should
+        return None (default).
+        :param str subtask_id: id of a subtask that should be duplicated
+        :param int perf_index: performance that given node declares
+        :param int num_cores: number of cores that current node declares
+        :param None|str node_id: id of a node that wants to get a next subtask
+        :param None|str node_name: name of a node that wants to get a next subtask
+        :return ExtraData|None
+        """
+        return None
+
+    def computation_cancelled(self, subtask_id):
+        """ Inform that subtask with given id won't be computed, because a result of its copy was accepted
+        or another copy is still computed
+        :param subtask_id:
+        """
+        pass
+
+    def prepare_results(self, subtask_id, task_result, result_type=0):
+        """ Prepare received results for computation_finished, eg. unpack them to files. It is called outside
+        of the reactor thread, so it must not change the task nor notify its listeners.
+        :param subtask_id: finished subtask id
+        :param task_result: task result, can be binary data or list of files
+        :param result_type: result_types representation
+        :return tuple: task result and its type that should be passed to computation_finished
+        """
+        return task_result, result_type
+
+    def verify_results(self, subtask_id, task_result, result_type=0):
+        """ Run blocking verification of prepared results, eg. render reference images and compare them with
+        the received ones. It is called outside of the reactor thread after prepare_results, so it must not
+        change the task nor notify its listeners.
+        :param subtask_id: finished subtask id
+        :param task_result: prepared task result
+        :param result_type: result_types representation
+        :return: outcome passed to computation_finished, None if the task verifies results there
+        """
+        return None
+
 
 result_types = {'data': 0, 'files': 1}
 resource_types = {'zip': 0, 'parts': 1, 'hashes': 2}
@@ -37,6 +37,15 @@ class TaskClient(object):
         with self._lock:
             self._finishing += 1
 
+    def cancel(self, finishing=False):
+        """ Computation was started, but its result won't be accepted nor rejected
+        :param bool finishing: whether the result was already being received
+        """
+        with self._lock:
+            self._started -= 1
+            if finishing:
+                self._finishing -= 1
+
     def accepted(self):
         with self._lock:
             return self._accepted
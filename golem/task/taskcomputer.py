@@ -4,8 +4,11 @@ import os
 import uuid
 from threading import Lock
 
+from twisted.internet import threads
+
 from golem.core.common import deadline_to_timeout
 from golem.core.statskeeper import IntStatsKeeper
+from golem.docker.container_pool import ContainerPool
 from golem.docker.machine.machine_manager import DockerMachineManager
 from golem.docker.task_thread import DockerTaskThread
 from golem.manager.nodestatesnapshot import TaskChunkStateSnapshot
@@ -26,6 +29,9 @@ from gnr.task.luxrendertask import LuxRenderTaskBuilder
 
 logger = logging.getLogger(__name__)
 
+# How often progress of computed subtasks is reported to their owners [s]
+PROGRESS_REPORT_INTERVAL = 10.0
+
 
 class CompStats(object):
     def __init__(self):
@@ -34,9 +40,75 @@ class CompStats(object):
         self.tasks_with_errors = 0
 
 
+class ComputeSlot(object):
+    """ Place for a single subtask computation. Every slot independently goes through the following states:
+    free -> task requested -> waiting for resources -> computing -> free
+    """
+    def __init__(self, index):
+        """
+        :param int index: number of the slot, used to select CPU cores for the computation
+        """
+        self.index = index
+        self.task_id = None  # task requested or computed in this slot
+        self.subtask_id = None  # subtask assigned to this slot
+        self.task_thread = None
+        self.use_waiting_ttl = False
+        self.waiting_ttl = 0
+        self.last_checking = time.time()
+
+    def is_free(self):
+        return self.task_id is None
+
+    def is_requesting(self):
+        return self.task_id is not None and self.subtask_id is None
+
+    def is_waiting_for_resources(self, task_id=None):
+        return self.subtask_id is not None and self.task_thread is None and task_id in (None, self.task_id)
+
+    def is_computing(self):
+        return self.task_thread is not None
+
+    def wait(self, ttl):
+        self.use_waiting_ttl = True
+        self.waiting_ttl = ttl
+        self.last_checking = time.time()
+
+    def waiting_expired(self, now):
+        """ Update waiting time to live
+        :param float now: current time
+        :return bool: True if the slot has waited too long for a task or resources
+        """
+        if not self.use_waiting_ttl or self.is_computing():
+            return False
+        self.waiting_ttl -= now - self.last_checking
+        self.last_checking = now
+        return self.waiting_ttl < 0
+
+    def reset(self):
+        self.task_id = None
+        self.subtask_id = None
+        self.task_thread = None
+        self.use_waiting_ttl = False
+        self.waiting_ttl = 0
+
+
+class TaskResources(object):
+    """ Resources of a task fetched by this node. They're requested as soon as the node bids for the task and
+    are shared by all subtasks of the task computed here, so they're fetched only once.
+    """
+    requested = "Requested"  # resource list was requested from the task owner
+    fetching = "Fetching"  # resources are being downloaded
+    collected = "Collected"  # resources are ready for any subtask of the task
+
+    def __init__(self):
+        self.status = TaskResources.requested
+        self.delta = None  # resources that should be unpacked after they're collected
+
+
 class TaskComputer(object):
     """ TaskComputer is responsible for task computations that take place in Golem application. Tasks are started
-    in separate threads.
+    in separate threads. Node's resources are divided into compute slots, so a few subtasks may be computed
+    (or wait for their resources) at the same time.
     """
 
     lock = Lock()
@@ -57,18 +129,23 @@ class TaskComputer(object):
         self.listeners = []
         self.current_computations = []
         self.last_task_request = time.time()
+        self.last_progress_report = time.time()
+        self.reported_progress = {}  # subtask_id -> last progress sent to the task owner
+        self.task_resources = {}  # task_id -> TaskResources fetched or being fetched
 
-        self.waiting_ttl = 0
-        self.last_checking = time.time()
+        self.slots = []
+        self.max_assigned_tasks = 1
+        self.slot_num_cores = 0
+        self.slot_max_memory_size = 0
 
         self.dir_manager = None
         self.resource_manager = None
         self.task_request_frequency = None
-        self.use_waiting_ttl = None
         self.waiting_for_task_timeout = None
         self.waiting_for_task_session_timeout = None
 
         self.docker_manager = DockerMachineManager.install()
+        self.container_pool = None
         try:
             lux_perf = float(task_server.config_desc.estimated_lux_performance)
             blender_perf = float(task_server.config_desc.estimated_blender_performance)
@@ -89,77 +166,104 @@ class TaskComputer(object):
         self.stats = IntStatsKeeper(CompStats)
 
         self.assigned_subtasks = {}
-        self.task_to_subtask_mapping = {}
-        self.max_assigned_tasks = 1
 
-        self.delta = None
-        self.last_task_timeout_checking = None
         self.support_direct_computation = False
         self.compute_tasks = task_server.config_desc.accept_tasks
 
     def task_given(self, ctd):
-        if ctd.subtask_id not in self.assigned_subtasks:
-            self.wait(ttl=self.waiting_for_task_timeout)
-            self.assigned_subtasks[ctd.subtask_id] = ctd
-            self.task_to_subtask_mapping[ctd.task_id] = ctd.subtask_id
+        if ctd.subtask_id in self.assigned_subtasks:
+            return False
+
+        with self.lock:
+            slot = self.__get_slot(lambda s: s.is_requesting() and s.task_id == ctd.task_id) or \
+                self.__get_slot(ComputeSlot.is_free)
+            if slot is not None:
+                slot.task_id = ctd.task_id
+                slot.subtask_id = ctd.subtask_id
+
+        if slot is None:
+            logger.warning("No free compute slot for subtask {}".format(ctd.subtask_id))
+            self.task_server.send_task_failed(ctd.subtask_id, ctd.task_id, "No free compute slot",
+                                              ctd.return_address, ctd.return_port, ctd.key_id, ctd.task_owner,
+                                              self.node_name)
+            return False
+
+        slot.wait(ttl=self.waiting_for_task_timeout)
+        self.assigned_subtasks[ctd.subtask_id] = ctd
+        resources = self.task_resources.get(ctd.task_id)
+        if resources is None:
+            self.task_resources[ctd.task_id] = TaskResources()
             self.__request_resource(ctd.task_id, self.resource_manager.get_resource_header(ctd.task_id),
                                     ctd.return_address, ctd.return_port, ctd.key_id, ctd.task_owner)
-            return True
+        elif resources.status == TaskResources.collected:
+            self.__start_computations([slot])
         else:
+            # resources were requested together with the task or are being fetched for another subtask
+            self.__update_state()
+        return True
+
+    def prefetch_resources(self, task_id):
+        """ Check whether resources of a task this node bids for should be requested together with the task,
+        so that they're fetched while the task owner assigns a subtask
+        :param str task_id:
+        :return bool: False if resources are already fetched or being fetched
+        """
+        resources = self.task_resources.get(task_id)
+        if resources is not None and resources.status != TaskResources.requested:
             return False
+        self.task_resources[task_id] = TaskResources()
+        return True
+
+    def forget_task_resources(self, task_id):
+        self.task_resources.pop(task_id, None)
 
     def resource_given(self, task_id):
-        if task_id in self.task_to_subtask_mapping:
-            subtask_id = self.task_to_subtask_mapping[task_id]
-            if subtask_id in self.assigned_subtasks:
-                subtask = self.assigned_subtasks[subtask_id]
-                timeout = deadline_to_timeout(subtask.deadline)
-                self.__compute_task(subtask_id, subtask.docker_images,
-                                    subtask.src_code, subtask.extra_data,
-                                    subtask.short_description, timeout)
-                self.waiting_for_task = None
-                return True
-            else:
-                return False
+        self.task_resources.setdefault(task_id, TaskResources()).status = TaskResources.collected
+        return self.__start_computations(self.__find_slots(lambda s: s.is_waiting_for_resources(task_id)))
 
     def task_resource_collected(self, task_id, unpack_delta=True):
-        if task_id in self.task_to_subtask_mapping:
-            subtask_id = self.task_to_subtask_mapping[task_id]
-            if subtask_id in self.assigned_subtasks:
-                subtask = self.assigned_subtasks[subtask_id]
-                if unpack_delta:
-                    self.task_server.unpack_delta(self.dir_manager.get_task_resource_dir(task_id), self.delta, task_id)
-                self.delta = None
-                self.last_task_timeout_checking = time.time()
-                self.__compute_task(subtask_id, subtask.docker_images, subtask.src_code, subtask.extra_data,
-                                    subtask.short_description, deadline_to_timeout(subtask.deadline))
-                return True
-            return False
+        resources = self.task_resources.setdefault(task_id, TaskResources())
+        if unpack_delta and resources.status != TaskResources.collected:
+            self.task_server.unpack_delta(self.dir_manager.get_task_resource_dir(task_id), resources.delta,
+                                          task_id)
+        resources.delta = None
+        return self.resource_given(task_id)
 
     def task_resource_failure(self, task_id, reason):
-        if task_id in self.task_to_subtask_mapping:
-            subtask_id = self.task_to_subtask_mapping.pop(task_id)
-            if subtask_id in self.assigned_subtasks:
-                subtask = self.assigned_subtasks.pop(subtask_id)
-                self.task_server.send_task_failed(subtask_id, subtask.task_id,
+        self.forget_task_resources(task_id)
+        for slot in self.__find_slots(lambda s: s.is_waiting_for_resources(task_id)):
+            subtask = self.assigned_subtasks.pop(slot.subtask_id, None)
+            if subtask:
+                self.task_server.send_task_failed(subtask.subtask_id, subtask.task_id,
                                                   'Error downloading resources: {}'.format(reason),
                                                   subtask.return_address, subtask.return_port, subtask.key_id,
                                                   subtask.task_owner, self.node_name)
-            self.session_closed()
+            self.__release_slot(slot)
 
     def wait_for_resources(self, task_id, delta):
-        if task_id in self.task_to_subtask_mapping:
-            subtask_id = self.task_to_subtask_mapping[task_id]
-            if subtask_id in self.assigned_subtasks:
-                self.delta = delta
+        """ Start fetching resources of a task, unless they're already fetched or being fetched
+        :param str task_id:
+        :param delta: resources that should be unpacked after they're collected
+        :return bool: True if resources should be pulled
+        """
+        resources = self.task_resources.setdefault(task_id, TaskResources())
+        if resources.status != TaskResources.requested:
+            return False
+        resources.status = TaskResources.fetching
+        resources.delta = delta
+        return True
 
     def task_request_rejected(self, task_id, reason):
         logger.warning("Task {} request rejected: {}".format(task_id, reason))
+        for slot in self.__find_slots(lambda s: s.is_requesting() and s.task_id == task_id):
+            self.__release_slot(slot)
 
     def resource_request_rejected(self, subtask_id, reason):
         logger.warning("Task {} resource request rejected: {}".format(subtask_id, reason))
-        self.assigned_subtasks.pop(subtask_id, None)
-        self.reset()
+        for slot in self.__find_slots(lambda s: s.is_waiting_for_resources() and
+                                      subtask_id in (s.subtask_id, s.task_id)):
+            self.assigned_subtasks.pop(slot.subtask_id, None)
+            self.__release_slot(slot)
 
     def task_computed(self, task_thread):
         if task_thread.end_time is None:
@@ -168,10 +272,15 @@ class TaskComputer(object):
         with self.lock:
             if task_thread in self.current_computations:
                 self.current_computations.remove(task_thread)
+            slot = self.__get_slot(lambda s: s.task_thread is task_thread)
+
+        if slot is not None:
+            self.__release_slot(slot)
 
         time_ = task_thread.end_time - task_thread.start_time
         subtask_id = task_thread.subtask_id
         subtask = self.assigned_subtasks.pop(subtask_id, None)
+        self.reported_progress.pop(subtask_id, None)
 
         if not subtask:
             logger.error("No subtask with id {}".format(subtask_id))
@@ -196,23 +305,18 @@ class TaskComputer(object):
             self.task_server.send_task_failed(subtask_id, subtask.task_id, "Wrong result format",
                                               subtask.return_address, subtask.return_port, subtask.key_id,
                                               subtask.task_owner, self.node_name)
-        self.counting_task = None
 
     def run(self):
-        if self.counting_task:
-            for task_thread in self.current_computations:
-                task_thread.check_timeout()
-        elif self.compute_tasks and self.runnable:
-            if not self.waiting_for_task:
-                if time.time() - self.last_task_request > self.task_request_frequency:
-                    if len(self.current_computations) == 0:
-                        self.__request_task()
-            elif self.use_waiting_ttl:
-                time_ = time.time()
-                self.waiting_ttl -= time_ - self.last_checking
-                self.last_checking = time_
-                if self.waiting_ttl < 0:
-                    self.reset()
+        for task_thread in list(self.current_computations):
+            task_thread.check_timeout()
+        if self.container_pool:
+            self.__evict_idle_containers()
+        if time.time() - self.last_progress_report > PROGRESS_REPORT_INTERVAL:
+            self.__report_progress()
+        if self.compute_tasks and self.runnable:
+            self.__check_waiting_slots()
+            if time.time() - self.last_task_request > self.task_request_frequency:
+                self.__request_tasks()
 
     def get_progresses(self):
         ret = {}
@@ -230,6 +334,8 @@ class TaskComputer(object):
         self.waiting_for_task_timeout = config_desc.waiting_for_task_timeout
         self.waiting_for_task_session_timeout = config_desc.waiting_for_task_session_timeout
         self.compute_tasks = config_desc.accept_tasks
+        self.__configure_slots(config_desc)
+        self.__configure_container_pool(config_desc)
         self.change_docker_config(config_desc, run_benchmarks, in_background)
     
     def _validate_task_state(self, task_state):
@@ -336,49 +442,159 @@ class TaskComputer(object):
         for l in self.listeners:
             l.toggle_config_dialog(on)
 
-    def session_timeout(self):
-        self.session_closed()
+    def session_timeout(self, task_id):
+        """ Free slots waiting for a subtask of a task requested in a session that timed out
+        :param str task_id: id of the task requested in the session
+        """
+        if task_id is not None:
+            self.session_closed(task_id)
 
-    def session_closed(self):
-        if not self.counting_task:
-            self.reset()
+    def session_closed(self, task_id=None):
+        """ Free slots that are still waiting for a subtask from a closed session
+        :param str|None task_id: id of the task requested in the session, None if unknown
+        """
+        for slot in self.__find_slots(lambda s: s.is_requesting() and task_id in (None, s.task_id)):
+            self.__release_slot(slot)
 
     def wait(self, wait=True, ttl=None):
-        self.use_waiting_ttl = wait
         if ttl is None:
-            self.waiting_ttl = self.waiting_for_task_session_timeout
+            ttl = self.waiting_for_task_session_timeout
+        for slot in self.__find_slots(lambda s: not s.is_free() and not s.is_computing()):
+            if wait:
+                slot.wait(ttl)
+            else:
+                slot.use_waiting_ttl = False
+
+    def __configure_slots(self, config_desc):
+        """ Divide node's cores and memory into compute slots of the configured size. Slots that are busy
+        are kept until their work is finished. """
+        try:
+            num_cores = max(int(config_desc.num_cores), 1)
+            max_memory_size = int(config_desc.max_memory_size)
+            slot_num_cores = min(int(config_desc.slot_num_cores) or num_cores, num_cores)
+            slot_max_memory_size = min(int(config_desc.slot_max_memory_size), max_memory_size)
+        except (AttributeError, TypeError, ValueError) as err:
+            logger.warning("Wrong compute slots configuration: {}".format(err))
+            num_cores = slot_num_cores = 1
+            max_memory_size = slot_max_memory_size = 0
+
+        num_slots = num_cores // slot_num_cores
+        if slot_max_memory_size > 0:
+            num_slots = min(num_slots, max_memory_size // slot_max_memory_size)
+
+        self.max_assigned_tasks = max(num_slots, 1)
+        self.slot_num_cores = slot_num_cores
+        self.slot_max_memory_size = slot_max_memory_size or max_memory_size // self.max_assigned_tasks
+
+        with self.lock:
+            self.slots = [slot for slot in self.slots if not slot.is_free()]
+            used = set(slot.index for slot in self.slots)
+            self.slots += [ComputeSlot(i) for i in range(self.max_assigned_tasks) if i not in used]
+            self.slots.sort(key=lambda slot: slot.index)
+        logger.info("Using {} compute slot(s): {} core(s), {} kB of memory each"
+                    .format(self.max_assigned_tasks, self.slot_num_cores, self.slot_max_memory_size))
+
+    def __evict_idle_containers(self):
+        """ Forget idle containers in the reactor thread, the docker daemon removes them in a thread """
+        evicted = self.container_pool.evict_idle()
+        if evicted:
+            deferred = threads.deferToThread(self.container_pool.remove, evicted)
+            deferred.addErrback(lambda failure: logger.warning("Can't remove idle containers: {}"
+                                                               .format(failure.getErrorMessage())))
+
+    def __configure_container_pool(self, config_desc):
+        """ Keep Docker containers warm between subtasks, unless container idle timeout is 0. Pooled
+        containers may reserve at most max_memory_size of memory. """
+        try:
+            idle_timeout = int(config_desc.container_idle_timeout)
+            max_memory = int(config_desc.max_memory_size) * 1000
+        except (AttributeError, TypeError, ValueError) as err:
+            logger.warning("Wrong container pool configuration: {}".format(err))
+            idle_timeout, max_memory = 0, 0
+
+        if idle_timeout <= 0:
+            if self.container_pool:
+                self.container_pool.quit()
+                self.container_pool = None
+        elif self.container_pool:
+            self.container_pool.idle_timeout = idle_timeout
+            self.container_pool.max_memory = max_memory
         else:
-            self.waiting_ttl = ttl
+            self.container_pool = ContainerPool(os.path.join(self.dir_manager.root_path, "containers"),
+                                                idle_timeout=idle_timeout, max_memory=max_memory)
 
-    def reset(self, counting_task=False):
-        self.counting_task = counting_task
-        self.use_waiting_ttl = False
-        self.task_requested = False
-        self.waiting_for_task = None
-        self.waiting_ttl = 0
+    def __get_slot(self, condition):
+        return next((slot for slot in self.slots if condition(slot)), None)
 
-    def __request_task(self):
+    def __find_slots(self, condition):
         with self.lock:
-            perform_request = not self.waiting_for_task and not self.counting_task
+            return [slot for slot in self.slots if condition(slot)]
 
-        if perform_request:
-            now = time.time()
-            self.wait()
-            self.last_checking = now
-            self.last_task_request = now
-            self.waiting_for_task = self.task_server.request_task()
+    def __release_slot(self, slot):
+        with self.lock:
+            slot.reset()
+            if slot.index >= self.max_assigned_tasks and slot in self.slots:
+                self.slots.remove(slot)
+        self.__update_state()
 
-    def __request_resource(self, task_id, resource_header, return_address, return_port, key_id, task_owner):
-        self.last_checking = time.time()
-        self.wait(ttl=self.waiting_for_task_timeout)
-        self.waiting_for_task = self.task_server.request_resource(task_id, resource_header, return_address, return_port,
-                                                                  key_id,
-                                                                  task_owner)
+    def __update_state(self):
+        with self.lock:
+            waiting = [slot for slot in self.slots if not slot.is_free() and not slot.is_computing()]
+            self.counting_task = any(slot.is_computing() for slot in self.slots)
+            self.task_requested = any(slot.is_requesting() for slot in self.slots)
+            self.waiting_for_task = waiting[0].task_id if waiting else None
+
+    def __check_waiting_slots(self):
+        now = time.time()
+        for slot in self.__find_slots(lambda s: s.waiting_expired(now)):
+            if slot.subtask_id is not None:
+                logger.warning("Resources for subtask {} not received in time".format(slot.subtask_id))
+                self.assigned_subtasks.pop(slot.subtask_id, None)
+            self.__release_slot(slot)
+
+    def __request_tasks(self):
+        free_slots = self.__find_slots(ComputeSlot.is_free)
+        if not free_slots:
+            return
 
-    def __compute_task(self, subtask_id, docker_images,
-                       src_code, extra_data, short_desc, task_timeout):
+        self.last_task_request = time.time()
+        for slot in free_slots:
+            task_id = self.task_server.request_task()
+            if task_id is None:
+                break
+            with self.lock:
+                slot.task_id = task_id
+            slot.wait(ttl=self.waiting_for_task_session_timeout)
+        self.__update_state()
+
+    def __report_progress(self):
+        """ Send progress of subtasks that has changed since the last report to their owners """
+        self.last_progress_report = time.time()
+        for task_thread in list(self.current_computations):
+            subtask_id = task_thread.subtask_id
+            progress = task_thread.get_progress()
+            if progress > self.reported_progress.get(subtask_id, 0.0):
+                if self.task_server.send_subtask_progress(subtask_id, progress):
+                    self.reported_progress[subtask_id] = progress
 
-        self.reset(counting_task=True)
+    def __request_resource(self, task_id, resource_header, return_address, return_port, key_id, task_owner):
+        self.task_server.request_resource(task_id, resource_header, return_address, return_port, key_id,
+                                          task_owner)
+        self.__update_state()
+
+    def __start_computations(self, slots):
+        for slot in slots:
+            subtask = self.assigned_subtasks.get(slot.subtask_id)
+            if subtask is None:
+                self.__release_slot(slot)
+                continue
+            self.__compute_task(slot, subtask.subtask_id, subtask.docker_images, subtask.src_code,
+                                subtask.extra_data, subtask.short_description,
+                                deadline_to_timeout(subtask.deadline))
+        return bool(slots)
+
+    def __compute_task(self, slot, subtask_id, docker_images,
+                       src_code, extra_data, short_desc, task_timeout):
 
         task_id = self.assigned_subtasks[subtask_id].task_id
         working_dir = self.assigned_subtasks[subtask_id].working_directory
@@ -393,9 +609,12 @@ class TaskComputer(object):
                 os.makedirs(temp_dir)
 
         if docker_images:
+            host_config = self.docker_manager.get_slot_host_config(slot.index, self.slot_num_cores,
+                                                                   self.slot_max_memory_size)
             tt = DockerTaskThread(self, subtask_id, docker_images, working_dir,
                                   src_code, extra_data, short_desc,
-                                  resource_dir, temp_dir, task_timeout)
+                                  resource_dir, temp_dir, task_timeout, host_config=host_config,
+                                  container_pool=self.container_pool)
         elif self.support_direct_computation:
             tt = PyTaskThread(self, subtask_id, working_dir, src_code,
                               extra_data, short_desc, resource_dir, temp_dir,
@@ -406,15 +625,20 @@ class TaskComputer(object):
             self.task_server.send_task_failed(subtask_id, subtask.task_id, "Host direct task not supported",
                                               subtask.return_address, subtask.return_port, subtask.key_id,
                                               subtask.task_owner, self.node_name)
-            self.counting_task = None
+            self.__release_slot(slot)
             return
 
-        self.current_computations.append(tt)
+        with self.lock:
+            slot.task_thread = tt
+            self.current_computations.append(tt)
+        self.__update_state()
         tt.start()
 
     def quit(self):
         for t in self.current_computations:
             t.end_comp()
+        if self.container_pool:
+            self.container_pool.quit()
 
 
 class AssignedSubTask(object):
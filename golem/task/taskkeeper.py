@@ -2,9 +2,11 @@ from __future__ import division
 import logging
 import random
 import time
+from collections import OrderedDict
 from math import ceil
 
 from golem.core.common import HandleKeyError, get_current_time
+from golem.core.deadlinequeue import DeadlineQueue
 from golem.core.variables import APP_VERSION
 
 from .taskbase import TaskHeader, ComputeTaskDef
@@ -99,6 +101,97 @@ class CompTaskKeeper(object):
                 self.remove_task(task_id)
 
 
+class RandomAccessSet(object):
+    """ Set of items which may also be accessed by index, so that a random item can be chosen. Adding,
+    removing, membership tests and indexing take constant time. Removing an item moves the last item into
+    its place.
+    """
+
+    def __init__(self, items=()):
+        self._items = []
+        self._positions = {}  # item -> index in _items
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def add(self, item):
+        if item not in self._positions:
+            self._positions[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item):
+        index = self._positions.pop(item, None)
+        if index is None:
+            return
+        last = self._items.pop()
+        if index < len(self._items):
+            self._items[index] = last
+            self._positions[last] = index
+
+    def clear(self):
+        self._items = []
+        self._positions = {}
+
+    def choice(self):
+        """ Return a random item or None if the set is empty """
+        if self._items:
+            return random.choice(self._items)
+
+    def sample(self, k):
+        """ Return up to k distinct random items. O(k) """
+        k = min(k, len(self._items))
+        return [self._items[i] for i in random.sample(xrange(len(self._items)), k)]
+
+
+class HeaderVersions(object):
+    """ Numbers changes of task headers, so that a peer may ask only for headers that changed after the last
+    version it has received, instead of the whole list. A header is changed when it's added or signed again.
+    """
+
+    def __init__(self):
+        self.version = 0  # version of the last change
+        # task id -> (version, signature) of its last change, the oldest change first
+        self.changes = OrderedDict()
+
+    def update(self, task_id, signature):
+        """ Record a change of a task header. Header with the same signature isn't changed. """
+        change = self.changes.get(task_id)
+        if change is not None:
+            if change[1] == signature:
+                return
+            del self.changes[task_id]
+        self.version += 1
+        self.changes[task_id] = (self.version, signature)
+
+    def remove(self, task_id):
+        self.changes.pop(task_id, None)
+
+    def changed_since(self, version):
+        """ Return ids of tasks whose headers changed after given version, the oldest change first. Only the
+        returned changes are looked at.
+        :param int version:
+        :return list:
+        """
+        task_ids = []
+        for task_id in reversed(self.changes):
+            if self.changes[task_id][0] <= version:
+                break
+            task_ids.append(task_id)
+        task_ids.reverse()
+        return task_ids
+
+
 class TaskHeaderKeeper(object):
     """ Keeps information about tasks living in Golem Network. Node may choose one of those task
     to compute or will pass information to other nodes.
@@ -107,8 +200,17 @@ class TaskHeaderKeeper(object):
     def __init__(self, environments_manager, min_price=0.0, app_version=APP_VERSION, remove_task_timeout=180,
                  verification_timeout=3600):
         self.task_headers = {}  # all computing tasks that this node now about
-        self.supported_tasks = []  # ids of tasks that this node may try to compute
+        self.supported_tasks = RandomAccessSet()  # ids of tasks that this node may try to compute
         self.removed_tasks = {}  # tasks that were removed from network recently, so they won't be add to again
+        self.task_deadlines = DeadlineQueue()  # deadlines of known task headers
+        self.removed_tasks_times = DeadlineQueue()  # removal times of recently removed tasks
+        # changes of known headers, for peers that ask only for new ones
+        self.header_versions = HeaderVersions()
+        # recently removed tasks that were still alive, eg. their owner refused to assign a subtask; when
+        # they're forgotten their headers must be received again from peers that have already sent them, so
+        # full header lists should be requested each time resync_version changes
+        self.dropped_tasks = set()
+        self.resync_version = 0
 
         self.min_price = min_price
         self.app_version = app_version
@@ -179,10 +281,10 @@ class TaskHeaderKeeper(object):
         if config_desc.min_price == self.min_price:
             return
         self.min_price = config_desc.min_price
-        self.supported_tasks = []
+        self.supported_tasks.clear()
         for id_, th in self.task_headers.iteritems():
             if self.is_supported(th.__dict__):
-                self.supported_tasks.append(id_)
+                self.supported_tasks.add(id_)
 
     def add_task_header(self, th_dict_repr):
         """ This function will try to add to or update a task header in a list of known headers. The header will be
@@ -193,18 +295,20 @@ class TaskHeaderKeeper(object):
         """
         try:
             id_ = th_dict_repr["task_id"]
-            update = id_ in self.task_headers.keys()
+            update = id_ in self.task_headers
 
-            if id_ not in self.removed_tasks.keys():  # not removed recently
+            if id_ not in self.removed_tasks:  # not removed recently
                 self.task_headers[id_] = TaskHeader.from_dict(th_dict_repr)
+                self.task_deadlines.push(id_, self.task_headers[id_].deadline)
+                self.header_versions.update(id_, self.task_headers[id_].signature)
                 is_supported = self.is_supported(th_dict_repr)
 
                 if update:
-                    if not is_supported and id_ in self.supported_tasks:
-                        self.supported_tasks.remove(id_)
+                    if not is_supported:
+                        self.supported_tasks.discard(id_)
                 elif is_supported:
                     logger.info("Adding task {} is_supported={}".format(id_, is_supported))
-                    self.supported_tasks.append(id_)
+                    self.supported_tasks.add(id_)
 
             return True
         except (KeyError, TypeError) as err:
@@ -214,32 +318,57 @@ class TaskHeaderKeeper(object):
     def remove_task_header(self, task_id):
         """ Removes task with given id from a list of known task headers.
         """
-        if task_id in self.task_headers:
-            del self.task_headers[task_id]
-        if task_id in self.supported_tasks:
-            self.supported_tasks.remove(task_id)
+        th = self.task_headers.pop(task_id, None)
+        if th is not None and th.deadline > get_current_time():
+            self.dropped_tasks.add(task_id)
+        self.supported_tasks.discard(task_id)
+        self.task_deadlines.remove(task_id)
+        self.header_versions.remove(task_id)
         self.removed_tasks[task_id] = time.time()
-
-    def get_task(self):
-        """ Returns random task from supported tasks that may be computed
+        self.removed_tasks_times.push(task_id, self.removed_tasks[task_id])
+
+    def get_task(self, score=None, candidates=8):
+        """ Returns random task from supported tasks that may be computed. If score function is given, a few
+        random supported tasks are scored and the best one is returned, so the cost doesn't depend on the
+        number of known tasks.
+        :param None|func score: function returning a number (higher is better) for a task header or None if
+                                a task shouldn't be computed
+        :param int candidates: number of tasks that are scored
         :return TaskHeader|None: returns either None if there are no tasks that this node may want to compute
         """
-        if len(self.supported_tasks) > 0:
-            tn = random.randrange(0, len(self.supported_tasks))
-            task_id = self.supported_tasks[tn]
-            return self.task_headers[task_id]
+        if score is None:
+            task_id = self.supported_tasks.choice()
+            if task_id is not None:
+                return self.task_headers[task_id]
+            return None
+
+        best, best_score = None, None
+        for task_id in self.supported_tasks.sample(candidates):
+            th = self.task_headers[task_id]
+            th_score = score(th)
+            if th_score is not None and (best_score is None or th_score > best_score):
+                best, best_score = th, th_score
+        return best
 
     def remove_old_tasks(self):
-        for t in self.task_headers.values():
-            cur_time = get_current_time()
-            if cur_time > t.deadline:
-                logger.warning("Task {} dies".format(t.task_id))
-                self.remove_task_header(t.task_id)
-
-        for task_id, remove_time in self.removed_tasks.items():
-            cur_time = time.time()
-            if cur_time - remove_time > self.removed_task_timeout:
-                del self.removed_tasks[task_id]
+        """ Remove headers of tasks past their deadlines and forget tasks removed more than
+        removed_task_timeout seconds ago. Only expired entries are looked at.
+        :return list: ids of tasks whose headers have been removed
+        """
+        dead_tasks = self.task_deadlines.pop_expired(get_current_time())
+        for task_id in dead_tasks:
+            logger.warning("Task {} dies".format(task_id))
+            self.remove_task_header(task_id)
+
+        resync = False
+        for task_id in self.removed_tasks_times.pop_expired(time.time() - self.removed_task_timeout):
+            self.removed_tasks.pop(task_id, None)
+            if task_id in self.dropped_tasks:
+                self.dropped_tasks.discard(task_id)
+                resync = True
+        if resync:
+            self.resync_version += 1
+        return dead_tasks
 
     def request_failure(self, task_id):
         self.remove_task_header(task_id)
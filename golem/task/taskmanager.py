@@ -1,7 +1,12 @@
+import copy
 import logging
 import time
 
+from twisted.internet import defer, reactor
+from twisted.internet.task import deferLater
+
 from golem.core.common import HandleKeyError, get_current_time, timeout_to_deadline
+from golem.core.deadlinequeue import DeadlineQueue
 from golem.core.hostaddress import get_external_address
 from golem.manager.nodestatesnapshot import LocalTaskStateSnapshot
 from golem.network.transport.tcpnetwork import SocketAddress
@@ -9,12 +14,16 @@ from golem.resource.dirmanager import DirManager
 from golem.resource.swift.resourcemanager import OpenStackSwiftResourceManager
 from golem.task.result.resultmanager import EncryptedResultPackageManager
 from golem.task.taskbase import ComputeTaskDef, TaskEventListener
+from golem.task.speculation import SpeculationPolicy, TaskSpeculation
 from golem.task.taskkeeper import CompTaskKeeper, compute_subtask_value
 from golem.task.taskstate import TaskState, TaskStatus, SubtaskStatus, SubtaskState
+from golem.task.verificationpool import VerificationPool, VerificationQueueFull
 
 
 logger = logging.getLogger(__name__)
 
+VERIFICATION_RETRY_DELAY = 10
+
 
 class TaskManagerEventListener:
     def __init__(self):
@@ -43,8 +52,12 @@ class TaskManager(TaskEventListener):
     handle_task_key_error = HandleKeyError(log_task_key_error)
     handle_subtask_key_error = HandleKeyError(log_subtask_key_error)
 
+    # How often subtasks that should be duplicated are looked for (in seconds)
+    STRAGGLERS_CHECK_INTERVAL = 10.0
+
     def __init__(self, node_name, node, keys_auth, listen_address="", listen_port=0, root_path="res",
-                 use_distributed_resources=True):
+                 use_distributed_resources=True, verification_workers=2, verification_queue_size=100,
+                 speculation_policy=None):
         super(TaskManager, self).__init__()
         self.node_name = node_name
         self.node = node
@@ -71,6 +84,20 @@ class TaskManager(TaskEventListener):
 
         self.comp_task_keeper = CompTaskKeeper()
 
+        self.verification_pool = VerificationPool(max_workers=verification_workers,
+                                                  max_queue_size=verification_queue_size)
+        self.subtasks_verified = {}  # subtask id -> Deferred fired after verification
+
+        # Policy copied to new tasks, may be changed for each task with set_speculation_policy
+        self.speculation_policy = speculation_policy or SpeculationPolicy()
+        self.speculations = {}
+        self.last_stragglers_check = 0.0
+
+        # Deadlines of active tasks and of their starting subtasks, so that check_timeouts doesn't have to
+        # look at all of them
+        self.task_deadlines = DeadlineQueue()
+        self.subtask_deadlines = DeadlineQueue()
+
     def get_task_manager_root(self):
         return self.root_path
 
@@ -130,6 +157,8 @@ class TaskManager(TaskEventListener):
         ts.time_started = time.time()
 
         self.tasks_states[task.header.task_id] = ts
+        self.speculations[task.header.task_id] = TaskSpeculation(copy.copy(self.speculation_policy))
+        self.task_deadlines.push(task.header.task_id, task.header.deadline)
         logger.info("Task {} added".format(task.header.task_id))
 
         self.notice_task_updated(task.header.task_id)
@@ -169,9 +198,18 @@ class TaskManager(TaskEventListener):
             if th.max_price < price:
                 return None, False, should_wait
 
-            if self.__has_subtasks(ts, task, max_resource_size, max_memory_size):
-                extra_data = task.query_extra_data(estimated_performance, num_cores, node_id, node_name)
+            extra_data, original = None, None
+            if self.__can_compute(ts, task, max_resource_size, max_memory_size):
+                if task.needs_computation():
+                    extra_data = task.query_extra_data(estimated_performance, num_cores, node_id, node_name)
+                else:
+                    # All subtasks are given, but some of them may be late and should be duplicated
+                    original = self.__get_straggler(task_id, node_id)
+                    if original is not None:
+                        extra_data = task.query_speculative_extra_data(original, estimated_performance,
+                                                                       num_cores, node_id, node_name)
 
+            if extra_data is not None:
                 should_wait = extra_data.should_wait
                 ctd = extra_data.ctd
 
@@ -186,6 +224,9 @@ class TaskManager(TaskEventListener):
                 ctd.task_owner = th.task_owner
                 self.subtask2task_mapping[ctd.subtask_id] = task_id
                 self.__add_subtask_to_tasks_states(node_name, node_id, price, ctd, address)
+                if original is not None:
+                    logger.info("Subtask {} duplicated as {}".format(original, ctd.subtask_id))
+                    self.speculations[task_id].add_duplicate(original, ctd.subtask_id)
                 self.notice_task_updated(task_id)
                 return ctd, False, should_wait
 
@@ -256,14 +297,111 @@ class TaskManager(TaskEventListener):
     @handle_subtask_key_error
     def computed_task_received(self, subtask_id, result, result_type):
         task_id = self.subtask2task_mapping[subtask_id]
+        if not self.__is_subtask_starting(task_id, subtask_id):
+            return False
 
+        verified = self.__finish_computation(self.tasks[task_id], subtask_id, result, result_type)
+        return self.__subtask_computed(task_id, subtask_id, verified)
+
+    def verify_computed_task(self, subtask_id, result, result_type):
+        """ Same as computed_task_received, but the result is prepared (eg. unpacked) and verified (eg.
+        reference images are rendered and compared) in the verification pool instead of the reactor thread.
+        The task state is changed in the reactor thread, after checking that the subtask still waits for the
+        result (it might have timed out or been cancelled in the meantime). If there are too many results
+        waiting for verification, the result is submitted again after VERIFICATION_RETRY_DELAY seconds.
+        :param str subtask_id: id of a computed subtask
+        :param result: received result
+        :param int result_type: type of the result (data or files)
+        :return Deferred: fired with True if the result was accepted and False otherwise
+        """
+        task_id = self.subtask2task_mapping.get(subtask_id)
+        if task_id not in self.tasks:
+            logger.warning("This is not my subtask {}".format(subtask_id))
+            return defer.succeed(False)
+        if subtask_id in self.subtasks_verified:
+            logger.warning("Result for subtask {} is already being verified".format(subtask_id))
+            return defer.succeed(False)
+        if not self.__is_subtask_starting(task_id, subtask_id):
+            return defer.succeed(False)
+
+        for copy_id in self.speculations[task_id].get_group(subtask_id):
+            if copy_id in self.subtasks_verified:
+                # Another copy of this subtask is being verified, this result is checked after it. It will be
+                # rejected if the other one is accepted.
+                logger.debug("Result for subtask {} waits for verification of {}".format(subtask_id, copy_id))
+                retried = defer.Deferred()
+
+                def retry(other_result):
+                    self.verify_computed_task(subtask_id, result, result_type).chainDeferred(retried)
+                    return other_result
+
+                self.subtasks_verified[copy_id].addBoth(retry)
+                return retried
+
+        def verify():
+            if task_id not in self.tasks or not self.__is_subtask_starting(task_id, subtask_id):
+                return False
+            d = self.verification_pool.submit(task_id, self.__verify_results, self.tasks[task_id], subtask_id,
+                                              result, result_type)
+            d.addCallbacks(verified, verification_failed)
+            return d
+
+        def verified(verified_result):
+            if task_id not in self.tasks or not self.__is_subtask_starting(task_id, subtask_id):
+                return False
+            result_verified = self.__finish_computation(self.tasks[task_id], subtask_id, *verified_result)
+            return self.__subtask_computed(task_id, subtask_id, result_verified)
+
+        def verification_failed(failure):
+            if failure.check(VerificationQueueFull):
+                logger.warning("Can't verify result for subtask {} now, retrying in {} s: {}"
+                               .format(subtask_id, VERIFICATION_RETRY_DELAY, failure.value))
+                return deferLater(reactor, VERIFICATION_RETRY_DELAY, verify)
+            logger.error("Verification of subtask {} failed: {}".format(subtask_id,
+                                                                        failure.getErrorMessage()))
+            if task_id not in self.tasks or not self.__is_subtask_starting(task_id, subtask_id):
+                return False
+            self.tasks[task_id].computation_failed(subtask_id)
+            return self.__subtask_computed(task_id, subtask_id, False)
+
+        finished = []
+
+        def verification_finished(accepted):
+            finished.append(True)
+            self.subtasks_verified.pop(subtask_id, None)
+            return accepted
+
+        d = defer.maybeDeferred(verify)
+        d.addBoth(verification_finished)
+        if not finished:
+            self.subtasks_verified[subtask_id] = d
+        return d
+
+    def quit(self):
+        self.verification_pool.stop()
+
+    def __is_subtask_starting(self, task_id, subtask_id):
         subtask_status = self.tasks_states[task_id].subtask_states[subtask_id].subtask_status
         if subtask_status != SubtaskStatus.starting:
             logger.warning("Result for subtask {} when subtask state is {}".format(subtask_id, subtask_status))
             self.notice_task_updated(task_id)
             return False
+        return True
 
-        self.tasks[task_id].computation_finished(subtask_id, result, result_type)
+    @staticmethod
+    def __verify_results(task, subtask_id, result, result_type):
+        """ Prepare and verify a result in a verification pool thread
+        :return tuple: prepared result, its type and the outcome of its verification
+        """
+        result, result_type = task.prepare_results(subtask_id, result, result_type)
+        return result, result_type, task.verify_results(subtask_id, result, result_type)
+
+    @staticmethod
+    def __finish_computation(task, subtask_id, result, result_type, verification=None):
+        task.computation_finished(subtask_id, result, result_type, verification=verification)
+        return task.verify_subtask(subtask_id)
+
+    def __subtask_computed(self, task_id, subtask_id, verified):
         ss = self.tasks_states[task_id].subtask_states[subtask_id]
         ss.subtask_progress = 1.0
         ss.subtask_rem_time = 0.0
@@ -272,12 +410,15 @@ class TaskManager(TaskEventListener):
         ss.stderr = self.tasks[task_id].get_stderr(subtask_id)
         ss.results = self.tasks[task_id].get_results(subtask_id)
 
-        if not self.tasks[task_id].verify_subtask(subtask_id):
+        if not verified:
             logger.debug("Subtask {} not accepted\n".format(subtask_id))
             ss.subtask_status = SubtaskStatus.failure
             self.notice_task_updated(task_id)
             return False
 
+        self.__cancel_copies(task_id, subtask_id)
+        self.speculations[task_id].subtask_computed(time.time() - ss.time_started)
+
         if self.tasks_states[task_id].status in self.activeStatus:
             if not self.tasks[task_id].finished_computation():
                 self.tasks_states[task_id].status = TaskStatus.computing
@@ -299,7 +440,7 @@ class TaskManager(TaskEventListener):
             self.notice_task_updated(task_id)
             return False
 
-        self.tasks[task_id].computation_failed(subtask_id)
+        self.__subtask_failed(task_id, subtask_id)
         ss = self.tasks_states[task_id].subtask_states[subtask_id]
         ss.subtask_progress = 1.0
         ss.subtask_rem_time = 0.0
@@ -309,12 +450,36 @@ class TaskManager(TaskEventListener):
         self.notice_task_updated(task_id)
         return True
 
+    @handle_subtask_key_error
+    def set_subtask_progress(self, subtask_id, progress):
+        """ Save progress reported by the node computing the subtask and estimate the remaining
+        computation time from the average progress rate
+        :param str subtask_id:
+        :param float progress: computed part of the subtask (between 0 and 1)
+        :return bool: True if the progress was saved
+        """
+        task_id = self.subtask2task_mapping[subtask_id]
+        ss = self.tasks_states[task_id].subtask_states[subtask_id]
+        if ss.subtask_status != SubtaskStatus.starting:
+            return False
+
+        now = time.time()
+        ss.subtask_progress = min(max(float(progress), 0.0), 1.0)
+        ss.last_progress_time = now
+        if ss.subtask_progress > 0.0:
+            elapsed = now - ss.time_started
+            ss.subtask_rem_time = elapsed * (1.0 - ss.subtask_progress) / ss.subtask_progress
+        self.notice_task_updated(task_id)
+        return True
+
     def task_result_incoming(self, subtask_id):
         node_id = self.get_node_id_for_subtask(subtask_id)
 
         if node_id and subtask_id in self.subtask2task_mapping:
             task_id = self.subtask2task_mapping[subtask_id]
-            if task_id in self.tasks:
+            if self.is_subtask_cancelled(subtask_id):
+                logger.debug("Result for cancelled subtask {} is incoming".format(subtask_id))
+            elif task_id in self.tasks:
                 task = self.tasks[task_id]
                 task.result_incoming(subtask_id)
             else:
@@ -325,29 +490,64 @@ class TaskManager(TaskEventListener):
 
     # CHANGE TO RETURN KEY_ID (check IF SUBTASK COMPUTER HAS KEY_ID
     def check_timeouts(self):
+        """ Mark expired tasks and subtasks as timed out. Only expired deadlines are looked at, deadlines of
+        tasks that are not active are indexed again when the tasks are resumed or restarted.
+        :return list: ids of nodes which haven't computed their subtasks in time
+        """
         nodes_with_timeouts = []
-        for t in self.tasks.values():
-            th = t.header
-            if self.tasks_states[th.task_id].status not in self.activeStatus:
+        cur_time = get_current_time()
+        for subtask_id in self.subtask_deadlines.pop_expired(cur_time):
+            task_id = self.subtask2task_mapping.get(subtask_id)
+            if task_id not in self.tasks or self.tasks_states[task_id].status not in self.activeStatus:
                 continue
-            cur_time = get_current_time()
-            if cur_time > th.deadline:
-                logger.info("Task {} dies".format(th.task_id))
-                t.task_stats = TaskStatus.timeout
-                self.tasks_states[th.task_id].status = TaskStatus.timeout
-                self.notice_task_updated(th.task_id)
-            ts = self.tasks_states[th.task_id]
-            for s in ts.subtask_states.values():
-                if s.subtask_status == SubtaskStatus.starting:
-                    if cur_time > s.deadline:
-                        logger.info("Subtask {} dies".format(s.subtask_id))
-                        s.subtask_status = SubtaskStatus.failure
-                        nodes_with_timeouts.append(s.computer.node_id)
-                        t.computation_failed(s.subtask_id)
-                        s.stderr = "[GOLEM] Timeout"
-                        self.notice_task_updated(th.task_id)
+            s = self.tasks_states[task_id].subtask_states.get(subtask_id)
+            if s is None or s.subtask_status != SubtaskStatus.starting:
+                continue
+            logger.info("Subtask {} dies".format(subtask_id))
+            s.subtask_status = SubtaskStatus.failure
+            nodes_with_timeouts.append(s.computer.node_id)
+            self.__subtask_failed(task_id, subtask_id)
+            s.stderr = "[GOLEM] Timeout"
+            self.notice_task_updated(task_id)
+
+        for task_id in self.task_deadlines.pop_expired(cur_time):
+            if task_id not in self.tasks or self.tasks_states[task_id].status not in self.activeStatus:
+                continue
+            logger.info("Task {} dies".format(task_id))
+            self.tasks[task_id].task_stats = TaskStatus.timeout
+            self.tasks_states[task_id].status = TaskStatus.timeout
+            self.notice_task_updated(task_id)
+
+        if time.time() - self.last_stragglers_check >= self.STRAGGLERS_CHECK_INTERVAL:
+            self.update_stragglers()
         return nodes_with_timeouts
 
+    def update_stragglers(self):
+        """ Look for subtasks of active tasks that should be duplicated on other nodes """
+        self.last_stragglers_check = time.time()
+        for task_id, ts in self.tasks_states.iteritems():
+            if ts.status in self.activeStatus:
+                self.speculations[task_id].find_stragglers(self.tasks[task_id], ts.subtask_states,
+                                                           self.last_stragglers_check)
+
+    @handle_subtask_key_error
+    def is_subtask_cancelled(self, subtask_id):
+        """ Return True if the subtask was cancelled because a result of its copy was accepted """
+        task_id = self.subtask2task_mapping[subtask_id]
+        return self.tasks_states[task_id].subtask_states[subtask_id].subtask_status == SubtaskStatus.cancelled
+
+    @handle_task_key_error
+    def get_speculation_policy(self, task_id):
+        return self.speculations[task_id].policy
+
+    @handle_task_key_error
+    def set_speculation_policy(self, task_id, policy):
+        self.speculations[task_id].policy = policy
+
+    @handle_task_key_error
+    def get_speculation_stats(self, task_id):
+        return self.speculations[task_id].stats
+
     def get_progresses(self):
         tasks_progresses = {}
 
@@ -383,6 +583,8 @@ class TaskManager(TaskEventListener):
         for ss in self.tasks_states[task_id].subtask_states.values():
             if ss.subtask_status != SubtaskStatus.failure:
                 ss.subtask_status = SubtaskStatus.restarted
+        self.speculations[task_id] = TaskSpeculation(self.speculations[task_id].policy)
+        self.__index_deadlines(task_id)
 
         self.notice_task_updated(task_id)
 
@@ -418,6 +620,7 @@ class TaskManager(TaskEventListener):
     def resume_task(self, task_id):
         self.tasks[task_id].task_status = TaskStatus.starting
         self.tasks_states[task_id].status = TaskStatus.starting
+        self.__index_deadlines(task_id)
 
         self.notice_task_updated(task_id)
 
@@ -425,11 +628,14 @@ class TaskManager(TaskEventListener):
     def delete_task(self, task_id):
         for sub in self.tasks_states[task_id].subtask_states.values():
             del self.subtask2task_mapping[sub.subtask_id]
+            self.subtask_deadlines.remove(sub.subtask_id)
+        self.task_deadlines.remove(task_id)
         self.tasks_states[task_id].subtask_states.clear()
 
         self.tasks[task_id].unregister_listener(self)
         del self.tasks[task_id]
         del self.tasks_states[task_id]
+        self.speculations.pop(task_id, None)
 
         self.dir_manager.clear_temporary(task_id)
 
@@ -468,6 +674,7 @@ class TaskManager(TaskEventListener):
     def change_timeouts(self, task_id, full_task_timeout, subtask_timeout):
         task = self.tasks[task_id]
         task.header.deadline = timeout_to_deadline(full_task_timeout)
+        self.task_deadlines.push(task_id, task.header.deadline)
         task.header.subtask_timeout = subtask_timeout
         task.full_task_timeout = full_task_timeout
         task.header.last_checking = time.time()
@@ -562,6 +769,7 @@ class TaskManager(TaskEventListener):
             ss.computer.price = price
             ss.time_started = time.time()
             ss.deadline = ctd.deadline
+            self.subtask_deadlines.push(ctd.subtask_id, ctd.deadline)
             # TODO: read node ip address
             ss.subtask_definition = ctd.short_description
             ss.subtask_id = ctd.subtask_id
@@ -589,11 +797,58 @@ class TaskManager(TaskEventListener):
             return False
         return True
 
-    def __has_subtasks(self, task_state, task, max_resource_size, max_memory_size):
+    def __index_deadlines(self, task_id):
+        """ Index deadlines of a task and of its starting subtasks again, ie. after the task was paused """
+        self.task_deadlines.push(task_id, self.tasks[task_id].header.deadline)
+        for ss in self.tasks_states[task_id].subtask_states.values():
+            if ss.subtask_status == SubtaskStatus.starting:
+                self.subtask_deadlines.push(ss.subtask_id, ss.deadline)
+
+    def __get_straggler(self, task_id, node_id):
+        """ Return id of a subtask that should be duplicated on the given node, None if there's no such
+        subtask. A node never gets two copies of the same subtask. """
+        spec = self.speculations[task_id]
+        subtask_states = self.tasks_states[task_id].subtask_states
+        for original in spec.stragglers:
+            nodes = [subtask_states[s].computer.node_id for s in spec.get_group(original)]
+            if node_id not in nodes:
+                return original
+        return None
+
+    def __subtask_failed(self, task_id, subtask_id):
+        """ Tell the task that the subtask failed. If another copy of it is still computed, the subtask
+        doesn't have to be given again, so it is only cancelled. """
+        subtask_states = self.tasks_states[task_id].subtask_states
+        for copy_id in self.speculations[task_id].get_group(subtask_id):
+            if copy_id != subtask_id and subtask_states[copy_id].subtask_status == SubtaskStatus.starting:
+                self.tasks[task_id].computation_cancelled(subtask_id)
+                return
+        self.tasks[task_id].computation_failed(subtask_id)
+
+    def __cancel_copies(self, task_id, subtask_id):
+        """ Cancel other copies of an accepted subtask. Their results won't be verified nor paid for. """
+        spec = self.speculations[task_id]
+        group = spec.get_group(subtask_id)
+        for copy_id in group:
+            ss = self.tasks_states[task_id].subtask_states[copy_id]
+            if copy_id == subtask_id or ss.subtask_status != SubtaskStatus.starting:
+                continue
+            logger.info("Subtask {} cancelled, result of {} accepted".format(copy_id, subtask_id))
+            ss.subtask_status = SubtaskStatus.cancelled
+            ss.subtask_rem_time = 0.0
+            ss.stderr = "[GOLEM] Cancelled, result of {} accepted".format(subtask_id)
+            self.tasks[task_id].computation_cancelled(copy_id)
+            spec.stats.cancelled += 1
+            if spec.is_duplicate(copy_id):
+                spec.stats.lost += 1
+        if spec.is_duplicate(subtask_id):
+            spec.stats.won += 1
+        if group[0] in spec.stragglers:
+            spec.stragglers.remove(group[0])
+
+    def __can_compute(self, task_state, task, max_resource_size, max_memory_size):
         if task_state.status not in self.activeStatus:
             return False
-        if not task.needs_computation():
-            return False
         if task.header.resource_size > (long(max_resource_size) * 1024):
             return False
         if task.header.estimated_memory > (long(max_memory_size) * 1024):
@@ -0,0 +1,135 @@
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TTL = 3600  # seconds
+RESOURCES_CHECK_INTERVAL = 60  # seconds
+
+
+class TaskSelector(object):
+    """ Scores task headers, so that a provider asks for tasks it's likely to compute in time, for requesters
+    that pay well and accept results. The score is a weighted sum of:
+     - price: how much the max price offered exceeds the provider's min price (0 to 1),
+     - trust: requesting trust of the task owner (-1 to 1),
+     - time: part of subtask timeout left after the estimated computation time (0 to 1),
+     - resources: 1 if resources of the task are already stored by this node, 0 otherwise.
+    Tasks that are estimated to take longer than their subtask timeout, or whose owners are less trusted than
+    min_trust, aren't scored at all. Computation times expire after history_ttl, so such tasks and
+    environments are tried again later (eg. the node may be less loaded, or timeouts may have been caused by
+    a slow requester).
+    """
+
+    def __init__(self, get_trust, has_resources, min_price=0, min_trust=-1.0, price_weight=1.0,
+                 trust_weight=1.0, time_weight=1.0, resources_weight=0.5, history_size=20,
+                 history_ttl=HISTORY_TTL, resources_check_interval=RESOURCES_CHECK_INTERVAL):
+        """
+        :param func get_trust: returns requesting trust of a node with given key id
+        :param func has_resources: returns True if resources of a task with given id are stored by this node
+        :param int min_price: minimal price this node accepts
+        :param float min_trust: minimal requesting trust of a task owner
+        :param int history_size: number of computation times remembered for each task and environment
+        :param float history_ttl: how long (in seconds) computation times are remembered
+        :param float resources_check_interval: how long (in seconds) the result of has_resources is used
+                                               before the task's resources are looked up again
+        """
+        self.get_trust = get_trust
+        self.has_resources = has_resources
+        self.min_price = min_price
+        self.min_trust = min_trust
+        self.price_weight = price_weight
+        self.trust_weight = trust_weight
+        self.time_weight = time_weight
+        self.resources_weight = resources_weight
+        self.history_size = history_size
+        self.history_ttl = history_ttl
+        self.resources_check_interval = resources_check_interval
+
+        # task id -> (time, computation time) of its subtasks computed on this node
+        self.task_times = {}
+        # environment id -> (time, computation time / subtask timeout) of subtasks
+        self.environment_ratios = {}
+        # task id -> (time, whether resources are stored) of the last has_resources call
+        self.task_resources = {}
+
+    def change_config(self, config_desc):
+        self.min_price = config_desc.min_price
+        self.min_trust = config_desc.requesting_trust
+
+    def subtask_computed(self, header, computation_time):
+        """ Remember how long it took to compute a subtask of a task described with given header. Subtasks
+        that timed out should be reported with their timeout.
+        :param TaskHeader header:
+        :param float computation_time: in seconds
+        """
+        now = time.time()
+        times = self.task_times.setdefault(header.task_id, deque(maxlen=self.history_size))
+        times.append((now, computation_time))
+        if header.subtask_timeout > 0:
+            ratios = self.environment_ratios.setdefault(header.environment, deque(maxlen=self.history_size))
+            ratios.append((now, computation_time / float(header.subtask_timeout)))
+
+    def forget_task(self, task_id):
+        self.task_times.pop(task_id, None)
+        self.task_resources.pop(task_id, None)
+
+    def estimate_time_ratio(self, header):
+        """ Estimate computation time of a subtask as a part of its timeout. Computation times of subtasks of
+        the same task are used if there are any, otherwise the median ratio for the task's environment.
+        :param TaskHeader header:
+        :return float|None: None if there's no data to estimate the time
+        """
+        if header.subtask_timeout <= 0:
+            return None
+        times = self.__recent(self.task_times, header.task_id)
+        if times:
+            return sum(times) / len(times) / float(header.subtask_timeout)
+        ratios = self.__recent(self.environment_ratios, header.environment)
+        if ratios:
+            return sorted(ratios)[len(ratios) // 2]
+        return None
+
+    def score(self, header):
+        """ Return a score of a task (higher is better) or None if this node shouldn't ask for it
+        :param TaskHeader header:
+        :return float|None:
+        """
+        time_ratio = self.estimate_time_ratio(header)
+        if time_ratio is not None and time_ratio >= 1.0:
+            logger.debug("Task {} is too slow to compute on this node".format(header.task_id))
+            return None
+        trust = self.get_trust(header.task_owner_key_id)
+        if trust < self.min_trust:
+            return None
+
+        if header.max_price > 0:
+            price_score = max(0.0, 1.0 - self.min_price / float(header.max_price))
+        else:
+            price_score = 0.0
+        time_score = 0.5 if time_ratio is None else 1.0 - time_ratio
+        resources_score = 1.0 if self.__has_resources(header.task_id) else 0.0
+
+        return (self.price_weight * price_score + self.trust_weight * trust + self.time_weight * time_score +
+                self.resources_weight * resources_score)
+
+    def __has_resources(self, task_id):
+        """ has_resources looks into the file system, its results are reused for resources_check_interval """
+        now = time.time()
+        checked = self.task_resources.get(task_id)
+        if checked is None or now - checked[0] >= self.resources_check_interval:
+            checked = now, bool(self.has_resources(task_id))
+            self.task_resources[task_id] = checked
+        return checked[1]
+
+    def __recent(self, history, key):
+        """ Drop expired entries of history[key] and return values of the remaining ones """
+        entries = history.get(key)
+        if not entries:
+            return []
+        deadline = time.time() - self.history_ttl
+        while entries and entries[0][0] < deadline:
+            entries.popleft()
+        if not entries:
+            del history[key]
+        return [value for _, value in entries]
@@ -4,11 +4,13 @@ import time
 from collections import deque
 
 from golem.network.transport.network import ProtocolFactory, SessionFactory
+from golem.network.transport.sessionpool import SessionPool
 from golem.network.transport.tcpnetwork import TCPNetwork, TCPConnectInfo, SocketAddress, MidAndFilesProtocol
 from golem.network.transport.tcpserver import PendingConnectionsServer, PenConnStatus
 from golem.ranking.ranking import RankingStats
 from golem.task.taskbase import TaskHeader
 from golem.task.taskconnectionshelper import TaskConnectionsHelper
+from golem.task.taskselector import TaskSelector
 from taskcomputer import TaskComputer
 from taskkeeper import TaskHeaderKeeper
 from taskmanager import TaskManager
@@ -27,15 +29,23 @@ class TaskServer(PendingConnectionsServer):
 
         self.node = node
         self.task_keeper = TaskHeaderKeeper(client.environments_manager, min_price=config_desc.min_price)
+        use_distributed_resources = config_desc.use_distributed_resource_management
         self.task_manager = TaskManager(config_desc.node_name, self.node, self.keys_auth,
                                         root_path=TaskServer.__get_task_manager_root(client.datadir),
-                                        use_distributed_resources=config_desc.use_distributed_resource_management)
+                                        use_distributed_resources=use_distributed_resources,
+                                        verification_workers=config_desc.verification_workers,
+                                        verification_queue_size=config_desc.verification_queue_size)
         self.task_computer = TaskComputer(config_desc.node_name, task_server=self,
                                           use_docker_machine_manager=use_docker_machine_manager)
+        self.task_selector = TaskSelector(client.get_requesting_trust, self.__has_task_resources,
+                                          min_price=config_desc.min_price,
+                                          min_trust=config_desc.requesting_trust)
         self.task_connections_helper = TaskConnectionsHelper()
         self.task_connections_helper.task_server = self
         self.task_sessions = {}
         self.task_sessions_incoming = WeakList()
+        self.session_pool = SessionPool(max_sessions_per_peer=config_desc.max_task_sessions_per_peer,
+                                        idle_timeout=config_desc.task_session_idle_timeout)
 
         self.max_trust = 1.0
         self.min_trust = 0.0
@@ -68,13 +78,15 @@ class TaskServer(PendingConnectionsServer):
         self.task_computer.run()
         self.task_connections_helper.sync()
         self._sync_forwarded_session_requests()
+        self._sync_session_pool()
         self.__remove_old_tasks()
         # self.__remove_old_sessions()
         self._remove_old_listenings()
 
-    # This method chooses random task from the network to compute on our machine
+    # This method chooses a task from the network to compute in one of the free compute slots on our machine.
+    # Task computer calls it for every free slot, so many subtasks may be requested at once
     def request_task(self):
-        theader = self.task_keeper.get_task()
+        theader = self.task_keeper.get_task(self.task_selector.score)
         if theader is not None:
             try:
                 trust = self.client.get_requesting_trust(theader.task_owner_key_id)
@@ -94,8 +106,8 @@ class TaskServer(PendingConnectionsServer):
                         'estimated_performance': performance,
                         'price': self.config_desc.min_price,
                         'max_resource_size': self.config_desc.max_resource_size,
-                        'max_memory_size': self.config_desc.max_memory_size,
-                        'num_cores': self.config_desc.num_cores
+                        'max_memory_size': self.task_computer.slot_max_memory_size,
+                        'num_cores': self.task_computer.slot_num_cores
                     }
                     self._add_pending_request(TaskConnTypes.TaskRequest, theader.task_owner, theader.task_owner_port,
                                               theader.task_owner_key_id, args)
@@ -126,6 +138,7 @@ class TaskServer(PendingConnectionsServer):
             assert False
 
         self.client.increase_trust(owner_key_id, RankingStats.requested)
+        self.__subtask_computed(task_id, computing_time)
 
         if subtask_id not in self.results_to_send:
             value = self.task_manager.comp_task_keeper.get_value(task_id, computing_time)
@@ -146,32 +159,86 @@ class TaskServer(PendingConnectionsServer):
 
     def send_task_failed(self, subtask_id, task_id, err_msg, owner_address, owner_port, owner_key_id, owner, node_name):
         self.client.decrease_trust(owner_key_id, RankingStats.requested)
+        if "Task timed out" in err_msg:
+            # This node is too slow for this task
+            self.__subtask_computed(task_id, None)
         if subtask_id not in self.failures_to_send:
             self.failures_to_send[subtask_id] = WaitingTaskFailure(task_id, subtask_id, err_msg,
                                                                    owner_address, owner_port, owner_key_id, owner)
 
+    def send_subtask_progress(self, subtask_id, progress):
+        """ Report progress of subtask computation to the task owner. Progress is only sent through an already
+        open session, there's no point in connecting just to send it.
+        :return bool: True if the progress was sent
+        """
+        session = self.task_sessions.get(subtask_id)
+        if session is None:
+            return False
+        session.send_subtask_progress(subtask_id, progress)
+        return True
+
     def new_connection(self, session):
         self.task_sessions_incoming.append(session)
 
-    def get_tasks_headers(self):
-        ths = self.task_keeper.get_all_tasks() + self.task_manager.get_tasks_headers()
+    def get_tasks_headers(self, since=None):
+        """ Return dictionary representations of known task headers and headers of this node's tasks
+        :param int|None since: return only headers that changed after this version of the list (see
+                               get_tasks_version), all of them if None
+        :return list:
+        """
+        if since is None:
+            ths = self.task_keeper.get_all_tasks() + self.task_manager.get_tasks_headers()
+            return [th.to_dict() for th in ths]
+
+        versions = self.task_keeper.header_versions
+        own_headers = {th.task_id: th for th in self.task_manager.get_tasks_headers()}
+        for task_id, th in own_headers.iteritems():
+            versions.update(task_id, th.signature)
+
+        ths = []
+        for task_id in versions.changed_since(since):
+            th = own_headers.get(task_id) or self.task_keeper.task_headers.get(task_id)
+            if th is not None:
+                ths.append(th)
         return [th.to_dict() for th in ths]
 
-    def add_task_header(self, th_dict_repr):
+    def get_tasks_version(self):
+        """ Return current version of the task header list """
+        return self.task_keeper.header_versions.version
+
+    def get_tasks_resync_version(self):
+        """ Return number that changes each time full task header lists should be requested from peers,
+        because headers that have been dropped may be accepted again """
+        return self.task_keeper.resync_version
+
+    def add_task_headers(self, th_dict_reprs):
+        """ Add many task headers at once. Signatures of all headers are verified in a single batch. Headers
+        that are already known with the same signature wouldn't change anything, so they aren't verified
+        again.
+        :param list th_dict_reprs: task headers dictionary representations
+        :return list: for each header True if it was in a right format, False otherwise
+        """
+        known = [self.__is_header_known(th) for th in th_dict_reprs]
+        sigs_valid = iter(self.verify_header_sigs([th for th, k in zip(th_dict_reprs, known) if not k]))
+        return [True if k else self.add_task_header(th, next(sigs_valid))
+                for th, k in zip(th_dict_reprs, known)]
+
+    def add_task_header(self, th_dict_repr, sig_valid=None):
         try:
-            if not self.verify_header_sig(th_dict_repr):
+            if sig_valid is None:
+                sig_valid = self.verify_header_sig(th_dict_repr)
+            if not sig_valid:
                 raise Exception("Invalid signature")
 
             task_id = th_dict_repr["task_id"]
             key_id = th_dict_repr["task_owner_key_id"]
-            task_ids = self.task_manager.tasks.keys()
             new_sig = True
 
             if task_id in self.task_keeper.task_headers:
                 header = self.task_keeper.task_headers[task_id]
                 new_sig = th_dict_repr["signature"] != header.signature
 
-            if task_id not in task_ids and key_id != self.node.key and new_sig:
+            if task_id not in self.task_manager.tasks and key_id != self.node.key and new_sig:
                 self.task_keeper.add_task_header(th_dict_repr)
 
             return True
@@ -185,8 +252,29 @@ class TaskServer(PendingConnectionsServer):
         _key = th_dict_repr["task_owner_key_id"]
         return self.verify_sig(_sig, _bin, _key)
 
+    def verify_header_sigs(self, th_dict_reprs):
+        """ Verify signatures of many task headers in a single batch. Malformed headers are invalid and aren't
+        verified at all.
+        :param list th_dict_reprs: task headers dictionary representations
+        :return list: for each header True if its signature is valid, False otherwise
+        """
+        items = []
+        well_formed = []
+        for th_dict_repr in th_dict_reprs:
+            try:
+                items.append((th_dict_repr["signature"], TaskHeader.dict_to_binary(th_dict_repr),
+                              th_dict_repr["task_owner_key_id"]))
+                well_formed.append(True)
+            except Exception as err:
+                logger.error("Wrong task header received {}".format(err))
+                well_formed.append(False)
+        sigs_valid = iter(self.keys_auth.verify_batch(items))
+        return [ok and next(sigs_valid) for ok in well_formed]
+
     def remove_task_header(self, task_id):
         self.task_keeper.remove_task_header(task_id)
+        self.task_selector.forget_task(task_id)
+        self.task_computer.forget_task_resources(task_id)
 
     def add_task_session(self, subtask_id, session):
         self.task_sessions[subtask_id] = session
@@ -194,11 +282,27 @@ class TaskServer(PendingConnectionsServer):
     def remove_task_session(self, task_session):
         self.remove_pending_conn(task_session.conn_id)
         self.remove_responses(task_session.conn_id)
+        self.session_pool.remove(task_session)
 
         for tsk in self.task_sessions.keys():
             if self.task_sessions[tsk] == task_session:
                 del self.task_sessions[tsk]
 
+    def task_session_verified(self, session):
+        """ Keep a verified session open for all task traffic with its node and send requests that have been
+        waiting for it
+        :param TaskSession session:
+        """
+        if session.is_middleman or not session.key_id:
+            return
+        if not self.session_pool.add(session.key_id, session):
+            return
+        for req_type, _, _, args in self.session_pool.pop_waiting(session.key_id):
+            self.conn_established_for_type[req_type](session, session.conn_id, **args)
+
+    def is_session_pooled(self, session):
+        return session in self.session_pool
+
     def set_last_message(self, type_, t, msg, address, port):
         if len(self.last_messages) >= 5:
             self.last_messages = self.last_messages[-4:]
@@ -231,6 +335,9 @@ class TaskServer(PendingConnectionsServer):
     def verify_sig(self, sig, data, public_key):
         return self.keys_auth.verify(sig, data, public_key)
 
+    def get_shared_secret(self, public_key):
+        return self.keys_auth.get_shared_secret(public_key)
+
     def get_resource_addr(self):
         return self.client.node.prv_addr
 
@@ -259,6 +366,9 @@ class TaskServer(PendingConnectionsServer):
                                         config_desc.use_distributed_resource_management)
         self.task_computer.change_config(config_desc, run_benchmarks=run_benchmarks)
         self.task_keeper.change_config(config_desc)
+        self.task_selector.change_config(config_desc)
+        self.session_pool.change_config(config_desc.max_task_sessions_per_peer,
+                                        config_desc.task_session_idle_timeout)
 
     def change_timeouts(self, task_id, full_task_timeout, subtask_timeout):
         self.task_manager.change_timeouts(task_id, full_task_timeout, subtask_timeout)
@@ -293,6 +403,11 @@ class TaskServer(PendingConnectionsServer):
         logger.debug("Subtask {} result accepted".format(subtask_id))
         self.task_result_sent(subtask_id)
 
+    def subtask_not_needed(self, subtask_id, reason):
+        """ Requester won't take the result, but not because of its quality, so trust isn't changed """
+        logger.info("Subtask {} result is not needed: {}".format(subtask_id, reason))
+        self.task_result_sent(subtask_id)
+
     def subtask_failure(self, subtask_id, err):
         logger.info("Computation for task {} failed: {}.".format(subtask_id, err))
         node_id = self.task_manager.get_node_id_for_subtask(subtask_id)
@@ -409,6 +524,7 @@ class TaskServer(PendingConnectionsServer):
 
     def quit(self):
         self.task_computer.quit()
+        self.task_manager.quit()
 
     def receive_subtask_computation_time(self, subtask_id, computation_time):
         self.task_manager.set_computation_time(subtask_id, computation_time)
@@ -432,6 +548,35 @@ class TaskServer(PendingConnectionsServer):
     def remove_forwarded_session_request(self, key_id):
         return self.forwarded_session_requests.pop(key_id, None)
 
+    def _add_pending_request(self, req_type, task_owner, port, key_id, args):
+        """ Send requests through an open session with the node if there's one. Otherwise connect, unless the
+        node already has as many connections as allowed - then the request waits for one of them. """
+        if req_type in TaskConnTypes.pooled and self.session_pool.max_sessions_per_peer > 0:
+            session = self.session_pool.get(key_id)
+            if session is not None:
+                self.conn_established_for_type[req_type](session, session.conn_id, **args)
+                return
+            if not self.session_pool.can_connect(key_id, self.__count_connecting(key_id)):
+                self.get_socket_addresses(task_owner, port, key_id)  # fail early if the node can't be reached
+                self.session_pool.wait(key_id, (req_type, task_owner, port, args))
+                return
+        PendingConnectionsServer._add_pending_request(self, req_type, task_owner, port, key_id, args)
+
+    def _sync_session_pool(self):
+        for session in self.session_pool.remove_idle(time.time()):
+            session.disconnect(TaskSession.DCRTimeout)
+
+        # requests whose connections have failed or were closed in the meantime
+        for key_id in self.session_pool.get_waiting_peers():
+            if self.session_pool.get(key_id) is not None:
+                waiting = self.session_pool.pop_waiting(key_id)
+            elif self.session_pool.can_connect(key_id, self.__count_connecting(key_id)):
+                waiting = self.session_pool.pop_waiting(key_id, 1)
+            else:
+                continue
+            for req_type, task_owner, port, args in waiting:
+                self._add_pending_request(req_type, task_owner, port, key_id, args)
+
     def _sync_forwarded_session_requests(self):
         now = time.time()
         for key_id, data in self.forwarded_session_requests.items():
@@ -475,6 +620,34 @@ class TaskServer(PendingConnectionsServer):
 
         self.__connection_for_nat_punch_failure(listen_id, super_node, asking_node, dest_node, ask_conn_id)
 
+    def __count_connecting(self, key_id):
+        """ Count connections with a node that haven't been added to the session pool yet """
+        pooled_ids = [session.conn_id for session in self.session_pool.sessions.get(key_id, [])]
+        return sum(1 for pc in self.pending_connections.itervalues()
+                   if pc.type in TaskConnTypes.pooled and pc.args.get('key_id') == key_id and
+                   pc.id not in pooled_ids)
+
+    def __is_header_known(self, th_dict_repr):
+        try:
+            header = self.task_keeper.task_headers.get(th_dict_repr["task_id"])
+            return header is not None and header.signature == th_dict_repr["signature"]
+        except (KeyError, TypeError):
+            return False
+
+    def __has_task_resources(self, task_id):
+        dir_manager = self.task_computer.dir_manager
+        return dir_manager is not None and dir_manager.has_task_resources(task_id)
+
+    def __subtask_computed(self, task_id, computing_time):
+        """ Remember computation time of a subtask for task selection. None means the computation timed
+        out. """
+        task = self.task_manager.comp_task_keeper.active_tasks.get(task_id)
+        if task is None:
+            return
+        if computing_time is None:
+            computing_time = task.header.subtask_timeout
+        self.task_selector.subtask_computed(task.header, computing_time)
+
     #############################
     #   CONNECTION REACTIONS    #
     #############################
@@ -489,6 +662,9 @@ class TaskServer(PendingConnectionsServer):
         self.task_sessions[task_id] = session
         session.send_hello()
         session.request_task(node_name, task_id, estimated_performance, price, max_resource_size, max_memory_size, num_cores)
+        if self.task_computer.prefetch_resources(task_id):
+            resource_header = self.task_computer.resource_manager.get_resource_header(task_id)
+            session.request_resource(task_id, resource_header)
 
     def __connection_for_task_request_failure(self, conn_id, node_name, key_id, task_id, estimated_performance, price,
                                               max_resource_size, max_memory_size, num_cores, *args):
@@ -737,13 +913,12 @@ class TaskServer(PendingConnectionsServer):
 
     def __connection_for_task_failure_final_failure(self, conn_id, key_id, subtask_id, err_msg):
         logger.warning("Cannot connect to task {} owner".format(subtask_id))
-        self.task_computer.session_timeout()
+        # the subtask has already left its slot, no slot waits for this connection
         self.remove_pending_conn(conn_id)
         self.remove_responses(conn_id)
 
     def __connection_for_start_session_final_failure(self, conn_id, key_id, node_info, super_node_info, ans_conn_id):
         logger.warning("Impossible to start session with {}".format(node_info))
-        self.task_computer.session_timeout()
         self.remove_pending_conn(conn_id)
         self.remove_responses(conn_id)
         self.remove_pending_conn(ans_conn_id)
@@ -758,7 +933,9 @@ class TaskServer(PendingConnectionsServer):
     # SYNC METHODS
     #############################
     def __remove_old_tasks(self):
-        self.task_keeper.remove_old_tasks()
+        for task_id in self.task_keeper.remove_old_tasks():
+            self.task_selector.forget_task(task_id)
+            self.task_computer.forget_task_resources(task_id)
         nodes_with_timeouts = self.task_manager.check_timeouts()
         for node_id in nodes_with_timeouts:
             self.client.decrease_trust(node_id, RankingStats.computed)
@@ -770,8 +947,10 @@ class TaskServer(PendingConnectionsServer):
             if cur_time - session.last_message_time > self.last_message_time_threshold:
                 sessions_to_remove.append(subtask_id)
         for subtask_id in sessions_to_remove:
-            if self.task_sessions[subtask_id].task_computer is not None:
-                self.task_sessions[subtask_id].task_computer.session_timeout()
+            session = self.task_sessions[subtask_id]
+            if session.task_computer is not None:
+                for task_id in session.requested_task_ids():
+                    session.task_computer.session_timeout(task_id)
             self.task_sessions[subtask_id].dropped()
 
     def __send_waiting_results(self):
@@ -901,6 +1080,9 @@ class TaskConnTypes(object):
     Middleman = 8
     NatPunch = 9
 
+    # connections for these requests are shared by all task traffic with a node
+    pooled = [TaskRequest, ResourceRequest, ResultRejected, TaskResult, TaskFailure]
+
 
 class TaskListenTypes(object):
     StartSession = 1
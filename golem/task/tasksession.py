@@ -3,15 +3,18 @@ import logging
 import os
 import struct
 import time
+from collections import deque
 
 from golem.core.common import HandleAttributeError
+from golem.core.sessioncipher import SessionCipher, SessionCipherError
 from golem.network.transport.message import MessageHello, MessageRandVal, MessageWantToComputeTask, \
     MessageTaskToCompute, MessageCannotAssignTask, MessageGetResource, MessageResource, MessageReportComputedTask, \
     MessageGetTaskResult, MessageSubtaskResultAccepted, MessageSubtaskResultRejected, \
     MessageDeltaParts, MessageResourceFormat, MessageAcceptResourceFormat, MessageTaskFailure, \
     MessageStartSessionResponse, MessageMiddleman, MessageMiddlemanReady, MessageBeingMiddlemanAccepted, \
     MessageMiddlemanAccepted, MessageJoinMiddlemanConn, MessageNatPunch, MessageWaitForNatTraverse, \
-    MessageResourceList, MessageTaskResultHash, MessageWaitingForResults, MessageCannotComputeTask
+    MessageResourceList, MessageTaskResultHash, MessageWaitingForResults, MessageCannotComputeTask, \
+    MessageSubtaskProgress, MessageSubtaskResultNotNeeded
 from golem.network.transport.session import MiddlemanSafeSession
 from golem.network.transport.tcpnetwork import MidAndFilesProtocol, EncryptFileProducer, DecryptFileConsumer, \
     EncryptDataProducer, DecryptDataConsumer, SocketAddress
@@ -23,7 +26,8 @@ from golem.transactions.ethereum.ethereumpaymentskeeper import EthAccountInfo
 logger = logging.getLogger(__name__)
 
 
-TASK_PROTOCOL_ID = 8
+TASK_PROTOCOL_ID = 9
+SESSION_ENCRYPTION_STR = u"SESSION_ENCRYPTION"
 
 
 def drop_after_attr_error(*args, **kwargs):
@@ -33,7 +37,7 @@ def drop_after_attr_error(*args, **kwargs):
 
 def call_task_computer_and_drop_after_attr_error(*args, **kwargs):
     logger.warning("Attribute error occur")
-    args[0].task_computer.session_closed()
+    args[0].task_computer.session_closed(args[0].task_id)
     args[0].dropped()
 
 
@@ -61,10 +65,17 @@ class TaskSession(MiddlemanSafeSession):
 
         self.msgs_to_send = []  # messages waiting to be send (because connection hasn't been verified yet)
 
+        # Pooled session carries many interactions at once. Answers to these requests come in the same order.
+        self.task_requests = deque()  # ids of tasks requested in this session
+        self.resource_requests = deque()  # ids of tasks whose resources were requested in this session
+        self.verifying = 0  # number of received results that are being verified
+
         # self.last_resource_msg = None  # last message about resource
 
         self.result_owner = None  # information about user that should be rewarded (or punished) for the result
 
+        self.session_cipher = None  # symmetric cipher agreed with the peer during the handshake
+
         self.__set_msg_interpretations()
 
     ########################
@@ -87,15 +98,29 @@ class TaskSession(MiddlemanSafeSession):
         if self.task_server:
             self.task_server.remove_task_session(self)
 
+    def release(self):
+        """ Current interaction is finished. Pooled session is kept open for other interactions with the same
+        node, other sessions are closed. """
+        if self.task_server and self.task_server.is_session_pooled(self):
+            return
+        self.dropped()
+
+    def is_busy(self):
+        """ Return True if the session shouldn't be closed even if it's idle """
+        return self.verifying > 0 or self.conn.stream_mode or self.conn.producer is not None
+
     #######################
     # SafeSession methods #
     #######################
 
     def encrypt(self, data):
-        """ Encrypt given data using key_id from this connection
+        """ Encrypt given data using key_id from this connection. If the connection has been verified and both
+        sides agreed on a session key, symmetric encryption is used instead.
         :param str data: data to be encrypted
         :return str: encrypted data or unchanged message (if server doesn't exist)
         """
+        if self.session_cipher and self.verified:
+            return self.session_cipher.encrypt(data)
         if self.task_server:
             return self.task_server.encrypt(data, self.key_id)
         logger.warning("Can't encrypt message - no task server")
@@ -107,6 +132,13 @@ class TaskSession(MiddlemanSafeSession):
         :param str data: data to be decrypted
         :return str|None: decrypted data
         """
+        if self.session_cipher and SessionCipher.is_encrypted(data):
+            try:
+                return self.session_cipher.decrypt(data)
+            except SessionCipherError as err:
+                logger.warning("Fail to decrypt message {}".format(err))
+                self.dropped()
+                return None
         if self.task_server is None:
             logger.warning("Can't decrypt data - no task server")
             return data
@@ -165,7 +197,8 @@ class TaskSession(MiddlemanSafeSession):
         if data_type == "resource":
             self.resource_received(extra_data)
         elif data_type == "result":
-            self.result_received(extra_data)
+            # chunks of the stream have already been decrypted
+            self.result_received(extra_data, decrypt=False)
         else:
             logger.error("Unknown data type {}".format(data_type))
             self.conn.producer = None
@@ -217,16 +250,35 @@ class TaskSession(MiddlemanSafeSession):
                 self.dropped()
                 return
 
-        if subtask_id:
-            self.task_manager.computed_task_received(subtask_id, result, result_type)
+        if not subtask_id:
+            logger.error("No task_id value in extra_data for received data ")
+            self.dropped()
+            return
+
+        def verified(_):
             if self.task_manager.verify_subtask(subtask_id):
                 self.task_server.accept_result(subtask_id, self.result_owner)
                 self.send(MessageSubtaskResultAccepted(subtask_id))
+            elif self.task_manager.is_subtask_cancelled(subtask_id):
+                # Another copy was faster, the provider shouldn't lose trust for that
+                self.send(MessageSubtaskResultNotNeeded(subtask_id, "Subtask cancelled"))
             else:
                 self._reject_subtask_result(subtask_id)
-        else:
-            logger.error("No task_id value in extra_data for received data ")
-        self.dropped()
+
+        def verification_failed(failure):
+            logger.error("Can't verify result for subtask {}: {}".format(subtask_id,
+                                                                         failure.getErrorMessage()))
+            self._reject_subtask_result(subtask_id)
+
+        def verification_finished(_):
+            self.verifying -= 1
+            self.release()
+
+        # Verification runs outside of the reactor thread, the session is released when it's done
+        self.verifying += 1
+        d = self.task_manager.verify_computed_task(subtask_id, result, result_type)
+        d.addCallbacks(verified, verification_failed)
+        d.addBoth(verification_finished)
 
     def _reject_subtask_result(self, subtask_id):
         self.task_server.reject_result(subtask_id, self.result_owner)
@@ -243,6 +295,7 @@ class TaskSession(MiddlemanSafeSession):
         :param int num_cores: how many cpu cores this node can offer
         :return:
         """
+        self.task_requests.append(task_id)
         self.send(MessageWantToComputeTask(node_name, task_id, performance_index, price,
                                            max_resource_size, max_memory_size, num_cores))
 
@@ -253,6 +306,7 @@ class TaskSession(MiddlemanSafeSession):
         :param ResourceHeader resource_header: description of resources that current node has
         :return:
         """
+        self.resource_requests.append(task_id)
         self.send(MessageGetResource(task_id, pickle.dumps(resource_header)))
 
     # TODO address, port and eth_account should be in node_info (or shouldn't be here at all)
@@ -285,6 +339,13 @@ class TaskSession(MiddlemanSafeSession):
         """
         self.send(MessageTaskFailure(subtask_id, err_msg))
 
+    def send_subtask_progress(self, subtask_id, progress):
+        """ Inform task owner how much of the subtask is already computed
+        :param str subtask_id:
+        :param float progress: computed part of the subtask (between 0 and 1)
+        """
+        self.send(MessageSubtaskProgress(subtask_id, progress))
+
     def send_result_rejected(self, subtask_id):
         """ Inform that result don't pass verification
         :param str subtask_id: subtask that has wrong result
@@ -299,11 +360,17 @@ class TaskSession(MiddlemanSafeSession):
         self.send(MessageSubtaskResultAccepted(subtask_id, reward))
 
     def send_hello(self):
-        """ Send first hello message, that should begin the communication """
+        """ Send first hello message, that should begin the communication. Verified (eg. pooled) session
+        doesn't need another handshake. """
+        if self.verified:
+            return
+        use_encryption = self.task_server.config_desc.use_session_encryption
+        metadata = {SESSION_ENCRYPTION_STR: True} if use_encryption else None
         self.send(
             MessageHello(
                 client_key_id=self.task_server.get_key_id(),
                 rand_val=self.rand_val,
+                metadata=metadata,
                 proto_id=TASK_PROTOCOL_ID
             ),
             send_unverified=True
@@ -360,27 +427,30 @@ class TaskSession(MiddlemanSafeSession):
 
         if wrong_task:
             self.send(MessageCannotAssignTask(msg.task_id, "Not my task  {}".format(msg.task_id)))
-            self.dropped()
+            self.release()
         elif ctd:
             self.send(MessageTaskToCompute(ctd))
         elif wait:
             self.send(MessageWaitingForResults())
         else:
             self.send(MessageCannotAssignTask(msg.task_id, "No more subtasks in {}".format(msg.task_id)))
-            self.dropped()
+            self.release()
 
     @handle_attr_error_with_task_computer
     def _react_to_task_to_compute(self, msg):
+        task_id = self.__answer_task_request()
         if self._check_ctd_params(msg.ctd) and self.task_manager.comp_task_keeper.receive_subtask(msg.ctd):
             self.task_server.add_task_session(msg.ctd.subtask_id, self)
             self.task_computer.task_given(msg.ctd)
         else:
             self.send(MessageCannotComputeTask(msg.ctd.subtask_id))
-            self.task_computer.session_closed()
-            self.dropped()
+            self.task_computer.session_closed(task_id)
+            self.release()
 
     def _react_to_waiting_for_results(self, _):
-        self.task_computer.session_closed()
+        self.task_computer.session_closed(self.__answer_task_request())
+        if self.task_server.is_session_pooled(self):
+            return
         if not self.msgs_to_send:
             self.disconnect(self.DCRNoMoreMessages)
 
@@ -388,15 +458,26 @@ class TaskSession(MiddlemanSafeSession):
         if self.task_manager.get_node_id_for_subtask(msg.subtask_id) == self.key_id:
             self.task_manager.task_computation_failure(msg.subtask_id,
                                                        'Task computation rejected: {}'.format(msg.reason))
-        self.dropped()
+        self.release()
 
     def _react_to_cannot_assign_task(self, msg):
+        self.__answer_task_request()
         self.task_computer.task_request_rejected(msg.task_id, msg.reason)
         self.task_server.remove_task_header(msg.task_id)
-        self.task_computer.session_closed()
-        self.dropped()
+        self.task_computer.session_closed(msg.task_id)
+        self.release()
+
+    def _react_to_subtask_progress(self, msg):
+        if self.task_manager.get_node_id_for_subtask(msg.subtask_id) == self.key_id:
+            self.task_manager.set_subtask_progress(msg.subtask_id, msg.progress)
 
     def _react_to_report_computed_task(self, msg):
+        if self.task_manager.is_subtask_cancelled(msg.subtask_id):
+            # Result of another copy of this subtask was accepted, this one won't be paid for
+            logger.info("Subtask {} was cancelled, result is not needed".format(msg.subtask_id))
+            self.send(MessageSubtaskResultNotNeeded(msg.subtask_id, "Subtask cancelled"))
+            self.release()
+            return
         if msg.subtask_id in self.task_manager.subtask2task_mapping:
             self.task_server.receive_subtask_computation_time(msg.subtask_id, msg.computation_time)
             delay = self.task_manager.accept_results_delay(self.task_manager.subtask2task_mapping[msg.subtask_id])
@@ -404,7 +485,7 @@ class TaskSession(MiddlemanSafeSession):
                                                msg.eth_account)
             self.send(MessageGetTaskResult(msg.subtask_id, delay))
         else:
-            self.dropped()
+            self.release()
 
     def _react_to_get_task_result(self, msg):
         res = self.task_server.get_waiting_task_result(msg.subtask_id)
@@ -418,7 +499,7 @@ class TaskSession(MiddlemanSafeSession):
             res.last_sending_trial = time.time()
             res.delay_time = msg.delay
             res.already_sending = False
-            self.dropped()
+            self.release()
 
     def _react_to_task_result_hash(self, msg):
         secret = msg.secret
@@ -450,7 +531,7 @@ class TaskSession(MiddlemanSafeSession):
             self.task_server.reject_result(subtask_id, self.result_owner)
             self.task_manager.task_computation_failure(subtask_id,
                                                        'Error downloading task result')
-            self.dropped()
+            self.release()
 
         self.task_manager.task_result_incoming(subtask_id)
         self.task_manager.task_result_manager.pull_package(multihash, task_id, subtask_id,
@@ -481,19 +562,24 @@ class TaskSession(MiddlemanSafeSession):
 
     def _react_to_subtask_result_accepted(self, msg):
         self.task_server.subtask_accepted(msg.subtask_id, msg.reward)
-        self.dropped()
+        self.release()
 
     def _react_to_subtask_result_rejected(self, msg):
         self.task_server.subtask_rejected(msg.subtask_id)
-        self.dropped()
+        self.release()
+
+    def _react_to_subtask_result_not_needed(self, msg):
+        self.task_server.subtask_not_needed(msg.subtask_id, msg.reason)
+        self.release()
 
     def _react_to_task_failure(self, msg):
         self.task_server.subtask_failure(msg.subtask_id, msg.err)
-        self.dropped()
+        self.release()
 
     def _react_to_delta_parts(self, msg):
-        self.task_computer.wait_for_resources(self.task_id, msg.delta_header)
-        self.task_server.pull_resources(self.task_id, msg.parts)
+        task_id = self.__answer_resource_request()
+        if self.task_computer.wait_for_resources(task_id, msg.delta_header):
+            self.task_server.pull_resources(task_id, msg.parts)
         self.task_server.add_resource_peer(msg.node_name, msg.addr, msg.port, self.key_id, msg.node_info)
 
     def _react_to_resource_list(self, msg):
@@ -501,9 +587,10 @@ class TaskSession(MiddlemanSafeSession):
         resources = resource_manager.join_split_resources(msg.resources)
         client_options = msg.options
 
-        self.task_computer.wait_for_resources(self.task_id, resources)
-        self.task_server.pull_resources(self.task_id, resources,
-                                        client_options=client_options)
+        task_id = self.__answer_resource_request()
+        if self.task_computer.wait_for_resources(task_id, resources):
+            self.task_server.pull_resources(task_id, resources,
+                                            client_options=client_options)
 
     def _react_to_resource_format(self, msg):
         if not msg.use_distributed_resource:
@@ -533,6 +620,8 @@ class TaskSession(MiddlemanSafeSession):
             self.disconnect(TaskSession.DCRProtocolVersion)
             return
 
+        self.__init_session_cipher(msg)
+
         if send_hello:
             self.send_hello()
         self.send(MessageRandVal(msg.rand_val), send_unverified=True)
@@ -544,6 +633,7 @@ class TaskSession(MiddlemanSafeSession):
             for msg in self.msgs_to_send:
                 self.send(msg)
             self.msgs_to_send = []
+            self.task_server.task_session_verified(self)
         else:
             self.disconnect(TaskSession.DCRUnverified)
 
@@ -568,6 +658,7 @@ class TaskSession(MiddlemanSafeSession):
 
     def _react_to_being_middleman_accepted(self, msg):
         self.key_id = self.asking_node_key_id
+        self.session_cipher = None
 
     def _react_to_middleman_accepted(self, msg):
         self.send(MessageMiddlemanReady())
@@ -594,6 +685,19 @@ class TaskSession(MiddlemanSafeSession):
         # print "Task Session Sending to {}:{}: {}".format(self.address, self.port, msg)
         self.task_server.set_last_message("->", time.localtime(), msg, self.address, self.port)
 
+    def requested_task_ids(self):
+        """ Return ids of tasks requested in this session that haven't been answered yet """
+        return list(self.task_requests)
+
+    def __answer_task_request(self):
+        """ Return id of the oldest task requested in this session that hasn't been answered yet """
+        return self.task_requests.popleft() if self.task_requests else self.task_id
+
+    def __answer_resource_request(self):
+        """ Return id of the oldest task whose resources were requested in this session and haven't been
+        listed yet """
+        return self.resource_requests.popleft() if self.resource_requests else self.task_id
+
     def _check_ctd_params(self, ctd):
         if not isinstance(ctd, ComputeTaskDef) or ctd.key_id != self.key_id or ctd.task_owner.key != self.key_id:
             return False
@@ -640,7 +744,7 @@ class TaskSession(MiddlemanSafeSession):
     def __send_data_results(self, res):
         result = pickle.dumps(res.result)
         extra_data = {"subtask_id": res.subtask_id, "data_type": "result"}
-        self.conn.producer = EncryptDataProducer(self.encrypt(result), self, extra_data=extra_data)
+        self.conn.producer = EncryptDataProducer(result, self, extra_data=extra_data)
 
     def __send_files_results(self, res):
         extra_data = {"subtask_id": res.subtask_id}
@@ -694,6 +798,20 @@ class TaskSession(MiddlemanSafeSession):
         self.conn.stream_mode = True
         self.subtask_id = msg.subtask_id
 
+    def __init_session_cipher(self, hello):
+        """ Derive a symmetric session key if both sides support it. The key is used for sending only after
+        the connection is verified, ie. when the peer has already received our hello and derived the same
+        key. """
+        metadata = hello.metadata if isinstance(hello.metadata, dict) else {}
+        if not (self.task_server.config_desc.use_session_encryption and metadata.get(SESSION_ENCRYPTION_STR)):
+            return
+        shared_secret = self.task_server.get_shared_secret(self.key_id)
+        if shared_secret is None:
+            logger.warning("Can't derive session key, using public key encryption")
+            return
+        self.session_cipher = SessionCipher(shared_secret, self.task_server.get_key_id(), self.key_id,
+                                            self.rand_val, hello.rand_val)
+
     def __set_msg_interpretations(self):
         self._interpretation.update({
             MessageWantToComputeTask.Type: self._react_to_want_to_compute_task,
@@ -709,6 +827,7 @@ class TaskSession(MiddlemanSafeSession):
             MessageResourceList.Type: self._react_to_resource_list,
             MessageSubtaskResultAccepted.Type: self._react_to_subtask_result_accepted,
             MessageSubtaskResultRejected.Type: self._react_to_subtask_result_rejected,
+            MessageSubtaskResultNotNeeded.Type: self._react_to_subtask_result_not_needed,
             MessageTaskFailure.Type: self._react_to_task_failure,
             MessageDeltaParts.Type: self._react_to_delta_parts,
             MessageResourceFormat.Type: self._react_to_resource_format,
@@ -723,6 +842,7 @@ class TaskSession(MiddlemanSafeSession):
             MessageNatPunch.Type: self._react_to_nat_punch,
             MessageWaitForNatTraverse.Type: self._react_to_wait_for_nat_traverse,
             MessageWaitingForResults.Type: self._react_to_waiting_for_results,
+            MessageSubtaskProgress.Type: self._react_to_subtask_progress,
         })
 
         # self.can_be_not_encrypted.append(MessageHello.Type)
@@ -44,6 +44,7 @@ class SubtaskState(object):
         self.deadline = 0
         self.extra_data = {}
         self.subtask_rem_time = 0
+        self.last_progress_time = 0  # when the computing node last reported progress
         self.subtask_status = ""
         self.value = 0
         self.stdout = ""
@@ -73,3 +74,4 @@ class SubtaskStatus(object):
     finished = "Finished"
     failure = "Failure"
     restarted = "Restart"
+    cancelled = "Cancelled"
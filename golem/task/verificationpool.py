@@ -0,0 +1,118 @@
+import logging
+from collections import deque, defaultdict
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+MAX_VERIFICATIONS_PER_TASK = 1
+
+
+class VerificationQueueFull(Exception):
+    pass
+
+
+class VerificationPool(object):
+    """ Runs blocking result verification (eg. rendering of reference images) outside of the reactor thread.
+
+    Verifications are executed by a bounded pool of worker threads. At most max_per_task verifications of the
+    same task run at once, the others wait in a queue in submission order. If the queue already holds
+    max_queue_size verifications, new ones are refused with VerificationQueueFull.
+    All bookkeeping is done in the reactor thread; only the verification function runs in a worker thread.
+    """
+
+    def __init__(self, max_workers=2, max_queue_size=100, max_per_task=MAX_VERIFICATIONS_PER_TASK):
+        """
+        :param int max_workers: number of worker threads
+        :param int max_queue_size: how many verifications may wait for a worker
+        :param int max_per_task: how many verifications of one task may run concurrently
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max_queue_size
+        self.max_per_task = max(1, max_per_task)
+        self.pending = deque()
+        self.running = {}
+        self.num_running = 0
+        self._thread_pool = None
+        self._dispatching = False
+        self._redispatch = False
+
+    def submit(self, task_id, fn, *args, **kwargs):
+        """ Schedule fn(*args, **kwargs) to be run in a worker thread
+        :param str task_id: task that the verification belongs to
+        :return Deferred: fired with the result of fn or failed with the exception it has raised;
+        fails with VerificationQueueFull if there's no room in the queue
+        """
+        if len(self.pending) >= self.max_queue_size:
+            return defer.fail(VerificationQueueFull("Verification queue is full ({} waiting)"
+                                                    .format(len(self.pending))))
+        deferred = defer.Deferred()
+        self.pending.append((task_id, fn, args, kwargs, deferred))
+        self._dispatch()
+        return deferred
+
+    def get_queue_size(self):
+        return len(self.pending)
+
+    def stop(self):
+        """ Stop worker threads. Verifications that didn't start are failed with CancelledError """
+        pending, self.pending = self.pending, deque()
+        for _, _, _, _, deferred in pending:
+            deferred.errback(defer.CancelledError())
+        if self._thread_pool is not None:
+            self._thread_pool.stop()
+            self._thread_pool = None
+
+    def _dispatch(self):
+        # Verifications may finish synchronously, don't reenter the loop in that case
+        if self._dispatching:
+            self._redispatch = True
+            return
+        self._dispatching = True
+        try:
+            self._redispatch = True
+            while self._redispatch:
+                self._redispatch = False
+                for item in self._take_startable():
+                    self._start(*item)
+        finally:
+            self._dispatching = False
+
+    def _take_startable(self):
+        startable = []
+        waiting = deque()
+        free_workers = self.max_workers - self.num_running
+        scheduled = defaultdict(int)
+        for item in self.pending:
+            task_id = item[0]
+            running = self.running.get(task_id, 0) + scheduled[task_id]
+            if len(startable) < free_workers and running < self.max_per_task:
+                scheduled[task_id] += 1
+                startable.append(item)
+            else:
+                waiting.append(item)
+        self.pending = waiting
+        return startable
+
+    def _start(self, task_id, fn, args, kwargs, deferred):
+        self.running[task_id] = self.running.get(task_id, 0) + 1
+        self.num_running += 1
+
+        def finished(result):
+            self.num_running -= 1
+            self.running[task_id] -= 1
+            if self.running[task_id] <= 0:
+                del self.running[task_id]
+            self._dispatch()
+            return result
+
+        d = self._run_in_thread(fn, *args, **kwargs)
+        d.addBoth(finished)
+        d.chainDeferred(deferred)
+
+    def _run_in_thread(self, fn, *args, **kwargs):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPool(minthreads=0, maxthreads=self.max_workers, name="VerificationPool")
+            self._thread_pool.start()
+        return threads.deferToThreadPool(reactor, self._thread_pool, fn, *args, **kwargs)
@@ -0,0 +1,78 @@
+""" Measure end-to-end latency of short Docker subtasks (prepare, start, wait, collect logs and clean up)
+run in a new container each time (DockerJob) and in warm containers from ContainerPool (PooledDockerJob).
+Requires a running Docker daemon and the golem/base image. """
+import os
+import shutil
+import tempfile
+import time
+
+import click
+
+from golem.docker.container_pool import ContainerPool, PooledDockerJob
+from golem.docker.image import DockerImage
+from golem.docker.job import DockerJob
+
+TASK_SCRIPT = "import time\ntime.sleep(duration)\nopen('/golem/output/result.txt', 'w').write('done')\n"
+
+
+def run_subtask(job_factory, root_dir, index, duration):
+    subtask_dir = os.path.join(root_dir, "subtask{}".format(index))
+    dirs = [os.path.join(subtask_dir, name) for name in ["work", "output"]]
+    for directory in dirs:
+        os.makedirs(directory)
+
+    start = time.time()
+    with job_factory(TASK_SCRIPT, {"duration": duration}, dirs[0], dirs[1]) as job:
+        log_files = os.path.join(dirs[1], "stdout.log"), os.path.join(dirs[1], "stderr.log")
+        job.start()
+        job.stream_logs(*log_files)
+        exit_code = job.wait()
+        job.dump_logs(*log_files)
+    latency = time.time() - start
+
+    if exit_code != 0 or not os.path.exists(os.path.join(dirs[1], "result.txt")):
+        raise RuntimeError("Subtask {} failed with exit code {}".format(index, exit_code))
+    return latency
+
+
+def print_stats(label, latencies):
+    latencies = sorted(latencies)
+    print "{:12} {:10.3f} {:10.3f} {:10.3f} {:10.3f}".format(label, sum(latencies) / len(latencies),
+                                                           latencies[len(latencies) / 2], latencies[0],
+                                                           latencies[-1])
+
+
+@click.command()
+@click.option("--subtasks", "-n", default=20, help="Number of subtasks run one after another")
+@click.option("--duration", "-d", default=0.5, help="Computation time of a single subtask [s]")
+@click.option("--image", default="golem/base", help="Docker image to use")
+def run_benchmark(subtasks, duration, image):
+    image = DockerImage(image)
+    if not image.is_available():
+        raise click.ClickException("Docker image {} is not available".format(image.name))
+
+    root_dir = tempfile.mkdtemp()
+    resources_dir = os.path.join(root_dir, "resources")
+    os.makedirs(resources_dir)
+    pool = ContainerPool(os.path.join(root_dir, "containers"))
+
+    def new_container_job(script, params, work_dir, output_dir):
+        return DockerJob(image, script, params, resources_dir, work_dir, output_dir)
+
+    def pooled_job(script, params, work_dir, output_dir):
+        return PooledDockerJob(pool, image, script, params, resources_dir, work_dir, output_dir)
+
+    try:
+        print "{} subtasks, {:.2f} s of computation each".format(subtasks, duration)
+        print "{:12} {:>10} {:>10} {:>10} {:>10}".format("latency [s]", "mean", "median", "min", "max")
+        for label, job_factory in [("new", new_container_job), ("pooled", pooled_job)]:
+            latencies = [run_subtask(job_factory, os.path.join(root_dir, label), i, duration)
+                         for i in range(subtasks)]
+            print_stats(label, latencies)
+    finally:
+        pool.quit()
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,101 @@
+""" Compare the cost of result verification primitives from gnr.task.imgrepr (MSE / PSNR check of PNG and EXR
+images and EXR blending) with the previous per pixel implementation, for 1080p and 4K frames. """
+import os
+import random
+import timeit
+
+import click
+from mock import Mock
+from PIL import Image
+
+from gnr.task import imgrepr
+from gnr.task.imgrepr import PILImgRepr, EXRImgRepr, blend
+
+RESOLUTIONS = {"1080p": (1920, 1080), "4K": (3840, 2160)}
+
+compare_imgs = getattr(imgrepr, "__compare_imgs")
+
+
+def per_pixel_mse(img1, img2):
+    (res_x, res_y) = img1.get_size()
+    mse = 0
+    for i in range(0, res_x):
+        for j in range(0, res_y):
+            [r1, g1, b1] = img1.get_pixel((i, j))
+            [r2, g2, b2] = img2.get_pixel((i, j))
+            mse += (r1 - r2) * (r1 - r2) + (g1 - g2) * (g1 - g2) + (b1 - b2) * (b1 - b2)
+    mse /= res_x * res_y * 3
+    return mse
+
+
+def per_pixel_blend(img1, img2, alpha):
+    (res_x, res_y) = img1.get_size()
+    img = EXRImgRepr.__new__(EXRImgRepr)
+    img.__dict__.update(img1.__dict__)
+    img.rgb = [c.copy() for c in img1.rgb]
+    for x in range(0, res_x):
+        for y in range(0, res_y):
+            p1 = img1.get_pixel((x, y))
+            p2 = img2.get_pixel((x, y))
+            img.set_pixel((x, y), map(lambda a, b: a * (1 - alpha) + b * alpha, p1, p2))
+    return img
+
+
+def pil_img(size, seed):
+    img = PILImgRepr()
+    num_bytes = size[0] * size[1] * 3
+    img.img = Image.frombytes("RGB", size, os.urandom(num_bytes) if seed else '\x80' * num_bytes)
+    return img
+
+
+def exr_img(size, seed):
+    rand = random.Random(seed)
+    img = EXRImgRepr()
+    img.dw = Mock()
+    img.dw.min.x, img.dw.min.y = 0, 0
+    img.dw.max.x, img.dw.max.y = size[0] - 1, size[1] - 1
+    # noise in a few rows is enough, the cost doesn't depend on pixel values
+    img.rgb = []
+    for _ in "RGB":
+        channel = Image.new("F", size, 0.5)
+        for x in xrange(size[0]):
+            channel.putpixel((x, rand.randrange(size[1])), rand.random())
+        img.rgb.append(channel)
+    return img
+
+
+def measure(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+@click.command()
+@click.option("--resolution", "-r", multiple=True, type=click.Choice(sorted(RESOLUTIONS)),
+              help="Resolutions to test (default: all)")
+@click.option("--repeat", default=3, help="Number of measurements per operation (best one is shown)")
+@click.option("--per-pixel/--no-per-pixel", default=True, help="Also measure the per pixel implementation")
+def run_benchmark(resolution, repeat, per_pixel):
+    print "{:24} {:>14} {:>14} {:>10}".format("operation [s]", "per pixel", "whole image", "speedup")
+    for name in resolution or sorted(RESOLUTIONS):
+        size = RESOLUTIONS[name]
+        cases = [("PNG compare", pil_img(size, 1), pil_img(size, 0), 255),
+                 ("EXR compare", exr_img(size, 1), exr_img(size, 2), 1)]
+        for label, img1, img2, max_col in cases:
+            new = measure(lambda: compare_imgs(img1, img2, max_col), repeat)
+            old = measure(lambda: per_pixel_mse(img1, img2), 1) if per_pixel else None
+            print_row("{} {}".format(label, name), old, new)
+
+        img1, img2 = cases[1][1], cases[1][2]
+        new = measure(lambda: blend(img1, img2, 0.3), repeat)
+        old = measure(lambda: per_pixel_blend(img1, img2, 0.3), 1) if per_pixel else None
+        print_row("EXR blend {}".format(name), old, new)
+
+
+def print_row(label, old, new):
+    if old is None:
+        print "{:24} {:>14} {:14.3f} {:>10}".format(label, "-", new, "-")
+    else:
+        print "{:24} {:14.3f} {:14.3f} {:9.0f}x".format(label, old, new, old / new)
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,86 @@
+""" Compare the cost of computing message short hashes (used for signing and verification) with the
+sorted-copy approach and with the canonical single-pass encoder, for every registered message type. """
+import collections
+import timeit
+
+import click
+
+from golem.core.simplehash import SimpleHash
+from golem.core.simpleserializer import CBORSerializer
+from golem.network.transport.message import init_messages, Message, MessagePeers, MessageTasks, \
+    MessageResourcePeers
+
+
+def sorted_repr(v):
+    def sort_dict(dictionary, filter_properties=False):
+        return sorted((k, sorted_repr(_v)) for k, _v in dictionary.iteritems()
+                      if not (filter_properties and (k.startswith('_') or callable(_v))))
+    if isinstance(v, dict):
+        return sort_dict(v)
+    elif hasattr(v, '__dict__'):
+        return sort_dict(v.__dict__, filter_properties=True)
+    elif isinstance(v, basestring):
+        return v
+    elif isinstance(v, collections.Iterable):
+        return v.__class__([sorted_repr(_v) for _v in v])
+    return v
+
+
+def sorted_copy_hash(msg):
+    return SimpleHash.hash(CBORSerializer.dumps(sorted_repr(msg._get_hashed_data())))
+
+
+def canonical_hash(msg):
+    return SimpleHash.hash(CBORSerializer.dumps_canonical(msg._get_hashed_data()))
+
+
+def header(i):
+    return {u"task_id": u"task-{}".format(i), u"node_name": u"node", u"environment": u"BLENDER",
+            u"task_owner_address": u"10.0.0.1", u"task_owner_port": 40102, u"task_owner_key_id": "ab" * 64,
+            u"deadline": 1476000000.0 + i, u"subtask_timeout": 3600, u"max_price": 10 ** 18,
+            u"min_version": 0.3, u"docker_images": [{u"repository": u"golem/blender", u"tag": u"1.0"}]}
+
+
+def peer(i):
+    return {u"address": u"10.0.{}.{}".format(i // 256, i % 256), u"port": 40102, u"node_name": u"node",
+            u"node": {u"key": "ab" * 64, u"prv_addresses": [u"10.0.0.1", u"192.168.0.1"]}}
+
+
+def build_messages(size):
+    init_messages()
+    messages = {}
+    for msg_type, msg_cls in sorted(Message.registered_message_types.items()):
+        messages[msg_cls.__name__] = msg_cls()
+    messages["MessageTasks"] = MessageTasks([header(i) for i in xrange(size)])
+    messages["MessagePeers"] = MessagePeers([peer(i) for i in xrange(size)])
+    messages["MessageResourcePeers"] = MessageResourcePeers([peer(i) for i in xrange(size)])
+    return messages
+
+
+@click.command()
+@click.option("--size", default=100, help="Number of entries in MessageTasks / MessagePeers payloads")
+@click.option("--repeat", default=200, help="Number of hash computations per message type")
+def run_benchmark(size, repeat):
+    messages = build_messages(size)
+    totals = [0.0, 0.0, 0.0]
+    print "{:40} {:>12} {:>12} {:>12}".format("message [us per sign + verify]", "sorted copy", "canonical",
+                                              "memoized")
+    for name, msg in sorted(messages.items()):
+        assert sorted_copy_hash(msg) == canonical_hash(msg)
+
+        def memoized():
+            msg._short_hash = None
+            msg.get_short_hash()
+            msg.get_short_hash()
+
+        times = [timeit.timeit(lambda: (sorted_copy_hash(msg), sorted_copy_hash(msg)), number=repeat),
+                 timeit.timeit(lambda: (canonical_hash(msg), canonical_hash(msg)), number=repeat),
+                 timeit.timeit(memoized, number=repeat)]
+        for i, t in enumerate(times):
+            totals[i] += t
+        print "{:40} {:12.1f} {:12.1f} {:12.1f}".format(name, *[t * 10 ** 6 / repeat for t in times])
+    print "{:40} {:12.1f} {:12.1f} {:12.1f}".format("TOTAL", *[t * 10 ** 6 / repeat for t in totals])
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,52 @@
+""" Measure the cost of PeerKeeper (Kademlia routing table) operations: adding peers, finding a peer's bucket,
+refreshing a bucket and finding nearest neighbours of a key, with a large number of peers offered to the
+table. """
+import logging
+import random
+import time
+
+import click
+
+from golem.network.p2p.node import Node
+from golem.network.p2p.peerkeeper import PeerKeeper, K_SIZE
+
+
+def random_key():
+    return "{:0{}x}".format(random.getrandbits(K_SIZE), K_SIZE // 4)
+
+
+def measure(label, fn, items):
+    start = time.time()
+    for item in items:
+        fn(item)
+    elapsed = time.time() - start
+    print "{:24} {:10} {:12.2f}".format(label, len(items), elapsed * 10 ** 6 / max(len(items), 1))
+
+
+@click.command()
+@click.option("--peers", "-n", default=10000, help="Number of peers added to the routing table")
+@click.option("--lookups", default=10000, help="Number of lookups of each kind")
+@click.option("--bucket-size", "-k", default=16, help="Bucket size")
+@click.option("--seed", default=0)
+def run_benchmark(peers, lookups, bucket_size, seed):
+    logging.basicConfig(level=logging.ERROR)
+    random.seed(seed)
+    peer_keeper = PeerKeeper(random_key())
+    peer_keeper.k = bucket_size
+    nodes = [Node(key=random_key()) for _ in xrange(peers)]
+    targets = [long(random_key(), 16) for _ in xrange(lookups)]
+
+    print "{:24} {:>10} {:>12}".format("operation", "count", "us per op")
+    measure("add_peer", peer_keeper.add_peer, nodes)
+    known = [peer for bucket in peer_keeper.buckets for peer in bucket.peers]
+    print "{} buckets, {} peers kept".format(len(peer_keeper.buckets), len(known))
+    measure("add_peer (known)", peer_keeper.add_peer, [random.choice(known) for _ in xrange(lookups)])
+    measure("bucket_for_peer", peer_keeper.bucket_for_peer, targets)
+    measure("set_last_message_time", peer_keeper.set_last_message_time,
+            [random.choice(known).key for _ in xrange(lookups)])
+    measure("neighbours (alpha=3)", peer_keeper.neighbours, targets)
+    measure("neighbours (alpha=k)", lambda t: peer_keeper.neighbours(t, bucket_size), targets)
+
+
+if __name__ == "__main__":
+    run_benchmark()
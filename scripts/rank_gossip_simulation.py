@@ -0,0 +1,413 @@
+""" Simulate global rank gossip in a network of in-process nodes and measure how long it takes until every
+node has saved global ranks close to the real averages of local ranks, and how many gossip messages and bytes
+it costs.
+
+"incremental" runs Ranking itself: every node gossips only trust estimates that haven't converged, and only
+the changes of local ranks are added to them. Rounds take place every GOSSIP_INTERVAL seconds, but a node
+sends nothing while nothing changes. Every gossip epoch starts again from local ranks; nodes of the first runs
+were already running when the epoch started, so they contribute to it.
+
+"stages" reproduces the previous scheme: at every stage each node starts again from all its local ranks and
+gossips the whole working vector in MAX_STEPS rounds fixed to the ROUND_TIME, END_ROUND_TIME and BREAK_TIME
+timers, then saves every estimate.
+
+Both schemes are run twice: once from scratch and once after local ranks of some nodes changed. The second run
+checks only global ranks of nodes whose local ranks changed. Gossip messages are serialized, so the reported
+bytes are the real payload sizes.
+
+Then local ranks change again and incremental gossip runs with churn: nodes leave the network with their share
+of the gossip, return and restart without their in-memory gossip state. "recovery" runs after churn stops
+until the next epoch converges. Global ranks are checked against averages of local ranks of nodes that are
+online.
+"""
+import heapq
+import logging
+import random
+
+import click
+
+from golem.core.variables import BREAK_TIME, ROUND_TIME, END_ROUND_TIME, GOSSIP_EPOCH_LENGTH
+from golem.model import LocalRank
+from golem.network.transport.message import Message, MessageGossip, init_messages
+from golem.ranking.ranking import Ranking
+
+MAX_STEPS = 10
+
+
+class Stats(object):
+    def __init__(self):
+        self.bytes = 0
+        self.messages = 0
+        self.entries = 0
+        self.last_message_time = 0.0
+
+    def add(self, gossip, now):
+        data = MessageGossip(gossip).serialize()
+        self.bytes += len(data)
+        self.messages += 1
+        self.entries += len(gossip)
+        self.last_message_time = now
+        return Message.deserialize_message(data).gossip
+
+
+class SimReactor(object):
+    """ Runs delayed calls in the order of simulated time """
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.calls = []
+        self.counter = 0
+
+    def seconds(self):
+        return self.now
+
+    def callLater(self, delay, fn, *args, **kwargs):
+        self.counter += 1
+        heapq.heappush(self.calls, (self.now + delay, self.counter, fn, args, kwargs))
+
+    def run_until(self, end):
+        while self.calls and self.calls[0][0] <= end:
+            self.now, _, fn, args, kwargs = heapq.heappop(self.calls)
+            fn(*args, **kwargs)
+        self.now = end
+
+
+class MemoryRankingDatabase(object):
+    """ Part of BufferedRankingDatabase used by gossip rounds, keeping local ranks of a single node in
+    memory """
+
+    def __init__(self):
+        self.local_ranks = {}
+        self.changed = set()
+        self.global_ranks = {}
+        self.writes = 0
+
+    def set_local_rank(self, node_id, positive, negative):
+        self.local_ranks[node_id] = LocalRank(node_id=node_id, positive_computed=positive,
+                                              negative_computed=negative, positive_payment=positive,
+                                              negative_payment=negative)
+        self.changed.add(node_id)
+
+    def get_all_local_rank(self):
+        return self.local_ranks.values()
+
+    def get_local_ranks(self, node_ids):
+        return [self.local_ranks[node_id] for node_id in node_ids if node_id in self.local_ranks]
+
+    def pop_changed(self):
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def insert_or_update_global_rank(self, node_id, comp_trust, req_trust, comp_weight, req_weight):
+        self.global_ranks[node_id] = [comp_trust, req_trust]
+        self.writes += 1
+
+
+class SimNode(object):
+    """ Part of Client and P2PService that takes part in rank gossip """
+
+    def __init__(self, node_id, network, stats, reactor, epoch_length, db=None):
+        self.node_id = node_id
+        self.network = network
+        self.stats = stats
+        self.reactor = reactor
+        self.peers = []
+        self.inbox = []
+        self.online = True
+        self.db = db or MemoryRankingDatabase()
+        self.ranking = Ranking(self, epoch_length=epoch_length)
+        self.ranking.db = self.db
+
+    def send_gossip(self, gossip, send_to):
+        for peer_id in send_to:
+            self.network[peer_id].inbox.append(self.stats.add(gossip, self.reactor.now))
+
+    def collect_gossip(self):
+        gossip, self.inbox = self.inbox, []
+        return gossip
+
+    def get_neighbours_degree(self):
+        if not self.online:
+            return {}
+        return {peer_id: len(self.network[peer_id].peers) for peer_id in self.peers
+                if self.network[peer_id].online}
+
+    def push_local_rank(self, node_id, loc_rank):
+        pass
+
+    def global_ranks(self):
+        return self.db.global_ranks
+
+    def stop(self):
+        """ Leave the network with the gossip received in this round. Rounds of the stopped Ranking still run
+        in the reactor, so it gets an empty database.
+        """
+        self.online = False
+        self.inbox = []
+        self.ranking.db = MemoryRankingDatabase()
+
+    def restart(self):
+        """ Replace this node with a new one that has the same peers and database but no gossip state """
+        self.stop()
+        node = SimNode(self.node_id, self.network, self.stats, self.reactor, self.ranking.epoch_length,
+                       self.db)
+        node.peers = self.peers
+        self.network[self.node_id] = node
+        node.ranking.run(self.reactor)
+
+
+class StagesNode(SimNode):
+    """ Node gossiping with the previous scheme """
+
+    def __init__(self, node_id, network, stats, reactor, epoch_length):
+        super(StagesNode, self).__init__(node_id, network, stats, reactor, epoch_length)
+        self.working_vec = {}
+        self.glob_rank = {}
+
+    def start_stage(self):
+        self.working_vec = {}
+        for loc_rank in self.ranking.db.get_all_local_rank():
+            comp_trust, req_trust = local_trust(self.ranking, loc_rank)
+            self.working_vec[loc_rank.node_id] = [[comp_trust, 1.0], [req_trust, 1.0]]
+
+    def new_round(self):
+        degrees = self.get_neighbours_degree()
+        k = max(int(round(len(degrees) / (float(sum(degrees.values())) / len(degrees)))), 1)
+        gossip = [[node_id, [[v / (k + 1.0) for v in comp], [v / (k + 1.0) for v in req]]]
+                  for node_id, [comp, req] in self.working_vec.iteritems()]
+        self.send_gossip(gossip, random.sample(self.peers, k))
+        self.inbox.append(gossip)
+
+    def end_round(self):
+        self.working_vec = {}
+        for gossip_group in self.collect_gossip():
+            for node_id, [comp, req] in gossip_group:
+                prev_comp, prev_req = self.working_vec.get(node_id, [[0.0, 0.0], [0.0, 0.0]])
+                self.working_vec[node_id] = [[comp[0] + prev_comp[0], comp[1] + prev_comp[1]],
+                                             [req[0] + prev_req[0], req[1] + prev_req[1]]]
+
+    def save(self):
+        to_trust = self.ranking._Ranking__working_vec_to_trust
+        self.glob_rank = {node_id: [to_trust(comp), to_trust(req)]
+                          for node_id, [comp, req] in self.working_vec.iteritems()}
+        self.ranking.db.writes += len(self.glob_rank)
+
+    def global_ranks(self):
+        return self.glob_rank
+
+
+def local_trust(ranking, loc_rank):
+    """ Trust counted by Ranking from a local rank with only computed and payment stats """
+    count_trust = ranking._Ranking__count_trust
+    return [count_trust(loc_rank.positive_computed, loc_rank.negative_computed),
+            count_trust(loc_rank.positive_payment, loc_rank.negative_payment)]
+
+
+def build_network(node_cls, nodes, degree, rated, known, epoch_length, seed):
+    random.seed(seed)
+    stats = Stats()
+    # the first epoch starts now and nodes were running before
+    reactor = SimReactor(epoch_length)
+    network = {}
+    ids = ["node-{}".format(i) for i in xrange(nodes)]
+    for node_id in ids:
+        network[node_id] = node_cls(node_id, network, stats, reactor, epoch_length)
+        network[node_id].ranking.epoch = 0
+    for i, node_id in enumerate(ids):
+        for other_id in random.sample(ids[:i] + ids[i + 1:], degree // 2):
+            if other_id not in network[node_id].peers:
+                network[node_id].peers.append(other_id)
+                network[other_id].peers.append(node_id)
+    rated_ids = ids[:rated]
+    for node_id in ids:
+        for about_id in random.sample(rated_ids, known):
+            if about_id != node_id:
+                network[node_id].ranking.db.set_local_rank(about_id, random.random() * 100,
+                                                           random.random() * 50)
+    return network, stats, reactor
+
+
+def change_local_ranks(network, changes, seed):
+    """ Lower one local rank of randomly chosen nodes, as if a node failed to compute their subtasks
+    :return set: ids of nodes whose local ranks changed
+    """
+    random.seed(seed + 1)
+    changed = set()
+    for node in random.sample(sorted(network.values(), key=lambda n: n.node_id), changes):
+        loc_rank = random.choice(sorted(node.ranking.db.local_ranks.values(), key=lambda r: r.node_id))
+        node.ranking.db.set_local_rank(loc_rank.node_id, loc_rank.positive_computed,
+                                       loc_rank.negative_computed + 100)
+        changed.add(loc_rank.node_id)
+    return changed
+
+
+def real_ranks(network, about_ids=None):
+    """ Average local trust of rated nodes given by online nodes, all of them if about_ids is None """
+    sums = {}
+    for node in online(network):
+        for loc_rank in node.ranking.db.get_all_local_rank():
+            if about_ids is not None and loc_rank.node_id not in about_ids:
+                continue
+            trust = sums.setdefault(loc_rank.node_id, [0.0, 0.0, 0])
+            comp_trust, req_trust = local_trust(node.ranking, loc_rank)
+            trust[0] += comp_trust
+            trust[1] += req_trust
+            trust[2] += 1
+    return {node_id: [comp / num, req / num] for node_id, (comp, req, num) in sums.iteritems()}
+
+
+def error(network, real, tolerance):
+    """ Return the biggest difference between saved global ranks and real averages and the part of them that
+    are closer than tolerance. Missing global ranks count as wrong.
+    """
+    max_diff, good = 0.0, 0
+    nodes = online(network)
+    for node in nodes:
+        global_ranks = node.global_ranks()
+        for node_id, trust in real.iteritems():
+            saved = global_ranks.get(node_id)
+            diff = max(abs(saved[0] - trust[0]), abs(saved[1] - trust[1])) if saved else 2.0
+            max_diff = max(max_diff, diff)
+            good += diff <= tolerance
+    return max_diff, good / float(len(nodes) * len(real))
+
+
+def online(network):
+    return sorted((node for node in network.itervalues() if node.online), key=lambda n: n.node_id)
+
+
+def run_incremental(network, stats, reactor, tolerance, target, check_interval, max_time, about_ids=None,
+                    min_time=0):
+    """ Run Ranking gossip rounds until nodes stop sending gossip, but at least min_time
+    :return: time after which global ranks of about_ids were accurate enough, time of the last message, the
+             biggest difference between global ranks and real averages, part of global ranks within tolerance
+    """
+    real = real_ranks(network, about_ids)
+    start = reactor.now
+    stats.last_message_time = start
+    converged_at = None
+    while reactor.now - start < max_time:
+        reactor.run_until(reactor.now + check_interval)
+        max_diff, good = error(network, real, tolerance)
+        if converged_at is None and good >= target:
+            converged_at = reactor.now - start
+        if reactor.now - stats.last_message_time > 2 * check_interval and stats.last_message_time > start \
+                and reactor.now - start >= min_time:
+            break
+    return converged_at, stats.last_message_time - start, max_diff, good
+
+
+def run_churn(network, stats, reactor, tolerance, target, check_interval, duration, leaves, restarts,
+              about_ids):
+    """ Run Ranking gossip rounds for the given time. In every check interval some online nodes leave, the
+    same number of offline ones return and some online nodes restart.
+    :return: the same values as run_incremental
+    """
+    start = reactor.now
+    stats.last_message_time = start
+    converged_at = None
+    max_diff, good = None, None
+    while reactor.now - start < duration:
+        nodes = online(network)
+        offline = sorted((node for node in network.itervalues() if not node.online), key=lambda n: n.node_id)
+        for node in random.sample(offline, min(leaves, len(offline))):
+            node.restart()
+        chosen = random.sample(nodes, leaves + restarts)
+        for node in chosen[:leaves]:
+            node.stop()
+        for node in chosen[leaves:]:
+            node.restart()
+        reactor.run_until(reactor.now + check_interval)
+        max_diff, good = error(network, real_ranks(network, about_ids), tolerance)
+        if converged_at is None and good >= target:
+            converged_at = reactor.now - start
+    return converged_at, stats.last_message_time - start, max_diff, good
+
+
+def run_stage(network, tolerance, target, about_ids=None):
+    """ Run a single stage of the previous scheme
+    :return: the same values as run_incremental, the stage takes fixed time
+    """
+    for node in network.itervalues():
+        node.start_stage()
+    for _ in xrange(MAX_STEPS):
+        for node in network.itervalues():
+            node.new_round()
+        for node in network.itervalues():
+            node.end_round()
+    for node in network.itervalues():
+        node.save()
+    max_diff, good = error(network, real_ranks(network, about_ids), tolerance)
+    duration = MAX_STEPS * (ROUND_TIME + END_ROUND_TIME + BREAK_TIME)
+    return duration if good >= target else None, duration, max_diff, good
+
+
+def report(label, network, stats, converged, quiet, max_diff, good):
+    writes = reset(network)
+    print "{:22} {:>11} {:>11} {:10} {:12} {:12.1f} {:10} {:9.3f} {:8.3f}".format(
+        label, "-" if converged is None else int(converged), int(quiet), stats.messages, stats.entries,
+        stats.bytes / 1024.0, writes, max_diff, good)
+    stats.messages = stats.entries = stats.bytes = 0
+
+
+def reset(network):
+    """ Return the number of global rank writes and clear it """
+    writes = sum(node.ranking.db.writes for node in network.itervalues())
+    for node in network.itervalues():
+        node.ranking.db.writes = 0
+    return writes
+
+
+@click.command()
+@click.option("--nodes", default=1000, help="Number of nodes")
+@click.option("--degree", default=8, help="Average number of peers of a node")
+@click.option("--rated", default=100, help="Number of nodes that have local ranks at other nodes")
+@click.option("--known", default=10, help="Number of local ranks of every node")
+@click.option("--changes", default=10, help="Number of nodes whose local ranks change after the first run")
+@click.option("--tolerance", default=0.05,
+              help="Maximal difference between a global rank and the real average")
+@click.option("--target", default=0.99, help="Part of global ranks that have to be within tolerance")
+@click.option("--check-interval", default=120, help="Seconds of simulated time between accuracy checks")
+@click.option("--max-hours", default=12.0, help="Simulated time limit of an incremental run")
+@click.option("--epoch-hours", default=GOSSIP_EPOCH_LENGTH / 3600.0, help="Length of a gossip epoch")
+@click.option("--churn-hours", default=1.0, help="Simulated time of the run with churn")
+@click.option("--leaves", default=2,
+              help="Number of nodes leaving and returning to the network in a check interval")
+@click.option("--restarts", default=2, help="Number of nodes restarting in a check interval")
+@click.option("--seed", default=0)
+def run_benchmark(nodes, degree, rated, known, changes, tolerance, target, check_interval, max_hours,
+                  epoch_hours, churn_hours, leaves, restarts, seed):
+    logging.basicConfig(level=logging.ERROR)
+    init_messages()
+    print ("{} nodes, {} peers per node, {} rated nodes, {} local ranks per node, "
+           "{} nodes change local ranks".format(nodes, degree, rated, known, changes))
+    print "{:22} {:>11} {:>11} {:>10} {:>12} {:>12} {:>10} {:>9} {:>8}".format(
+        "run", "converged s", "last msg s", "messages", "entries", "kB", "db writes", "max diff", "good")
+
+    epoch_length = int(epoch_hours * 3600)
+    network, stats, reactor = build_network(SimNode, nodes, degree, rated, known, epoch_length, seed)
+    for node in network.itervalues():
+        node.ranking.run(reactor)
+    result = run_incremental(network, stats, reactor, tolerance, target, check_interval, max_hours * 3600)
+    report("incremental: start", network, stats, *result)
+    changed = change_local_ranks(network, changes, seed)
+    result = run_incremental(network, stats, reactor, tolerance, target, check_interval, max_hours * 3600,
+                             changed)
+    report("incremental: changes", network, stats, *result)
+    changed = change_local_ranks(network, changes, seed + 1)
+    result = run_churn(network, stats, reactor, tolerance, target, check_interval, churn_hours * 3600, leaves,
+                       restarts, changed)
+    report("incremental: churn", network, stats, *result)
+    next_epoch = epoch_length - reactor.now % epoch_length
+    result = run_incremental(network, stats, reactor, tolerance, target, check_interval, max_hours * 3600,
+                             min_time=next_epoch)
+    report("incremental: recovery", network, stats, *result)
+
+    network, stats, reactor = build_network(StagesNode, nodes, degree, rated, known, epoch_length, seed)
+    report("stages: start", network, stats, *run_stage(network, tolerance, target))
+    changed = change_local_ranks(network, changes, seed)
+    report("stages: changes", network, stats, *run_stage(network, tolerance, target, changed))
+
+
+if __name__ == "__main__":
+    run_benchmark()
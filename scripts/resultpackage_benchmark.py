@@ -0,0 +1,87 @@
+""" Compare throughput of result packaging: zip + separate AES pass (EncryptingPackager) versus single pass
+compression and encryption (StreamingEncryptingPackager), for multi-GB results. """
+import os
+import shutil
+import tempfile
+import time
+
+import click
+
+from golem.core.fileencrypt import FileEncryptor
+from golem.task.result.resultpackage import EncryptingPackager, StreamingEncryptingPackager
+
+MB = 1024 * 1024
+
+
+def generate_files(directory, size_mb, num_files, compressible):
+    files = []
+    per_file = max(1, size_mb / num_files)
+    for i in range(num_files):
+        file_path = os.path.join(directory, "result{}.exr".format(i))
+        with open(file_path, "wb") as f:
+            for _ in xrange(per_file):
+                block = os.urandom(MB / 2) if compressible else os.urandom(MB)
+                f.write(block + '\0' * (MB - len(block)))
+        files.append(file_path)
+    return files
+
+
+def measure(fn):
+    start = time.time()
+    fn()
+    return time.time() - start
+
+
+@click.command()
+@click.option("--size", default=2048, help="Total size of result files in MB")
+@click.option("--files", "num_files", default=4, help="Number of result files")
+@click.option("--compressible/--random", default=True, help="Half of each MB is zeros / all data is random")
+@click.option("--level", "-l", multiple=True, type=click.IntRange(0, 9),
+              help="Compression levels of the streaming packager to test "
+                   "(default: 0 and the packager's default)")
+@click.option("--tmp-dir", type=click.Path(exists=True, file_okay=False), default=None,
+              help="Directory for test files (default: system temp dir)")
+def run_benchmark(size, num_files, compressible, level, tmp_dir):
+    packagers = [("zip + encrypt", EncryptingPackager, None)]
+    for compression_level in level or sorted({0, StreamingEncryptingPackager.compression_level}):
+        packagers.append(("streaming (z{})".format(compression_level), StreamingEncryptingPackager,
+                          compression_level))
+
+    work_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        files = generate_files(work_dir, size, num_files, compressible)
+        total_mb = sum(os.path.getsize(f) for f in files) / float(MB)
+        secret = FileEncryptor.gen_secret(12, 24)
+        print "{:16} {:>12} {:>12} {:>12} {:>12}".format("packager", "package MB", "create MB/s",
+                                                         "extract MB/s", "total [s]")
+
+        for label, packager_class, compression_level in packagers:
+            package_path = os.path.join(work_dir, "package")
+            output_dir = os.path.join(work_dir, "extracted")
+            packager = packager_class(secret)
+            if compression_level is not None:
+                packager.compression_level = compression_level
+
+            try:
+                create_time = measure(lambda: packager.create(package_path, disk_files=files))
+            except Exception as err:
+                # eg. zipfile without ZIP64 extensions can't store more than 2 GB
+                print "{:16} failed: {!r}".format(label, err)
+                if os.path.exists(package_path):
+                    os.remove(package_path)
+                continue
+            package_mb = os.path.getsize(package_path) / float(MB)
+            extract_time = measure(lambda: packager.extract(package_path, output_dir=output_dir))
+
+            print "{:16} {:12.1f} {:12.1f} {:12.1f} {:12.1f}".format(label, package_mb,
+                                                                     total_mb / create_time,
+                                                                     total_mb / extract_time,
+                                                                     create_time + extract_time)
+            os.remove(package_path)
+            shutil.rmtree(output_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    run_benchmark()
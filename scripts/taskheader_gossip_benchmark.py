@@ -0,0 +1,220 @@
+""" Measure task header gossip traffic in a network of in-process nodes. Every node asks its peers for task
+headers every sync interval (as P2PService does), either for the whole list ("full", the old protocol) or only
+for headers that changed since the version it has already received ("delta"). PeerSessions exchange serialized
+messages through loopback connections, so the reported bytes are the real payload sizes.
+
+Checking a header signature takes milliseconds, so signatures aren't checked during the run. Headers that
+TaskServer would verify (the ones that aren't already known with the same signature) are counted instead and
+the verification CPU time is estimated from the measured cost of a single EllipticalKeysAuth.verify call.
+"""
+import logging
+import random
+import shutil
+import tempfile
+import time
+
+import click
+
+from golem.core.common import timeout_to_deadline
+from golem.core.keysauth import EllipticalKeysAuth
+from golem.environments.environmentsmanager import EnvironmentsManager
+from golem.network.p2p.node import Node
+from golem.network.p2p.peersession import PeerSession
+from golem.network.transport.message import Message, MessageGetTasks, init_messages
+from golem.task.taskbase import TaskHeader
+from golem.task.taskkeeper import TaskHeaderKeeper
+
+
+class Stats(object):
+    def __init__(self):
+        self.bytes = 0
+        self.messages = 0
+        self.headers = 0
+        self.verified = 0
+
+
+class Peer(object):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+
+class Transport(object):
+    def __init__(self, host, port):
+        self.peer = Peer(host, port)
+
+    def getPeer(self):
+        return self.peer
+
+
+class LoopbackConnection(object):
+    """ Serializes sent messages and passes them to the session on the other end """
+
+    def __init__(self, server, host, port, stats):
+        self.server = server
+        self.transport = Transport(host, port)
+        self.stats = stats
+        self.opened = True
+        self.other = None
+
+    def send_message(self, msg):
+        data = msg.serialize()
+        self.stats.bytes += len(data)
+        self.stats.messages += 1
+        received = Message.deserialize_message(data)
+        self.other._interpretation[received.get_type()](received)
+        return True
+
+
+class SimNode(object):
+    """ Part of P2PService and TaskServer that takes part in task header gossip """
+
+    def __init__(self, num, stats):
+        self.num = num
+        self.stats = stats
+        self.node = Node(node_name="node-{}".format(num), key="{:0128x}".format(num), prv_addr="10.0.0.1",
+                         prv_port=40103, pub_addr="1.2.3.4", pub_port=40103)
+        self.task_keeper = TaskHeaderKeeper(EnvironmentsManager())
+        self.own_headers = {}
+        self.sessions = []
+
+    def create_task(self, task_id):
+        header = TaskHeader(self.node.node_name, task_id, "1.2.3.4", 40103, self.node.key, "BLENDER",
+                            task_owner=self.node, deadline=timeout_to_deadline(3600), subtask_timeout=600,
+                            max_price=10 ** 18)
+        header.signature = "{:0130x}".format(random.getrandbits(520))
+        self.own_headers[task_id] = header
+
+    def knows(self, task_id):
+        return task_id in self.own_headers or task_id in self.task_keeper.task_headers
+
+    # TaskServer
+    def get_tasks_headers(self, since=None):
+        if since is None:
+            ths = self.task_keeper.get_all_tasks() + self.own_headers.values()
+            return [th.to_dict() for th in ths]
+        versions = self.task_keeper.header_versions
+        for task_id, th in self.own_headers.iteritems():
+            versions.update(task_id, th.signature)
+        ths = [self.own_headers.get(task_id) or self.task_keeper.task_headers.get(task_id)
+               for task_id in versions.changed_since(since)]
+        return [th.to_dict() for th in ths if th is not None]
+
+    def get_tasks_version(self):
+        return self.task_keeper.header_versions.version
+
+    def add_task_headers(self, th_dict_reprs):
+        self.stats.headers += len(th_dict_reprs)
+        for th_dict_repr in th_dict_reprs:
+            task_id = th_dict_repr["task_id"]
+            header = self.task_keeper.task_headers.get(task_id)
+            if header is not None and header.signature == th_dict_repr["signature"]:
+                continue
+            self.stats.verified += 1
+            if task_id not in self.own_headers:
+                self.task_keeper.add_task_header(th_dict_repr)
+        return [True] * len(th_dict_reprs)
+
+    # P2PService
+    def set_last_message(self, *args):
+        pass
+
+    def remove_peer(self, session):
+        pass
+
+
+def connect(node_a, node_b, stats):
+    conn_a = LoopbackConnection(node_a, "10.0.{}.{}".format(node_b.num // 256, node_b.num % 256), 40102,
+                                stats)
+    conn_b = LoopbackConnection(node_b, "10.0.{}.{}".format(node_a.num // 256, node_a.num % 256), 40102,
+                                stats)
+    session_a, session_b = PeerSession(conn_a), PeerSession(conn_b)
+    session_a.verified = session_b.verified = True
+    conn_a.other, conn_b.other = session_b, session_a
+    node_a.sessions.append(session_a)
+    node_b.sessions.append(session_b)
+
+
+def measure_verify_cost(repeat=20):
+    path = tempfile.mkdtemp()
+    try:
+        keys_auth = EllipticalKeysAuth(path)
+        node = Node(node_name="node", key=keys_auth.key_id)
+        header = TaskHeader("node", "task", "1.2.3.4", 40103, keys_auth.key_id, "BLENDER", task_owner=node)
+        data = TaskHeader.dict_to_binary(header.to_dict())
+        signature = keys_auth.sign(data)
+        start = time.clock()
+        for _ in xrange(repeat):
+            assert keys_auth.verify(signature, data, keys_auth.key_id)
+        return (time.clock() - start) / repeat
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def simulate(mode, nodes, degree, tasks, new_tasks, minutes, interval, seed):
+    random.seed(seed)
+    stats = Stats()
+    network = [SimNode(i, stats) for i in xrange(nodes)]
+    for i, node in enumerate(network):
+        for other in random.sample(network[:i] + network[i + 1:], degree // 2):
+            connect(node, other, stats)
+
+    task_ids = []
+
+    def create_task():
+        task_id = "task-{}".format(len(task_ids))
+        random.choice(network).create_task(task_id)
+        task_ids.append(task_id)
+
+    for _ in xrange(tasks):
+        create_task()
+
+    rounds = int(minutes * 60 / interval)
+    tasks_per_round = new_tasks * interval / 60.0
+    created = 0.0
+    start = time.clock()
+    for r in xrange(rounds):
+        created += tasks_per_round
+        while created >= 1:
+            create_task()
+            created -= 1
+        for node in random.sample(network, len(network)):
+            for session in node.sessions:
+                if mode == "full":
+                    session.send(MessageGetTasks())
+                else:
+                    session.send_get_tasks()
+    cpu = time.clock() - start
+
+    known = sum(1 for node in network for task_id in task_ids if node.knows(task_id))
+    return stats, cpu, known / float(len(network) * len(task_ids))
+
+
+@click.command()
+@click.option("--nodes", default=200, help="Number of nodes")
+@click.option("--degree", default=8, help="Average number of peers of a node")
+@click.option("--tasks", default=20, help="Number of tasks at the start")
+@click.option("--new-tasks", default=10, help="Number of tasks created per minute")
+@click.option("--minutes", default=1.0, help="Simulated time")
+@click.option("--interval", default=2.0, help="Seconds between task requests sent to peers")
+@click.option("--mode", type=click.Choice(["full", "delta", "both"]), default="both")
+@click.option("--seed", default=0)
+def run_benchmark(nodes, degree, tasks, new_tasks, minutes, interval, mode, seed):
+    logging.basicConfig(level=logging.ERROR)
+    init_messages()
+    verify_cost = measure_verify_cost()
+    modes = ["full", "delta"] if mode == "both" else [mode]
+
+    print "{} nodes, {} peers per node, {} tasks + {} per minute, {} s sync interval".format(
+        nodes, degree, tasks, new_tasks, interval)
+    print "{:6} {:>12} {:>10} {:>12} {:>12} {:>12} {:>12} {:>10}".format(
+        "mode", "kB/min", "msgs/min", "headers/min", "verified/min", "CPU s/min", "+verify s", "coverage")
+    for m in modes:
+        stats, cpu, coverage = simulate(m, nodes, degree, tasks, new_tasks, minutes, interval, seed)
+        print "{:6} {:12.1f} {:10.0f} {:12.0f} {:12.0f} {:12.2f} {:12.1f} {:10.3f}".format(
+            m, stats.bytes / 1024.0 / minutes, stats.messages / minutes, stats.headers / minutes,
+            stats.verified / minutes, cpu / minutes, stats.verified * verify_cost / minutes, coverage)
+
+
+if __name__ == "__main__":
+    run_benchmark()
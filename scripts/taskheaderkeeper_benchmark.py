@@ -0,0 +1,67 @@
+""" Measure the cost of TaskHeaderKeeper operations (adding and updating headers received from peers, choosing
+a task to compute, removing headers and expiring them) with a large number of known headers. """
+import logging
+import time
+from datetime import timedelta
+
+import click
+
+from golem.core.common import get_current_time
+from golem.environments.environment import Environment
+from golem.environments.environmentsmanager import EnvironmentsManager
+from golem.task.taskkeeper import TaskHeaderKeeper
+
+
+def header(i, deadline):
+    return {"task_id": "task-{}".format(i), "node_name": "node", "task_owner": "task_owner",
+            "task_owner_address": "10.0.0.1", "task_owner_port": 40102, "task_owner_key_id": "ab" * 64,
+            "environment": "DEFAULT", "deadline": deadline, "subtask_timeout": 3600, "max_price": 10}
+
+
+def measure(label, fn, items):
+    start = time.time()
+    for item in items:
+        fn(item)
+    elapsed = time.time() - start
+    print "{:24} {:10} {:12.2f}".format(label, len(items), elapsed * 10 ** 6 / max(len(items), 1))
+
+
+@click.command()
+@click.option("--headers", "-n", default=100000, help="Number of known task headers")
+@click.option("--expired", default=0.01,
+              help="Part of the headers that expire before remove_old_tasks is called")
+def run_benchmark(headers, expired):
+    logging.basicConfig(level=logging.ERROR)
+    environment = Environment()
+    environment.accept_tasks = True
+    keeper = TaskHeaderKeeper(EnvironmentsManager(), min_price=1)
+    keeper.environments_manager.add_environment(environment)
+
+    now = get_current_time()
+    num_expired = int(headers * expired)
+    deadlines = [now + timedelta(seconds=1) if i < num_expired else now + timedelta(hours=1)
+                 for i in xrange(headers)]
+    added = [header(i, deadlines[i]) for i in xrange(headers)]
+    updated = [header(i, deadlines[i] + timedelta(seconds=1)) for i in xrange(headers)]
+
+    print "{:24} {:>10} {:>12}".format("operation", "count", "us per op")
+    measure("add_task_header", keeper.add_task_header, added)
+    measure("update header", keeper.add_task_header, updated)
+    assert len(keeper.supported_tasks) == headers
+    measure("get_task", lambda _: keeper.get_task(), xrange(10000))
+    measure("remove_task_header", keeper.remove_task_header,
+            ["task-{}".format(i) for i in xrange(headers - 1000, headers)])
+
+    time.sleep(2)
+    start = time.time()
+    keeper.remove_old_tasks()
+    print "{:24} {:10} {:12.2f}".format("remove_old_tasks", num_expired,
+                                        (time.time() - start) * 10 ** 6 / max(num_expired, 1))
+    assert len(keeper.task_headers) == headers - 1000 - num_expired
+    start = time.time()
+    keeper.remove_old_tasks()
+    print "{:24} {:>10} {:12.2f}".format("remove_old_tasks (idle)", "-", (time.time() - start) * 10 ** 6)
+
+
+if __name__ == "__main__":
+    run_benchmark()
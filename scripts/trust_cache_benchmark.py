@@ -0,0 +1,88 @@
+""" Measure the cost of trust lookups made while assigning subtasks. TaskSession checks computing trust of a
+node every time it asks for a subtask and the result of every computed subtask changes the node's local rank.
+The benchmark replays such traffic against Ranking with and without the trust cache. Some of the providers are
+unknown to this node, so their trust is counted from neighbours' local ranks and global ranks.
+"""
+import logging
+import random
+import shutil
+import tempfile
+import time
+
+import click
+from mock import MagicMock
+
+from golem.model import Database
+from golem.ranking.ranking import Ranking, RankingStats, TrustCache
+
+
+class NoTrustCache(TrustCache):
+    """ Trust cache that never returns anything, so trust is always counted from the database """
+
+    def get(self, node_id, computing):
+        return None
+
+
+def prepare_ranking(providers, neighbours):
+    ranking = Ranking(MagicMock())
+    ranking.neighbours = neighbours
+    for node_id in neighbours:
+        ranking.increase_trust(node_id, RankingStats.payment, random.random() * 50)
+    for node_id in providers[:len(providers) // 2]:
+        ranking.increase_trust(node_id, RankingStats.computed, random.random() * 50)
+    for node_id in providers:
+        for neighbour_id in random.sample(neighbours, len(neighbours) // 2):
+            ranking.db.insert_or_update_neighbour_loc_rank(neighbour_id, node_id,
+                                                           (random.uniform(-1, 1), random.uniform(-1, 1)))
+        ranking.db.insert_or_update_global_rank(node_id, random.uniform(-1, 1), random.uniform(-1, 1),
+                                                1.0, 1.0)
+    ranking.flush()
+    return ranking
+
+
+def assign_subtasks(ranking, providers, requests, results_ratio, min_trust):
+    assigned = 0
+    for _ in xrange(requests):
+        node_id = random.choice(providers)
+        if ranking.get_computing_trust(node_id) >= min_trust:
+            assigned += 1
+            if random.random() < results_ratio:
+                ranking.increase_trust(node_id, RankingStats.computed, 1.0)
+    return assigned
+
+
+@click.command()
+@click.option("--providers", default=500, help="Number of nodes asking for subtasks")
+@click.option("--neighbours", default=10, help="Number of neighbours of this node")
+@click.option("--requests", default=20000, help="Number of subtask requests")
+@click.option("--results-ratio", default=0.05, help="Part of requests followed by an accepted result")
+@click.option("--min-trust", default=-1.0, help="Minimal computing trust of a provider")
+@click.option("--seed", default=0)
+def run_benchmark(providers, neighbours, requests, results_ratio, min_trust, seed):
+    logging.basicConfig(level=logging.ERROR)
+    provider_ids = ["provider-{}".format(i) for i in xrange(providers)]
+    neighbour_ids = ["neighbour-{}".format(i) for i in xrange(neighbours)]
+
+    print "{} providers, {} neighbours, {} requests, {} of them followed by a result".format(
+        providers, neighbours, requests, results_ratio)
+    print "{:10} {:>10} {:>12} {:>12}".format("cache", "assigned", "total s", "us per req")
+    for cached in (False, True):
+        path = tempfile.mkdtemp()
+        database = Database(path)
+        try:
+            random.seed(seed)
+            ranking = prepare_ranking(provider_ids, neighbour_ids)
+            if not cached:
+                ranking.trust_cache = NoTrustCache()
+            start = time.time()
+            assigned = assign_subtasks(ranking, provider_ids, requests, results_ratio, min_trust)
+            elapsed = time.time() - start
+            print "{:10} {:10} {:12.3f} {:12.1f}".format("on" if cached else "off", assigned, elapsed,
+                                                        elapsed * 10 ** 6 / requests)
+        finally:
+            database.db.close()
+            shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run_benchmark()
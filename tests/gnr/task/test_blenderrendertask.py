@@ -1,5 +1,6 @@
 import OpenEXR
 import array
+import cPickle as pickle
 import os
 import unittest
 from os import path
@@ -13,7 +14,7 @@ from gnr.task.blenderrendertask import (BlenderDefaults, BlenderRenderTaskBuilde
                                         BlenderRendererOptions, PreviewUpdater, get_task_border,
                                         generate_expected_offsets, get_task_num_from_pixels)
 from golem.resource.dirmanager import DirManager
-from golem.task.taskbase import ComputeTaskDef
+from golem.task.taskbase import ComputeTaskDef, result_types
 from golem.task.taskstate import SubtaskStatus
 from golem.testutils import TempDirFixture
 
@@ -57,6 +58,14 @@ class TestBlenderFrameTask(TempDirFixture):
         assert len(self.bt.preview_file_path) == len(self.bt.frames)
         assert len(self.bt.preview_task_file_path) == len(self.bt.frames)
 
+    def test_pickle(self):
+        updater = self.bt.preview_updaters[0]
+        updater.canvas.fill((0, 0, 1, 10), (10, 20, 30))
+        task = pickle.loads(pickle.dumps(self.bt))
+        for i, updater in enumerate(task.preview_updaters):
+            assert updater.canvas is task._get_preview_canvas(task.preview_file_path[i])
+        assert task.preview_updaters[0].canvas.img.getpixel((0, 0)) == (10, 20, 30)
+
     def test_computation_failed_or_finished(self):
         assert self.bt.total_tasks == 6
         extra_data = self.bt.query_extra_data(1000, 2, "ABC", "abc")
@@ -95,6 +104,27 @@ class TestBlenderFrameTask(TempDirFixture):
         assert len(self.bt.preview_file_path) == len(self.bt.frames)
         assert len(self.bt.preview_task_file_path) == len(self.bt.frames)
 
+    def test_verify_results(self):
+        extra_data = self.bt.query_extra_data(1000, 2, "ABC", "abc")
+        subtask_id = extra_data.ctd.subtask_id
+        file_dir = path.join(self.bt.tmp_dir, subtask_id)
+        os.makedirs(file_dir)
+        file1 = path.join(file_dir, 'result1')
+        Image.new("RGB", (self.bt.res_x, self.bt.res_y / 2)).save(file1, "PNG")
+        log = path.join(file_dir, 'stdout.log')
+        open(log, "w").close()
+
+        assert self.bt.verify_results(subtask_id, ["data"], result_types['data']) is None
+        assert self.bt.verify_results(subtask_id, [file1, log], result_types['files'])
+        Image.new("RGB", (10, 10)).save(file1, "PNG")
+        assert not self.bt.verify_results(subtask_id, [file1, log], result_types['files'])
+
+        # results verified outside of the reactor thread aren't verified again
+        self.bt._verify_imgs = None
+        self.bt.computation_finished(subtask_id, [file1], result_types['files'], verification=False)
+        assert self.bt.subtasks_given[subtask_id]['status'] == SubtaskStatus.failure
+        assert self.bt.verify_results(subtask_id, [file1], result_types['files']) is None
+
 
 class TestBlenderTask(TempDirFixture):
     def build_bt(self, res_x, res_y, total_tasks, frames=None):
@@ -350,6 +380,29 @@ class TestBlenderTask(TempDirFixture):
 
         extra_data = self.bt.query_extra_data(100000, num_cores=0, node_id='node', node_name='node')
         assert extra_data.should_wait
+
+    def test_query_speculative_extra_data(self):
+        ctd = self.bt.query_extra_data(1000, 2, "ABC", "abc").ctd
+        self.bt.result_incoming(ctd.subtask_id)
+
+        extra_data = self.bt.query_speculative_extra_data(ctd.subtask_id, 2000, 2, "DEF", "def")
+        copy = extra_data.ctd
+        assert copy.subtask_id != ctd.subtask_id
+        assert copy.extra_data['start_task'] == ctd.extra_data['start_task']
+        assert copy.extra_data['script_src'] == ctd.extra_data['script_src']
+        given = self.bt.subtasks_given[copy.subtask_id]
+        assert given['node_id'] == "DEF"
+        assert given['perf'] == 2000
+        assert 'result_incoming' not in given
+        assert self.bt.counting_nodes["DEF"].started() == 1
+
+        # the original is cancelled when the copy's result is accepted
+        self.bt.computation_cancelled(ctd.subtask_id)
+        assert self.bt.subtasks_given[ctd.subtask_id]['status'] == SubtaskStatus.cancelled
+        assert not self.bt.counting_nodes["ABC"].started()
+        assert not self.bt.counting_nodes["ABC"].finishing()
+        assert self.bt.num_failed_subtasks == 0
+        assert self.bt.query_speculative_extra_data(ctd.subtask_id, 2000, 2, "GHI", "ghi") is None
     
     def test_advanced_verification(self):
         bb = BlenderBenchmark()
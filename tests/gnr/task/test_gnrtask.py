@@ -167,6 +167,22 @@ class TestGNRTask(LogTestCase, TestDirFixture):
         self.assertEqual(task.stderr[subtask_id], "[GOLEM] Task result 58 not supported")
         self.assertEqual(task.stdout[subtask_id], "")
 
+    def test_prepare_results(self):
+        task = self._get_gnr_task()
+        files = ["file1", "file2"]
+        assert task.prepare_results("xxyyzz", files, result_types["files"]) == (files, result_types["files"])
+
+        res = [self.__compress_and_pickle_file(os.path.join(self.path, "file1"), "abc"),
+               self.__compress_and_pickle_file(os.path.join(self.path, "file2.log"), "log")]
+        prepared, result_type = task.prepare_results("xxyyzz", res, result_types["data"])
+        assert result_type == result_types["files"]
+        assert prepared == [os.path.join(task.tmp_dir, "xxyyzz", "file1"),
+                            os.path.join(task.tmp_dir, "xxyyzz", "file2.log")]
+        with open(prepared[0]) as f:
+            assert f.read() == "abc"
+        assert task.results == {}
+        assert task.stdout == {}
+
     def test_restart(self):
         task = self._get_gnr_task()
         task.num_tasks_received = 1
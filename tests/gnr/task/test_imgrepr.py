@@ -1,8 +1,38 @@
 import os
+import random
+
+from mock import Mock
 from PIL import Image
 
 from golem.testutils import TempDirFixture
-from gnr.task.imgrepr import verify_img
+from gnr.task import imgrepr
+from gnr.task.imgrepr import verify_img, compare_pil_imgs, advance_verify_img, blend, load_img, EXRImgRepr, \
+    PILImgRepr, PSNR_ACCEPTABLE_MIN
+
+# module private functions
+COUNT_MSE = getattr(imgrepr, "__count_mse")
+COMPARE_IMGS = getattr(imgrepr, "__compare_imgs")
+
+
+def reference_mse(img1, img2, start1=(0, 0), start2=(0, 0), box=None):
+    (res_x, res_y) = box or img1.get_size()
+    mse = 0
+    for i in range(res_x):
+        for j in range(res_y):
+            p1 = img1.get_pixel((start1[0] + i, start1[1] + j))
+            p2 = img2.get_pixel((start2[0] + i, start2[1] + j))
+            mse += sum((c1 - c2) * (c1 - c2) for c1, c2 in zip(p1, p2))
+    return mse / (res_x * res_y * 3)
+
+
+def make_exr_repr(channels):
+    img = EXRImgRepr()
+    width, height = channels[0].size
+    img.dw = Mock()
+    img.dw.min.x, img.dw.min.y = 0, 0
+    img.dw.max.x, img.dw.max.y = width - 1, height - 1
+    img.rgb = channels
+    return img
 
 
 class TestImgrepr(TempDirFixture):
@@ -17,3 +47,68 @@ class TestImgrepr(TempDirFixture):
             self.assertTrue(verify_img(file1, x, y + 1))
             self.assertTrue(verify_img(file1, x, y - 1))
             self.assertFalse(verify_img(file1, x + 1, y))
+
+    def _noisy_img(self, name, base, noise, size=(40, 30)):
+        rand = random.Random(name)
+        img = Image.new("RGB", size)
+        img.putdata([tuple(min(255, max(0, base + rand.randint(-noise, noise))) for _ in range(3))
+                     for _ in range(size[0] * size[1])])
+        file_ = self.temp_file_name(name)
+        img.save(file_)
+        return file_
+
+    def test_mse(self):
+        file1 = self._noisy_img("img1.png", 100, 10)
+        img1 = load_img(file1)
+        for name, noise in [("img2.png", 3), ("img3.png", 60)]:
+            img2 = load_img(self._noisy_img(name, 100, noise))
+            assert COUNT_MSE(img1, img2) == reference_mse(img1, img2)
+            assert COUNT_MSE(img1, img2, (3, 4), (5, 1), (20, 10)) == \
+                reference_mse(img1, img2, (3, 4), (5, 1), (20, 10))
+            with self.assertRaises(IndexError):
+                COUNT_MSE(img1, img2, (30, 0), (0, 0), (20, 10))
+
+    def test_compare_pil_imgs(self):
+        file1 = self._noisy_img("img1.png", 100, 2)
+        file2 = self._noisy_img("img2.png", 100, 2)
+        file3 = self._noisy_img("img3.png", 100, 80)
+        assert compare_pil_imgs(file1, file1)
+        assert compare_pil_imgs(file1, file2)
+        assert not compare_pil_imgs(file1, file3)
+        assert not compare_pil_imgs(file1, self.temp_file_name("nonexisting.png"))
+
+        assert advance_verify_img(file1, 40, 30, (10, 10), (10, 10), file2, (10, 10))
+        assert not advance_verify_img(file1, 40, 30, (10, 10), (10, 10), file3, (10, 10))
+        assert not advance_verify_img(file1, 40, 31, (10, 10), (10, 10), file2, (10, 10))
+
+    def test_psnr_threshold(self):
+        # PSNR = 20 * log10(255) - 10 * log10(MSE), so MSE 65 is the largest acceptable one
+        img1 = PILImgRepr()
+        img1.img = Image.new("RGB", (10, 10), (100, 100, 100))
+        img2 = PILImgRepr()
+        for diff, accepted in [(8, True), (9, False)]:
+            img2.img = Image.new("RGB", (10, 10), (100 + diff, 100 + diff, 100 + diff))
+            assert COMPARE_IMGS(img1, img2) == accepted
+        assert PSNR_ACCEPTABLE_MIN == 30
+
+    def test_exr_compare_and_blend(self):
+        img1 = make_exr_repr([Image.new("F", (8, 6), v) for v in [0.2, 0.4, 0.6]])
+        img2 = make_exr_repr([Image.new("F", (8, 6), v) for v in [0.3, 0.4, 1.6]])
+        img2.rgb[0].putpixel((2, 3), 0.9)
+        self.assertAlmostEqual(COUNT_MSE(img1, img2), reference_mse(img1, img2), places=5)
+
+        img = blend(img1, img2, 0.5)
+        self.assertAlmostEqual(img.get_pixel((0, 0))[0], 0.25, places=5)
+        self.assertAlmostEqual(img.get_pixel((2, 3))[0], 0.55, places=5)
+        self.assertAlmostEqual(img.get_pixel((0, 0))[1], 0.4, places=5)
+        # values are clamped to [min, max]
+        self.assertAlmostEqual(img.get_pixel((0, 0))[2], 1.0, places=5)
+        # source images are not changed
+        self.assertAlmostEqual(img1.get_pixel((0, 0))[0], 0.2, places=5)
+        assert blend(img1, make_exr_repr([Image.new("F", (4, 4))] * 3), 0.5) is None
+
+        pil1 = PILImgRepr()
+        pil1.img = Image.new("RGB", (4, 4), (0, 100, 200))
+        pil2 = PILImgRepr()
+        pil2.img = Image.new("RGB", (4, 4), (100, 100, 100))
+        assert blend(pil1, pil2, 0.5).get_pixel((1, 1)) == [50, 100, 150]
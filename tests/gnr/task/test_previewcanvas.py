@@ -0,0 +1,94 @@
+import cPickle as pickle
+from copy import deepcopy
+from os import path
+
+from mock import patch
+from PIL import Image
+
+from gnr.task.previewcanvas import PreviewCanvas, fill_rectangle
+from golem.tools.testdirfixture import TestDirFixture
+
+
+class TestPreviewCanvas(TestDirFixture):
+    def test_load(self):
+        file_path = path.join(self.path, "preview.bmp")
+        Image.new("RGB", (10, 20), (1, 2, 3)).save(file_path, "BMP")
+        assert PreviewCanvas(file_path, (10, 20)).img.getpixel((5, 5)) == (1, 2, 3)
+        # existing file of wrong size is ignored
+        canvas = PreviewCanvas(file_path, (20, 20))
+        assert canvas.size == (20, 20)
+        assert canvas.img.getpixel((5, 5)) == (0, 0, 0)
+
+    def test_flush(self):
+        file_path = path.join(self.path, "preview.bmp")
+        canvas = PreviewCanvas(file_path, (10, 10), flush_interval=10)
+        with patch("gnr.task.previewcanvas.time.time", return_value=100):
+            assert canvas.flush()
+            assert path.isfile(file_path)
+            # nothing has changed
+            assert not canvas.flush(force=True)
+
+            canvas.fill((0, 0, 10, 10), (255, 0, 0))
+            assert not canvas.flush()
+            assert Image.open(file_path).getpixel((0, 0)) == (0, 0, 0)
+            assert canvas.flush(force=True)
+            assert Image.open(file_path).getpixel((0, 0)) == (255, 0, 0)
+
+            canvas.clear()
+            assert not canvas.flush()
+        with patch("gnr.task.previewcanvas.time.time", return_value=111):
+            assert canvas.flush()
+        assert Image.open(file_path).getpixel((0, 0)) == (0, 0, 0)
+
+    def test_paste_and_add(self):
+        canvas = PreviewCanvas(None, (10, 10))
+        canvas.paste(Image.new("RGB", (10, 5), (100, 0, 0)), (0, 5))
+        canvas.add(Image.new("RGB", (10, 4), (200, 10, 0)), (0, 3))
+        assert canvas.img.getpixel((0, 0)) == (0, 0, 0)
+        assert canvas.img.getpixel((0, 4)) == (200, 10, 0)
+        assert canvas.img.getpixel((0, 5)) == (255, 10, 0)
+        assert canvas.img.getpixel((0, 7)) == (100, 0, 0)
+        # chunk exceeding the preview is clipped
+        canvas.add(Image.new("RGB", (10, 10), (0, 0, 1)), (0, 8))
+        assert canvas.img.getpixel((9, 9)) == (100, 0, 1)
+
+    def test_copy(self):
+        canvas = PreviewCanvas(None, (10, 10))
+        canvas.fill((0, 0, 5, 5), (1, 1, 1))
+        canvas_copy = deepcopy(canvas)
+        canvas_copy.clear()
+        assert canvas.img.getpixel((0, 0)) == (1, 1, 1)
+        with canvas_copy.edit() as img:
+            assert img.getpixel((0, 0)) == (0, 0, 0)
+
+
+    def test_pickle(self):
+        file_path = path.join(self.path, "preview.bmp")
+        canvas = PreviewCanvas(file_path, (10, 10))
+        canvas.fill((0, 0, 5, 5), (1, 1, 1))
+        state = canvas.__getstate__()
+        assert state['_img'] is None
+        assert Image.open(file_path).getpixel((0, 0)) == (1, 1, 1)
+        canvas_copy = pickle.loads(pickle.dumps(canvas))
+        assert canvas_copy.size == (10, 10)
+        assert canvas_copy.img.getpixel((0, 0)) == (1, 1, 1)
+
+        # preview without a file keeps its image
+        canvas = PreviewCanvas(None, (10, 10))
+        canvas.fill((0, 0, 5, 5), (1, 1, 1))
+        assert pickle.loads(pickle.dumps(canvas)).img.getpixel((0, 0)) == (1, 1, 1)
+
+
+class TestFillRectangle(TestDirFixture):
+    def test_fill(self):
+        img = Image.new("RGB", (10, 10))
+        fill_rectangle(img, (-5, 2, 3, 20), (0, 255, 0))
+        assert img.getpixel((0, 1)) == (0, 0, 0)
+        assert img.getpixel((0, 2)) == (0, 255, 0)
+        assert img.getpixel((2, 9)) == (0, 255, 0)
+        assert img.getpixel((3, 9)) == (0, 0, 0)
+
+        # empty rectangles don't change anything
+        fill_rectangle(img, (5, 5, 5, 8), (255, 0, 0))
+        fill_rectangle(img, (12, 0, 15, 10), (255, 0, 0))
+        assert sorted(img.getcolors()) == [(24, (0, 255, 0)), (76, (0, 0, 0))]
@@ -1,8 +1,11 @@
 import os
 
+from mock import patch
+from PIL import Image
+
 from golem.tools.testdirfixture import TestDirFixture
 
-from gnr.task.renderingtaskcollector import get_exr_files
+from gnr.task.renderingtaskcollector import get_exr_files, RenderingTaskCollector
 
 
 class TestRenderingTaskCollector(TestDirFixture):
@@ -14,3 +17,56 @@ class TestRenderingTaskCollector(TestDirFixture):
         os.rename(files[7], files[7] + ".EXR")
         os.rename(files[8], files[8] + ".xr")
         assert set(get_exr_files(self.path)) == {files[3] + ".exr", files[7] + ".EXR"}
+
+    @patch("gnr.task.renderingtaskcollector.open_exr_as_rgbf_images")
+    def test_collect_exr_chunks(self, open_exr):
+        chunks = {"chunk1.exr": [Image.new("F", (4, 2), v) for v in (0.1, 0.2, 0.3)],
+                  "chunk2.exr": [Image.new("F", (4, 3), v) for v in (0.4, 0.5, 2.0)],
+                  "chunk3.exr": [Image.new("F", (4, 5), v) for v in (-0.5, 0.0, 0.6)]}
+        open_exr.side_effect = lambda file_: chunks[file_]
+
+        collector = RenderingTaskCollector(paste=True, width=4, height=10)
+        for name in sorted(chunks):
+            collector.add_img_file(name)
+        assert open_exr.call_count == 3
+        # tone mapping statistics are ready before finalize
+        assert (collector.darkest, collector.lightest) == (-0.5, 2.0)
+
+        img = collector.finalize()
+        assert open_exr.call_count == 3
+        assert img.size == (4, 10)
+        assert img.getpixel((0, 0)) == (25, 51, 76)
+        assert img.getpixel((3, 4)) == (102, 127, 255)
+        assert img.getpixel((2, 9)) == (0, 0, 153)
+
+    @patch("gnr.task.renderingtaskcollector.open_exr_as_rgbf_images")
+    def test_collect_exr_unknown_size(self, open_exr):
+        open_exr.side_effect = lambda file_: [Image.new("F", (3, 2), 0.5)] * 3
+        collector = RenderingTaskCollector(paste=True, width=0, height=0)
+        for i in range(4):
+            collector.add_img_file("chunk{}.exr".format(i))
+        img = collector.finalize()
+        assert img.size == (3, 8)
+        assert img.getpixel((2, 7)) == (127, 127, 127)
+
+    @patch("gnr.task.renderingtaskcollector.open_exr_as_rgbf_images")
+    def test_collect_exr_add(self, open_exr):
+        chunks = {"chunk1.exr": [Image.new("F", (4, 4), 0.1)] * 3,
+                  "chunk2.exr": [Image.new("F", (4, 4), 0.2)] * 3,
+                  "alpha1.exr": [Image.new("F", (4, 4), 0.25)] * 3,
+                  "alpha2.exr": [Image.new("F", (4, 4), 0.5)] * 3}
+        open_exr.side_effect = lambda file_: chunks[file_]
+        collector = RenderingTaskCollector()
+        collector.add_img_file("chunk1.exr")
+        collector.add_img_file("chunk2.exr")
+        collector.add_alpha_file("alpha1.exr")
+        collector.add_alpha_file("alpha2.exr")
+        assert (collector.alpha_darkest, collector.alpha_lightest) == (0.25, 0.5)
+
+        img = collector.finalize()
+        assert open_exr.call_count == 4
+        assert img.mode == "RGBA"
+        assert img.getpixel((1, 1)) == (25 + 51, 25 + 51, 25 + 51, 63 + 127)
+
+    def test_finalize_empty(self):
+        assert RenderingTaskCollector().finalize() is None
@@ -1,7 +1,8 @@
 import logging
 import os
+from cStringIO import StringIO
 
-from golem.core.compress import compress, decompress, load, save
+from golem.core.compress import compress, decompress, load, save, CompressingWriter, DecompressingReader
 from golem.tools.testdirfixture import TestDirFixture
 
 
@@ -23,3 +24,17 @@ class TestCompress(TestDirFixture):
         save(c, file_)
         c2 = load(file_)
         self.assertEqual(text, decompress(c2))
+
+    def testStreams(self):
+        text = "".join(str(i) for i in range(10000))
+        compressed = StringIO()
+        writer = CompressingWriter(compressed)
+        for i in range(0, len(text), 1000):
+            writer.write(text[i:i + 1000])
+        writer.close()
+        self.assertEqual(decompress(compressed.getvalue()), text)
+
+        reader = DecompressingReader(StringIO(compressed.getvalue()), buffer_size=16)
+        self.assertEqual(reader.read(10), text[:10])
+        self.assertEqual(reader.read(), text[10:])
+        self.assertEqual(reader.read(10), "")
@@ -0,0 +1,75 @@
+import struct
+import unittest
+
+from golem.core.databuffer import DataBuffer, DataBufferOverflow
+
+
+class TestDataBuffer(unittest.TestCase):
+    def test_ulong(self):
+        db = DataBuffer()
+        db.append_ulong(1234)
+        db.append_ulong(0)
+        self.assertEqual(db.data_size(), 8)
+        self.assertEqual(db.peek_ulong(), 1234)
+        self.assertEqual(db.read_ulong(), 1234)
+        self.assertEqual(db.read_ulong(), 0)
+        self.assertEqual(db.data_size(), 0)
+
+    def test_strings(self):
+        db = DataBuffer()
+        db.append_string("abcdef")
+        self.assertEqual(db.peek_string(3), "abc")
+        self.assertEqual(db.read_string(2), "ab")
+        self.assertEqual(db.read_all(), "cdef")
+        self.assertEqual(db.data_size(), 0)
+        db.append_string("xyz")
+        db.clear_buffer()
+        self.assertEqual(db.read_all(), "")
+
+    def test_len_prefixed_string(self):
+        db = DataBuffer()
+        self.assertIsNone(db.read_len_prefixed_string())
+        db.append_len_prefixed_string("first")
+        db.append_len_prefixed_string("second")
+        self.assertEqual(db.read_len_prefixed_string(), "first")
+        self.assertEqual(db.read_len_prefixed_string(), "second")
+        self.assertIsNone(db.read_len_prefixed_string())
+
+    def test_partial_frames(self):
+        db = DataBuffer()
+        frames = ["frame{}".format(i) * (i + 1) for i in range(50)]
+        data = "".join(struct.pack("!L", len(f)) + f for f in frames)
+        received = []
+        for i in range(0, len(data), 7):
+            db.append_string(data[i:i + 7])
+            received.extend(db.get_len_prefixed_string())
+        self.assertEqual(received, frames)
+        self.assertEqual(db.data_size(), 0)
+
+    def test_overflow(self):
+        db = DataBuffer(max_size=16)
+        db.append_string("a" * 10)
+        self.assertEqual(db.free_space(), 6)
+        with self.assertRaises(DataBufferOverflow):
+            db.append_string("b" * 7)
+        # buffer is left untouched
+        self.assertEqual(db.read_all(), "a" * 10)
+        db.append_string("c" * 20, check_size=False)
+        self.assertEqual(db.data_size(), 20)
+        self.assertEqual(db.free_space(), 0)
+
+        db = DataBuffer(max_size=16)
+        with self.assertRaises(DataBufferOverflow):
+            db.append_len_prefixed_string("d" * 13)
+        self.assertEqual(db.data_size(), 0)
+        db.append_len_prefixed_string("d" * 12)
+        self.assertEqual(db.read_len_prefixed_string(), "d" * 12)
+
+    def test_memory_bounded(self):
+        db = DataBuffer(max_size=1024)
+        frame = struct.pack("!L", 100) + "x" * 100
+        for _ in range(10000):
+            db.append_string(frame[:50])
+            db.append_string(frame[50:])
+            self.assertEqual(db.read_len_prefixed_string(), "x" * 100)
+            self.assertLessEqual(len(db._data), 2 * db.max_size)
@@ -0,0 +1,38 @@
+import unittest
+
+from golem.core.deadlinequeue import DeadlineQueue
+
+
+class TestDeadlineQueue(unittest.TestCase):
+    def test_pop_expired(self):
+        q = DeadlineQueue()
+        for key, deadline in [("c", 30), ("a", 10), ("b", 20), ("d", 40)]:
+            q.push(key, deadline)
+        assert len(q) == 4
+        assert q.pop_expired(10) == []
+        assert q.pop_expired(25) == ["a", "b"]
+        assert "a" not in q
+        assert "c" in q
+        assert q.pop_expired(100) == ["c", "d"]
+        assert len(q) == 0
+
+    def test_push_and_remove(self):
+        q = DeadlineQueue()
+        q.push("a", 10)
+        q.push("b", 20)
+        q.push("a", 30)
+        assert q.get("a") == 30
+        q.remove("b")
+        q.remove("xyz")
+        assert q.get("b") is None
+        assert q.pop_expired(25) == []
+        q.push("a", 10)
+        assert q.pop_expired(25) == ["a"]
+        assert q.pop_expired(100) == []
+
+    def test_compact(self):
+        q = DeadlineQueue()
+        for i in range(1000):
+            q.push("a", i)
+        assert len(q._heap) < 100
+        assert q.pop_expired(1000) == ["a"]
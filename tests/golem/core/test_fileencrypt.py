@@ -1,7 +1,9 @@
 import os
 import random
+from cStringIO import StringIO
 
-from golem.core.fileencrypt import FileHelper, FileEncryptor, AESFileEncryptor
+from golem.core.fileencrypt import (FileHelper, FileEncryptor, AESFileEncryptor, AESStreamWriter,
+                                    AESStreamReader)
 from golem.resource.dirmanager import DirManager
 from golem.tools.testdirfixture import TestDirFixture
 
@@ -85,6 +87,59 @@ class TestAESFileEncryptor(TestDirFixture):
         self.assertFalse(decrypted)
 
 
+class TestAESStream(TestDirFixture):
+
+    def setUp(self):
+        TestDirFixture.setUp(self)
+        self.secret = FileEncryptor.gen_secret(10, 20)
+        self.data = os.urandom(1000)
+
+    def test_compatible_with_file_encryptor(self):
+        for length in [0, 15, 16, 17, 1000]:
+            encrypted = StringIO()
+            writer = AESStreamWriter(encrypted, self.secret, buffer_size=40)
+            for i in range(0, length, 7):
+                writer.write(self.data[i:min(i + 7, length)])
+            writer.close()
+
+            enc_file_path = os.path.join(self.path, 'stream.enc')
+            dec_file_path = os.path.join(self.path, 'stream.dec')
+            with open(enc_file_path, 'wb') as f:
+                f.write(encrypted.getvalue())
+            AESFileEncryptor.decrypt(enc_file_path, dec_file_path, self.secret)
+            with open(dec_file_path, 'rb') as f:
+                self.assertEqual(f.read(), self.data[:length])
+
+            reader = AESStreamReader(StringIO(encrypted.getvalue()), self.secret, buffer_size=40)
+            chunks = []
+            chunk = reader.read(5)
+            while chunk:
+                chunks.append(chunk)
+                chunk = reader.read(5)
+            self.assertEqual(str().join(chunks), self.data[:length])
+
+    def test_read_file_encryptor_output(self):
+        file_path = os.path.join(self.path, 'file')
+        enc_file_path = os.path.join(self.path, 'file.enc')
+        with open(file_path, 'wb') as f:
+            f.write(self.data)
+        AESFileEncryptor.encrypt(file_path, enc_file_path, self.secret)
+
+        with open(enc_file_path, 'rb') as f:
+            reader = AESStreamReader(f, self.secret, buffer_size=100)
+            self.assertEqual(reader.read(), self.data)
+            self.assertEqual(reader.read(), "")
+
+    def test_invalid_data(self):
+        encrypted = StringIO()
+        writer = AESStreamWriter(encrypted, self.secret)
+        writer.write(self.data)
+        writer.close()
+
+        with self.assertRaises(ValueError):
+            AESStreamReader(StringIO(encrypted.getvalue()[:-1]), self.secret).read()
+
+
 class TestFileHelper(TestDirFixture):
 
     def setUp(self):
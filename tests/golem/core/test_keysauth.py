@@ -139,3 +139,53 @@ class TestEllipticalKeysAuth(TestWithKeysAuth):
         self.assertEqual(ek2.decrypt(ek.encrypt(data, ek2.key_id)), data)
         data2 = "23103"
         self.assertEqual(ek.decrypt(ek2.encrypt(data2, ek.key_id)), data2)
+
+    def test_shared_secret(self):
+        ek = EllipticalKeysAuth(self.path)
+        ek2 = EllipticalKeysAuth(self.path, "PRIVATE_KEY_2", "PUBLIC_KEY_2")
+        secret = ek.get_shared_secret(ek2.key_id)
+        self.assertEqual(len(secret), 32)
+        self.assertEqual(secret, ek2.get_shared_secret(ek.key_id))
+        self.assertEqual(secret, ek2.get_shared_secret(ek.public_key))
+        self.assertIsNone(ek.get_shared_secret("abc"))
+
+    def test_public_key_cache(self):
+        ek = EllipticalKeysAuth(self.path)
+        ek2 = EllipticalKeysAuth(self.path, "PRIVATE_KEY_2", "PUBLIC_KEY_2")
+        data = "abcdefgh\nafjalfa\rtajlajfrlajl\t" * 100
+        sig = ek2.sign(data)
+        ek.public_key_cache.clear()
+        for _ in range(3):
+            self.assertTrue(ek.verify(sig, data, ek2.key_id))
+            self.assertTrue(ek.verify(sig, data, ek2.public_key))
+        self.assertFalse(ek.verify(sig, data + "x", ek2.key_id))
+        self.assertFalse(ek.verify(sig, data, ek.key_id))
+        self.assertEqual(ek.public_key_cache.misses, 2)
+        self.assertEqual(ek.public_key_cache.hits, 6)
+        self.assertEqual(len(ek.public_key_cache), 2)
+
+        ek.public_key_cache.clear()
+        ek.public_key_cache.max_size = 1
+        self.assertTrue(ek.verify(sig, data, ek2.key_id))
+        self.assertFalse(ek.verify(sig, data, ek.key_id))
+        self.assertEqual(len(ek.public_key_cache), 1)
+        self.assertTrue(ek.verify(sig, data, ek2.key_id))
+        self.assertFalse(ek.verify(sig, data, "abc"))
+        self.assertEqual(len(ek.public_key_cache), 1)
+        self.assertEqual(ek.public_key_cache.misses, 4)
+        self.assertEqual(ek.public_key_cache.hits, 0)
+
+    def test_verify_batch(self):
+        ek = EllipticalKeysAuth(self.path)
+        ek2 = EllipticalKeysAuth(self.path, "PRIVATE_KEY_2", "PUBLIC_KEY_2")
+        items = [(ek2.sign("data{}".format(i)), "data{}".format(i), ek2.key_id) for i in range(5)]
+        items.append((ek.sign("data"), "data", None))
+        items.append((ek.sign("data"), "data", ek2.key_id))
+        items.append((ek2.sign("data"), "data", "abc"))
+        items.append((None, None, None))
+        ek.public_key_cache.clear()
+        self.assertEqual(ek.verify_batch(items), [True] * 6 + [False] * 3)
+        self.assertEqual(ek.public_key_cache.misses, 3)
+        self.assertEqual(ek.public_key_cache.hits, 0)
+        self.assertEqual(KeysAuth(self.path).verify_batch([("abc", "abc", None), ("abc", "def", None)]),
+                         [True, False])
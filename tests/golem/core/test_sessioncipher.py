@@ -0,0 +1,54 @@
+import unittest
+
+from golem.core.sessioncipher import SessionCipher, SessionCipherError
+
+
+class TestSessionCipher(unittest.TestCase):
+    def _pair(self, secret="s" * 32):
+        alice = SessionCipher(secret, "alice", "bob", 0.25, 0.75)
+        bob = SessionCipher(secret, "bob", "alice", 0.75, 0.25)
+        return alice, bob
+
+    def test_encrypt_decrypt(self):
+        alice, bob = self._pair()
+        for data in ["", "abc", "abcdefgh\nafjalfa\rtajlajfrlajl\t" * 1000]:
+            enc = alice.encrypt(data)
+            self.assertTrue(SessionCipher.is_encrypted(enc))
+            self.assertEqual(len(enc), len(data) + SessionCipher.OVERHEAD)
+            self.assertEqual(bob.decrypt(enc), data)
+            self.assertEqual(alice.decrypt(bob.encrypt(data)), data)
+
+    def test_directions_use_different_keys(self):
+        alice, bob = self._pair()
+        enc = alice.encrypt("abc")
+        with self.assertRaises(SessionCipherError):
+            alice.decrypt(enc)
+        self.assertNotEqual(alice.encrypt("abc")[9:12], bob.encrypt("abc")[9:12])
+
+    def test_wrong_secret(self):
+        alice, _ = self._pair()
+        _, bob = self._pair("x" * 32)
+        with self.assertRaises(SessionCipherError):
+            bob.decrypt(alice.encrypt("abc"))
+
+    def test_tampered(self):
+        alice, bob = self._pair()
+        enc = alice.encrypt("abcdef")
+        tampered = enc[:10] + chr(ord(enc[10]) ^ 1) + enc[11:]
+        with self.assertRaises(SessionCipherError):
+            bob.decrypt(tampered)
+        with self.assertRaises(SessionCipherError):
+            bob.decrypt(enc[:-1])
+        with self.assertRaises(SessionCipherError):
+            bob.decrypt("\x00" + enc[1:])
+        self.assertEqual(bob.decrypt(enc), "abcdef")
+
+    def test_replay(self):
+        alice, bob = self._pair()
+        first = alice.encrypt("first")
+        second = alice.encrypt("second")
+        self.assertEqual(bob.decrypt(second), "second")
+        with self.assertRaises(SessionCipherError):
+            bob.decrypt(second)
+        with self.assertRaises(SessionCipherError):
+            bob.decrypt(first)
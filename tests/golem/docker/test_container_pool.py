@@ -0,0 +1,222 @@
+import os
+import threading
+import uuid
+
+import requests
+from mock import Mock, patch
+
+from golem.docker.container_pool import ContainerPool, PooledDockerJob
+from golem.docker.image import DockerImage
+from golem.docker.job import DockerJob
+from golem.tools.testdirfixture import TestDirFixture
+
+MB = 1024 * 1024
+
+
+def fake_client():
+    client = Mock()
+    client.create_container.side_effect = lambda **kwargs: {"Id": str(uuid.uuid4())}
+    client.exec_create.return_value = {"Id": "exec"}
+    client.exec_start.side_effect = lambda *args, **kwargs: iter([])
+    client.exec_inspect.return_value = {"Running": False, "ExitCode": 0}
+    return client
+
+
+class TestContainerPool(TestDirFixture):
+
+    def setUp(self):
+        super(TestContainerPool, self).setUp()
+        self.client = fake_client()
+        self.pool = ContainerPool(os.path.join(self.path, "containers"), idle_timeout=10,
+                                  client_factory=lambda: self.client)
+        self.image = DockerImage("golem/base")
+        self.resources_dir = os.path.join(self.path, "resources")
+        os.mkdir(self.resources_dir)
+
+    def test_reuse(self):
+        container = self.pool.acquire(self.image, self.resources_dir, {"mem_limit": MB})
+        assert self.client.create_container.call_count == 1
+        assert self.client.create_container.call_args[1]["entrypoint"]
+        self.client.start.assert_called_once_with(container.container_id)
+
+        with open(os.path.join(container.work_dir, "file"), "w") as f:
+            f.write("subtask data")
+        os.mkdir(os.path.join(container.output_dir, "dir"))
+        self.pool.release(container)
+        assert os.listdir(container.work_dir) == []
+        assert os.listdir(container.output_dir) == []
+        assert self.pool.get_num_idle() == 1
+
+        # the same task reuses the container, a different one gets a new container
+        assert self.pool.acquire(self.image, self.resources_dir, {"mem_limit": MB}) is container
+        other = self.pool.acquire(self.image, self.path, {"mem_limit": MB})
+        assert other is not container
+        assert self.pool.get_num_containers() == 2
+        assert self.client.create_container.call_count == 2
+        assert not self.client.remove_container.called
+
+    def test_not_reusable(self):
+        container = self.pool.acquire(self.image, self.resources_dir)
+        container.reusable = False
+        self.pool.release(container)
+        self.client.remove_container.assert_called_once_with(container.container_id, force=True)
+        assert not os.path.exists(container.host_dir)
+        assert self.pool.get_num_containers() == 0
+
+    def test_evict_idle(self):
+        with patch("golem.docker.container_pool.time.time", return_value=100.0):
+            container = self.pool.acquire(self.image, self.resources_dir)
+            self.pool.release(container)
+        with patch("golem.docker.container_pool.time.time", return_value=109.0):
+            assert self.pool.evict_idle() == []
+        assert self.pool.get_num_idle() == 1
+        with patch("golem.docker.container_pool.time.time", return_value=110.0):
+            evicted = self.pool.evict_idle()
+        assert evicted == [container]
+        assert self.pool.get_num_idle() == 0
+        assert self.pool.get_num_containers() == 0
+        # evicted containers are only removed when asked to
+        assert not self.client.remove_container.called
+        self.pool.remove(evicted)
+        self.client.remove_container.assert_called_once_with(container.container_id, force=True)
+        assert not os.path.exists(container.host_dir)
+
+    def test_memory_limit(self):
+        self.pool.max_memory = 3 * MB
+        first = self.pool.acquire(self.image, self.resources_dir, {"mem_limit": 2 * MB})
+        # containers without memory limit can't be accounted for
+        assert self.pool.acquire(self.image, self.path, {}) is None
+        # busy containers aren't evicted
+        assert self.pool.acquire(self.image, self.path, {"mem_limit": 2 * MB}) is None
+        assert self.pool.reserved_memory == 2 * MB
+
+        self.pool.release(first)
+        second = self.pool.acquire(self.image, self.path, {"mem_limit": 2 * MB})
+        assert second is not None
+        self.client.remove_container.assert_called_once_with(first.container_id, force=True)
+        assert self.pool.reserved_memory == 2 * MB
+        assert self.pool.acquire(self.image, self.path, {"mem_limit": 4 * MB}) is None
+
+    def test_create_error(self):
+        self.client.start.side_effect = Exception("start failed")
+        assert self.pool.acquire(self.image, self.resources_dir) is None
+        assert self.client.remove_container.called
+        assert self.pool.get_num_containers() == 0
+        assert os.listdir(self.pool.root_dir) == []
+
+    def test_quit(self):
+        idle = self.pool.acquire(self.image, self.resources_dir)
+        busy = self.pool.acquire(self.image, self.resources_dir)
+        self.pool.release(idle)
+        self.pool.quit()
+        assert self.client.remove_container.call_count == 2
+        assert self.pool.get_num_containers() == 0
+        self.pool.release(busy)
+        assert self.pool.get_num_idle() == 0
+
+
+class TestPooledDockerJob(TestDirFixture):
+
+    def setUp(self):
+        super(TestPooledDockerJob, self).setUp()
+        self.client = fake_client()
+        self.pool = ContainerPool(os.path.join(self.path, "containers"), client_factory=lambda: self.client)
+        self.image = DockerImage("golem/base")
+        self.dirs = []
+        for name in ["resources", "work", "output"]:
+            self.dirs.append(os.path.join(self.path, name))
+            os.mkdir(self.dirs[-1])
+
+    def _job(self):
+        return PooledDockerJob(self.pool, self.image, "print 'Hello'", {"param": 1}, *self.dirs)
+
+    def test_run(self):
+        with self._job() as job:
+            container = job.warm_container
+            assert os.path.isfile(os.path.join(container.work_dir, DockerJob.PARAMS_FILE))
+            assert os.path.isfile(os.path.join(container.work_dir, DockerJob.TASK_SCRIPT))
+            # the job's own work dir isn't used
+            assert os.listdir(job.work_dir) == []
+
+            job.start()
+            command = self.client.exec_create.call_args[0][1]
+            assert command[:2] == ["/bin/sh", "-c"]
+            assert DockerJob._get_container_script_path() in command[2]
+            assert job.get_status() == DockerJob.STATE_RUNNING
+
+            assert job.get_progress() is None
+            with open(os.path.join(container.work_dir, DockerJob.PROGRESS_FILE), "w") as f:
+                f.write("0.25")
+            assert job.get_progress() == 0.25
+
+            with open(os.path.join(container.output_dir, "result.png"), "w") as f:
+                f.write("result")
+            with open(os.path.join(container.work_dir, PooledDockerJob.STDOUT_FILE), "w") as f:
+                f.write("stdout")
+            self.client.exec_inspect.return_value = {"Running": False, "ExitCode": 3}
+            assert job.wait() == 3
+            assert self.client.exec_inspect.call_count == 1
+            assert os.listdir(job.output_dir) == ["result.png"]
+
+            stdout_file = os.path.join(self.path, "stdout.log")
+            stderr_file = os.path.join(self.path, "stderr.log")
+            job.dump_logs(stdout_file, stderr_file)
+            with open(stdout_file) as f:
+                assert f.read() == "stdout"
+            assert os.path.getsize(stderr_file) == 0
+
+        assert job.get_status() == DockerJob.STATE_REMOVED
+        assert self.pool.get_num_idle() == 1
+
+        with self._job() as job:
+            assert job.warm_container is container
+            # files of the previous subtask are removed
+            assert sorted(os.listdir(container.work_dir)) == sorted([DockerJob.PARAMS_FILE,
+                                                                     DockerJob.TASK_SCRIPT])
+            assert os.listdir(container.output_dir) == []
+
+    def test_wait_timeout(self):
+        finished = threading.Event()
+
+        def exec_stream():
+            finished.wait()
+            yield ""
+
+        self.client.exec_start.side_effect = lambda *args, **kwargs: exec_stream()
+        with self._job() as job:
+            job.start()
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                job.wait(timeout=0.05)
+            assert not self.client.exec_inspect.called
+            finished.set()
+            assert job.wait(timeout=1) == 0
+
+    def test_lost_exec(self):
+        self.client.exec_start.side_effect = lambda *args, **kwargs: iter([])
+        self.client.exec_inspect.return_value = {"Running": True}
+        with self._job() as job:
+            job.start()
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                job.wait()
+            container_id = job.container_id
+        self.client.remove_container.assert_called_once_with(container_id, force=True)
+
+    def test_kill(self):
+        with self._job() as job:
+            job.start()
+            job.kill()
+            self.client.kill.assert_called_once_with(job.container_id)
+            container_id = job.container_id
+        self.client.remove_container.assert_called_once_with(container_id, force=True)
+        assert self.pool.get_num_containers() == 0
+
+    @patch("golem.docker.job.local_client")
+    def test_fallback(self, local_client):
+        local_client.return_value = fake_client()
+        self.pool.max_memory = MB
+        with self._job() as job:
+            assert job.warm_container is None
+            assert local_client.return_value.create_container.called
+            assert os.path.isfile(os.path.join(job.work_dir, DockerJob.TASK_SCRIPT))
+        assert local_client.return_value.remove_container.called
+        assert not self.client.create_container.called
@@ -40,6 +40,27 @@ class TestDockerConfigManager(unittest.TestCase):
         assert 'cpuset' not in cm.container_host_config
         assert 'mem_limit' not in cm.container_host_config
 
+    def test_slot_host_config(self):
+        cm = DockerConfigManager()
+        cm.cpu_cores = [0, 1, 2, 3, 4, 5]
+        cm.build_config(self.MockConfig(4, 4096, 2048))
+        assert cm.container_host_config['cpuset'] == '0,1,2,3'
+
+        slot_0 = cm.get_slot_host_config(0, 2, 1024)
+        slot_1 = cm.get_slot_host_config(1, 2, 1024)
+        assert slot_0['cpuset'] == '0,1'
+        assert slot_1['cpuset'] == '2,3'
+        assert slot_0['mem_limit'] == slot_1['mem_limit'] == 1024 * 1000
+        assert slot_0['network_mode'] == cm.container_host_config['network_mode']
+
+        assert cm.get_slot_host_config(2, 2, 1024)['cpuset'] == '0,1'
+        assert cm.get_slot_host_config(0, 8, 0)['cpuset'] == '0,1,2,3'
+        assert cm.get_slot_host_config(0, 0, 0) == cm.container_host_config
+
+        cm.cpu_cores = None
+        cm.container_host_config.pop('cpuset')
+        assert 'cpuset' not in cm.get_slot_host_config(1, 2, 1024)
+
     def test_try(self):
         cm = DockerConfigManager()
         with cm._try():
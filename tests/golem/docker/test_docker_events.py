@@ -0,0 +1,206 @@
+import os
+import Queue
+import threading
+import unittest
+import uuid
+
+import requests
+from mock import Mock, patch
+
+from golem.docker.events import ContainerWatch, DockerEventMonitor
+from golem.docker.image import DockerImage
+from golem.docker.job import DockerJob
+from golem.tools.testdirfixture import TestDirFixture
+
+
+class FakeEventsClient(object):
+    """ Docker client whose events stream returns events put into a queue. None breaks the stream. """
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.since = []
+
+    def events(self, since=None, decode=False):
+        self.since.append(since)
+        return self._stream()
+
+    def _stream(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                raise requests.exceptions.ConnectionError("stream broken")
+            yield event
+
+
+def event(container_id, action, time, **attributes):
+    return {"id": container_id, "status": action, "Action": action, "time": time,
+            "Actor": {"ID": container_id, "Attributes": attributes}}
+
+
+class TestDockerEventMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeEventsClient()
+        self.monitor = DockerEventMonitor(client_factory=lambda: self.client, reconnect_delay=0.01)
+
+    def tearDown(self):
+        self.monitor.stop()
+        self.client.queue.put({})
+
+    def test_dispatch(self):
+        watch = self.monitor.watch("abc")
+        other = self.monitor.watch("def")
+        assert self.monitor.watch("abc") is watch
+        assert self.monitor.get_num_watched() == 2
+
+        self.client.queue.put(event("abc", "create", 10))
+        self.client.queue.put(event("abc", "start", 11))
+        self.client.queue.put(event("xyz", "die", 12, exitCode="1"))
+        self.client.queue.put(event("abc", "exec_start: /bin/sh", 12))
+        self.client.queue.put(event("abc", "die", 13, exitCode="3"))
+        assert watch.wait(5)
+        assert watch.status == "exited"
+        assert watch.exit_code == 3
+        assert other.status is None
+        assert not other.is_finished()
+
+        self.monitor.unwatch("abc")
+        assert self.monitor.get_num_watched() == 1
+        self.client.queue.put(event("abc", "destroy", 14))
+        self.client.queue.put(event("def", "destroy", 15))
+        assert other.wait(5)
+        assert watch.status == "exited"
+
+    def test_die_without_exit_code(self):
+        watch = self.monitor.watch("abc")
+        self.client.queue.put({"id": "abc", "status": "die", "time": 10})
+        assert watch.wait(5)
+        assert watch.exit_code is None
+
+    def test_reconnect(self):
+        with patch("golem.docker.events.time.time", return_value=100):
+            watch = self.monitor.watch("abc")
+        self.client.queue.put(event("abc", "start", 105))
+        self.client.queue.put(None)
+        self.client.queue.put(event("abc", "die", 107, exitCode="0"))
+        assert watch.wait(5)
+        # missed events are replayed after reconnecting
+        assert self.client.since == [99, 105]
+
+    def test_single_stream(self):
+        watches = [self.monitor.watch(str(i)) for i in range(100)]
+        for i in range(100):
+            self.client.queue.put(event(str(i), "die", 10, exitCode=str(i)))
+        assert all(w.wait(5) for w in watches)
+        assert [w.exit_code for w in watches] == range(100)
+        assert len(self.client.since) == 1
+
+
+class TestContainerWatch(unittest.TestCase):
+
+    def test_wait(self):
+        watch = ContainerWatch("abc")
+        assert not watch.wait(0.01)
+        watch.update("running")
+        assert not watch.is_finished()
+        watch.update("exited", 1)
+        assert watch.wait(0.01)
+        assert watch.exit_code == 1
+
+
+class TestDockerJobEvents(TestDirFixture):
+
+    def setUp(self):
+        super(TestDockerJobEvents, self).setUp()
+        self.dirs = []
+        for name in ["resources", "work", "output"]:
+            self.dirs.append(os.path.join(self.path, name))
+            os.mkdir(self.dirs[-1])
+
+        self.events = FakeEventsClient()
+        self.monitor = DockerEventMonitor(client_factory=lambda: self.events, reconnect_delay=0.01)
+        self.client = Mock()
+        self.client.create_container.side_effect = lambda **kwargs: {"Id": str(uuid.uuid4())}
+        self.logs_finished = threading.Event()
+        self.client.logs.side_effect = self._logs
+
+        patches = [patch("golem.docker.job.local_client", return_value=self.client),
+                   patch("golem.docker.job.event_monitor", return_value=self.monitor)]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.monitor.stop()
+        self.events.queue.put({})
+        super(TestDockerJobEvents, self).tearDown()
+
+    def _logs(self, container_id, stream, stdout, stderr):
+        yield "out " if stdout else "err "
+        self.logs_finished.wait()
+        yield "done"
+
+    def _job(self):
+        return DockerJob(DockerImage("golem/base"), "print 'Hello'", {}, *self.dirs, container_log_level=0)
+
+    def _wait_connected(self):
+        for _ in range(500):
+            if self.monitor.connected:
+                return
+            threading.Event().wait(0.01)
+        self.fail("Event monitor not connected")
+
+    def test_run(self):
+        stdout_file = os.path.join(self.path, "stdout.log")
+        stderr_file = os.path.join(self.path, "stderr.log")
+
+        with self._job() as job:
+            self._wait_connected()
+            assert job.get_status() == DockerJob.STATE_CREATED
+            job.start()
+            assert job.get_status() == DockerJob.STATE_RUNNING
+            job.stream_logs(stdout_file, stderr_file)
+
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                job.wait(0.01)
+
+            # logs are written while the job runs
+            for _ in range(500):
+                if os.path.getsize(stdout_file) and os.path.getsize(stderr_file):
+                    break
+                threading.Event().wait(0.01)
+            with open(stdout_file) as f:
+                assert f.read() == "out "
+
+            self.events.queue.put(event(job.container_id, "die", 10, exitCode="2"))
+            assert job.wait(5) == 2
+            assert job.get_status() == DockerJob.STATE_EXITED
+
+            self.logs_finished.set()
+            job.dump_logs(stdout_file, stderr_file)
+            with open(stdout_file) as f:
+                assert f.read() == "out done"
+            with open(stderr_file) as f:
+                assert f.read() == "err done"
+
+        assert job.get_status() == DockerJob.STATE_REMOVED
+        assert self.monitor.get_num_watched() == 0
+        assert not self.client.inspect_container.called
+        assert not self.client.wait.called
+
+    def test_exit_code_from_inspect(self):
+        self.client.inspect_container.return_value = {"State": {"ExitCode": 1}}
+        with self._job() as job:
+            self._wait_connected()
+            job.start()
+            self.events.queue.put({"id": job.container_id, "status": "die", "time": 10})
+            assert job.wait(5) == 1
+            assert self.client.inspect_container.call_count == 1
+
+    def test_kill(self):
+        with self._job() as job:
+            job.kill()
+            assert not self.client.kill.called
+            job.start()
+            job.kill()
+            self.client.kill.assert_called_once_with(job.container_id)
@@ -652,3 +652,18 @@ class TestSettings(TempDirFixture):
 
             with self.assertRaises(CommandException):
                 settings.set('num_cores', _cpu_count + 1)
+
+            settings.set('slot_num_cores', 0)
+            settings.set('slot_num_cores', _cpu_count)
+
+            with self.assertRaises(CommandException):
+                settings.set('slot_num_cores', -1)
+
+            with self.assertRaises(CommandException):
+                settings.set('slot_num_cores', _cpu_count + 1)
+
+            settings.set('slot_max_memory_size', 0)
+            settings.set('slot_max_memory_size', MIN_MEMORY_SIZE)
+
+            with self.assertRaises(CommandException):
+                settings.set('slot_max_memory_size', -1)
@@ -322,12 +322,21 @@ class TestP2PService(DatabaseFixture):
         service.send_nat_traverse_failure(p.key_id, 'conn_id')
         assert p.send_nat_traverse_failure.called
 
-        service.send_stop_gossip()
-        assert p.send_stop_gossip.called
-
         service.sync_network()
         assert p.send_get_tasks.called
 
+        # headers were dropped and may be accepted again, full lists are requested once
+        service.peers[p.key_id] = p
+        p.last_message_time = time.time()
+        service.last_message_time_threshold = 60
+        service.task_server.get_tasks_resync_version.return_value = 1
+        service.last_tasks_request = 0
+        service.sync_network()
+        p.send_get_tasks.assert_called_with(True)
+        service.last_tasks_request = 0
+        service.sync_network()
+        p.send_get_tasks.assert_called_with(False)
+
         service.remove_peer(p)
         assert p.key_id not in service.peers
 
@@ -0,0 +1,133 @@
+import random
+import time
+import unittest
+
+from golem.network.p2p.node import Node
+from golem.network.p2p.peerkeeper import PeerKeeper, KBucket
+
+
+def random_key(k_size=512):
+    return "{:0{}x}".format(random.getrandbits(k_size), k_size // 4)
+
+
+def key_with_prefix(key, prefix_len, k_size=512):
+    """ Return a random key sharing exactly prefix_len leading bits with given key """
+    key_num = long(key, 16)
+    shift = k_size - prefix_len - 1
+    num = ((key_num >> shift) ^ 1) << shift | random.getrandbits(shift)
+    return "{:0{}x}".format(num, k_size // 4)
+
+
+class TestPeerKeeper(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+        self.key = random_key()
+        self.pk = PeerKeeper(self.key)
+
+    def test_add_peer(self):
+        assert self.pk.add_peer(Node(key=self.key)) is None
+        assert len(self.pk.buckets) == 1
+
+        peers = [Node(key=random_key()) for _ in xrange(200)]
+        for peer in peers:
+            self.pk.add_peer(peer)
+        assert len(self.pk.buckets) > 1
+
+        # buckets cover the whole key space and every peer is in a bucket of its prefix length
+        assert self.pk.buckets[0].start == 0 or self.pk.buckets[0].end == 2 ** 512 - 1
+        assert sum(b.end - b.start + 1 for b in self.pk.buckets) == 2 ** 512
+        last = self.pk.buckets[-1]
+        assert last.start <= self.pk.key_num <= last.end
+        for i, bucket in enumerate(self.pk.buckets):
+            assert len(bucket.peers) <= self.pk.k
+            for peer in bucket.peers:
+                key_num = long(peer.key, 16)
+                assert bucket.start <= key_num <= bucket.end
+                assert self.pk.bucket_for_peer(key_num) is bucket
+                if bucket is not last:
+                    assert self.pk.prefix_len(key_num) == i
+
+    def test_full_bucket(self):
+        peers = [Node(key=key_with_prefix(self.key, 0)) for _ in xrange(self.pk.k + 1)]
+        for peer in peers[:-1]:
+            assert self.pk.add_peer(peer) is None
+        self.pk.add_peer(Node(key=key_with_prefix(self.key, 5)))
+        assert len(self.pk.buckets) == 2
+
+        # the far bucket isn't split, the oldest peer should answer a ping
+        assert self.pk.add_peer(peers[-1]) == peers[0]
+        assert peers[0].key in self.pk.expected_pongs
+        self.pk.pong_received(peers[0].key)
+        assert peers[0].key not in self.pk.expected_pongs
+
+        # known peer is moved to the end
+        assert self.pk.add_peer(peers[0]) is None
+        assert self.pk.buckets[0].peers[-1] is peers[0]
+
+    def test_remove_old_expected_pongs(self):
+        peers = [Node(key=key_with_prefix(self.key, 0)) for _ in xrange(self.pk.k + 1)]
+        for peer in peers:
+            self.pk.add_peer(peer)
+        self.pk.add_peer(Node(key=key_with_prefix(self.key, 5)))
+        assert self.pk.add_peer(peers[-1]) == peers[0]
+        self.pk.expected_pongs[peers[0].key] = (peers[-1], time.time() - self.pk.pong_timeout - 1)
+        self.pk.sync()
+        assert self.pk.sessions_to_end == [peers[0]]
+        assert peers[-1] in self.pk.buckets[0].peers
+        assert peers[0] not in self.pk.buckets[0].peers
+
+    def test_neighbours(self):
+        peers = [Node(key=random_key()) for _ in xrange(300)]
+        peers += [Node(key=key_with_prefix(self.key, i)) for i in xrange(1, 40) for _ in xrange(3)]
+        for peer in peers:
+            self.pk.add_peer(peer)
+        known = [peer for bucket in self.pk.buckets for peer in bucket.peers]
+
+        targets = [long(random_key(), 16) for _ in xrange(20)]
+        targets += [long(key_with_prefix(self.key, i), 16) for i in xrange(0, 50, 5)]
+        targets += [self.pk.key_num, long(known[0].key, 16)]
+        for target in targets:
+            for alpha in [1, 3, 20]:
+                expected = sorted((p for p in known if long(p.key, 16) != target),
+                                  key=lambda p: long(p.key, 16) ^ target)[:alpha]
+                assert self.pk.neighbours(target, alpha) == expected
+        assert len(self.pk.neighbours(targets[0])) == self.pk.concurrency
+
+    def test_set_last_message_time(self):
+        peer = Node(key=random_key())
+        self.pk.add_peer(peer)
+        bucket = self.pk.bucket_for_peer(long(peer.key, 16))
+        bucket.last_updated = 0
+        self.pk.set_last_message_time(peer.key)
+        assert bucket.last_updated > 0
+        self.pk.set_last_message_time(None)
+
+    def test_restart(self):
+        for _ in xrange(100):
+            self.pk.add_peer(Node(key=random_key()))
+        key = random_key()
+        self.pk.restart(key)
+        assert self.pk.key_num == long(key, 16)
+        assert len(self.pk.buckets) == 1
+        assert self.pk.get_random_known_peer() is None
+
+
+class TestKBucket(unittest.TestCase):
+
+    def test_split(self):
+        bucket = KBucket(0, 2 ** 8 - 1, 4)
+        peers = [Node(key="{:02x}".format(n)) for n in [0x10, 0x7f, 0x80, 0xff]]
+        for peer in peers:
+            assert bucket.add_peer(peer) is None
+        assert bucket.add_peer(Node(key="01")) is peers[0]
+
+        lower, upper = bucket.split()
+        assert (lower.start, lower.end) == (0, 0x7f)
+        assert (upper.start, upper.end) == (0x80, 0xff)
+        assert list(lower.peers) == peers[:2]
+        assert list(upper.peers) == peers[2:]
+
+        assert upper.remove_peer(0xff) is peers[3]
+        assert upper.remove_peer(0xff) is None
+        assert upper.peers_with_nums() == [(peers[2], 0x80)]
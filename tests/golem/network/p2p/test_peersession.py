@@ -6,7 +6,7 @@ from golem.core.keysauth import EllipticalKeysAuth, KeysAuth
 from golem.network.p2p.node import Node
 from golem.network.p2p.p2pservice import P2PService
 from golem.network.p2p.peersession import PeerSession, logger, P2P_PROTOCOL_ID, PeerSessionInfo
-from golem.network.transport.message import MessageHello
+from golem.network.transport.message import MessageHello, MessageTasks, MessageGetTasks, MessageStopGossip
 from golem.tools.assertlogs import LogTestCase
 from golem.tools.testwithappconfig import TestWithKeysAuth
 
@@ -118,6 +118,71 @@ class TestPeerSession(TestWithKeysAuth, LogTestCase):
         assert peer_session.p2p_service.remove_peer.called
         assert not peer_session.p2p_service.remove_pending_conn.called
 
+    def test_react_to_stop_gossip(self):
+        peer_session = PeerSession(MagicMock())
+        peer_session.p2p_service = MagicMock()
+        peer_session.disconnect = MagicMock()
+
+        # nodes that gossip in stages still send it, it's ignored without dropping the connection
+        peer_session._react_to_stop_gossip(MessageStopGossip())
+        assert not peer_session.disconnect.called
+        assert not peer_session.p2p_service.method_calls
+
+    def test_react_to_tasks(self):
+        peer_session = PeerSession(MagicMock())
+        peer_session.p2p_service = MagicMock()
+        peer_session.disconnect = MagicMock()
+
+        peer_session.p2p_service.add_task_headers.return_value = [True, True]
+        peer_session._react_to_tasks(MessageTasks([{"task_id": "abc"}, {"task_id": "def"}]))
+        peer_session.p2p_service.add_task_headers.assert_called_with([{"task_id": "abc"}, {"task_id": "def"}])
+        assert not peer_session.disconnect.called
+
+        peer_session.p2p_service.add_task_headers.return_value = [True, False]
+        peer_session._react_to_tasks(MessageTasks([{"task_id": "abc"}, {"task_id": "def"}]))
+        peer_session.disconnect.assert_called_once_with(PeerSession.DCRBadProtocol)
+
+        # version of the peer's list is remembered and sent with the next request
+        peer_session.p2p_service.add_task_headers.return_value = [True]
+        peer_session._react_to_tasks(MessageTasks([{"task_id": "ghi"}], 7))
+        assert peer_session.tasks_version == 7
+        peer_session.send = MagicMock()
+        peer_session.send_get_tasks()
+        assert peer_session.send.call_args[0][0].version == 7
+        peer_session.send_get_tasks(full=True)
+        assert peer_session.send.call_args[0][0].version == 0
+        assert peer_session.tasks_version == 0
+
+    def test_react_to_get_tasks(self):
+        peer_session = PeerSession(MagicMock())
+        peer_session.p2p_service = MagicMock()
+        peer_session.send = MagicMock()
+        peer_session.p2p_service.get_tasks_headers.return_value = [{"task_id": "abc"}]
+        peer_session.p2p_service.get_tasks_version.return_value = 5
+
+        # peer that doesn't know versions gets all headers
+        peer_session._react_to_get_tasks(MessageGetTasks())
+        peer_session.p2p_service.get_tasks_headers.assert_called_with()
+        msg = peer_session.send.call_args[0][0]
+        assert msg.tasks_array == [{"task_id": "abc"}]
+        assert msg.version is None
+
+        peer_session._react_to_get_tasks(MessageGetTasks(3))
+        peer_session.p2p_service.get_tasks_headers.assert_called_with(3)
+        msg = peer_session.send.call_args[0][0]
+        assert msg.tasks_array == [{"task_id": "abc"}]
+        assert msg.version == 5
+
+        # nothing changed since the last request
+        peer_session.send.reset_mock()
+        peer_session._react_to_get_tasks(MessageGetTasks(5))
+        assert not peer_session.send.called
+
+        # unknown version
+        peer_session._react_to_get_tasks(MessageGetTasks(10))
+        peer_session.p2p_service.get_tasks_headers.assert_called_with(0)
+        assert peer_session.send.call_args[0][0].version == 5
+
 
 class TestPeerSessionInfo(unittest.TestCase):
 
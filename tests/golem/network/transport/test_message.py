@@ -1,12 +1,33 @@
+import collections
 import unittest
 import os
 import time
 
 from golem.core.databuffer import DataBuffer
-from golem.network.transport.message import MessageWantToComputeTask, MessageReportComputedTask, Message, MessageHello
+from golem.core.simplehash import SimpleHash
+from golem.core.simpleserializer import CBORSerializer
+from golem.network.transport.message import MessageWantToComputeTask, MessageReportComputedTask, Message, \
+    MessageHello, MessagePeers, MessageTasks, MessageTaskToCompute
+from golem.task.taskbase import ComputeTaskDef
 from mock import Mock, patch
 
 
+def sorted_repr(v):
+    """ Sorted copy of a message representation, as it used to be hashed """
+    def sort_dict(dictionary, filter_properties=False):
+        return sorted((k, sorted_repr(_v)) for k, _v in dictionary.iteritems()
+                      if not (filter_properties and (k.startswith('_') or callable(_v))))
+    if isinstance(v, dict):
+        return sort_dict(v)
+    elif hasattr(v, '__dict__'):
+        return sort_dict(v.__dict__, filter_properties=True)
+    elif isinstance(v, basestring):
+        return v
+    elif isinstance(v, collections.Iterable):
+        return v.__class__([sorted_repr(_v) for _v in v])
+    return v
+
+
 class FailingMessage(Message):
     def __init__(self, *args, **kwargs):
         Message.__init__(self, *args, **kwargs)
@@ -73,6 +94,36 @@ class TestMessages(unittest.TestCase):
                                       extra_data=MessageWantToComputeTask("ABC", "xyz", 1000, 20, 4, 5, 3))
         assert m.get_short_hash()
 
+    def test_message_hash_compatibility(self):
+        ctd = ComputeTaskDef()
+        ctd.extra_data = {u"frames": [1, 2, 3], "outfilebasename": u"out", "border": (0.0, 1.0, None)}
+        headers = [{u"task_id": u"t{}".format(i), u"deadline": 1234.5 + i, u"environment": "DEFAULT",
+                    u"task_owner": {u"node_name": u"n", u"pub_port": 40102, u"prv_addresses": [u"10.0.0.1"]}}
+                   for i in xrange(20)]
+        messages = [
+            MessageHello(port=40102, node_name=u"node", client_key_id="ABC", rand_val=0.5,
+                         metadata={u"os": u"linux", "version": [0, 3]}),
+            MessageWantToComputeTask("ABC", "xyz", 1000, 20, 4, 5, 3),
+            MessageReportComputedTask("xxyyzz", 0, 12034, "ABC", "10.10.10.1", 1023, "KEY_ID", "NODE", "ETH",
+                                      extra_data=MessageWantToComputeTask("ABC", "xyz", 1000, 20, 4, 5, 3)),
+            MessagePeers([{"address": "10.0.0.{}".format(i), "port": i, "node": None} for i in xrange(10)]),
+            MessageTasks(headers),
+            MessageTasks(headers, 10),
+            MessageTaskToCompute(ctd),
+        ]
+        for m in messages:
+            expected = SimpleHash.hash(CBORSerializer.dumps(sorted_repr(m._get_hashed_data())))
+            assert m.get_short_hash() == expected
+
+    def test_message_hash_cached(self):
+        m = MessageTasks([{u"task_id": u"abc", u"deadline": 1234.5}])
+        with patch('golem.network.transport.message.CBORSerializer.dumps_canonical',
+                   side_effect=CBORSerializer.dumps_canonical) as dumps:
+            short_hash = m.get_short_hash()
+            m.sig = "signature"
+            assert m.get_short_hash() == short_hash
+            assert dumps.call_count == 1
+
     def test_serialization(self):
         m = MessageReportComputedTask("xxyyzz", 0, 12034, "ABC", "10.10.10.1", 1023, "KEY_ID", "NODE", "ETH", {})
         assert m.serialize()
@@ -4,6 +4,10 @@ import time
 import unittest
 from contextlib import contextmanager
 
+from mock import Mock
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+
 from golem.core.databuffer import DataBuffer
 from golem.network.transport.message import Message, MessageHello, init_messages
 from golem.network.transport.network import ProtocolFactory, SessionFactory, SessionProtocol
@@ -232,6 +236,48 @@ class TestNetwork(TestWithReactor):
             self.network.stop_listening(listening_info)
         self.assertEquals(len(self.network.active_listeners), 0)
 
+    def test_connect_with_blackholed_addresses(self):
+        listen_status = [False]
+        conn_status = [False]
+
+        def _listen_success(*args, **kwargs):
+            self.__listen_success(*args, **kwargs)
+            listen_status[0] = True
+
+        def _conn_success(*args, **kwargs):
+            self.__connection_success(*args, **kwargs)
+            conn_status[0] = True
+
+        def _conn_failure(**kwargs):
+            self.__connection_failure(**kwargs)
+            conn_status[0] = True
+
+        def _listen_stopped():
+            listen_status[0] = True
+
+        port = get_port()
+        with async_scope(listen_status):
+            self.network.listen(TCPListenInfo(port, port + 1000, established_callback=_listen_success))
+        port = self.port
+
+        # addresses that never answer are tried first, the connection timeout is much longer than the test
+        # takes
+        blackholed = [SocketAddress('10.0.0.1', port), SocketAddress('192.168.0.1', port)]
+        network = BlackholeNetwork(self.network.protocol_factory, blackholed, timeout=30, connect_delay=0.1)
+        connect_info = TCPConnectInfo(blackholed + [SocketAddress('127.0.0.1', port)], _conn_success,
+                                      _conn_failure)
+
+        started = time.time()
+        with async_scope(conn_status):
+            network.connect(connect_info)
+        self.assertTrue(self.connect_success)
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(len(network.attempts), 2)
+        self.assertTrue(all(defer.called for defer in network.attempts))
+
+        with async_scope(listen_status):
+            self.network.stop_listening(TCPListeningInfo(port, stopped_callback=_listen_stopped))
+
     def __listen_success(self, port, **kwargs):
         self.listen_success = True
         self.port = port
@@ -402,3 +448,101 @@ class TestSaferProtocol(unittest.TestCase):
         self.assertEqual(msg.sig, "ASessionSign")
         p.connectionLost()
         assert 'session' not in p.__dict__
+
+
+class BlackholeEndpoint(object):
+    """ Client endpoint of an address that drops all packets: connection attempts never end unless
+    cancelled """
+    def __init__(self, attempts):
+        self.attempts = attempts
+
+    def connect(self, protocol_factory):
+        defer = Deferred()
+        self.attempts.append(defer)
+        return defer
+
+
+class BlackholeNetwork(TCPNetwork):
+    def __init__(self, protocol_factory, blackholed, **kwargs):
+        TCPNetwork.__init__(self, protocol_factory, **kwargs)
+        self.blackholed = blackholed
+        self.attempts = []
+
+    def _get_client_endpoint(self, address, port):
+        if SocketAddress(address, port) in self.blackholed:
+            return BlackholeEndpoint(self.attempts)
+        return TCPNetwork._get_client_endpoint(self, address, port)
+
+
+class FakeEndpoint(object):
+    def __init__(self):
+        self.defer = None
+        self.cancelled = False
+
+    def connect(self, protocol_factory):
+        self.defer = Deferred(lambda _: setattr(self, 'cancelled', True))
+        return self.defer
+
+
+class TestConnectAttempts(unittest.TestCase):
+    def setUp(self):
+        self.network = TCPNetwork(Mock(), connect_delay=0.25)
+        self.network.reactor = Clock()
+        self.network.host_addresses = []
+        self.addresses = [SocketAddress('10.0.0.{}'.format(i), 40102) for i in range(1, 4)]
+        self.endpoints = {str(address): FakeEndpoint() for address in self.addresses}
+        self.network._get_client_endpoint = (lambda address, port:
+                                             self.endpoints["{}:{}".format(address, port)])
+        self.established = Mock()
+        self.failure = Mock()
+
+    def __connect(self, **kwargs):
+        self.network.connect(TCPConnectInfo(list(self.addresses), self.established, self.failure), **kwargs)
+        return [self.endpoints[str(address)] for address in self.addresses]
+
+    def test_staggered_attempts(self):
+        first, second, third = self.__connect()
+        assert first.defer and not second.defer and not third.defer
+        self.network.reactor.advance(0.2)
+        assert not second.defer
+        self.network.reactor.advance(0.05)
+        assert second.defer and not third.defer
+        self.network.reactor.advance(0.25)
+        assert third.defer
+
+    def test_first_connection_wins(self):
+        first, second, third = self.__connect(a=1)
+        self.network.reactor.advance(0.25)
+        conn = Mock()
+        second.defer.callback(conn)
+
+        self.established.assert_called_once_with(conn.session, a=1)
+        assert first.cancelled
+        assert third.defer is None
+        self.network.reactor.advance(1.0)
+        assert third.defer is None
+        assert not self.failure.called
+
+    def test_failure_starts_next_attempt(self):
+        first, second, third = self.__connect(a=1)
+        first.defer.errback(Exception("refused"))
+        assert second.defer
+        second.defer.errback(Exception("refused"))
+        assert third.defer
+        assert not self.failure.called
+        third.defer.errback(Exception("refused"))
+        self.failure.assert_called_once_with(a=1)
+        assert not self.established.called
+        self.network.reactor.advance(1.0)
+        self.failure.assert_called_once_with(a=1)
+
+    def test_failure_waits_for_pending_attempts(self):
+        first, second, third = self.__connect()
+        self.network.reactor.pump([0.25, 0.25])
+        third.defer.errback(Exception("refused"))
+        second.defer.errback(Exception("timeout"))
+        assert not self.failure.called
+        conn = Mock()
+        first.defer.callback(conn)
+        self.established.assert_called_once_with(conn.session)
+        assert not self.failure.called
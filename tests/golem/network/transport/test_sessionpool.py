@@ -0,0 +1,92 @@
+import unittest
+
+from mock import Mock
+
+from golem.network.transport.sessionpool import SessionPool
+
+
+def make_session(key_id, last_message_time=0.0, opened=True, busy=False):
+    session = Mock()
+    session.key_id = key_id
+    session.last_message_time = last_message_time
+    session.conn.opened = opened
+    session.is_busy.return_value = busy
+    return session
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def test_add_remove(self):
+        pool = SessionPool(max_sessions_per_peer=2)
+        s1, s2, s3 = make_session("abc"), make_session("abc"), make_session("abc")
+        assert pool.add("abc", s1)
+        assert pool.add("abc", s1)
+        assert pool.add("abc", s2)
+        assert not pool.add("abc", s3)
+        assert s1 in pool and s2 in pool
+        assert s3 not in pool
+        assert len(pool) == 2
+
+        pool.remove(s1)
+        pool.remove(s3)
+        assert s1 not in pool
+        assert len(pool) == 1
+        pool.remove(s2)
+        assert pool.sessions == {}
+
+    def test_pooling_off(self):
+        pool = SessionPool(max_sessions_per_peer=0)
+        assert not pool.add("abc", make_session("abc"))
+        assert pool.sessions == {}
+        assert not pool.can_connect("abc")
+
+    def test_get(self):
+        pool = SessionPool(max_sessions_per_peer=3)
+        assert pool.get("abc") is None
+        s1 = make_session("abc", last_message_time=10.0)
+        s2 = make_session("abc", last_message_time=20.0)
+        s3 = make_session("abc", last_message_time=30.0, opened=False)
+        for s in [s1, s2, s3]:
+            pool.add("abc", s)
+        assert pool.get("abc") is s2
+        assert pool.get("def") is None
+
+    def test_can_connect(self):
+        pool = SessionPool(max_sessions_per_peer=2)
+        assert pool.can_connect("abc")
+        assert pool.can_connect("abc", connecting=1)
+        assert not pool.can_connect("abc", connecting=2)
+        pool.add("abc", make_session("abc"))
+        assert not pool.can_connect("abc", connecting=1)
+        pool.change_config(3, 100)
+        assert pool.can_connect("abc", connecting=1)
+        assert pool.idle_timeout == 100
+
+    def test_waiting(self):
+        pool = SessionPool()
+        assert pool.pop_waiting("abc") == []
+        for i in range(4):
+            pool.wait("abc", i)
+        pool.wait("def", 10)
+        assert set(pool.get_waiting_peers()) == {"abc", "def"}
+        assert pool.pop_waiting("abc", 1) == [0]
+        assert pool.pop_waiting("abc", 2) == [1, 2]
+        assert pool.pop_waiting("abc") == [3]
+        assert pool.get_waiting_peers() == ["def"]
+        assert pool.pop_waiting("def", 5) == [10]
+        assert pool.get_waiting_peers() == []
+
+    def test_remove_idle(self):
+        pool = SessionPool(max_sessions_per_peer=2, idle_timeout=10)
+        s1 = make_session("abc", last_message_time=0.0)
+        s2 = make_session("abc", last_message_time=5.0)
+        s3 = make_session("def", last_message_time=0.0, busy=True)
+        pool.add("abc", s1)
+        pool.add("abc", s2)
+        pool.add("def", s3)
+        assert pool.remove_idle(10.0) == []
+        assert pool.remove_idle(12.0) == [s1]
+        assert s1 not in pool
+        assert s2 in pool and s3 in pool
+        assert pool.remove_idle(100.0) == [s2]
+        assert s3 in pool
@@ -7,6 +7,7 @@ from unittest import TestCase
 from mock import MagicMock
 
 from golem.core.common import config_logging
+from golem.core.databuffer import DataBuffer
 from golem.core.keysauth import EllipticalKeysAuth
 from golem.core.variables import BUFF_SIZE
 from golem.network.transport.message import MessageDisconnect
@@ -197,6 +198,21 @@ class TestBasicProtocol(LogTestCase):
         protocol.dataReceived(packed_data)
         self.assertEqual(protocol.session.interpret.call_args[0][0].get_type(), m.get_type())
 
+    def test_buffer_overflow(self):
+        protocol = BasicProtocol()
+        protocol.opened = True
+        protocol.session = MagicMock()
+        protocol.transport = MagicMock()
+        protocol.db = DataBuffer(max_size=10)
+        protocol.dataReceived(struct.pack("!L", 100) + "abc")
+        assert protocol.db.data_size() == 7
+        with self.assertLogs(logger, level="ERROR") as logs:
+            protocol.dataReceived("x" * 10)
+        assert "message size 100" in logs.output[0]
+        assert protocol.transport.abortConnection.called
+        assert not protocol.opened
+        assert not protocol.session.interpret.called
+
 
 class TestSocketAddress(TestCase):
     def test_zone_index(self):
@@ -5,7 +5,8 @@ from mock import patch, MagicMock
 
 from golem.tools.testwithdatabase import TestWithDatabase
 from golem.tools.assertlogs import LogTestCase
-from golem.ranking.ranking import DiscreteTimeRoundOracle, logger, Ranking, RankingDatabase, RankingStats
+from golem.ranking.ranking import (logger, Ranking, RankingDatabase, RankingStats, BufferedRankingDatabase,
+                                  TrustCache)
 from golem.client import Client
 
 
@@ -95,36 +96,141 @@ class TestRankingDatabase(TestWithDatabase):
         self.assertEqual(nr.requesting_trust_value, -0.2)
 
 
-class TestDiscreteTimeOracle(TestCase):
-    @patch("golem.ranking.ranking.time")
-    def test_oracle(self, mock_time):
+class TestBufferedRankingDatabase(TestWithDatabase):
+    def test_local_rank(self):
+        bdb = BufferedRankingDatabase()
+        RankingDatabase.increase_positive_computing("ABC", 1.0)
+        bdb.increase_positive_computing("ABC", 2.0)
+        bdb.increase_positive_computing("ABC", 0.5)
+        bdb.increase_negative_payment("DEF", 3.0)
+
+        # pending increments are visible before flush
+        assert RankingDatabase.get_local_rank("ABC").positive_computed == 1.0
+        assert RankingDatabase.get_local_rank("DEF") is None
+        assert bdb.get_local_rank("ABC").positive_computed == 3.5
+        assert bdb.get_local_rank("DEF").negative_payment == 3.0
+        assert bdb.get_local_rank("DEF").positive_payment == 0.0
+        assert bdb.get_local_rank("GHI") is None
+        assert {r.node_id: r.positive_computed for r in bdb.get_all_local_rank()} == {"ABC": 3.5, "DEF": 0.0}
+        assert [r.node_id for r in bdb.get_local_ranks(["DEF", "GHI"])] == ["DEF"]
+        assert bdb.pop_changed() == {"ABC", "DEF"}
+        assert bdb.pop_changed() == set()
+        assert bdb.pending() == 2
+
+        bdb.flush()
+        assert bdb.pending() == 0
+        assert RankingDatabase.get_local_rank("ABC").positive_computed == 3.5
+        assert RankingDatabase.get_local_rank("DEF").negative_payment == 3.0
+        assert bdb.get_local_rank("ABC").positive_computed == 3.5
+
+        bdb.increase_wrong_computed("ABC", 1.0)
+        bdb.flush()
+        lr = RankingDatabase.get_local_rank("ABC")
+        assert lr.positive_computed == 3.5
+        assert lr.wrong_computed == 1.0
+
+    def test_neighbour_rank(self):
+        bdb = BufferedRankingDatabase()
+        RankingDatabase.insert_or_update_neighbour_loc_rank("ABC", "DEF", (0.2, 0.3))
+        bdb.insert_or_update_neighbour_loc_rank("ABC", "DEF", (-0.3, 0.9))
+        bdb.insert_or_update_neighbour_loc_rank("DEF", "ABC", (0.5, -0.2))
+        bdb.insert_or_update_neighbour_loc_rank("ABC", "ABC", (0.5, -0.2))
+        assert bdb.pending() == 2
+        nr = bdb.get_neighbour_loc_rank("ABC", "DEF")
+        assert (nr.computing_trust_value, nr.requesting_trust_value) == (-0.3, 0.9)
+        assert RankingDatabase.get_neighbour_loc_rank("DEF", "ABC") is None
+
+        bdb.flush()
+        nr = RankingDatabase.get_neighbour_loc_rank("ABC", "DEF")
+        assert (nr.computing_trust_value, nr.requesting_trust_value) == (-0.3, 0.9)
+        nr = bdb.get_neighbour_loc_rank("DEF", "ABC")
+        assert (nr.computing_trust_value, nr.requesting_trust_value) == (0.5, -0.2)
+        assert bdb.get_neighbour_loc_rank("ABC", "ABC") is None
+
+    def test_needs_flush(self):
+        bdb = BufferedRankingDatabase(flush_interval=1000, max_pending=3)
+        assert not bdb.needs_flush()
+        bdb.increase_positive_resource("ABC", 1.0)
+        bdb.insert_or_update_neighbour_loc_rank("ABC", "DEF", (0.2, 0.3))
+        assert not bdb.needs_flush()
+        bdb.increase_negative_resource("DEF", 1.0)
+        assert bdb.needs_flush()
+        bdb.flush()
+        assert not bdb.needs_flush()
+
+        bdb.increase_positive_requested("ABC", 1.0)
+        bdb.last_flush -= 1000
+        assert bdb.needs_flush()
 
-        oracle = DiscreteTimeRoundOracle(200, 50, 110, 1000)
-        assert oracle.break_time == 200
-        assert oracle.round_time == 50
-        assert oracle.end_round_time == 110
-        assert oracle.stage_time == 1000
+    def test_flush_failure(self):
+        bdb = BufferedRankingDatabase()
+        bdb.increase_positive_computing("ABC", 2.0)
+        bdb.insert_or_update_neighbour_loc_rank("ABC", "DEF", (0.2, 0.3))
+        with patch("golem.ranking.ranking.NeighbourLocRank.create", side_effect=Exception("error")):
+            with self.assertRaises(Exception):
+                bdb.flush()
+        # nothing is written, changes are kept for the next flush
+        assert RankingDatabase.get_local_rank("ABC") is None
+        assert bdb.pending() == 2
+        bdb.flush()
+        assert RankingDatabase.get_local_rank("ABC").positive_computed == 2.0
+        assert RankingDatabase.get_neighbour_loc_rank("ABC", "DEF") is not None
 
-        # During round
-        mock_time.time.return_value = 1475850990.931
-        assert int(oracle.sec_to_round()) == 329
-        assert int(oracle.sec_to_end_round()) == 19
-        assert int(oracle.sec_to_break()) == 129
-        assert int(oracle.sec_to_new_stage()) == 9
+    def test_many_nodes(self):
+        bdb = BufferedRankingDatabase()
+        for i in range(1500):
+            bdb.increase_positive_computing("node{}".format(i), 1.0)
+        bdb.flush()
+        for i in range(0, 3000, 2):
+            bdb.increase_positive_computing("node{}".format(i), 1.0)
+        bdb.flush()
+        ranks = {r.node_id: r.positive_computed for r in RankingDatabase.get_all_local_rank()}
+        assert len(ranks) == 2250
+        assert ranks["node0"] == 2.0
+        assert ranks["node1"] == 1.0
+        assert ranks["node2000"] == 1.0
+        assert len(bdb.get_local_ranks(ranks.keys())) == 2250
 
-        # During end round
-        mock_time.time.return_value = 1475851010.931
-        assert int(oracle.sec_to_round()) == 309
-        assert int(oracle.sec_to_end_round()) == 359
-        assert int(oracle.sec_to_break()) == 109
-        assert int(oracle.sec_to_new_stage()) == 989
 
-        # During break
-        mock_time.time.return_value = 1475851140.931
-        assert int(oracle.sec_to_round()) == 179
-        assert int(oracle.sec_to_end_round()) == 229
-        assert int(oracle.sec_to_break()) == 339
-        assert int(oracle.sec_to_new_stage()) == 859
+class TestTrustCache(TestCase):
+    def test_cache(self):
+        tc = TrustCache(max_size=2)
+        assert tc.get("ABC", True) is None
+        tc.put("ABC", True, 0.5, True, tc.generation)
+        tc.put("ABC", False, -0.5, True, tc.generation)
+        tc.put("DEF", True, 0.1, False, tc.generation)
+        assert tc.get("ABC", True) == 0.5
+        assert tc.get("ABC", False) == -0.5
+        assert tc.get("DEF", True) == 0.1
+        assert tc.get("DEF", False) is None
+        assert len(tc) == 3
+
+        tc.invalidate("ABC")
+        assert tc.get("ABC", True) is None
+        assert tc.get("ABC", False) is None
+        assert tc.get("DEF", True) == 0.1
+
+        tc.put("GHI", True, 0.2, True, tc.generation)
+        tc.invalidate("GHI", derived=True)
+        assert len(tc) == 0
+
+        tc.put("ABC", True, 0.3, False, tc.generation)
+        tc.invalidate_derived()
+        assert tc.get("ABC", True) is None
+
+    def test_stale_value(self):
+        tc = TrustCache()
+        generation = tc.generation
+        tc.invalidate("ABC")
+        tc.put("ABC", True, 0.5, True, generation)
+        assert tc.get("ABC", True) is None
+
+    def test_max_size(self):
+        tc = TrustCache(max_size=2)
+        for node_id in ["ABC", "DEF", "GHI"]:
+            tc.put(node_id, True, 0.5, False, tc.generation)
+        assert len(tc) == 1
+        assert tc.get("GHI", True) == 0.5
 
 
 class TestRanking(TestWithDatabase, LogTestCase):
@@ -158,13 +264,73 @@ class TestRanking(TestWithDatabase, LogTestCase):
         result = r.get_computing_trust("ABC")
         self.assertEqual(result, expected)
 
-    def test_without_reactor(self):
+    def test_trust_cache(self):
         r = Ranking(MagicMock(spec=Client))
+        r.neighbours = ["ABC"]
+        r.increase_trust("ABC", RankingStats.payment, 50)
+        r.increase_trust("DEF", RankingStats.payment, 10)
+        comp_trust = r.get_computing_trust("DEF")
+        req_trust = r.get_requesting_trust("DEF")
+        unknown_trust = r.get_computing_trust("XYZ")
+        assert req_trust > 0
+
+        # cached values are returned without touching the database
+        with patch.object(r.db, "get_local_rank", side_effect=Exception("database used")), \
+                patch.object(r.db, "get_global_rank", side_effect=Exception("database used")):
+            assert r.get_computing_trust("DEF") == comp_trust
+            assert r.get_requesting_trust("DEF") == req_trust
+            assert r.get_computing_trust("XYZ") == unknown_trust
+
+        r.decrease_trust("DEF", RankingStats.payment, 10)
+        assert r.get_requesting_trust("DEF") < req_trust
+        assert r.get_computing_trust("XYZ") == unknown_trust
+
+        # trust counted from neighbours' ranks changes with them
+        r.client.collect_neighbours_loc_ranks.return_value = [["ABC", "XYZ", [0.9, 0.9]]]
+        r.sync_network()
+        neighbours_trust = r.get_computing_trust("XYZ")
+        assert neighbours_trust > unknown_trust
+        r.decrease_trust("ABC", RankingStats.payment, 100)
+        assert r.get_computing_trust("XYZ") < neighbours_trust
+
+        r.client.get_neighbours_degree.return_value = {}
+        r._Ranking__set_k()
+        assert r.get_computing_trust("XYZ") == unknown_trust
+
+    def test_convergence_rounds(self):
+        r = Ranking(MagicMock(spec=Client), convergence_rounds=3)
+        r.client.get_neighbours_degree.return_value = {'ABC': 4}
+        # the node was running when the epoch started
+        r.reactor = MagicMock()
+        r.reactor.seconds.return_value = r.epoch_length + 10
+        r.epoch = 0
+        r.client.collect_gossip.return_value = []
+        r.increase_trust("DEF", RankingStats.computed, 10)
+        for i in range(3):
+            r._Ranking__make_round()
+            assert r.client.send_gossip.call_count == i + 1
+            assert RankingDatabase.get_global_rank("DEF") is None
+        # the estimate didn't change, so it's converged
+        r._Ranking__make_round()
+        assert r.client.send_gossip.call_count == 3
+        assert RankingDatabase.get_global_rank("DEF").computing_trust_value == 0.2
+        assert RankingDatabase.get_global_rank("DEF").gossip_weight_computing == 0.125
+
+        # received estimate that differs from own one is gossiped again
+        r.client.collect_gossip.return_value = [[["DEF", 1, [[0.5, 0.5], [0.0, 0.5]]]]]
+        r._Ranking__make_round()
+        assert r.client.send_gossip.call_count == 4
+        assert r.unconverged["DEF"] == 2
+
+    def test_without_reactor(self):
+        r = Ranking(MagicMock(spec=Client), convergence_rounds=1)
         r.client.get_neighbours_degree.return_value = {'ABC': 4, 'JKL': 2, 'MNO': 5}
-        r.client.collect_stopped_peers.return_value = set()
         reactor = MagicMock()
         r.run(reactor)
         assert r.reactor == reactor
+        assert reactor.callLater.call_args[0][0] == r.gossip_interval
+        reactor.seconds.return_value = 3 * r.epoch_length + 10
+        r.epoch = 2
         r.increase_trust("ABC", RankingStats.computed, 1)
         r.increase_trust("DEF", RankingStats.requested, 1)
         r.increase_trust("DEF", RankingStats.payment, 1)
@@ -180,83 +346,131 @@ class TestRanking(TestWithDatabase, LogTestCase):
         with self.assertLogs(logger, level="WARNING"):
             r.decrease_trust("XYZ", "UNKNOWN", 1)
 
-        r._Ranking__init_stage()
-        assert not r.finished
-        assert not r.global_finished
-        assert r.step == 0
-        assert len(r.finished_neighbours) == 0
-        for v in r.working_vec.itervalues():
-            assert v[0][1] == 1.0
-            assert v[1][1] == 1.0
-        assert r.working_vec["ABC"][0][0] > 0.0
-        assert r.working_vec["ABC"][1][0] == 0.0
-        assert r.working_vec["DEF"][0][0] < 0.0
-        assert r.working_vec["DEF"][1][0] > 0.0
-        assert r.working_vec["GHI"][0][0] == 0.0
-        assert r.working_vec["GHI"][1][0] == 0.0
-        assert r.working_vec["XYZ"][0][0] < 0.0
-        assert r.working_vec["XYZ"][1][0] < 0.0
-
+        r.client.collect_gossip.return_value = []
+        r._Ranking__make_round()
+        assert r.k == 1
+        assert set(r.neighbours) == {'ABC', 'JKL', 'MNO'}
+        assert set(r.contributed) == {"ABC", "DEF", "GHI", "XYZ"}
         assert r.prevRank["ABC"][0] > 0
         assert r.prevRank["ABC"][1] == 0
         assert r.prevRank["DEF"][0] < 0
         assert r.prevRank["DEF"][1] > 0
-        assert r.prevRank["GHI"][0] == 0
-        assert r.prevRank["GHI"][1] == 0
+        assert r.prevRank["GHI"] == [0, 0]
         assert r.prevRank["XYZ"][0] < 0
         assert r.prevRank["XYZ"][1] < 0
 
-        r._Ranking__new_round()
-        assert set(r.neighbours) == {'ABC', 'JKL', 'MNO'}
-        assert r.k == 1
-        assert r.step == 1
-        assert len(r.received_gossip[0]) == 4
-        found = False
-        for gossip in r.received_gossip[0]:
-            if gossip[0] == "DEF":
-                found = True
-                assert gossip[1][0][0] < 0
-                assert gossip[1][0][0] > r.working_vec["DEF"][0][0]
-                assert gossip[1][0][1] == 0.5
-                assert gossip[1][1][0] > 0
-                assert gossip[1][0][0] < r.working_vec["DEF"][1][0]
-                assert gossip[1][0][1] == 0.5
-        assert found
-        assert r.client.send_gossip.called
-        assert r.client.send_gossip.call_args[0][0] == r.received_gossip[0]
-        assert r.client.send_gossip.call_args[0][1][0] in ["ABC", "JKL", "MNO"]
+        # each node keeps one share and sends the other one to a random neighbour
+        gossip, send_to = r.client.send_gossip.call_args[0]
+        assert len(send_to) == 1
+        assert send_to[0] in ["ABC", "JKL", "MNO"]
+        assert {epoch for _, epoch, _ in gossip} == {3}
+        gossip = {node_id: share for node_id, _, share in gossip}
+        assert set(gossip) == {"ABC", "DEF", "GHI", "XYZ"}
+        assert gossip["DEF"][0][0] < 0
+        assert gossip["DEF"][0][1] == 0.5
+        assert gossip["DEF"][1][0] > 0
+        assert gossip["DEF"][1][1] == 0.5
+        assert r.working_vec["DEF"] == gossip["DEF"]
+        assert not r.unconverged
+        # estimates aren't saved until they stop changing
+        assert RankingDatabase.get_global_rank("DEF") is None
 
-        r.client.collect_neighbours_loc_ranks.return_value = [['ABC', 'XYZ', [-0.2, -0.5]],
-                                                              ['JKL', 'PQR', [0.8, 0.7]]]
-        r.sync_network()
+        r.client.send_gossip.reset_mock()
+        r._Ranking__make_round()
+        assert not r.client.send_gossip.called
+        assert RankingDatabase.get_global_rank("DEF").computing_trust_value < 0
+        assert RankingDatabase.get_global_rank("DEF").requesting_trust_value > 0
+        assert RankingDatabase.get_global_rank("GHI").computing_trust_value == 0
+        assert not r.unsaved
 
-        r.client.collect_gossip.return_value = [[["MNO", [[0.2, 0.2], [-0.1, 0.3]]],
-                                                ["ABC", [[0.3, 0.5], [0.3, 0.5]]]]]
-        r._Ranking__end_round()
-        assert len(r.prevRank) == 4
-        assert len(r.received_gossip) == 0
-        assert len(r.working_vec) == 5
-        assert r.working_vec["ABC"][0][0] > r.prevRank["ABC"][0]
-        assert r.working_vec["MNO"][1][0] < 0.0
-        assert not r.finished
-        assert not r.global_finished
-
-        r._Ranking__make_break()
-        r._Ranking__new_round()
-        assert r.step == 2
+        # only estimates that differ from the received ones are gossiped further
+        r.client.collect_gossip.return_value = [[["MNO", 3, [[0.2, 0.2], [-0.1, 0.3]]],
+                                                 ["ABC", 3, [[0.3, 0.5], [0.3, 0.5]]],
+                                                 ["GHI", 3, [[0.0, 0.5], [0.0, 0.5]]]]]
+        r._Ranking__make_round()
+        gossip = {node_id: share for node_id, _, share in r.client.send_gossip.call_args[0][0]}
+        assert set(gossip) == {"MNO", "ABC"}
+        assert gossip["MNO"] == [[0.1, 0.1], [-0.05, 0.15]]
+        assert r.working_vec["GHI"] == [[0.0, 1.0], [0.0, 1.0]]
+        assert r.prevRank["ABC"][0] > RankingDatabase.get_global_rank("ABC").computing_trust_value
+
+        # local rank changes are added to the current estimates
         r.client.collect_gossip.return_value = []
-        r._Ranking__end_round()
-        assert r.finished
-        r.client.send_stop_gossip.assert_called_with()
-        r.client.collect_stopped_peers.return_value = {"ABC", "JKL"}
-        r._Ranking__make_break()
-        assert not r.global_finished
-        r.client.collect_stopped_peers.return_value = {"MNO"}
-        r._Ranking__make_break()
-        assert r.global_finished
+        r.increase_trust("DEF", RankingStats.payment, 25)
+        r._Ranking__make_round()
+        gossip = {node_id: share for node_id, _, share in r.client.send_gossip.call_args[0][0]}
+        assert set(gossip) == {"DEF"}
+        assert gossip["DEF"][1][1] == 0.25
+        assert r.contributed["DEF"][1] == 0.52
+        assert r.working_vec["DEF"][1][0] > 0
 
+        with self.assertLogs(logger, level="ERROR"):
+            r.client.collect_gossip.return_value = [[["ABC", 3, [[0.3], [0.3, 0.5]]]]]
+            r._Ranking__make_round()
 
+        r.client.collect_gossip.return_value = []
+        r._Ranking__make_round()
+        r._Ranking__make_round()
+        assert RankingDatabase.get_global_rank("ABC").computing_trust_value == r.prevRank["ABC"][0]
+        assert RankingDatabase.get_global_rank("MNO").requesting_trust_value == r.prevRank["MNO"][1]
+        r.client.send_gossip.reset_mock()
+        r._Ranking__make_round()
+        assert not r.client.send_gossip.called
 
+        r.client.collect_neighbours_loc_ranks.return_value = [['ABC', 'XYZ', [-0.2, -0.5]],
+                                                              ['JKL', 'PQR', [0.8, 0.7]]]
+        r.sync_network()
+        assert r.db.get_neighbour_loc_rank('ABC', 'XYZ').computing_trust_value == -0.2
+        r.quit()
+        assert r.db.pending() == 0
+        assert RankingDatabase.get_local_rank("ABC").positive_computed == 1
+        assert RankingDatabase.get_neighbour_loc_rank('JKL', 'PQR').requesting_trust_value == 0.7
+
+    def test_epochs(self):
+        r = Ranking(MagicMock(spec=Client), convergence_rounds=1)
+        r.client.get_neighbours_degree.return_value = {'ABC': 1}
+        r.reactor = MagicMock()
+        r.reactor.seconds.return_value = 2 * r.epoch_length + 10
+        r.increase_trust("DEF", RankingStats.computed, 10)
 
+        # a node that joins in the middle of an epoch only passes gossip on
+        r.client.collect_gossip.return_value = [[["GHI", 2, [[0.5, 1.0], [0.5, 1.0]]],
+                                                 ["JKL", 1, [[0.5, 1.0], [0.5, 1.0]]]]]
+        r._Ranking__make_round()
+        assert r.epoch == 2
+        assert not r.contributed
+        gossip, _ = r.client.send_gossip.call_args[0]
+        assert gossip == [["GHI", 2, [[0.25, 0.5], [0.25, 0.5]]]]
+
+        # a node restarted in the same epoch doesn't add its local ranks again
+        r.client.collect_gossip.return_value = []
+        r._Ranking__make_round()
+        assert RankingDatabase.get_global_rank("GHI").computing_trust_value == 0.5
+        restarted = Ranking(r.client, convergence_rounds=1)
+        restarted.reactor = r.reactor
+        restarted._Ranking__make_round()
+        assert restarted.epoch == 2
+        assert not restarted.contributed
+        assert not restarted.working_vec
 
+        # the next epoch starts again from local ranks, saved global ranks are kept
+        r.reactor.seconds.return_value = 3 * r.epoch_length
+        r.client.send_gossip.reset_mock()
+        r._Ranking__make_round()
+        assert r.epoch == 3
+        assert set(r.contributed) == {"DEF"}
+        assert set(r.working_vec) == {"DEF"}
+        gossip, _ = r.client.send_gossip.call_args[0]
+        assert gossip == [["DEF", 3, [[0.1, 0.5], [0.0, 0.5]]]]
+        assert RankingDatabase.get_global_rank("GHI").computing_trust_value == 0.5
 
+        # gossip from the next epoch starts it, gossip from later ones is ignored
+        r.client.collect_gossip.return_value = [[["GHI", 5, [[0.5, 1.0], [0.5, 1.0]]]]]
+        r._Ranking__make_round()
+        assert r.epoch == 3
+        assert "GHI" not in r.working_vec
+        r.client.collect_gossip.return_value = [[["GHI", 4, [[0.5, 1.0], [0.5, 1.0]]]]]
+        r._Ranking__make_round()
+        assert r.epoch == 4
+        assert r.working_vec["GHI"] == [[0.25, 0.5], [0.25, 0.5]]
+        assert r.working_vec["DEF"] == [[0.1, 0.5], [0.0, 0.5]]
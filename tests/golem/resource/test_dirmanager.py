@@ -85,6 +85,16 @@ class TestDirManager(TestDirFixture):
         resDir = dm.get_task_resource_dir(task_id, create=True)
         self.assertTrue(os.path.isdir(resDir))
 
+    def testHasTaskResources(self):
+        dm = DirManager(self.path)
+        task_id = '12345'
+        self.assertFalse(dm.has_task_resources(task_id))
+        res_dir = dm.get_task_resource_dir(task_id)
+        self.assertFalse(dm.has_task_resources(task_id))
+        with open(os.path.join(res_dir, 'file'), 'w') as f:
+            f.write('resource')
+        self.assertTrue(dm.has_task_resources(task_id))
+
     def testGetTaskOutputDir(self):
         dm = DirManager(self.path)
         task_id = '12345'
@@ -1,11 +1,12 @@
 import os
+import pickle
 import shutil
 import uuid
 
 from golem.core.fileencrypt import FileEncryptor
 from golem.resource.dirmanager import DirManager
 from golem.task.result.resultpackage import ZipPackager, EncryptingPackager, EncryptingTaskResultPackager, \
-    ExtractedPackage
+    ExtractedPackage, StreamingEncryptingPackager
 from golem.task.taskbase import result_types
 from golem.tools.testdirfixture import TestDirFixture
 
@@ -125,6 +126,49 @@ class TestEncryptingPackager(TestDirFixture):
         shutil.rmtree(self.out_dir)
 
 
+class TestStreamingEncryptingPackager(TestDirFixture):
+
+    def setUp(self):
+        TestDirFixture.setUp(self)
+
+        self.task_id = str(uuid.uuid4())
+        self.dir_manager = DirManager(self.path)
+        self.secret = FileEncryptor.gen_secret(10, 20)
+        MockDirContents.populate(self, self.dir_manager, self.task_id)
+
+    def testCreateAndExtract(self):
+        sp = StreamingEncryptingPackager(self.secret)
+        sp.buffer_size = 64
+        path = sp.create(self.out_path, self.files, self.pickle_files)
+        self.assertTrue(os.path.exists(path))
+
+        extract_dir = os.path.join(self.out_dir, 'extracted')
+        files, out_dir = sp.extract(path, output_dir=extract_dir)
+
+        self.assertEqual(out_dir, extract_dir)
+        self.assertEqual(sorted(files), sorted(self.file_list))
+        with open(os.path.join(out_dir, 'dir_file')) as f:
+            self.assertEqual(f.read(), "Dir file contents")
+        with open(os.path.join(out_dir, 'pickle1')) as f:
+            self.assertEqual(pickle.loads(f.read()), 'pickle_data1')
+        # the package is left untouched
+        self.assertTrue(os.path.exists(path))
+
+    def testExtractWithWrongSecret(self):
+        StreamingEncryptingPackager(self.secret).create(self.out_path, self.files, self.pickle_files)
+        with self.assertRaises(Exception):
+            StreamingEncryptingPackager(self.secret + "0").extract(self.out_path)
+
+    def testExtractInvalidFileName(self):
+        sp = StreamingEncryptingPackager(self.secret)
+        with sp.generator(self.out_path) as tar:
+            sp.write_pickle_file(tar, os.path.join(os.pardir, 'outside'), 'data')
+
+        with self.assertRaises(ValueError):
+            sp.extract(self.out_path)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.out_dir), 'outside')))
+
+
 class TestEncryptingTaskResultPackager(TestDirFixture):
 
     def setUp(self):
@@ -0,0 +1,105 @@
+import unittest
+
+from mock import Mock
+
+from golem.task.speculation import SpeculationPolicy, TaskSpeculation
+from golem.task.taskstate import SubtaskState, SubtaskStatus
+
+
+def subtask_state(subtask_id, time_started, status=SubtaskStatus.starting, progress=0.0,
+                  last_progress_time=0):
+    ss = SubtaskState()
+    ss.subtask_id = subtask_id
+    ss.subtask_status = status
+    ss.time_started = time_started
+    ss.subtask_progress = progress
+    ss.last_progress_time = last_progress_time
+    return ss
+
+
+class TestSpeculationPolicy(unittest.TestCase):
+    def test_get_max_duplicates(self):
+        policy = SpeculationPolicy(max_duplicates=0.1)
+        assert policy.get_max_duplicates(5) == 1
+        assert policy.get_max_duplicates(100) == 10
+
+
+class TestTaskSpeculation(unittest.TestCase):
+    def setUp(self):
+        self.spec = TaskSpeculation(SpeculationPolicy(min_finished=3, max_duplicates=0.5))
+        self.task = Mock()
+        self.task.needs_computation.return_value = False
+        self.task.get_progress.return_value = 0.8
+        self.task.get_total_tasks.return_value = 10
+
+    def test_groups(self):
+        self.spec.stragglers = ["aa"]
+        self.spec.add_duplicate("aa", "aa2")
+        self.spec.add_duplicate("aa", "aa3")
+        assert self.spec.get_group("aa") == ["aa", "aa2", "aa3"]
+        assert self.spec.get_group("aa3") == ["aa", "aa2", "aa3"]
+        assert self.spec.get_group("bb") == ["bb"]
+        assert self.spec.is_duplicate("aa2")
+        assert not self.spec.is_duplicate("aa")
+        assert self.spec.stragglers == []
+        assert self.spec.stats.issued == 2
+
+    def test_get_typical_duration(self):
+        assert self.spec.get_typical_duration() is None
+        for duration in [10.0, 30.0]:
+            self.spec.subtask_computed(duration)
+        assert self.spec.get_typical_duration() is None
+        self.spec.subtask_computed(20.0)
+        assert self.spec.get_typical_duration() == 20.0
+
+    def test_get_projected_duration(self):
+        assert TaskSpeculation.get_projected_duration(subtask_state("aa", 100.0), 130.0) == 30.0
+        # 10% computed in 20 seconds
+        ss = subtask_state("aa", 100.0, progress=0.1, last_progress_time=120.0)
+        assert TaskSpeculation.get_projected_duration(ss, 130.0) == 200.0
+
+    def test_find_stragglers(self):
+        for duration in [10.0, 10.0, 10.0]:
+            self.spec.subtask_computed(duration)
+        now = 1000.0
+        states = {
+            "fast": subtask_state("fast", now - 5),
+            "slow": subtask_state("slow", now - 20),
+            "slowest": subtask_state("slowest", now - 10, progress=0.1, last_progress_time=now - 5),
+            "done": subtask_state("done", now - 100, status=SubtaskStatus.finished),
+        }
+        self.spec.find_stragglers(self.task, states, now)
+        assert self.spec.stragglers == ["slowest", "slow"]
+
+        # duplicates aren't duplicated and each subtask has at most max_copies copies
+        states["slow2"] = subtask_state("slow2", now - 100)
+        self.spec.add_duplicate("slow", "slow2")
+        self.spec.find_stragglers(self.task, states, now)
+        assert self.spec.stragglers == ["slowest"]
+
+        # no more than max_duplicates copies for the task
+        self.spec.policy.max_duplicates = 0.1
+        self.spec.find_stragglers(self.task, states, now)
+        assert self.spec.stragglers == []
+
+    def test_find_stragglers_policy(self):
+        for duration in [10.0, 10.0, 10.0]:
+            self.spec.subtask_computed(duration)
+        states = {"slow": subtask_state("slow", 0.0)}
+
+        self.spec.find_stragglers(self.task, states, 100.0)
+        assert self.spec.stragglers == ["slow"]
+
+        self.task.get_progress.return_value = 0.5
+        self.spec.find_stragglers(self.task, states, 100.0)
+        assert self.spec.stragglers == []
+
+        self.task.get_progress.return_value = 0.8
+        self.task.needs_computation.return_value = True
+        self.spec.find_stragglers(self.task, states, 100.0)
+        assert self.spec.stragglers == []
+
+        self.task.needs_computation.return_value = False
+        self.spec.policy.enabled = False
+        self.spec.find_stragglers(self.task, states, 100.0)
+        assert self.spec.stragglers == []
@@ -26,3 +26,18 @@ class TestTaskClient(unittest.TestCase):
 
         tc.reject()
         assert tc.rejected()
+
+    def test_cancel(self):
+        tc = TaskClient(str(uuid.uuid4()))
+        tc.start()
+        tc.start()
+        tc.finish()
+
+        tc.cancel(finishing=True)
+        assert tc.started() == 1
+        assert not tc.finishing()
+        assert not tc.accepted()
+        assert not tc.rejected()
+
+        tc.cancel()
+        assert not tc.started()
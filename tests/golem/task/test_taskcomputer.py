@@ -5,10 +5,10 @@ from golem.client import ClientTaskComputerEventListener
 from golem.clientconfigdescriptor import ClientConfigDescriptor
 from golem.core.common import timeout_to_deadline
 from golem.task.taskbase import ComputeTaskDef
-from golem.task.taskcomputer import TaskComputer, PyTaskThread
+from golem.task.taskcomputer import TaskComputer, TaskResources, PyTaskThread
 from golem.tools.assertlogs import LogTestCase
 from golem.tools.testdirfixture import TestDirFixture
-from mock import MagicMock, Mock
+from mock import MagicMock, Mock, patch
 
 
 class TestTaskComputer(TestDirFixture, LogTestCase):
@@ -64,7 +64,25 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         tc2.last_checking = 10 ** 10
 
         tc2.run()
-        tc2.session_timeout()
+        tc2.session_timeout(None)
+
+    @patch("golem.task.taskcomputer.threads")
+    def test_run_evicts_idle_containers(self, threads):
+        task_server = MagicMock()
+        task_server.config_desc = config_desc()
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+        tc.container_pool = Mock()
+        tc.container_pool.evict_idle.return_value = []
+        tc.run()
+        assert tc.container_pool.evict_idle.called
+        assert not threads.deferToThread.called
+
+        # docker calls are made outside the reactor thread
+        evicted = [Mock()]
+        tc.container_pool.evict_idle.return_value = evicted
+        tc.run()
+        threads.deferToThread.assert_called_once_with(tc.container_pool.remove, evicted)
+        assert not tc.container_pool.remove.called
 
     def test_resource_failure(self):
         task_server = MagicMock()
@@ -77,13 +95,22 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         tc.task_resource_failure(task_id, 'reason')
         assert not task_server.send_task_failed.called
 
-        tc.task_to_subtask_mapping[task_id] = subtask_id
+        tc.slots[0].task_id = task_id
+        tc.slots[0].subtask_id = subtask_id
         tc.assigned_subtasks[subtask_id] = Mock()
 
         tc.task_resource_failure(task_id, 'reason')
         assert task_server.send_task_failed.called
+        assert tc.slots[0].is_free()
+        assert subtask_id not in tc.assigned_subtasks
+
+        tc.slots[0].task_id = task_id
+        tc.slots[0].subtask_id = subtask_id
+        tc.assigned_subtasks[subtask_id] = Mock()
 
         tc.resource_request_rejected(subtask_id, 'reason')
+        assert tc.slots[0].is_free()
+        assert subtask_id not in tc.assigned_subtasks
 
     def test_computation(self):
         task_server = MagicMock()
@@ -106,7 +133,7 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         tc.task_given(ctd)
         self.assertEqual(tc.assigned_subtasks["xxyyzz"], ctd)
         self.assertLessEqual(tc.assigned_subtasks["xxyyzz"].deadline, timeout_to_deadline(10))
-        self.assertEqual(tc.task_to_subtask_mapping["xyz"], "xxyyzz")
+        self.assertEqual(tc.slots[0].subtask_id, "xxyyzz")
         tc.task_server.request_resource.assert_called_with("xyz",  tc.resource_manager.get_resource_header("xyz"),
                                                            "10.10.10.10", 10203, "key", "owner")
         assert tc.task_resource_collected("xyz")
@@ -116,9 +143,11 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         task_server.send_task_failed.assert_called_with("xxyyzz", "xyz", "Host direct task not supported",
                                                         "10.10.10.10", 10203, "key", "owner", "ABC")
 
+        # resources of the task are already collected, so the computation starts at once
         tc.support_direct_computation = True
+        tc.task_server.request_resource.reset_mock()
         tc.task_given(ctd)
-        assert tc.task_resource_collected("xyz")
+        tc.task_server.request_resource.assert_not_called()
         assert not tc.waiting_for_task
         assert len(tc.current_computations) == 1
         self.__wait_for_tasks(tc)
@@ -147,10 +176,8 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         tc.task_given(ctd)
         self.assertEqual(tc.assigned_subtasks["aabbcc"], ctd)
         self.assertLessEqual(tc.assigned_subtasks["aabbcc"].deadline, timeout_to_deadline(5))
-        self.assertEqual(tc.task_to_subtask_mapping["xyz"], "aabbcc")
-        tc.task_server.request_resource.assert_called_with("xyz",  tc.resource_manager.get_resource_header("xyz"),
-                                                           "10.10.10.10", 10203, "key", "owner")
-        self.assertTrue(tc.task_resource_collected("xyz"))
+        self.assertEqual(tc.slots[0].subtask_id, "aabbcc")
+        tc.task_server.request_resource.assert_not_called()
         self.__wait_for_tasks(tc)
 
         self.assertFalse(tc.counting_task)
@@ -163,7 +190,6 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         ctd.src_code = "print 'Hello world'"
         ctd.timeout = timeout_to_deadline(5)
         tc.task_given(ctd)
-        self.assertTrue(tc.task_resource_collected("xyz"))
         self.__wait_for_tasks(tc)
 
         task_server.send_task_failed.assert_called_with("aabbcc2", "xyz", "Wrong result format", "10.10.10.10", 10203,
@@ -172,7 +198,6 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         ctd.subtask_id = "xxyyzz2"
         ctd.timeout = timeout_to_deadline(1)
         tc.task_given(ctd)
-        self.assertTrue(tc.task_resource_collected("xyz"))
         tt = tc.current_computations[0]
         tc.task_computed(tc.current_computations[0])
         self.assertEqual(len(tc.current_computations), 0)
@@ -183,6 +208,110 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
         if tt.is_alive():
             tt.join(timeout=5)
 
+    def test_slots(self):
+        task_server = MagicMock()
+        task_server.get_task_computer_root.return_value = self.path
+        task_server.config_desc = config_desc()
+        task_server.config_desc.num_cores = 8
+        task_server.config_desc.max_memory_size = 4096
+        task_server.config_desc.slot_num_cores = 2
+        task_server.config_desc.accept_tasks = True
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+        assert tc.max_assigned_tasks == 4
+        assert len(tc.slots) == 4
+        assert tc.slot_num_cores == 2
+        assert tc.slot_max_memory_size == 1024
+
+        task_server.config_desc.slot_max_memory_size = 2048
+        tc.change_config(task_server.config_desc, in_background=False)
+        assert tc.max_assigned_tasks == 2
+        assert [slot.index for slot in tc.slots] == [0, 1]
+
+        task_server.request_task.side_effect = ["xyz", "xyz"]
+        tc.last_task_request = 0
+        tc.run()
+        assert task_server.request_task.call_count == 2
+        assert [slot.task_id for slot in tc.slots] == ["xyz", "xyz"]
+        assert tc.waiting_for_task == "xyz"
+        assert tc.task_requested
+
+        ctds = []
+        for subtask_id in ["xxyyzz", "aabbcc"]:
+            ctd = ComputeTaskDef()
+            ctd.task_id = "xyz"
+            ctd.subtask_id = subtask_id
+            ctd.key_id = "key"
+            ctd.task_owner = "owner"
+            ctd.deadline = timeout_to_deadline(10)
+            ctds.append(ctd)
+            assert tc.task_given(ctd)
+        assert not tc.task_given(ctds[0])
+        assert [slot.subtask_id for slot in tc.slots] == ["xxyyzz", "aabbcc"]
+
+        ctd = ComputeTaskDef()
+        ctd.task_id = "abc"
+        ctd.subtask_id = "ddeeff"
+        assert not tc.task_given(ctd)
+        task_server.send_task_failed.assert_called_with("ddeeff", "abc", "No free compute slot",
+                                                        ctd.return_address, ctd.return_port, ctd.key_id,
+                                                        ctd.task_owner, "ABC")
+
+        # both slots wait for resources of the same task
+        assert tc.wait_for_resources("xyz", "delta")
+        assert not tc.wait_for_resources("xyz", "delta")
+        assert tc.task_resources["xyz"].delta == "delta"
+        assert tc.task_resource_collected("xyz")
+        task_server.unpack_delta.assert_called_once_with(tc.dir_manager.get_task_resource_dir("xyz"), "delta",
+                                                         "xyz")
+        assert all(slot.is_free() for slot in tc.slots)
+        assert not tc.assigned_subtasks
+
+        tc.slots[0].task_id = "xyz"
+        tc.session_closed("abc")
+        assert not tc.slots[0].is_free()
+        tc.session_closed("xyz")
+        assert tc.slots[0].is_free()
+
+        # a timed out session frees only slots requesting its task
+        tc.slots[0].task_id = "xyz"
+        tc.slots[1].task_id = "abc"
+        tc.session_timeout(None)
+        tc.session_timeout("abc")
+        assert not tc.slots[0].is_free()
+        assert tc.slots[1].is_free()
+
+    def test_prefetch_resources(self):
+        task_server = MagicMock()
+        task_server.config_desc = config_desc()
+        task_server.get_task_computer_root.return_value = self.path
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+
+        # resources are requested with the task and fetched before a subtask is given
+        assert tc.prefetch_resources("xyz")
+        assert tc.prefetch_resources("xyz")
+        assert tc.wait_for_resources("xyz", "delta")
+        assert not tc.prefetch_resources("xyz")
+
+        ctd = ComputeTaskDef()
+        ctd.task_id = "xyz"
+        ctd.subtask_id = "xxyyzz"
+        ctd.deadline = timeout_to_deadline(10)
+        assert tc.task_given(ctd)
+        task_server.request_resource.assert_not_called()
+        assert tc.slots[0].is_waiting_for_resources("xyz")
+
+        tc.task_resource_collected("xyz", unpack_delta=False)
+        task_server.unpack_delta.assert_not_called()
+        assert tc.task_resources["xyz"].status == TaskResources.collected
+        assert not tc.prefetch_resources("xyz")
+
+        # failed download is requested again with the next subtask
+        tc.task_resource_failure("xyz", "reason")
+        assert "xyz" not in tc.task_resources
+        assert tc.prefetch_resources("xyz")
+        tc.forget_task_resources("xyz")
+        assert "xyz" not in tc.task_resources
+
     def test_change_config(self):
         task_server = MagicMock()
         task_server.config_desc = config_desc()
@@ -227,6 +356,39 @@ class TestTaskComputer(TestDirFixture, LogTestCase):
     def __wait_for_tasks(tc):
         [t.join() for t in tc.current_computations]
 
+    def test_report_progress(self):
+        task_server = MagicMock()
+        task_server.config_desc = config_desc()
+        task_server.get_task_computer_root.return_value = self.path
+        tc = TaskComputer("ABC", task_server, use_docker_machine_manager=False)
+        tc.compute_tasks = False
+
+        threads = [Mock(subtask_id="xxyyzz"), Mock(subtask_id="aabbcc")]
+        threads[0].get_progress.return_value = 0.5
+        threads[1].get_progress.return_value = 0.0
+        tc.current_computations = threads
+        tc.last_progress_report = 0
+        tc.run()
+        task_server.send_subtask_progress.assert_called_once_with("xxyyzz", 0.5)
+        assert tc.last_progress_report > 0
+
+        # unchanged progress isn't sent again, progress that couldn't be sent is retried
+        task_server.send_subtask_progress.reset_mock()
+        task_server.send_subtask_progress.return_value = False
+        threads[1].get_progress.return_value = 0.2
+        tc.last_progress_report = 0
+        tc.run()
+        task_server.send_subtask_progress.assert_called_once_with("aabbcc", 0.2)
+        tc.last_progress_report = 0
+        tc.run()
+        assert task_server.send_subtask_progress.call_count == 2
+        assert tc.reported_progress == {"xxyyzz": 0.5}
+
+        # reports aren't sent more often than every PROGRESS_REPORT_INTERVAL
+        task_server.send_subtask_progress.reset_mock()
+        tc.run()
+        task_server.send_subtask_progress.assert_not_called()
+
 
 class TestTaskThread(TestDirFixture):
     def test_thread(self):
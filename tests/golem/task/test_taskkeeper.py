@@ -8,7 +8,8 @@ from golem.core.common import get_current_time, timeout_to_deadline
 from golem.environments.environment import Environment
 from golem.environments.environmentsmanager import EnvironmentsManager
 from golem.task.taskbase import TaskHeader, ComputeTaskDef
-from golem.task.taskkeeper import TaskHeaderKeeper, CompTaskKeeper, CompSubtaskInfo, logger
+from golem.task.taskkeeper import (TaskHeaderKeeper, CompTaskKeeper, CompSubtaskInfo, RandomAccessSet,
+                                   HeaderVersions, logger)
 from golem.tools.assertlogs import LogTestCase
 
 
@@ -101,6 +102,29 @@ class TestTaskHeaderKeeper(LogTestCase):
         th = tk.get_task()
         self.assertEqual(task_header["task_id"], th.task_id)
 
+    def test_get_task_with_score(self):
+        tk = TaskHeaderKeeper(EnvironmentsManager(), 10)
+        e = Environment()
+        e.accept_tasks = True
+        tk.environments_manager.add_environment(e)
+        assert tk.get_task(lambda th: 1.0) is None
+
+        task_header = get_task_header()
+        for i in range(20):
+            task_header["task_id"] = "task{}".format(i)
+            task_header["max_price"] = 10 + i
+            assert tk.add_task_header(task_header)
+
+        # all tasks are candidates, the best one is chosen
+        th = tk.get_task(lambda th: th.max_price, candidates=20)
+        assert th.task_id == "task19"
+        # only a few random tasks are scored
+        scored = []
+        tk.get_task(lambda th: scored.append(th.task_id), candidates=5)
+        assert len(set(scored)) == 5
+        # tasks scored with None are never chosen
+        assert tk.get_task(lambda th: None, candidates=20) is None
+
     def test_old_tasks(self):
         tk = TaskHeaderKeeper(EnvironmentsManager(), 10)
         e = Environment()
@@ -118,7 +142,7 @@ class TestTaskHeaderKeeper(LogTestCase):
         assert tk.removed_tasks.get("xyz") is None
         assert len(tk.supported_tasks) == 2
         time.sleep(1.1)
-        tk.remove_old_tasks()
+        assert tk.remove_old_tasks() == ["abc"]
         assert tk.task_headers.get("abc") is None
         assert tk.task_headers.get("xyz") is not None
         assert tk.removed_tasks.get("abc") is not None
@@ -126,6 +150,19 @@ class TestTaskHeaderKeeper(LogTestCase):
         assert len(tk.supported_tasks) == 1
         assert tk.supported_tasks[0] == "xyz"
 
+        # updated header has a new deadline
+        task_header["task_id"] = "xyz"
+        task_header["deadline"] = timeout_to_deadline(0.1)
+        assert tk.add_task_header(task_header)
+        time.sleep(0.2)
+        tk.removed_task_timeout = 0.1
+        assert tk.remove_old_tasks() == ["xyz"]
+        assert tk.task_headers.get("xyz") is None
+        assert tk.removed_tasks.get("xyz") is not None
+        # "abc" was removed long enough ago to be forgotten
+        assert tk.removed_tasks.get("abc") is None
+        assert not tk.supported_tasks
+
     def test_task_header_update(self):
         e = Environment()
         e.accept_tasks = True
@@ -149,12 +186,56 @@ class TestTaskHeaderKeeper(LogTestCase):
         assert task_id not in tk.supported_tasks
 
         tk.task_headers = {}
-        tk.supported_tasks = []
+        tk.supported_tasks.clear()
 
         task_header["max_price"] = 1
         assert tk.add_task_header(task_header)
         assert task_id not in tk.supported_tasks
 
+    def test_header_versions(self):
+        tk = TaskHeaderKeeper(EnvironmentsManager(), 10)
+        task_header = get_task_header()
+        task_header["signature"] = "sig1"
+        assert tk.add_task_header(task_header)
+        assert tk.header_versions.changed_since(0) == ["xyz"]
+        version = tk.header_versions.version
+
+        # the same header again isn't a change
+        assert tk.add_task_header(task_header)
+        assert tk.header_versions.version == version
+
+        task_header["signature"] = "sig2"
+        assert tk.add_task_header(task_header)
+        assert tk.header_versions.changed_since(version) == ["xyz"]
+
+        tk.remove_task_header("xyz")
+        assert tk.header_versions.changed_since(0) == []
+
+    def test_resync_after_drop(self):
+        tk = TaskHeaderKeeper(EnvironmentsManager(), 10, remove_task_timeout=-1)
+        task_header = get_task_header()
+        task_header["task_id"] = "alive"
+        assert tk.add_task_header(task_header)
+        task_header = get_task_header()
+        task_header["task_id"] = "dead"
+        task_header["deadline"] = timeout_to_deadline(-10)
+        assert tk.add_task_header(task_header)
+
+        # task past its deadline won't be sent again, no need to ask for it
+        tk.remove_old_tasks()
+        assert "dead" not in tk.task_headers
+        tk.remove_old_tasks()
+        assert tk.resync_version == 0
+
+        # task dropped while alive may be received again when it's forgotten
+        tk.remove_task_header("alive")
+        assert tk.resync_version == 0
+        tk.remove_old_tasks()
+        assert tk.resync_version == 1
+        assert not tk.dropped_tasks
+        tk.remove_old_tasks()
+        assert tk.resync_version == 1
+
 
 def get_task_header():
     return {
@@ -170,6 +251,55 @@ def get_task_header():
         "max_price": 10
     }
 
+class TestRandomAccessSet(TestCase):
+    def test_operations(self):
+        s = RandomAccessSet(["a", "b", "c", "a"])
+        assert len(s) == 3
+        assert "b" in s
+        assert s.choice() in ["a", "b", "c"]
+
+        s.discard("a")
+        s.discard("xyz")
+        assert "a" not in s
+        assert sorted(s) == ["b", "c"]
+        assert sorted([s[0], s[1]]) == ["b", "c"]
+
+        s.discard("b")
+        s.discard("c")
+        assert len(s) == 0
+        assert s.choice() is None
+
+        s.add("d")
+        assert s[0] == "d"
+        s.clear()
+        assert "d" not in s
+
+
+class TestHeaderVersions(TestCase):
+    def test_changed_since(self):
+        hv = HeaderVersions()
+        assert hv.changed_since(0) == []
+        hv.update("a", "sig_a")
+        hv.update("b", "sig_b")
+        hv.update("c", "sig_c")
+        assert hv.version == 3
+        assert hv.changed_since(0) == ["a", "b", "c"]
+        assert hv.changed_since(2) == ["c"]
+        assert hv.changed_since(3) == []
+
+        hv.update("b", "sig_b")
+        assert hv.version == 3
+        hv.update("a", "sig_a2")
+        assert hv.version == 4
+        assert hv.changed_since(0) == ["b", "c", "a"]
+        assert hv.changed_since(3) == ["a"]
+
+        hv.remove("c")
+        hv.remove("xyz")
+        assert hv.changed_since(0) == ["b", "a"]
+        assert hv.changed_since(4) == []
+
+
 class TestCompSubtaskInfo(TestCase):
     def test_init(self):
         csi = CompSubtaskInfo("xxyyzz")
@@ -4,13 +4,16 @@ from datetime import timedelta
 
 from golem.core.keysauth import EllipticalKeysAuth
 from mock import Mock, patch
+from twisted.internet import defer
+from twisted.internet.task import Clock
 
 from golem.core.common import get_current_time, timeout_to_deadline
 from golem.network.p2p.node import Node
 from golem.task.taskbase import Task, TaskHeader, ComputeTaskDef, TaskEventListener
 from golem.task.taskclient import TaskClient
-from golem.task.taskmanager import TaskManager, logger
+from golem.task.taskmanager import TaskManager, logger, VERIFICATION_RETRY_DELAY
 from golem.task.taskstate import SubtaskStatus, SubtaskState, TaskState, TaskStatus, ComputerState
+from golem.task.verificationpool import VerificationPool
 
 from golem.tools.assertlogs import LogTestCase
 from golem.tools.testdirfixture import TestDirFixture
@@ -45,6 +48,8 @@ class TestTaskManager(LogTestCase, TestDirFixture):
 
         task_mock.query_extra_data.return_value = extra_data
         task_mock.get_progress.return_value = 0.3
+        task_mock.prepare_results.side_effect = lambda subtask_id, result, result_type: (result, result_type)
+        task_mock.verify_results.return_value = None
 
         return task_mock
 
@@ -193,7 +198,7 @@ class TestTaskManager(LogTestCase, TestDirFixture):
             def needs_computation(self):
                 return sum(self.finished.values()) != len(self.finished)
 
-            def computation_finished(self, subtask_id, task_result, result_type=0):
+            def computation_finished(self, subtask_id, task_result, result_type=0, verification=None):
                 if not self.restarted[subtask_id]:
                     self.finished[subtask_id] = True
 
@@ -274,6 +279,126 @@ class TestTaskManager(LogTestCase, TestDirFixture):
         assert ctd.subtask_id == "sss4"
         assert self.tm.computed_task_received("sss4", [], 0)
 
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_verify_computed_task(self, mock_addr):
+        mock_addr.return_value = self.addr_return
+        verifications = []
+
+        def run_in_thread(fn, *args):
+            d = defer.Deferred()
+            verifications.append((fn, args, d))
+            return d
+
+        def finish_verification():
+            fn, args, d = verifications.pop(0)
+            d.callback(fn(*args))
+
+        self.tm.verification_pool = VerificationPool(max_workers=1, max_queue_size=1)
+        self.tm.verification_pool._run_in_thread = run_in_thread
+
+        task_mock = self._get_task_mock()
+        task_mock.verify_subtask.return_value = True
+        task_mock.finished_computation.return_value = False
+        self.tm.add_new_task(task_mock)
+        for subtask_id in ["aa", "bb", "cc"]:
+            task_mock.query_extra_data.return_value.ctd.subtask_id = subtask_id
+            self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        states = self.tm.tasks_states["xyz"].subtask_states
+
+        results = []
+        self.tm.verify_computed_task("aa", [], 0).addCallback(results.append)
+        assert len(verifications) == 1
+        assert not task_mock.computation_finished.called
+        assert states["aa"].subtask_status == SubtaskStatus.starting
+
+        # the same result again
+        with self.assertLogs(logger, level="WARNING"):
+            self.tm.verify_computed_task("aa", [], 0).addCallback(results.append)
+        assert results == [False]
+
+        # per-task limit, waits in the queue
+        self.tm.verify_computed_task("bb", [], 0).addCallback(results.append)
+        assert len(verifications) == 1
+
+        clock = Clock()
+        with patch("golem.task.taskmanager.reactor", clock):
+            # queue is full, the result is submitted again later
+            with self.assertLogs(logger, level="WARNING"):
+                self.tm.verify_computed_task("cc", [], 0).addCallback(results.append)
+            assert states["cc"].subtask_status == SubtaskStatus.starting
+            assert "cc" in self.tm.subtasks_verified
+            with self.assertLogs(logger, level="WARNING"):
+                clock.advance(VERIFICATION_RETRY_DELAY)
+            assert not task_mock.computation_failed.called
+
+            finish_verification()
+            task_mock.computation_finished.assert_called_with("aa", [], 0, verification=None)
+            assert results == [False, True]
+            assert states["aa"].subtask_status == SubtaskStatus.finished
+            assert len(verifications) == 1
+
+            clock.advance(VERIFICATION_RETRY_DELAY)
+            task_mock.verify_subtask.return_value = False
+            finish_verification()
+            assert results == [False, True, False]
+            assert states["bb"].subtask_status == SubtaskStatus.failure
+
+            task_mock.verify_subtask.return_value = True
+            finish_verification()
+            assert results == [False, True, False, True]
+            assert states["cc"].subtask_status == SubtaskStatus.finished
+            assert not self.tm.subtasks_verified
+
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_verify_computed_task_in_reactor_thread(self, mock_addr):
+        mock_addr.return_value = self.addr_return
+        verifications = []
+
+        def run_in_thread(fn, *args):
+            d = defer.Deferred()
+            verifications.append((d, fn(*args)))
+            return d
+
+        self.tm.verification_pool = VerificationPool(max_workers=2)
+        self.tm.verification_pool._run_in_thread = run_in_thread
+
+        task_mock = self._get_task_mock(subtask_timeout=0.1)
+        task_mock.verify_subtask.return_value = True
+        task_mock.finished_computation.return_value = False
+        self.tm.add_new_task(task_mock)
+        self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+
+        # results are prepared and verified in the worker thread
+        results = []
+        self.tm.verify_computed_task("xxyyzz", ["data"], 0).addCallback(results.append)
+        task_mock.prepare_results.assert_called_once_with("xxyyzz", ["data"], 0)
+        task_mock.verify_results.assert_called_once_with("xxyyzz", ["data"], 0)
+        assert not task_mock.computation_finished.called
+
+        # subtask timed out during preparation, its result is neither applied nor accepted
+        time.sleep(0.1)
+        self.tm.check_timeouts()
+        d, prepared = verifications.pop()
+        with self.assertLogs(logger, level="WARNING"):
+            d.callback(prepared)
+        assert results == [False]
+        assert not task_mock.computation_finished.called
+        states = self.tm.tasks_states["xyz"].subtask_states
+        assert states["xxyyzz"].subtask_status == SubtaskStatus.failure
+
+        # prepared result is applied
+        task_mock.query_extra_data.return_value.ctd.subtask_id = "aabbcc"
+        task_mock.query_extra_data.return_value.ctd.deadline = timeout_to_deadline(120)
+        self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        task_mock.prepare_results.side_effect = lambda subtask_id, result, result_type: (["file"], 1)
+        task_mock.verify_results.return_value = True
+        self.tm.verify_computed_task("aabbcc", ["data"], 0).addCallback(results.append)
+        d, prepared = verifications.pop()
+        d.callback(prepared)
+        assert results == [False, True]
+        task_mock.computation_finished.assert_called_once_with("aabbcc", ["file"], 1, verification=True)
+        assert states["aabbcc"].subtask_status == SubtaskStatus.finished
+
     @patch("golem.task.taskmanager.get_external_address")
     def test_task_result_incoming(self, mock_addr):
         mock_addr.return_value = self.addr_return
@@ -368,6 +493,173 @@ class TestTaskManager(LogTestCase, TestDirFixture):
         self.tm.check_timeouts()
         assert self.tm.tasks_states["qwe"].status == TaskStatus.timeout
         assert self.tm.tasks_states["qwe"].subtask_states["qwerty"].subtask_status == SubtaskStatus.failure
+        assert len(self.tm.task_deadlines) == 1
+        assert "abc" in self.tm.task_deadlines
+        assert not self.tm.subtask_deadlines
+
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_check_timeouts_paused(self, mock_addr):
+        mock_addr.return_value = self.addr_return
+        t = self._get_task_mock(timeout=0.1, subtask_timeout=0.1)
+        self.tm.add_new_task(t)
+        self.tm.get_next_subtask("ABC", "ABC", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        self.tm.pause_task("xyz")
+        time.sleep(0.1)
+        assert self.tm.check_timeouts() == []
+        assert self.tm.tasks_states["xyz"].status == TaskStatus.paused
+        assert self.tm.tasks_states["xyz"].subtask_states["xxyyzz"].subtask_status == SubtaskStatus.starting
+
+        # deadlines are checked again after the task is resumed
+        self.tm.resume_task("xyz")
+        assert self.tm.check_timeouts() == ["ABC"]
+        assert self.tm.tasks_states["xyz"].status == TaskStatus.timeout
+        assert self.tm.tasks_states["xyz"].subtask_states["xxyyzz"].subtask_status == SubtaskStatus.failure
+
+        # new deadline
+        t2 = self._get_task_mock(task_id="abc", timeout=0.1)
+        self.tm.add_new_task(t2)
+        self.tm.change_timeouts("abc", 10, 10)
+        time.sleep(0.1)
+        self.tm.check_timeouts()
+        assert self.tm.tasks_states["abc"].status == TaskStatus.waiting
+        assert "abc" in self.tm.task_deadlines
+
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_set_subtask_progress(self, mock_addr):
+        mock_addr.return_value = self.addr_return
+        assert not self.tm.set_subtask_progress("xxyyzz", 0.5)
+
+        self.tm.add_new_task(self._get_task_mock())
+        self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        ss = self.tm.tasks_states["xyz"].subtask_states["xxyyzz"]
+        self.tm.listeners.append(Mock())
+
+        ss.time_started = time.time() - 30
+        assert self.tm.set_subtask_progress("xxyyzz", 0.25)
+        assert ss.subtask_progress == 0.25
+        assert ss.last_progress_time > 0
+        # a quarter has been computed in 30 seconds, the rest should take 90
+        self.assertAlmostEqual(ss.subtask_rem_time, 90.0, places=0)
+        self.tm.listeners[0].task_status_updated.assert_called_with("xyz")
+
+        assert self.tm.set_subtask_progress("xxyyzz", 2.0)
+        assert ss.subtask_progress == 1.0
+        assert ss.subtask_rem_time == 0.0
+
+        ss.subtask_status = SubtaskStatus.failure
+        assert not self.tm.set_subtask_progress("xxyyzz", 0.5)
+        assert ss.subtask_progress == 1.0
+
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_speculative_subtasks(self, mock_addr):
+        mock_addr.return_value = self.addr_return
+        verifications = []
+
+        def run_in_thread(fn, *args):
+            d = defer.Deferred()
+            verifications.append((fn, args, d))
+            return d
+
+        def finish_verification():
+            fn, args, d = verifications.pop(0)
+            d.callback(fn(*args))
+
+        self.tm.verification_pool._run_in_thread = run_in_thread
+
+        task_mock = self._get_task_mock()
+        task_mock.verify_subtask.return_value = True
+        task_mock.finished_computation.return_value = False
+        task_mock.needs_computation.return_value = True
+        task_mock.get_total_tasks.return_value = 4
+        self.tm.add_new_task(task_mock)
+        for subtask_id in ["aa", "bb", "cc", "dd"]:
+            task_mock.query_extra_data.return_value.ctd.subtask_id = subtask_id
+            self.tm.get_next_subtask(subtask_id.upper(), subtask_id.upper(), "xyz", 1000, 10, 5, 10, 2,
+                                     "10.10.10.10")
+        states = self.tm.tasks_states["xyz"].subtask_states
+        for subtask_id in ["aa", "bb", "cc"]:
+            states[subtask_id].time_started = time.time() - 10
+            self.tm.verify_computed_task(subtask_id, [], 0)
+            finish_verification()
+        states["dd"].time_started = time.time() - 100
+
+        # there are still subtasks to give
+        self.tm.update_stragglers()
+        assert self.tm.speculations["xyz"].stragglers == []
+
+        task_mock.needs_computation.return_value = False
+        task_mock.get_progress.return_value = 0.75
+        self.tm.update_stragglers()
+        assert self.tm.speculations["xyz"].stragglers == ["dd"]
+
+        # a node doesn't get a copy of its own subtask
+        subtask, _, _ = self.tm.get_next_subtask("DD", "DD", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert subtask is None
+        assert not task_mock.query_speculative_extra_data.called
+
+        spec_data = Mock()
+        spec_data.ctd = ComputeTaskDef()
+        spec_data.ctd.task_id = "xyz"
+        spec_data.ctd.subtask_id = "dd2"
+        spec_data.ctd.deadline = timeout_to_deadline(120)
+        spec_data.should_wait = False
+        task_mock.query_speculative_extra_data.return_value = spec_data
+        subtask, _, _ = self.tm.get_next_subtask("EE", "EE", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert subtask.subtask_id == "dd2"
+        task_mock.query_speculative_extra_data.assert_called_with("dd", 1000, 2, "EE", "EE")
+        assert self.tm.speculations["xyz"].stragglers == []
+        assert self.tm.get_speculation_stats("xyz").issued == 1
+
+        # both copies are computed, the second one is verified after the first one
+        results = []
+        self.tm.verify_computed_task("dd2", [], 0).addCallback(results.append)
+        self.tm.verify_computed_task("dd", [], 0).addCallback(results.append)
+        assert len(verifications) == 1
+
+        with self.assertLogs(logger, level="WARNING"):
+            finish_verification()
+        assert results == [True, False]
+        assert not verifications
+        assert states["dd2"].subtask_status == SubtaskStatus.finished
+        assert states["dd"].subtask_status == SubtaskStatus.cancelled
+        assert self.tm.is_subtask_cancelled("dd")
+        assert not self.tm.is_subtask_cancelled("dd2")
+        task_mock.computation_cancelled.assert_called_once_with("dd")
+        task_mock.computation_finished.assert_called_with("dd2", [], 0, verification=None)
+
+        stats = self.tm.get_speculation_stats("xyz")
+        assert (stats.issued, stats.won, stats.lost, stats.cancelled) == (1, 1, 0, 1)
+
+        # the policy may be changed for each task
+        self.tm.get_speculation_policy("xyz").enabled = False
+        assert self.tm.speculation_policy.enabled
+
+    @patch("golem.task.taskmanager.get_external_address")
+    def test_speculative_subtask_failure(self, mock_addr):
+        mock_addr.return_value = self.addr_return
+        task_mock = self._get_task_mock()
+        self.tm.add_new_task(task_mock)
+        self.tm.get_next_subtask("DEF", "DEF", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        task_mock.query_speculative_extra_data.return_value = None
+        task_mock.needs_computation.return_value = False
+        self.tm.speculations["xyz"].stragglers = ["xxyyzz"]
+
+        # task can't duplicate subtasks
+        subtask, _, _ = self.tm.get_next_subtask("ABC", "ABC", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert subtask is None
+
+        task_mock.query_speculative_extra_data.return_value = task_mock.query_extra_data.return_value
+        task_mock.query_extra_data.return_value.ctd.subtask_id = "xxyyzz2"
+        subtask, _, _ = self.tm.get_next_subtask("ABC", "ABC", "xyz", 1000, 10, 5, 10, 2, "10.10.10.10")
+        assert subtask.subtask_id == "xxyyzz2"
+
+        # another copy is still computed, the subtask doesn't have to be given again
+        self.tm.task_computation_failure("xxyyzz", "error")
+        task_mock.computation_cancelled.assert_called_once_with("xxyyzz")
+        assert not task_mock.computation_failed.called
+
+        self.tm.task_computation_failure("xxyyzz2", "error")
+        task_mock.computation_failed.assert_called_once_with("xxyyzz2")
 
     def test_task_event_listener(self):
         self.tm.notice_task_updated = Mock()
@@ -0,0 +1,105 @@
+import unittest
+
+from mock import Mock, patch
+
+from golem.task.taskselector import TaskSelector
+
+
+def header(task_id="xyz", max_price=20, subtask_timeout=100, environment="DEFAULT", owner="owner"):
+    th = Mock()
+    th.task_id = task_id
+    th.max_price = max_price
+    th.subtask_timeout = subtask_timeout
+    th.environment = environment
+    th.task_owner_key_id = owner
+    return th
+
+
+class TestTaskSelector(unittest.TestCase):
+    def setUp(self):
+        self.trust = {"owner": 0.0}
+        self.resources = set()
+        self.selector = TaskSelector(lambda key_id: self.trust.get(key_id, 0.0),
+                                     lambda task_id: task_id in self.resources, min_price=10)
+
+    def test_estimate_time_ratio(self):
+        assert self.selector.estimate_time_ratio(header()) is None
+        self.selector.subtask_computed(header(subtask_timeout=100), 20)
+        self.selector.subtask_computed(header(subtask_timeout=100), 40)
+        assert self.selector.estimate_time_ratio(header(subtask_timeout=100)) == 0.3
+        # other task in the same environment
+        assert self.selector.estimate_time_ratio(header("abc", subtask_timeout=200)) == 0.4
+        assert self.selector.estimate_time_ratio(header("abc", environment="OTHER")) is None
+        assert self.selector.estimate_time_ratio(header(subtask_timeout=0)) is None
+
+        self.selector.forget_task("xyz")
+        assert self.selector.estimate_time_ratio(header(subtask_timeout=100)) == 0.4
+
+    def test_score(self):
+        base = self.selector.score(header())
+        assert self.selector.score(header(max_price=40)) > base
+        assert self.selector.score(header(max_price=0)) < base
+
+        self.trust["trusted"] = 0.5
+        assert self.selector.score(header(owner="trusted")) > base
+        self.selector.min_trust = 0.1
+        assert self.selector.score(header()) is None
+        self.selector.min_trust = -1.0
+
+        # results of the resources check are cached until the task is forgotten
+        self.resources.add("xyz")
+        assert self.selector.score(header()) == base
+        self.selector.forget_task("xyz")
+        assert self.selector.score(header()) > base
+        self.resources.clear()
+        self.selector.forget_task("xyz")
+
+        # fast enough for the task
+        self.selector.subtask_computed(header(), 10)
+        assert self.selector.score(header()) > base
+        # too slow
+        self.selector.subtask_computed(header("abc"), 100)
+        assert self.selector.score(header("abc")) is None
+
+    def test_history_expires(self):
+        self.selector.history_ttl = 60
+        with patch("golem.task.taskselector.time.time", return_value=1000):
+            # subtask timed out
+            self.selector.subtask_computed(header(), 100)
+            assert self.selector.score(header()) is None
+            assert self.selector.score(header("abc")) is None
+        with patch("golem.task.taskselector.time.time", return_value=1030):
+            self.selector.subtask_computed(header("abc", environment="OTHER"), 10)
+        with patch("golem.task.taskselector.time.time", return_value=1061):
+            # the task may be tried again
+            assert self.selector.estimate_time_ratio(header()) is None
+            assert self.selector.score(header()) is not None
+            assert "xyz" not in self.selector.task_times
+            assert self.selector.estimate_time_ratio(header("abc", environment="OTHER")) == 0.1
+
+    def test_resources_cached(self):
+        has_resources = Mock(return_value=False)
+        self.selector.has_resources = has_resources
+        self.selector.resources_check_interval = 60
+        with patch("golem.task.taskselector.time.time", return_value=1000):
+            base = self.selector.score(header())
+            self.selector.score(header())
+        assert has_resources.call_count == 1
+
+        has_resources.return_value = True
+        with patch("golem.task.taskselector.time.time", return_value=1059):
+            assert self.selector.score(header()) == base
+        with patch("golem.task.taskselector.time.time", return_value=1060):
+            assert self.selector.score(header()) > base
+        assert has_resources.call_count == 2
+
+        self.selector.forget_task("xyz")
+        assert "xyz" not in self.selector.task_resources
+
+    def test_change_config(self):
+        config_desc = Mock()
+        config_desc.min_price = 30
+        config_desc.requesting_trust = 0.2
+        self.selector.change_config(config_desc)
+        assert self.selector.min_price == 30
+        assert self.selector.min_trust == 0.2
@@ -1,6 +1,7 @@
 from __future__ import division
 
 import os
+import time
 import uuid
 from collections import deque
 
@@ -38,6 +39,7 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         ts.verify_header_sig = lambda x: True
         self.ts = ts
         ts.client.get_suggested_addr.return_value = "10.10.10.10"
+        ts.client.get_requesting_trust.return_value = ts.max_trust
         ts.client.get_suggested_conn_reverse.return_value = False
         self.assertIsInstance(ts, TaskServer)
         assert ts.request_task() is None
@@ -66,6 +68,7 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         ts.verify_header_sig = lambda x: True
         self.ts = ts
         ts.client.get_suggested_addr.return_value = "10.10.10.10"
+        ts.client.get_requesting_trust.return_value = ts.max_trust
         results = {"data": "", "result_type": 0}
         task_header = self.__get_example_task_header()
         task_header["task_id"] = "xyz"
@@ -74,6 +77,9 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         self.assertTrue(ts.send_results("xxyyzz", "xyz", results, 40, "10.10.10.10", 10101, "key", n, "node_name"))
         self.assertTrue(ts.send_results("xyzxyz", "xyz", results, 40, "10.10.10.10", 10101, "key", n, "node_name"))
         assert ts.get_subtask_ttl("xyz") == 120
+        assert [t for _, t in ts.task_selector.task_times["xyz"]] == [40, 40]
+        ts.send_task_failed("xxyyzz2", "xyz", "Task timed out", "10.10.10.10", 10101, "key", n, "node_name")
+        assert [t for _, t in ts.task_selector.task_times["xyz"]] == [40, 40, 120]
         wtr = ts.results_to_send["xxyyzz"]
         self.assertIsInstance(wtr, WaitingTaskResult)
         self.assertEqual(wtr.subtask_id, "xxyyzz")
@@ -94,6 +100,11 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
             ts.subtask_rejected("aabbcc")
         self.assertIsNotNone(ts.task_keeper.task_headers.get("xyz"))
 
+        prev_call_count = ts.client.decrease_trust.call_count
+        ts.subtask_not_needed("xyzxyz", "Subtask cancelled")
+        assert ts.get_waiting_task_result("xyzxyz") is None
+        assert ts.client.decrease_trust.call_count == prev_call_count
+
         prev_call_count = ts.client.increase_trust.call_count
         with self.assertLogs(logger, level="WARNING"):
             ts.reward_for_subtask_paid("aa2bb2cc")
@@ -131,6 +142,17 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         self.assertEqual(ts.task_sessions["xyz"], session)
         session.send_hello.assert_called_with()
         session.request_task.assert_called_with("nodename", "xyz", 1010, 30, 3, 1, 2)
+        resource_header = ts.task_computer.resource_manager.get_resource_header("xyz")
+        session.request_resource.assert_called_with("xyz", resource_header)
+
+        # resources that are already fetched aren't requested again
+        ts.task_computer.wait_for_resources("xyz", None)
+        session.request_resource.reset_mock()
+        ts.conn_established_for_type[TaskConnTypes.TaskRequest](session, "abc", "nodename", "key", "xyz",
+                                                                1010, 30, 3, 1, 2)
+        session.request_resource.assert_not_called()
+        ts.remove_task_header("xyz")
+        assert "xyz" not in ts.task_computer.task_resources
 
     def test_change_config(self):
         ccd = self.__get_config_desc()
@@ -203,6 +225,106 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         saved_task = next(th for th in ts.get_tasks_headers() if th["task_id"] == "xyz_2")
         assert saved_task["signature"] == new_header["signature"]
 
+    def test_add_task_headers(self):
+        config = self.__get_config_desc()
+        keys_auth = EllipticalKeysAuth(self.path)
+        keys_auth_2 = EllipticalKeysAuth(self.path, "PRIVATE_KEY_2", "PUBLIC_KEY_2")
+
+        self.ts = ts = TaskServer(Node(), config, keys_auth, self.client,
+                                  use_docker_machine_manager=False)
+
+        headers = []
+        for i in range(3):
+            task_header = self.__get_example_task_header()
+            task_header["task_id"] = "xyz_{}".format(i)
+            task_header["task_owner_key_id"] = keys_auth_2.key_id
+            task_header["signature"] = keys_auth_2.sign(TaskHeader.dict_to_binary(task_header))
+            headers.append(task_header)
+        headers[1]["signature"] = keys_auth.sign(TaskHeader.dict_to_binary(headers[1]))
+        headers.append({"task_id": "broken"})
+
+        assert ts.add_task_headers(headers) == [True, False, True, False]
+        assert {th["task_id"] for th in ts.get_tasks_headers()} == {"xyz_0", "xyz_2"}
+
+        # malformed headers are invalid without verifying them
+        with patch.object(ts.keys_auth, 'verify_batch', return_value=[True]) as verify_batch:
+            assert ts.verify_header_sigs([{"task_id": "broken"}, headers[0]]) == [False, True]
+            assert len(verify_batch.call_args[0][0]) == 1
+
+        # known headers aren't verified again
+        with patch.object(ts.keys_auth, 'verify_batch', wraps=ts.keys_auth.verify_batch) as verify_batch:
+            assert ts.add_task_headers(headers[:2]) == [True, False]
+            verify_batch.assert_called_once()
+            assert len(verify_batch.call_args[0][0]) == 1
+
+    def test_get_tasks_headers_since(self):
+        config = self.__get_config_desc()
+        keys_auth = EllipticalKeysAuth(self.path)
+        keys_auth_2 = EllipticalKeysAuth(self.path, "PRIVATE_KEY_2", "PUBLIC_KEY_2")
+        self.ts = ts = TaskServer(Node(), config, keys_auth, self.client,
+                                  use_docker_machine_manager=False)
+
+        def signed_header(task_id):
+            task_header = self.__get_example_task_header()
+            task_header["task_id"] = task_id
+            task_header["task_owner_key_id"] = keys_auth_2.key_id
+            task_header["signature"] = keys_auth_2.sign(TaskHeader.dict_to_binary(task_header))
+            return task_header
+
+        assert ts.get_tasks_headers(0) == []
+        assert ts.get_tasks_version() == 0
+        ts.add_task_headers([signed_header("xyz_0"), signed_header("xyz_1")])
+        assert [th["task_id"] for th in ts.get_tasks_headers(0)] == ["xyz_0", "xyz_1"]
+        version = ts.get_tasks_version()
+        assert ts.get_tasks_headers(version) == []
+
+        # headers of own tasks are included too
+        own_header = TaskHeader("ABC", "own_task", "10.10.10.10", 10101, keys_auth.key_id, "DEFAULT",
+                                signature="own_sig")
+        ts.task_manager.get_tasks_headers = Mock(return_value=[own_header])
+        ts.add_task_headers([signed_header("xyz_2")])
+        assert [th["task_id"] for th in ts.get_tasks_headers(version)] == ["xyz_2", "own_task"]
+        version = ts.get_tasks_version()
+        assert ts.get_tasks_headers(version) == []
+        assert len(ts.get_tasks_headers()) == 4
+
+        ts.remove_task_header("xyz_0")
+        assert [th["task_id"] for th in ts.get_tasks_headers(0)] == ["xyz_1", "xyz_2", "own_task"]
+
+    def test_dropped_header_relearned(self):
+        config = self.__get_config_desc()
+        keys_auth = EllipticalKeysAuth(self.path)
+        keys_auth_2 = EllipticalKeysAuth(self.path, "PRIVATE_KEY_2", "PUBLIC_KEY_2")
+        keys_auth_3 = EllipticalKeysAuth(self.path, "PRIVATE_KEY_3", "PUBLIC_KEY_3")
+        self.ts = ts = TaskServer(Node(), config, keys_auth, self.client, use_docker_machine_manager=False)
+        peer = TaskServer(Node(), config, keys_auth_2, self.client, use_docker_machine_manager=False)
+        self.addCleanup(peer.quit)
+
+        task_header = self.__get_example_task_header()
+        task_header["task_owner_key_id"] = keys_auth_3.key_id
+        task_header = TaskHeader.from_dict(task_header).to_dict()
+        task_header["signature"] = keys_auth_3.sign(TaskHeader.dict_to_binary(task_header))
+        peer.add_task_headers([task_header])
+
+        # this node has received the peer's list
+        assert all(ts.add_task_headers(peer.get_tasks_headers(0)))
+        peer_version = peer.get_tasks_version()
+        resync_version = ts.get_tasks_resync_version()
+
+        # owner refused to assign a subtask, header is dropped and ignored for a while
+        ts.remove_task_header("uvw")
+        assert "uvw" not in ts.task_keeper.task_headers
+        assert peer.get_tasks_headers(peer_version) == []
+        ts.add_task_headers(peer.get_tasks_headers(0))
+        assert "uvw" not in ts.task_keeper.task_headers
+
+        # when the drop is forgotten, the header is requested from the beginning of the peer's list again
+        ts.task_keeper.removed_task_timeout = -1
+        ts.task_keeper.remove_old_tasks()
+        assert ts.get_tasks_resync_version() != resync_version
+        assert all(ts.add_task_headers(peer.get_tasks_headers(0)))
+        assert "uvw" in ts.task_keeper.task_headers
+
     def test_sync(self):
         ccd = self.__get_config_desc()
         ts = TaskServer(Node(), ccd, EllipticalKeysAuth(self.path), self.client,
@@ -353,6 +475,7 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         ts.task_manager = Mock()
         ts.task_manager.check_timeouts.return_value = []
         ts.task_keeper = Mock()
+        ts.task_keeper.remove_old_tasks.return_value = []
         ts.task_connections_helper = Mock()
         ts._add_pending_request = Mock()
 
@@ -458,6 +581,98 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
         ts.task_sessions['task'] = session
         ts.remove_task_session(session)
 
+    def test_remove_old_sessions(self):
+        ccd = self.__get_config_desc()
+        ts = TaskServer(Node(), ccd, Mock(), self.client,
+                        use_docker_machine_manager=False)
+        self.ts = ts
+        ts.last_message_time_threshold = 60
+        old_session, new_session = Mock(), Mock()
+        old_session.last_message_time = time.time() - ts.last_message_time_threshold - 10
+        old_session.requested_task_ids.return_value = ["xyz"]
+        new_session.last_message_time = time.time()
+        ts.task_sessions = {"subtask1": old_session, "subtask2": new_session}
+
+        ts._TaskServer__remove_old_sessions()
+        old_session.task_computer.session_timeout.assert_called_once_with("xyz")
+        assert old_session.dropped.called
+        assert not new_session.task_computer.session_timeout.called
+        assert not new_session.dropped.called
+
+    def test_remove_old_tasks(self):
+        ccd = self.__get_config_desc()
+        ts = TaskServer(Node(), ccd, Mock(), self.client,
+                        use_docker_machine_manager=False)
+        self.ts = ts
+        ts.task_manager.check_timeouts = Mock(return_value=[])
+        ts.task_keeper.remove_old_tasks = Mock(return_value=["xyz"])
+        ts.task_selector.task_times["xyz"] = deque([(time.time(), 10)])
+        ts.task_selector.task_times["abc"] = deque([(time.time(), 10)])
+        ts.task_computer.prefetch_resources("xyz")
+        ts.task_computer.prefetch_resources("abc")
+
+        # selection history and resources state of tasks whose headers expired are forgotten
+        ts._TaskServer__remove_old_tasks()
+        assert "xyz" not in ts.task_selector.task_times
+        assert "abc" in ts.task_selector.task_times
+        assert "xyz" not in ts.task_computer.task_resources
+        assert "abc" in ts.task_computer.task_resources
+
+    def test_session_pool(self):
+        ccd = self.__get_config_desc()
+        ts = TaskServer(Node(), ccd, Mock(), self.client,
+                        use_docker_machine_manager=False)
+        self.ts = ts
+        ts.network = Mock()
+        ts.client.get_suggested_addr.return_value = "10.10.10.10"
+        ts.client.get_suggested_conn_reverse.return_value = False
+        owner = Node()
+        owner.prv_addr = "10.10.10.10"
+        owner.port = 10101
+
+        # first request connects, the next one waits for that connection
+        ts._add_pending_request(TaskConnTypes.TaskFailure, owner, owner.port, "KEY_ID",
+                                {'key_id': "KEY_ID", 'subtask_id': "xxyyzz", 'err_msg': "some error"})
+        assert len(ts.pending_connections) == 1
+        ts._add_pending_request(TaskConnTypes.ResultRejected, owner, owner.port, "KEY_ID",
+                                {'key_id': "KEY_ID", 'subtask_id': "aabbcc"})
+        assert len(ts.pending_connections) == 1
+        assert ts.session_pool.get_waiting_peers() == ["KEY_ID"]
+        ts._sync_session_pool()
+        assert len(ts.pending_connections) == 1
+
+        session = Mock()
+        session.key_id = "KEY_ID"
+        session.is_middleman = False
+        session.conn_id = ts.pending_connections.keys()[0]
+        session.last_message_time = time.time()
+        session.is_busy.return_value = False
+        session.address = "10.10.10.10"
+        session.port = 10101
+        ts.task_session_verified(session)
+        assert ts.is_session_pooled(session)
+        session.send_result_rejected.assert_called_once_with("aabbcc")
+        assert ts.session_pool.get_waiting_peers() == []
+
+        # pooled session is used instead of a new connection
+        ts._add_pending_request(TaskConnTypes.ResultRejected, owner, owner.port, "KEY_ID",
+                                {'key_id': "KEY_ID", 'subtask_id': "ddeeff"})
+        session.send_result_rejected.assert_called_with("ddeeff")
+        assert len(ts.pending_connections) == 1
+
+        # idle session is closed
+        ts._sync_session_pool()
+        session.disconnect.assert_not_called()
+        session.last_message_time = time.time() - ccd.task_session_idle_timeout - 1
+        ts._sync_session_pool()
+        assert session.disconnect.called
+        assert not ts.is_session_pooled(session)
+
+        # middleman sessions aren't pooled
+        session.is_middleman = True
+        ts.task_session_verified(session)
+        assert not ts.is_session_pooled(session)
+
     def test_respond_to(self):
         ccd = self.__get_config_desc()
         ts = TaskServer(Node(), ccd, Mock(), self.client,
@@ -549,17 +764,17 @@ class TestTaskServer(TestWithKeysAuth, LogTestCase):
 
         assert ts.remove_pending_conn.called
         assert ts.remove_responses.called
-        assert ts.task_computer.session_timeout.called
+        # a failed connection doesn't affect slots requesting other tasks
+        assert not ts.task_computer.session_timeout.called
         ts.remove_pending_conn.called = False
         ts.remove_responses.called = False
-        ts.task_computer.session_timeout.called = False
 
         method = ts._TaskServer__connection_for_start_session_final_failure
         method('conn_id', 'key_id', Mock(), Mock(), 'ans_conn_id')
 
         assert ts.remove_pending_conn.called
         assert ts.remove_responses.called
-        assert ts.task_computer.session_timeout.called
+        assert not ts.task_computer.session_timeout.called
 
     def __get_config_desc(self):
         ccd = ClientConfigDescriptor()
@@ -2,13 +2,18 @@ import cPickle
 import unittest
 
 from mock import Mock, MagicMock, patch
+from twisted.internet import defer
 
 from golem.core.keysauth import KeysAuth
+from golem.core.sessioncipher import SessionCipher
 from golem.network.p2p.node import Node
 from golem.network.transport.message import (MessageWantToComputeTask, MessageCannotAssignTask, MessageTaskToCompute,
                                              MessageReportComputedTask, MessageHello,
                                              MessageSubtaskResultRejected, MessageSubtaskResultAccepted,
-                                             MessageTaskResultHash, MessageGetTaskResult, MessageCannotComputeTask)
+                                             MessageTaskResultHash, MessageGetTaskResult,
+                                             MessageCannotComputeTask,
+                                             MessageSubtaskProgress, MessageWaitingForResults,
+                                             MessageDeltaParts, MessageSubtaskResultNotNeeded)
 from golem.task.taskbase import ComputeTaskDef, result_types
 from golem.task.taskserver import WaitingTaskResult
 from golem.task.tasksession import TaskSession, logger, TASK_PROTOCOL_ID
@@ -129,6 +134,7 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         ts2.can_be_not_encrypted.append(ms.Type)
         ts2.can_be_unsigned.append(ms.Type)
         ts2.task_manager.subtask2task_mapping = {"xxyyzz": "xyz"}
+        ts2.task_manager.is_subtask_cancelled.return_value = False
         ts2.interpret(ms)
         ts2.task_server.receive_subtask_computation_time.assert_called_with("xxyyzz", 13190)
 
@@ -169,12 +175,38 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         ts._react_to_hello(msg)
         assert ts.send.called
 
+    def test_data_result_stream(self):
+        secret = "s" * 32
+        provider = TaskSession(Mock())
+        provider.session_cipher = SessionCipher(secret, "provider", "requestor", 0.25, 0.75)
+        provider.verified = True
+        requestor = TaskSession(Mock())
+        requestor.session_cipher = SessionCipher(secret, "requestor", "provider", 0.75, 0.25)
+        requestor.result_received = Mock()
+
+        res = Mock(subtask_id="xxyyzz", result={'stdout': 'xyz' * 10000})
+        provider._TaskSession__send_data_results(res)
+        producer = provider.conn.producer
+        while producer.data:
+            producer.resumeProducing()
+        stream = "".join(c[0][0] for c in provider.conn.transport.write.call_args_list)
+
+        requestor._TaskSession__receive_data_result(Mock(subtask_id="xxyyzz",
+                                                         result_type=result_types['data']))
+        requestor.conn.consumer.dataReceived(stream)
+        extra_data = requestor.result_received.call_args[0][0]
+        assert cPickle.loads(extra_data["result"]) == res.result
+        assert requestor.result_received.call_args[1] == {"decrypt": False}
+
     def test_result_received(self):
         conn = Mock()
         ts = TaskSession(conn)
         ts.task_server = Mock()
+        ts.task_server.is_session_pooled.return_value = False
         ts.task_manager = Mock()
         ts.task_manager.verify_subtask.return_value = True
+        ts.task_manager.is_subtask_cancelled.return_value = False
+        ts.task_manager.verify_computed_task.return_value = defer.succeed(True)
 
         extra_data = dict(
             # the result is explicitly serialized using cPickle
@@ -200,6 +232,36 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         assert ts.msgs_to_send
         assert ts.msgs_to_send[0].__class__ == MessageSubtaskResultAccepted
         assert conn.close.called
+        ts.task_server.accept_result.assert_called_with('xxyyzz', ts.result_owner)
+
+        # verification in progress, session is kept open
+        conn.close.called = False
+        ts.msgs_to_send = []
+        d = defer.Deferred()
+        ts.task_manager.verify_computed_task.return_value = d
+
+        ts.result_received(extra_data, decrypt=False)
+
+        assert not ts.msgs_to_send
+        assert not conn.close.called
+        ts.task_manager.verify_subtask.return_value = False
+        d.callback(False)
+        assert ts.msgs_to_send[0].__class__ == MessageSubtaskResultRejected
+        ts.task_server.reject_result.assert_called_with('xxyyzz', ts.result_owner)
+        assert conn.close.called
+
+        # result of another copy of the subtask was accepted first, provider is not punished
+        conn.close.called = False
+        ts.msgs_to_send = []
+        ts.task_server.reject_result.reset_mock()
+        ts.task_manager.verify_computed_task.return_value = defer.succeed(False)
+        ts.task_manager.is_subtask_cancelled.return_value = True
+
+        ts.result_received(extra_data, decrypt=False)
+
+        assert ts.msgs_to_send[0].__class__ == MessageSubtaskResultNotNeeded
+        assert not ts.task_server.reject_result.called
+        assert conn.close.called
 
         extra_data.update(dict(
             subtask_id=None,
@@ -246,6 +308,124 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         assert ts.task_server.reject_result.called
         assert ts.task_manager.task_computation_failure.called
 
+    def test_react_to_subtask_progress(self):
+        ts = TaskSession(Mock())
+        ts.key_id = "KEY_ID"
+        ts.task_manager = Mock()
+        ts.task_manager.get_node_id_for_subtask.return_value = "KEY_ID"
+        ts._react_to_subtask_progress(MessageSubtaskProgress("xxyyzz", 0.3))
+        ts.task_manager.set_subtask_progress.assert_called_once_with("xxyyzz", 0.3)
+
+        # only the node computing the subtask may report its progress
+        ts.task_manager.reset_mock()
+        ts.task_manager.get_node_id_for_subtask.return_value = "OTHER_KEY_ID"
+        ts._react_to_subtask_progress(MessageSubtaskProgress("xxyyzz", 0.3))
+        ts.task_manager.set_subtask_progress.assert_not_called()
+
+    def test_result_received_pooled(self):
+        conn = Mock()
+        ts = TaskSession(conn)
+        ts.task_server = Mock()
+        ts.task_server.is_session_pooled.return_value = True
+        ts.task_manager = Mock()
+        ts.task_manager.verify_subtask.return_value = True
+        ts.task_manager.is_subtask_cancelled.return_value = False
+        d = defer.Deferred()
+        ts.task_manager.verify_computed_task.return_value = d
+        extra_data = dict(result=cPickle.dumps({'stdout': 'xyz'}), result_type=result_types['data'],
+                          subtask_id='xxyyzz')
+
+        ts.result_received(extra_data, decrypt=False)
+        assert ts.verifying == 1
+        assert ts.is_busy()
+
+        # pooled session is kept open for other interactions when verification ends
+        d.callback(True)
+        assert ts.verifying == 0
+        assert ts.msgs_to_send[0].__class__ == MessageSubtaskResultAccepted
+        assert not conn.close.called
+
+    def test_answers_in_pooled_session(self):
+        ts = TaskSession(Mock())
+        ts.task_id = "xyz"
+        ts.key_id = "KEY_ID"
+        ts.task_server = Mock()
+        ts.task_server.is_session_pooled.return_value = True
+        ts.task_computer = Mock()
+        ts.task_manager = Mock()
+        ts.send = Mock()
+
+        ts.request_task("ABC", "xyz1", 1000, 30, 3, 1, 8)
+        ts.request_task("ABC", "xyz2", 1000, 30, 3, 1, 8)
+        ts.request_task("ABC", "xyz3", 1000, 30, 3, 1, 8)
+        ts.request_resource("xyz1", "header")
+        assert ts.requested_task_ids() == ["xyz1", "xyz2", "xyz3"]
+
+        # answers come in order of requests
+        ts._react_to_waiting_for_results(MessageWaitingForResults())
+        ts.task_computer.session_closed.assert_called_once_with("xyz1")
+        assert ts.requested_task_ids() == ["xyz2", "xyz3"]
+        ts._react_to_cannot_assign_task(MessageCannotAssignTask("xyz2", "No more subtasks"))
+        ts.task_computer.session_closed.assert_called_with("xyz2")
+        ctd = ComputeTaskDef()
+        ctd.key_id = "KEY_ID2"
+        ctd.subtask_id = "SUBTASKID"
+        ts._react_to_task_to_compute(MessageTaskToCompute(ctd))
+        ts.task_computer.session_closed.assert_called_with("xyz3")
+        assert not ts.task_requests
+        ts._react_to_delta_parts(MessageDeltaParts("xyz1", "header", []))
+        ts.task_computer.wait_for_resources.assert_called_with("xyz1", "header")
+        assert not ts.resource_requests
+
+        # pooled session isn't closed after the interactions
+        assert not ts.conn.close.called
+
+        ts.task_server.is_session_pooled.return_value = False
+        ts._react_to_subtask_result_accepted(MessageSubtaskResultAccepted("xxyyzz", 10))
+        assert ts.conn.close.called
+
+    def test_send_hello_verified(self):
+        ts = TaskSession(Mock())
+        ts.send = Mock()
+        ts.task_server = Mock()
+        ts.verified = True
+        ts.send_hello()
+        ts.send.assert_not_called()
+
+    def test_react_to_report_computed_task(self):
+        conn = Mock()
+        ts = TaskSession(conn)
+        ts.task_server = Mock()
+        ts.task_server.is_session_pooled.return_value = False
+        ts.task_manager = Mock()
+        ts.task_manager.subtask2task_mapping = {"xxyyzz": "xyz"}
+        ts.task_manager.is_subtask_cancelled.return_value = False
+        ts.task_manager.accept_results_delay.return_value = 0.0
+        msg = MessageReportComputedTask("xxyyzz", result_types['data'], 10.0, "node", "10.10.10.10", 30102,
+                                        "KEY_ID", None, "eth")
+        ts._react_to_report_computed_task(msg)
+        ts.task_server.receive_subtask_computation_time.assert_called_once_with("xxyyzz", 10.0)
+        assert ts.msgs_to_send[0].__class__ == MessageGetTaskResult
+        assert not conn.close.called
+
+        # result of another copy was accepted, this one isn't downloaded
+        ts.task_server.reset_mock()
+        ts.msgs_to_send = []
+        ts.task_manager.is_subtask_cancelled.return_value = True
+        ts._react_to_report_computed_task(msg)
+        assert not ts.task_server.receive_subtask_computation_time.called
+        assert len(ts.msgs_to_send) == 1
+        assert ts.msgs_to_send[0].__class__ == MessageSubtaskResultNotNeeded
+        assert ts.msgs_to_send[0].subtask_id == "xxyyzz"
+        assert conn.close.called
+
+        # provider drops the result without losing trust in the requester
+        conn.close.called = False
+        ts._react_to_subtask_result_not_needed(ts.msgs_to_send[0])
+        ts.task_server.subtask_not_needed.assert_called_once_with("xxyyzz", "Subtask cancelled")
+        assert not ts.task_server.subtask_rejected.called
+        assert conn.close.called
+
     def test_react_to_task_compute(self):
         conn = Mock()
         ts = TaskSession(conn)
@@ -253,6 +433,7 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         ts.task_manager = Mock()
         ts.task_computer = Mock()
         ts.task_server = Mock()
+        ts.task_server.is_session_pooled.return_value = False
         ts.task_server.get_subtask_ttl.return_value = 31313
 
         def __reset_mocks():
@@ -264,7 +445,7 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         with self.assertLogs(logger, level="WARNING"):
             ts._react_to_task_to_compute(msg)
         ts.task_manager.comp_task_keeper.receive_subtask.assert_not_called()
-        ts.task_computer.session_closed.assert_called_with()
+        ts.task_computer.session_closed.assert_called_with(ts.task_id)
         assert conn.close.called
 
         __reset_mocks()
@@ -287,7 +468,7 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         ctd.key_id = "KEY_ID2"
         ts._react_to_task_to_compute(MessageTaskToCompute(ctd))
         ts.task_manager.comp_task_keeper.receive_subtask.assert_not_called()
-        ts.task_computer.session_closed.assert_called_with()
+        ts.task_computer.session_closed.assert_called_with(ts.task_id)
         assert conn.close.called
 
         __reset_mocks()
@@ -295,7 +476,7 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         ctd.task_owner.key = "KEY_ID2"
         ts._react_to_task_to_compute(MessageTaskToCompute(ctd))
         ts.task_manager.comp_task_keeper.receive_subtask.assert_not_called()
-        ts.task_computer.session_closed.assert_called_with()
+        ts.task_computer.session_closed.assert_called_with(ts.task_id)
         assert conn.close.called
 
         __reset_mocks()
@@ -303,7 +484,7 @@ class TestTaskSession(LogTestCase, TempDirFixture):
         ctd.return_port = 0
         ts._react_to_task_to_compute(MessageTaskToCompute(ctd))
         ts.task_manager.comp_task_keeper.receive_subtask.assert_not_called()
-        ts.task_computer.session_closed.assert_called_with()
+        ts.task_computer.session_closed.assert_called_with(ts.task_id)
         assert conn.close.called
 
         __reset_mocks()
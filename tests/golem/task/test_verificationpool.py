@@ -0,0 +1,119 @@
+import unittest
+
+from twisted.internet import defer
+
+from golem.task.verificationpool import VerificationPool, VerificationQueueFull
+
+
+class ManualVerificationPool(VerificationPool):
+    """ Doesn't start threads, verifications are finished by the test """
+
+    def __init__(self, *args, **kwargs):
+        super(ManualVerificationPool, self).__init__(*args, **kwargs)
+        self.started = []
+
+    def _run_in_thread(self, fn, *args, **kwargs):
+        d = defer.Deferred()
+        self.started.append((fn, args, d))
+        return d
+
+    def finish(self, index=0):
+        fn, args, d = self.started.pop(index)
+        try:
+            d.callback(fn(*args))
+        except Exception as err:
+            d.errback(err)
+
+
+class TestVerificationPool(unittest.TestCase):
+    def test_workers_limit(self):
+        pool = ManualVerificationPool(max_workers=2, max_queue_size=10, max_per_task=10)
+        results = []
+        for i in range(4):
+            pool.submit("task", lambda x: x, i).addCallback(results.append)
+        assert len(pool.started) == 2
+        assert pool.get_queue_size() == 2
+
+        pool.finish(1)
+        assert results == [1]
+        assert len(pool.started) == 2
+        assert pool.get_queue_size() == 1
+
+        pool.finish()
+        pool.finish()
+        pool.finish()
+        assert sorted(results) == [0, 1, 2, 3]
+        assert pool.num_running == 0
+        assert not pool.running
+
+    def test_per_task_limit(self):
+        pool = ManualVerificationPool(max_workers=3, max_queue_size=10, max_per_task=1)
+        results = []
+        for task_id in ["a", "a", "a", "b"]:
+            pool.submit(task_id, lambda x: x, task_id).addCallback(results.append)
+        # only one verification of task "a" at once, "b" doesn't wait for "a"
+        assert [args for _, args, _ in pool.started] == [("a",), ("b",)]
+        assert pool.get_queue_size() == 2
+
+        pool.finish(1)
+        assert results == ["b"]
+        assert len(pool.started) == 1
+
+        pool.finish()
+        assert [args for _, args, _ in pool.started] == [("a",)]
+        pool.finish()
+        assert results == ["b", "a", "a"]
+        assert pool.get_queue_size() == 0
+        assert len(pool.started) == 1
+
+    def test_queue_full(self):
+        pool = ManualVerificationPool(max_workers=1, max_queue_size=1)
+        pool.submit("a", lambda: True)
+        pool.submit("b", lambda: True)
+        failures = []
+        pool.submit("c", lambda: True).addErrback(failures.append)
+        assert len(failures) == 1
+        assert failures[0].check(VerificationQueueFull)
+
+        pool.finish()
+        assert pool.get_queue_size() == 0
+        pool.submit("c", lambda: True).addErrback(failures.append)
+        assert len(failures) == 1
+
+    def test_errors(self):
+        pool = ManualVerificationPool(max_workers=1, max_queue_size=10)
+
+        def fail():
+            raise ValueError("verification error")
+
+        failures = []
+        pool.submit("a", fail).addErrback(failures.append)
+        pool.submit("a", lambda: True)
+        pool.finish()
+        assert failures[0].check(ValueError)
+        assert len(pool.started) == 1
+
+    def test_synchronous_verification(self):
+        pool = VerificationPool(max_workers=1, max_queue_size=10)
+        pool._run_in_thread = lambda fn, *args, **kwargs: defer.maybeDeferred(fn, *args, **kwargs)
+        results = []
+        for i in range(5):
+            pool.submit("a", lambda x: x, i).addCallback(results.append)
+        assert results == range(5)
+        assert pool.num_running == 0
+
+    def test_stop(self):
+        pool = ManualVerificationPool(max_workers=1, max_queue_size=10)
+        pool.submit("a", lambda: True)
+        failures = []
+        pool.submit("a", lambda: True).addErrback(failures.append)
+        pool.stop()
+        assert failures[0].check(defer.CancelledError)
+        assert pool.get_queue_size() == 0
+
+    def test_thread_pool(self):
+        pool = VerificationPool(max_workers=1, max_queue_size=10)
+        pool.submit("a", lambda: True)
+        assert pool._thread_pool is not None
+        pool.stop()
+        assert pool._thread_pool is None